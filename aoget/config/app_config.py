@@ -26,10 +26,24 @@ class AppConfig:
     LOW_BANDWIDTH_LIMIT = "low-bandwidth-limit"
     MEDIUM_BANDWIDTH_LIMIT = "medium-bandwidth-limit"
     HIGH_BANDWIDTH_LIMIT = "high-bandwidth-limit"
+    BANDWIDTH_BURST_SECONDS = "bandwidth-burst-seconds"
     OVERWRITE_EXISTING_FILES = "overwrite-existing-files"
     PER_JOB_DEFAULT_THREAD_COUNT = "per-job-default-thread-count"
+    PER_JOB_DEFAULT_SEGMENT_COUNT = "per-job-default-segment-count"
     URL_CACHE_ENABLED = "url-cache-enabled"
     DOWNLOAD_RETRY_ATTEMPTS = "download-retry-attempts"
+    DOWNLOAD_ENGINE = "download-engine"
+    WRITE_BEHIND_BUFFER_MB = "write-behind-buffer-mb"
+    PREALLOCATE_FILES = "preallocate-files"
+    CHECKSUM_ALGORITHM = "checksum-algorithm"
+    STALL_MIN_RATE_KBPS = "stall-min-rate-kbps"
+    STALL_TIMEOUT_SECONDS = "stall-timeout-seconds"
+    MAX_HEDGES_PER_JOB = "max-hedges-per-job"
+    SIZE_RESOLVER_THREADS = "size-resolver-threads"
+    URL_METADATA_TTL_HOURS = "url-metadata-ttl-hours"
+    URL_METADATA_CACHE_SIZE = "url-metadata-cache-size"
+    GLOBAL_DOWNLOAD_THREADS = "global-download-threads"
+    HOST_CONNECTION_LIMITS = "host-connection-limits"
 
     app_config = {}
 
@@ -52,10 +66,24 @@ class AppConfig:
         LOW_BANDWIDTH_LIMIT: 100,
         MEDIUM_BANDWIDTH_LIMIT: 1000,
         HIGH_BANDWIDTH_LIMIT: 5000,
+        BANDWIDTH_BURST_SECONDS: 0.25,
         OVERWRITE_EXISTING_FILES: True,
         PER_JOB_DEFAULT_THREAD_COUNT: 3,
+        PER_JOB_DEFAULT_SEGMENT_COUNT: 1,
         URL_CACHE_ENABLED: True,
         DOWNLOAD_RETRY_ATTEMPTS: 5,
+        DOWNLOAD_ENGINE: "threaded",
+        WRITE_BEHIND_BUFFER_MB: 64,
+        PREALLOCATE_FILES: False,
+        CHECKSUM_ALGORITHM: "sha256",
+        STALL_MIN_RATE_KBPS: 1,
+        STALL_TIMEOUT_SECONDS: 60,
+        MAX_HEDGES_PER_JOB: 2,
+        SIZE_RESOLVER_THREADS: 8,
+        URL_METADATA_TTL_HOURS: 24,
+        URL_METADATA_CACHE_SIZE: 100000,
+        GLOBAL_DOWNLOAD_THREADS: 16,
+        HOST_CONNECTION_LIMITS: {"*archive.org": 6},
     }
 
     JOB_NAMING_STRATEGY = {
@@ -69,6 +97,20 @@ class AppConfig:
         1: "shared",
     }
 
+    # of the checksums computed while downloading, none turns them off
+    CHECKSUM_ALGORITHMS = {
+        0: "none",
+        1: "md5",
+        2: "sha1",
+        3: "sha256",
+    }
+
+    # threaded: a thread per download worker, asyncio: all workers on a single event loop
+    DOWNLOAD_ENGINES = {
+        0: "threaded",
+        1: "asyncio",
+    }
+
     def job_naming_strategy_index(strategy: str) -> int:
         return list(AppConfig.JOB_NAMING_STRATEGY.values()).index(strategy)
 
@@ -161,6 +203,15 @@ def validate_bandwidth_config():
             f"Invalid value for {AppConfig.HIGH_BANDWIDTH_LIMIT} in the current configuration. Must be a number."
         )
 
+    bandwidth_burst_seconds = get_config_value(AppConfig.BANDWIDTH_BURST_SECONDS)
+    if bandwidth_burst_seconds is None:
+        bandwidth_burst_seconds = 0.25
+        set_config_value(AppConfig.BANDWIDTH_BURST_SECONDS, bandwidth_burst_seconds)
+    if not isinstance(bandwidth_burst_seconds, (int, float)) or bandwidth_burst_seconds <= 0:
+        raise ValueError(
+            f"Invalid value for {AppConfig.BANDWIDTH_BURST_SECONDS} in the current configuration. Must be a positive number."
+        )
+
     per_job_default_thread_count = get_config_value(
         AppConfig.PER_JOB_DEFAULT_THREAD_COUNT
     )
@@ -174,6 +225,19 @@ def validate_bandwidth_config():
             f"Invalid value for {AppConfig.PER_JOB_DEFAULT_THREAD_COUNT} in the current configuration. Must be a number."
         )
 
+    per_job_default_segment_count = get_config_value(
+        AppConfig.PER_JOB_DEFAULT_SEGMENT_COUNT
+    )
+    if per_job_default_segment_count is None:
+        per_job_default_segment_count = 1
+        set_config_value(
+            AppConfig.PER_JOB_DEFAULT_SEGMENT_COUNT, per_job_default_segment_count
+        )
+    if not isinstance(per_job_default_segment_count, int) or per_job_default_segment_count < 1:
+        raise ValueError(
+            f"Invalid value for {AppConfig.PER_JOB_DEFAULT_SEGMENT_COUNT} in the current configuration. Must be a positive number."
+        )
+
 
 def validate(filename: str):
     debug = get_config_value(AppConfig.DEBUG)
@@ -216,4 +280,111 @@ def validate(filename: str):
         url_cache_enabled = True
         set_config_value(AppConfig.URL_CACHE_ENABLED, url_cache_enabled)
 
+    write_behind_buffer_mb = get_config_value(AppConfig.WRITE_BEHIND_BUFFER_MB)
+    if write_behind_buffer_mb is None:
+        write_behind_buffer_mb = 64
+        set_config_value(AppConfig.WRITE_BEHIND_BUFFER_MB, write_behind_buffer_mb)
+    if not isinstance(write_behind_buffer_mb, int) or write_behind_buffer_mb < 1:
+        raise ValueError(
+            f"Invalid value for {AppConfig.WRITE_BEHIND_BUFFER_MB} in the current configuration. Must be a positive number."
+        )
+
+    preallocate_files = get_config_value(AppConfig.PREALLOCATE_FILES)
+    if preallocate_files is None:
+        preallocate_files = False
+        set_config_value(AppConfig.PREALLOCATE_FILES, preallocate_files)
+
+    checksum_algorithm = get_config_value(AppConfig.CHECKSUM_ALGORITHM)
+    if checksum_algorithm is None:
+        checksum_algorithm = "sha256"
+        set_config_value(AppConfig.CHECKSUM_ALGORITHM, checksum_algorithm)
+    if checksum_algorithm not in AppConfig.CHECKSUM_ALGORITHMS.values():
+        raise ValueError(
+            f"Invalid value for {AppConfig.CHECKSUM_ALGORITHM} in the current configuration: {checksum_algorithm} Must be 'none', 'md5', 'sha1' or 'sha256'."
+        )
+
+    stall_min_rate_kbps = get_config_value(AppConfig.STALL_MIN_RATE_KBPS)
+    if stall_min_rate_kbps is None:
+        stall_min_rate_kbps = 1
+        set_config_value(AppConfig.STALL_MIN_RATE_KBPS, stall_min_rate_kbps)
+    if not isinstance(stall_min_rate_kbps, (int, float)) or stall_min_rate_kbps < 0:
+        raise ValueError(
+            f"Invalid value for {AppConfig.STALL_MIN_RATE_KBPS} in the current configuration. Must be a non-negative number."
+        )
+
+    stall_timeout_seconds = get_config_value(AppConfig.STALL_TIMEOUT_SECONDS)
+    if stall_timeout_seconds is None:
+        stall_timeout_seconds = 60
+        set_config_value(AppConfig.STALL_TIMEOUT_SECONDS, stall_timeout_seconds)
+    if not isinstance(stall_timeout_seconds, int) or stall_timeout_seconds < 0:
+        raise ValueError(
+            f"Invalid value for {AppConfig.STALL_TIMEOUT_SECONDS} in the current configuration. Must be a non-negative number, 0 turns stall detection off."
+        )
+
+    max_hedges_per_job = get_config_value(AppConfig.MAX_HEDGES_PER_JOB)
+    if max_hedges_per_job is None:
+        max_hedges_per_job = 2
+        set_config_value(AppConfig.MAX_HEDGES_PER_JOB, max_hedges_per_job)
+    if not isinstance(max_hedges_per_job, int) or max_hedges_per_job < 0:
+        raise ValueError(
+            f"Invalid value for {AppConfig.MAX_HEDGES_PER_JOB} in the current configuration. Must be a non-negative number, 0 turns hedging off."
+        )
+
+    size_resolver_threads = get_config_value(AppConfig.SIZE_RESOLVER_THREADS)
+    if size_resolver_threads is None:
+        size_resolver_threads = 8
+        set_config_value(AppConfig.SIZE_RESOLVER_THREADS, size_resolver_threads)
+    if not isinstance(size_resolver_threads, int) or size_resolver_threads < 1:
+        raise ValueError(
+            f"Invalid value for {AppConfig.SIZE_RESOLVER_THREADS} in the current configuration. Must be a positive number."
+        )
+
+    url_metadata_ttl_hours = get_config_value(AppConfig.URL_METADATA_TTL_HOURS)
+    if url_metadata_ttl_hours is None:
+        url_metadata_ttl_hours = 24
+        set_config_value(AppConfig.URL_METADATA_TTL_HOURS, url_metadata_ttl_hours)
+    if not isinstance(url_metadata_ttl_hours, (int, float)) or url_metadata_ttl_hours < 0:
+        raise ValueError(
+            f"Invalid value for {AppConfig.URL_METADATA_TTL_HOURS} in the current configuration. Must be a non-negative number."
+        )
+
+    url_metadata_cache_size = get_config_value(AppConfig.URL_METADATA_CACHE_SIZE)
+    if url_metadata_cache_size is None:
+        url_metadata_cache_size = 100000
+        set_config_value(AppConfig.URL_METADATA_CACHE_SIZE, url_metadata_cache_size)
+    if not isinstance(url_metadata_cache_size, int) or url_metadata_cache_size < 1:
+        raise ValueError(
+            f"Invalid value for {AppConfig.URL_METADATA_CACHE_SIZE} in the current configuration. Must be a positive number."
+        )
+
+    global_download_threads = get_config_value(AppConfig.GLOBAL_DOWNLOAD_THREADS)
+    if global_download_threads is None:
+        global_download_threads = 16
+        set_config_value(AppConfig.GLOBAL_DOWNLOAD_THREADS, global_download_threads)
+    if not isinstance(global_download_threads, int) or global_download_threads < 0:
+        raise ValueError(
+            f"Invalid value for {AppConfig.GLOBAL_DOWNLOAD_THREADS} in the current configuration. Must be a non-negative number, 0 gives every job its own threads."
+        )
+
+    host_connection_limits = get_config_value(AppConfig.HOST_CONNECTION_LIMITS)
+    if host_connection_limits is None:
+        host_connection_limits = {"*archive.org": 6}
+        set_config_value(AppConfig.HOST_CONNECTION_LIMITS, host_connection_limits)
+    if not isinstance(host_connection_limits, dict) or not all(
+        isinstance(pattern, str) and isinstance(limit, int) and limit > 0
+        for pattern, limit in host_connection_limits.items()
+    ):
+        raise ValueError(
+            f"Invalid value for {AppConfig.HOST_CONNECTION_LIMITS} in the current configuration. Must map host patterns to positive numbers, e.g. {{\"*archive.org\": 6}}."
+        )
+
+    download_engine = get_config_value(AppConfig.DOWNLOAD_ENGINE)
+    if download_engine is None:
+        download_engine = "threaded"
+        set_config_value(AppConfig.DOWNLOAD_ENGINE, download_engine)
+    if download_engine not in AppConfig.DOWNLOAD_ENGINES.values():
+        raise ValueError(
+            f"Invalid value for {AppConfig.DOWNLOAD_ENGINE} in the current configuration: {download_engine} Must be 'threaded' or 'asyncio'."
+        )
+
     save_config_to_file(filename)  # defaults filled in, let's save it
@@ -1,9 +1,22 @@
+import os
 from threading import RLock
 from controller.app_cache import AppCache
 from controller.downloads import Downloads
 from controller.update_cycle import UpdateCycle
 from controller.journal_daemon import JournalDaemon
 from web.rate_limiter import RateLimiter
+from web.session_pool import SessionPool
+from web.probe_cache import ProbeCache
+from web.async_downloader import AsyncDownloadEngine
+from web.disk_writer import DiskWriterPool
+from web.stall_watchdog import StallWatchdog
+from web.retry_policy import RetryPolicy
+from web.circuit_breaker import HostCircuitBreakers
+from web.download_scheduler import DownloadScheduler
+from web.host_limits import HostConnectionLimits
+from config.app_config import AppConfig, get_config_value
+
+URL_METADATA_CACHE_FILE = "url_metadata.json"
 
 
 class AppStateHandlers:
@@ -17,7 +30,48 @@ class AppStateHandlers:
         self.db_lock = db_lock
         self.main_window = main_window
         self.cache = AppCache()
-        self.rate_limiter = RateLimiter()
+        self.rate_limiter = RateLimiter(
+            burst_seconds=get_config_value(AppConfig.BANDWIDTH_BURST_SECONDS)
+        )
+        self.session_pool = SessionPool()
+        # kept on disk, restarts do not probe every file of every job again
+        self.probe_cache = ProbeCache(
+            ttl_seconds=get_config_value(AppConfig.URL_METADATA_TTL_HOURS) * 3600,
+            max_entries=get_config_value(AppConfig.URL_METADATA_CACHE_SIZE),
+            path=os.path.join(
+                get_config_value(AppConfig.URL_CACHE_FOLDER), URL_METADATA_CACHE_FILE
+            ),
+        )
+        self.disk_writers = DiskWriterPool(
+            max_in_flight_bytes=get_config_value(AppConfig.WRITE_BEHIND_BUFFER_MB)
+            * 1024
+            * 1024
+        )
+        # only started when a job downloads with the asyncio engine
+        self.async_engine = AsyncDownloadEngine()
+        stall_timeout_seconds = get_config_value(AppConfig.STALL_TIMEOUT_SECONDS)
+        self.stall_watchdog = (
+            StallWatchdog(
+                min_rate_bps=get_config_value(AppConfig.STALL_MIN_RATE_KBPS) * 1024,
+                stall_seconds=stall_timeout_seconds,
+            )
+            if stall_timeout_seconds
+            else None
+        )
+        self.retry_policy = RetryPolicy()
+        # shared by all jobs, a failing host pauses every download from it
+        self.circuit_breakers = HostCircuitBreakers()
+        # shared by all jobs, hosts throttle clients opening too many connections
+        self.host_limits = HostConnectionLimits(
+            get_config_value(AppConfig.HOST_CONNECTION_LIMITS)
+        )
+        # a worker pool shared by all jobs on the threaded engine, 0 threads turns it off
+        global_download_threads = get_config_value(AppConfig.GLOBAL_DOWNLOAD_THREADS)
+        self.download_scheduler = (
+            DownloadScheduler(worker_count=global_download_threads)
+            if global_download_threads
+            else None
+        )
         self.downloads = Downloads(self)
         self.update_cycle = UpdateCycle(self, main_window)
         self.journal_daemon = JournalDaemon(
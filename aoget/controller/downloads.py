@@ -76,14 +76,43 @@ class Downloads:
                 if job_dto.threads_allocated
                 else get_config_value(AppConfig.PER_JOB_DEFAULT_THREAD_COUNT)
             )
+            segments_per_file = (
+                job_dto.segments_allocated
+                if job_dto.segments_allocated
+                else get_config_value(AppConfig.PER_JOB_DEFAULT_SEGMENT_COUNT)
+            )
             retry_attempts = get_config_value(AppConfig.DOWNLOAD_RETRY_ATTEMPTS)
+            checksum_algorithm = get_config_value(AppConfig.CHECKSUM_ALGORITHM)
+            if checksum_algorithm == "none":
+                checksum_algorithm = None
+            engine = (
+                app.async_engine
+                if get_config_value(AppConfig.DOWNLOAD_ENGINE) == "asyncio"
+                else None
+            )
             downloader = QueuedDownloader(
                 job=job_dto,
                 journal_daemon=app.journal_daemon,
                 worker_pool_size=worker_pool_size,
                 download_retry_attempts=retry_attempts,
+                segments_per_file=segments_per_file,
+                session_pool=app.session_pool,
+                probe_cache=app.probe_cache,
+                rate_limiter=app.rate_limiter,
+                disk_writers=app.disk_writers,
+                engine=engine,
+                preallocate_files=get_config_value(AppConfig.PREALLOCATE_FILES),
+                checksum_algorithm=checksum_algorithm,
+                stall_watchdog=app.stall_watchdog,
+                max_hedges=get_config_value(AppConfig.MAX_HEDGES_PER_JOB),
+                retry_policy=app.retry_policy,
+                circuit_breakers=app.circuit_breakers,
+                size_resolver_threads=get_config_value(AppConfig.SIZE_RESOLVER_THREADS),
+                scheduler=app.download_scheduler,
+                host_limits=app.host_limits,
             )
             self.job_downloaders[job_name] = downloader
+            self.update_connection_pool_size()
             if self.start_download_threads:
                 downloader.start_download_threads()
             app.update_cycle.journal_of_job(job_name).update_job_threads(
@@ -99,9 +128,11 @@ class Downloads:
         """Dequeue the given files."""
         self.get_downloader(job_name).dequeue_files(file_dtos)
 
-    def stop_active_downloads(self, job_name: str, file_dtos: list, sync: bool = False) -> None:
-        """Stop the active downloads for the given files."""
-        self.get_downloader(job_name).stop_active_downloads(file_dtos, sync=sync)
+    def stop_active_downloads(self, job_name: str, file_dtos: list, sync: bool = False) -> list:
+        """Stop the active downloads for the given files.
+        :return:
+            The names of the files not stopped in time if sync"""
+        return self.get_downloader(job_name).stop_active_downloads(file_dtos, sync=sync)
 
     def download_file(self, job_name: str, file_dto: FileModelDTO) -> None:
         """Download the given file."""
@@ -159,7 +190,35 @@ class Downloads:
         for downloader in self.job_downloaders.values():
             downloader.download_retry_attempts = retry_attempts
 
+    def update_connection_pool_size(self) -> None:
+        """Size the shared keep-alive connection pools to the number of threads that may
+        connect to the same host at once: all download threads (with their segments) of all
+        jobs, plus the threads of the size resolvers. The workers of the global scheduler
+        bound the download threads of all jobs together."""
+        downloaders = self.job_downloaders.values()
+        download_connections = sum(d.worker_pool_size * d.segments_per_file for d in downloaders)
+        scheduler = self.app.download_scheduler
+        if scheduler is not None and download_connections > 0:
+            download_connections = min(
+                download_connections,
+                scheduler.worker_count * max(d.segments_per_file for d in downloaders),
+            )
+        connections = max((d.size_resolver_threads for d in downloaders), default=1)
+        self.app.session_pool.set_pool_size(connections + download_connections)
+
+    def get_connection_stats(self) -> dict:
+        """Get the connection reuse statistics of the shared keep-alive sessions."""
+        return self.app.session_pool.get_stats()
+
+    def get_host_connection_stats(self, job_name: str) -> dict:
+        """Get the connections in use to the hosts the given job is downloading from, by
+        all jobs, empty if the job is not running."""
+        if not self.is_running_for_job(job_name):
+            return {}
+        return self.get_downloader(job_name).get_host_connection_stats()
+
     def drop_job(self, job_name: str) -> None:
         """Drop the job from the downloads."""
         if job_name in self.job_downloaders:
             self.job_downloaders.pop(job_name)
+            self.update_connection_pool_size()
@@ -32,6 +32,18 @@ class FileDetailsController:
             else ""
         )
         props["Size"] = human_filesize(size_bytes) or "Unknown"
+        if file_model_dto.checksum:
+            props["Checksum"] = file_model_dto.checksum
+        chunk_stats = self.app_controller.files.get_chunk_stats(
+            self.job_name, self.file_name
+        )
+        if chunk_stats:
+            props["Read Chunks"] = (
+                f"{chunk_stats['chunks']} chunks, "
+                f"avg {human_filesize(chunk_stats['average'])}, "
+                f"{human_filesize(chunk_stats['smallest'])} - "
+                f"{human_filesize(chunk_stats['largest'])}"
+            )
         return props
 
     def get_history_entries(self):
@@ -1,4 +1,3 @@
-import os
 import time
 import logging
 from threading import Event
@@ -7,7 +6,8 @@ from model.file_model import FileModel
 from model.dto.file_model_dto import FileModelDTO
 from model.dto.file_event_dto import FileEventDTO
 from util.disk_util import get_all_file_names_from_folders
-from util.aogetutil import human_duration
+from util.aogetutil import human_duration, wait_for_all
+from web.downloader import remove_download_artifacts
 
 logger = logging.getLogger(__name__)
 
@@ -137,9 +137,7 @@ class FileModelController:
             stopped_event.wait(self.FILE_DELETION_WAIT_SECONDS)
         # delete file from disk
         try:
-            file_path = self.resolve_local_file_path(job_name, file_name)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            remove_download_artifacts(self.resolve_local_file_path(job_name, file_name))
             # reset downloaded bytes
             self.app.update_cycle.journal_of_job(
                 job_name
@@ -308,9 +306,21 @@ class FileModelController:
                 self.get_selected_file_dtos(job_name).values(),
             )
         )
+        # stop all the active downloads first, then wait for them together
+        stopped_events = []
+        stopped_file_names = []
         for file_dto in relevant_file_dtos:
-            could_remove, msg = self.remove_file_from_job(
-                job_name, file_dto.name, delete_from_disk
+            could_stop, msg = self.__stop_before_removal(
+                job_name, file_dto.name, stopped_events
+            )
+            if could_stop:
+                stopped_file_names.append(file_dto.name)
+            else:
+                messages.append(msg)
+        wait_for_all(stopped_events, self.FILE_DELETION_WAIT_SECONDS)
+        for file_name in stopped_file_names:
+            could_remove, msg = self.__remove_stopped_file(
+                job_name, file_name, delete_from_disk
             )
             if not could_remove:
                 messages.append(msg)
@@ -330,24 +340,42 @@ class FileModelController:
             A tuple containing a boolean indicating whether the file was removed successfully
             and a string containing the status of the file or the error message if removal
             could not be completed"""
+        stopped_events = []
+        could_stop, msg = self.__stop_before_removal(job_name, file_name, stopped_events)
+        if not could_stop:
+            return False, msg
+        wait_for_all(stopped_events, self.FILE_DELETION_WAIT_SECONDS)
+        return self.__remove_stopped_file(job_name, file_name, delete_from_disk)
+
+    def __stop_before_removal(
+        self, job_name: str, file_name: str, stopped_events: list
+    ) -> tuple[bool, str]:
+        """Dequeue or stop the download of a file about to be removed, without waiting.
+        :param stopped_events:
+            Collects the event set when the stopped download concludes, if it was active
+        :return:
+            Whether the file could be stopped and the error message if not"""
         downloads = self.app.downloads
-        journal = self.app.update_cycle.journal_of_job(job_name)
         if downloads.is_file_queued(job_name, file_name):
             # download not active, but might be queued already
             downloads.get_downloader(job_name).cancel_download(file_name)
         elif downloads.is_file_downloading(job_name, file_name):
             stopped_event = Event()
-            # stop the current download and wait for it to conclude
             could_stop, msg = self.stop_download(job_name, file_name, stopped_event)
             if not could_stop:
                 return False, msg
-            stopped_event.wait(self.FILE_DELETION_WAIT_SECONDS)
+            stopped_events.append(stopped_event)
+        return True, ""
+
+    def __remove_stopped_file(
+        self, job_name: str, file_name: str, delete_from_disk: bool
+    ) -> tuple[bool, str]:
+        """Delete a file no longer downloading from disk if requested and deselect it."""
+        journal = self.app.update_cycle.journal_of_job(job_name)
         # delete file from disk
         if delete_from_disk:
             try:
-                file_path = self.resolve_local_file_path(job_name, file_name)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
+                remove_download_artifacts(self.resolve_local_file_path(job_name, file_name))
             except Exception as e:
                 logger.error("Could not delete file from disk: %s", e)
                 return False, f"Could not delete {file_name} from disk."
@@ -407,6 +435,28 @@ class FileModelController:
                     downloader = self.app.downloads.get_downloader(job_name)
                     downloader.update_priority(file)
 
+    def set_file_rate_limits(
+        self, job_name: str, file_names: list, rate_limit_bps: int
+    ) -> None:
+        """Set the bandwidth limit of the given files, 0 for unlimited"""
+        journal = self.app.update_cycle.journal_of_job(job_name)
+        for file_name in file_names:
+            file = self.get_selected_file_dtos(job_name)[file_name]
+            if file.rate_limit_bps == rate_limit_bps:
+                continue
+            file.rate_limit_bps = rate_limit_bps
+            journal.update_file_rate_limit(file_name, rate_limit_bps)
+            if self.app.downloads.is_running_for_job(job_name):
+                downloader = self.app.downloads.get_downloader(job_name)
+                downloader.update_rate_limit(file)
+
+    def get_chunk_stats(self, job_name: str, file_name: str) -> dict:
+        """Get the read chunk statistics of the current or last download of the file in this
+        session, None if it was not downloaded since the app started"""
+        if not self.app.downloads.is_running_for_job(job_name):
+            return None
+        return self.app.downloads.get_downloader(job_name).get_chunk_stats(file_name)
+
     def get_largest_fileset_length(self) -> int:
         """Get the length of the largest fileset"""
         return max(map(lambda fileset: len(fileset), self.app.cache.get_filesets()))
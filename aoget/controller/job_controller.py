@@ -11,6 +11,7 @@ from model.file_model import FileModel
 import model.yaml.job_yaml as job_yaml
 from controller.job_task_controller import JobTaskController
 from controller.app_state_handlers import AppStateHandlers
+from web.downloader import remove_download_artifacts
 
 logger = logging.getLogger(__name__)
 
@@ -106,11 +107,34 @@ class JobController:
         """Increase the threads for the given job"""
         downloader = self.app.downloads.get_downloader(job_name)
         downloader.add_thread()
+        self.app.downloads.update_connection_pool_size()
         self.app.update_cycle.journal_of_job(job_name).update_job_threads(
             threads_allocated=downloader.worker_pool_size,
             threads_active=downloader.get_active_thread_count(),
         )
 
+    def get_host_connection_stats(self, job_name: str) -> dict:
+        """Get the connections in use to the hosts the given job downloads from, by all
+        jobs, with the limits of the hosts"""
+        return self.app.downloads.get_host_connection_stats(job_name)
+
+    def get_job_rate_limit(self, job_name: str) -> int:
+        """Get the bandwidth limit of the given job, 0 for unlimited"""
+        if self.app.downloads.is_running_for_job(job_name):
+            return self.app.downloads.get_downloader(job_name).rate_limiter.rate_limit_bps
+        pending_update = self.app.update_cycle.journal_of_job(job_name).job_update
+        if pending_update is not None and pending_update.rate_limit_bps is not None:
+            return pending_update.rate_limit_bps
+        return self.get_job_dto_by_name(job_name).rate_limit_bps or 0
+
+    def set_job_rate_limit(self, job_name: str, rate_limit_bps: int) -> None:
+        """Set the bandwidth limit of the given job, 0 for unlimited"""
+        if self.app.downloads.is_running_for_job(job_name):
+            self.app.downloads.get_downloader(job_name).set_job_rate_limit(rate_limit_bps)
+        self.app.update_cycle.journal_of_job(job_name).update_job_rate_limit(
+            rate_limit_bps
+        )
+
     def remove_thread(self, job_name: str) -> None:
         """Decrease the threads for the given job"""
         downloader = self.app.downloads.get_downloader(job_name)
@@ -118,7 +142,11 @@ class JobController:
             return
         victim_file = None
         stopped = Event()
-        if downloader.get_active_thread_count() == downloader.worker_pool_size:
+        # with the global scheduler the threads are a weight, lowering it stops nothing
+        if (
+            downloader.scheduler is None
+            and downloader.get_active_thread_count() == downloader.worker_pool_size
+        ):
             # find the active download with the lowest prio
             files = []
             for file_name in downloader.files_downloading:
@@ -138,6 +166,7 @@ class JobController:
                     count (still reduced)"""
                 )
         downloader.remove_thread()
+        self.app.downloads.update_connection_pool_size()
         if victim_file is not None:
             stopped.wait(2)
             logger.info(
@@ -174,8 +203,8 @@ class JobController:
             for file in self.files.get_selected_file_dtos(job_name).values():
                 try:
                     file_path = os.path.join(target_folder, file.name)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                    removed = remove_download_artifacts(file_path)
+                    if file_path in removed:
                         logger.info("Deleted file from disk: %s", file_path)
                     elif (
                         file.status == FileModel.STATUS_COMPLETED
@@ -217,10 +246,16 @@ class JobController:
         """
         return job_yaml.read_from_yaml(source_file)
 
-    def health_check(self, job_name: str) -> None:
-        """Perform a health check"""
+    def health_check(self, job_name: str, deep: bool = False) -> None:
+        """Perform a health check
+        :param job_name:
+            The name of the job
+        :param deep:
+            Whether to also verify the contents of the completed files"""
         self.app.downloads.get_downloader(job_name).health_check(
-            self.files.get_selected_file_dtos(job_name).values(), self.message_callback
+            self.files.get_selected_file_dtos(job_name).values(),
+            self.message_callback,
+            deep=deep,
         )
 
     def validate_file_states(self) -> None:
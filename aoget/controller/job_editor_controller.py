@@ -35,6 +35,8 @@ class JobEditorController:
         self.page_url = page_url
         self.crawler = PageCrawler(page_url)
         urls_by_extension = self.crawler.fetch_links()
+        ao_page = self.crawler.ao_page
+        probe_cache = self.app_controller.handlers.probe_cache
         files_by_extension = {}
         for extension in urls_by_extension.keys():
             files_by_current_extension = []
@@ -42,6 +44,15 @@ class JobEditorController:
                 file = FileModelDTO.from_url(url)
                 file.selected = False
                 file.priority = 2
+                # listed by the page, or known from an earlier job or crawl, no need to
+                # resolve it again
+                file.size_bytes = ao_page.file_sizes.get(url)
+                if file.size_bytes is None:
+                    metadata = probe_cache.get(url)
+                    if metadata is not None and metadata.content_length > 0:
+                        file.size_bytes = metadata.content_length
+                # the expected checksum, verified once downloaded
+                file.checksum = ao_page.file_checksums.get(url)
                 files_by_current_extension.append(file)
                 self.files_by_name[file.name] = file
             files_by_extension[extension] = sorted(files_by_current_extension)
@@ -73,7 +84,8 @@ class JobEditorController:
             page_url=self.page_url,
             total_size_bytes=self.job.total_size_bytes if self.job else 0,
             target_folder=self.job_editor_dialog.get_target_folder(),
-            threads_allocated=get_config_value(AppConfig.PER_JOB_DEFAULT_THREAD_COUNT)
+            threads_allocated=get_config_value(AppConfig.PER_JOB_DEFAULT_THREAD_COUNT),
+            segments_allocated=get_config_value(AppConfig.PER_JOB_DEFAULT_SEGMENT_COUNT),
         )
 
     def use_files(self, files: list) -> None:
@@ -7,6 +7,25 @@ from controller.derived_field_calculator import DerivedFieldCalculator
 logger = logging.getLogger(__name__)
 
 
+class ProgressCounter:
+    """Progress of a single download. Written by the downloading worker only and read by the
+    journal daemon once per tick. The value is replaced as a whole, which is atomic, so neither
+    side needs a lock."""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = None  # (written, total) or None until the first update
+
+    def update(self, written: int, total: int) -> None:
+        """Record the progress of the download.
+        :param written:
+            Bytes written so far
+        :param total:
+            Total bytes to write"""
+        self.value = (written, total)
+
+
 class JournalDaemon:
     """A thread-safe progress reporter that reports progress of multiple event sources - firing on
     different threads - on a single thread. Also implements throttling of progress updates to
@@ -29,6 +48,8 @@ class JournalDaemon:
         self.__journal = {}  # type: Dict[str, JobUpdates]
         # holds the previous snapshot of the journal to calculate derived fields
         self.__snapshot = {}  # type: Dict[str, JobUpdates]
+        # (jobname, filename) -> [counter, last harvested value]
+        self.__progress_counters = {}
         flush_thread = threading.Thread(target=self.__append_journal, daemon=True)
         if start_daemon:
             flush_thread.start()
@@ -39,6 +60,7 @@ class JournalDaemon:
         while not self.__stopped:
             if self.__journal_processor is not None:
                 with self.__lock:
+                    self.__harvest_progress_counters()
                     # calculate the derived fields using the previous snapshot
                     if len(self.__snapshot) > 0:
                         DerivedFieldCalculator.patch(self.__journal, self.__snapshot)
@@ -69,6 +91,44 @@ class JournalDaemon:
                 filename, written, total
             )
 
+    def register_progress_counter(self, jobname: str, filename: str) -> ProgressCounter:
+        """Get a counter through which the progress of the given file is reported without
+        locking. The daemon picks up the latest value once per tick.
+        :param jobname:
+            The name of the job
+        :param filename:
+            The filename to report progress for
+        :return:
+            The counter, to be unregistered when the download ends"""
+        counter = ProgressCounter()
+        with self.__lock:
+            self.__progress_counters[(jobname, filename)] = [counter, None]
+        return counter
+
+    def unregister_progress_counter(self, jobname: str, filename: str) -> None:
+        """Journal the last value of the counter of the given file and stop harvesting it.
+        :param jobname:
+            The name of the job
+        :param filename:
+            The filename of the counter"""
+        with self.__lock:
+            entry = self.__progress_counters.pop((jobname, filename), None)
+            if entry is not None:
+                self.__harvest_progress_counter(jobname, filename, entry)
+
+    def __harvest_progress_counters(self) -> None:
+        """Journal the progress counters that changed since the last tick. Lock must be held."""
+        for (jobname, filename), entry in self.__progress_counters.items():
+            self.__harvest_progress_counter(jobname, filename, entry)
+
+    def __harvest_progress_counter(self, jobname: str, filename: str, entry: list) -> None:
+        counter, last_value = entry
+        value = counter.value
+        if value is None or value is last_value:
+            return
+        entry[1] = value
+        self.__journal_of_job(jobname).update_file_download_progress(filename, *value)
+
     def update_file_status(
         self, jobname: str, filename: str, status: str, err: str = ""
     ) -> None:
@@ -93,6 +153,41 @@ class JournalDaemon:
         with self.__lock:
             self.__journal_of_job(jobname).update_file_size(filename, size)
 
+    def update_file_sizes(self, jobname: str, sizes: dict) -> None:
+        """Update the sizes of files of the given job in a single batch.
+        :param jobname:
+            The name of the job
+        :param sizes:
+            The sizes to update in a dict of filename: size pairs"""
+        with self.__lock:
+            self.__journal_of_job(jobname).update_file_sizes(sizes)
+
+    def update_file_checksum(self, jobname: str, filename: str, checksum: str) -> None:
+        """Update the checksum of the given filename.
+        :param jobname:
+            The name of the job
+        :param filename:
+            The filename to update
+        :param checksum:
+            The checksum as algorithm:hexdigest"""
+        with self.__lock:
+            self.__journal_of_job(jobname).update_file_checksum(filename, checksum)
+
+    def update_file_verification(
+        self, jobname: str, filename: str, size: int, mtime_ns: int
+    ) -> None:
+        """Record a successful deep integrity check of the given filename.
+        :param jobname:
+            The name of the job
+        :param filename:
+            The filename checked
+        :param size:
+            The size of the file checked
+        :param mtime_ns:
+            The modification time of the file checked, in nanoseconds"""
+        with self.__lock:
+            self.__journal_of_job(jobname).update_file_verification(filename, size, mtime_ns)
+
     def add_file_events(self, jobname: str, events: dict) -> None:
         """Add events to the given filename.
         :param jobname:
@@ -138,6 +233,8 @@ class JournalDaemon:
         with self.__lock:
             if jobname in self.__journal:
                 self.__journal.pop(jobname, None)
+            for key in [key for key in self.__progress_counters if key[0] == jobname]:
+                self.__progress_counters.pop(key)
 
     def __journal_of_job(self, jobname: str) -> JobUpdates:
         """Get the journal of a job.
@@ -105,6 +105,12 @@ class MainWindowController:
         self.handlers.downloads.set_retry_attempts(
             get_config_value(AppConfig.DOWNLOAD_RETRY_ATTEMPTS)
         )
+        self.handlers.rate_limiter.set_burst(
+            get_config_value(AppConfig.BANDWIDTH_BURST_SECONDS)
+        )
+        self.handlers.disk_writers.set_max_in_flight_bytes(
+            get_config_value(AppConfig.WRITE_BEHIND_BUFFER_MB) * 1024 * 1024
+        )
 
     def on_resolver_finished(self, job_name: str) -> None:
         """Called when a resolver has finished"""
@@ -121,3 +127,11 @@ class MainWindowController:
     def shutdown(self) -> None:
         """Shutdown the controller"""
         self.handlers.downloads.shutdown_all()
+        if self.handlers.download_scheduler is not None:
+            self.handlers.download_scheduler.shutdown()
+        self.handlers.session_pool.close()
+        self.handlers.probe_cache.close()
+        self.handlers.disk_writers.close()
+        self.handlers.async_engine.stop()
+        if self.handlers.stall_watchdog is not None:
+            self.handlers.stall_watchdog.stop()
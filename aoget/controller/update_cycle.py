@@ -69,9 +69,12 @@ class UpdateCycle:
                     self.process_job_updates(async_journal[jobname], merge=True)
                 self.stats.check_out("process_job_updates")
         self.journal.clear()
-        self.__update_rate_limits()
         self.stats.check_out("tick")
         logger.debug(f"Tick #{self.tick_count} stats: totals={self.stats.get_totals()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Tick #{self.tick_count} connections: {self.app.downloads.get_connection_stats()}"
+            )
 
     def __update_job_in_db(self, job_name: str, job_updates: JobUpdates) -> Job:
         """Update the job in the database as per the in-cycle job updates."""
@@ -381,17 +384,3 @@ class UpdateCycle:
         for file_model_dto in all_impacted_files.values():
             self.main_window.update_file_signal.emit(file_model_dto)
         self.stats.check_out("update_file_signal")
-
-    def __update_rate_limits(self) -> None:
-        """Update the rate limits"""
-        total_thread_count = 0
-        dls = self.app.downloads
-        for job in dls.get_all_active_job_names():
-            total_thread_count += dls.get_downloader(job).get_active_thread_count()
-        if total_thread_count == 0:
-            return
-        per_thread_limit = self.app.rate_limiter.get_per_thread_limit(
-            total_thread_count
-        )
-        for job in dls.get_all_active_job_names():
-            dls.get_downloader(job).set_rate_limit(per_thread_limit)
@@ -1,7 +1,7 @@
 import logging
 from sqlalchemy.orm import scoped_session, sessionmaker, DeclarativeBase
 from sqlalchemy.engine import Engine
-from sqlalchemy import event
+from sqlalchemy import event, inspect, text
 
 global DBSession
 
@@ -32,3 +32,25 @@ def initialize_sql(engine):
     DBSession.configure(bind=engine)
     Base.metadata.bind = engine
     Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+
+
+def add_missing_columns(engine):
+    """Add the columns that were introduced to the models after the tables were created.
+    create_all() won't alter existing tables, so databases of earlier app versions need this."""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = [column["name"] for column in inspector.get_columns(table.name)]
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            default = column.default.arg if column.default is not None else None
+            statement = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+            if default is not None and not callable(default):
+                statement += f" DEFAULT {default!r}"
+            logger.info(f"Adding missing column {table.name}.{column.name}.")
+            with engine.begin() as connection:
+                connection.execute(text(statement))
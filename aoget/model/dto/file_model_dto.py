@@ -24,7 +24,11 @@ class FileModelDTO:
         last_event: str = None,
         target_path: str = None,
         priority: int = None,
+        rate_limit_bps: int = None,
         deleted: bool = False,
+        checksum: str = None,
+        verified_size: int = None,
+        verified_mtime_ns: int = None,
     ):
         self.name = name
         self.job_name = job_name
@@ -41,6 +45,10 @@ class FileModelDTO:
         self.last_event = last_event
         self.target_path = target_path
         self.priority = priority
+        self.rate_limit_bps = rate_limit_bps
+        self.checksum = checksum
+        self.verified_size = verified_size
+        self.verified_mtime_ns = verified_mtime_ns
         self.set_percent_completed
         self.deleted = False
 
@@ -71,6 +79,10 @@ class FileModelDTO:
             last_event=file_model.get_latest_history_entry().event,
             target_path=file_model.get_target_path(),
             priority=file_model.priority,
+            rate_limit_bps=file_model.rate_limit_bps,
+            checksum=file_model.checksum,
+            verified_size=file_model.verified_size,
+            verified_mtime_ns=file_model.verified_mtime_ns,
         )
         file_model_dto.set_percent_completed()
         return file_model_dto
@@ -91,7 +103,11 @@ class FileModelDTO:
             "last_event": self.last_event,
             "target_path": self.target_path,
             "priority": self.priority,
+            "rate_limit_bps": self.rate_limit_bps,
             "deleted": self.deleted,
+            "checksum": self.checksum,
+            "verified_size": self.verified_size,
+            "verified_mtime_ns": self.verified_mtime_ns,
         }
 
     def __merge_static_fields(self, other_file_model_dto):
@@ -114,6 +130,9 @@ class FileModelDTO:
             self.url = other_file_model_dto.url
         if other_file_model_dto.priority:
             self.priority = other_file_model_dto.priority
+        # 0 is a valid value, meaning unlimited
+        if other_file_model_dto.rate_limit_bps is not None:
+            self.rate_limit_bps = other_file_model_dto.rate_limit_bps
         if other_file_model_dto.target_path:
             self.target_path = other_file_model_dto.target_path
 
@@ -150,6 +169,11 @@ class FileModelDTO:
             self.rate_bytes_per_sec = other_file_model_dto.rate_bytes_per_sec
         if other_file_model_dto.eta_seconds and other_file_model_dto.eta_seconds > -1:
             self.eta_seconds = other_file_model_dto.eta_seconds
+        if other_file_model_dto.checksum:
+            self.checksum = other_file_model_dto.checksum
+        if other_file_model_dto.verified_mtime_ns is not None:
+            self.verified_size = other_file_model_dto.verified_size
+            self.verified_mtime_ns = other_file_model_dto.verified_mtime_ns
 
     def merge(self, other_file_model_dto):
         self.__merge_static_fields(other_file_model_dto)
@@ -176,6 +200,15 @@ class FileModelDTO:
         )
         file_model.status = self.status if self.status else file_model.status
         file_model.priority = self.priority if self.priority else file_model.priority
+        file_model.rate_limit_bps = (
+            self.rate_limit_bps
+            if self.rate_limit_bps is not None
+            else file_model.rate_limit_bps
+        )
+        file_model.checksum = self.checksum if self.checksum else file_model.checksum
+        if self.verified_mtime_ns is not None:
+            file_model.verified_size = self.verified_size
+            file_model.verified_mtime_ns = self.verified_mtime_ns
 
     def update_from_model(self, file_model):
         self.name = file_model.name if file_model.name else self.name
@@ -202,6 +235,11 @@ class FileModelDTO:
         self.last_event_timestamp = file_model.get_latest_history_timestamp()
         self.last_event = file_model.get_latest_history_entry().event
         self.priority = file_model.priority
+        self.rate_limit_bps = file_model.rate_limit_bps
+        self.checksum = file_model.checksum if file_model.checksum else self.checksum
+        if file_model.verified_mtime_ns is not None:
+            self.verified_size = file_model.verified_size
+            self.verified_mtime_ns = file_model.verified_mtime_ns
         self.target_path = file_model.get_target_path()
         self.set_percent_completed()
 
@@ -226,7 +264,9 @@ class FileModelDTO:
             f"last_event_timestamp={self.last_event_timestamp}, "
             f"last_event={self.last_event}, "
             f"target_path={self.target_path}, deleted={self.deleted}, "
-            f"priority={self.priority})"
+            f"priority={self.priority}, rate_limit_bps={self.rate_limit_bps}, "
+            f"checksum={self.checksum}, verified_size={self.verified_size}, "
+            f"verified_mtime_ns={self.verified_mtime_ns})"
         )
 
     def __repr__(self):
@@ -252,6 +292,10 @@ class FileModelDTO:
             and self.target_path == __value.target_path
             and self.deleted == __value.deleted
             and self.priority == __value.priority
+            and self.rate_limit_bps == __value.rate_limit_bps
+            and self.checksum == __value.checksum
+            and self.verified_size == __value.verified_size
+            and self.verified_mtime_ns == __value.verified_mtime_ns
         )
 
     def __lt__(self, other):
@@ -11,6 +11,8 @@ class JobDTO:
         rate_bytes_per_sec=None,
         threads_active=None,
         threads_allocated=None,
+        segments_allocated=None,
+        rate_limit_bps=None,
         files_done=None,
         selected_files_count=None,
         selected_files_with_known_size=None,
@@ -28,6 +30,8 @@ class JobDTO:
         self.rate_bytes_per_sec = rate_bytes_per_sec
         self.threads_active = threads_active
         self.threads_allocated = threads_allocated
+        self.segments_allocated = segments_allocated
+        self.rate_limit_bps = rate_limit_bps
         self.files_done = files_done
         self.selected_files_count = selected_files_count
         self.selected_files_with_known_size = selected_files_with_known_size
@@ -48,6 +52,8 @@ class JobDTO:
             selected_files_count=job_model.selected_files_count,
             selected_files_with_known_size=job_model.selected_files_with_known_size,
             threads_allocated=job_model.threads_allocated,
+            segments_allocated=job_model.segments_allocated,
+            rate_limit_bps=job_model.rate_limit_bps,
             files_done=job_model.files_done,
         )
         # job_dto.files = [FileModelDTO.from_model(file_model) for file_model in job_model.files]
@@ -72,6 +78,11 @@ class JobDTO:
             self.threads_active = other.threads_active
         if other.threads_allocated:
             self.threads_allocated = other.threads_allocated
+        if other.segments_allocated:
+            self.segments_allocated = other.segments_allocated
+        # 0 is a valid value, meaning unlimited
+        if other.rate_limit_bps is not None:
+            self.rate_limit_bps = other.rate_limit_bps
         if other.files_done:
             self.files_done = other.files_done
         if other.selected_files_count:
@@ -116,6 +127,16 @@ class JobDTO:
             if self.threads_allocated
             else job_model.threads_allocated
         )
+        job_model.segments_allocated = (
+            self.segments_allocated
+            if self.segments_allocated
+            else job_model.segments_allocated
+        )
+        job_model.rate_limit_bps = (
+            self.rate_limit_bps
+            if self.rate_limit_bps is not None
+            else job_model.rate_limit_bps
+        )
         job_model.files_done = (
             self.files_done if self.files_done else job_model.files_done
         )
@@ -153,6 +174,16 @@ class JobDTO:
             if job_model.threads_allocated
             else self.threads_allocated
         )
+        self.segments_allocated = (
+            job_model.segments_allocated
+            if job_model.segments_allocated
+            else self.segments_allocated
+        )
+        self.rate_limit_bps = (
+            job_model.rate_limit_bps
+            if job_model.rate_limit_bps is not None
+            else self.rate_limit_bps
+        )
         self.files_done = (
             job_model.files_done if job_model.files_done else self.files_done
         )
@@ -37,6 +37,13 @@ class FileModel(Base):
     downloaded_bytes: Mapped[int] = mapped_column(nullable=True, default=-1)
     status: Mapped[str] = mapped_column(default=STATUS_NEW)
     priority: Mapped[int] = mapped_column(default=2, nullable=False)
+    # bytes per second, 0 means unlimited
+    rate_limit_bps: Mapped[int] = mapped_column(default=0)
+    # algorithm:hexdigest computed while downloading, e.g. sha256:9f86d0...
+    checksum: Mapped[str] = mapped_column(nullable=True)
+    # size and modification time of the file at its last successful deep integrity check
+    verified_size: Mapped[int] = mapped_column(nullable=True)
+    verified_mtime_ns: Mapped[int] = mapped_column(nullable=True)
     history_entries: Mapped[List["FileEvent"]] = relationship(
         back_populates="file", cascade="all, delete, delete-orphan"
     )
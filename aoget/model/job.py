@@ -36,6 +36,9 @@ class Job(Base):
     # cache field
     files_done: Mapped[int] = mapped_column(default=0)
     threads_allocated: Mapped[int] = mapped_column(default=3)
+    segments_allocated: Mapped[int] = mapped_column(default=1)
+    # bytes per second, 0 means unlimited
+    rate_limit_bps: Mapped[int] = mapped_column(default=0)
     files: Mapped[List["FileModel"]] = relationship(back_populates="job",
                                                     cascade="all, delete, delete-orphan")
 
@@ -5,7 +5,7 @@ from model.dto.job_dto import JobDTO
 from model.dto.file_model_dto import FileModelDTO
 from model.dto.file_event_dto import FileEventDTO
 from model.file_model import FileModel
-from util.aogetutil import timestamp_str, human_filesize, human_priority
+from util.aogetutil import timestamp_str, human_filesize, human_priority, human_rate
 
 logger = logging.getLogger(__name__)
 
@@ -103,6 +103,16 @@ class JobUpdates:
             self.job_update.threads_allocated = threads_allocated
             self.job_update.threads_active = threads_active
 
+    def update_job_rate_limit(self, rate_limit_bps: int) -> None:
+        """Update the bandwidth limit of the job.
+        :param rate_limit_bps: The new limit in bytes per second, 0 for unlimited"""
+        if not self.job_update:
+            self.job_update = JobDTO(
+                id=-1, name=self.job_name, rate_limit_bps=rate_limit_bps
+            )
+        else:
+            self.job_update.rate_limit_bps = rate_limit_bps
+
     def update_job_status(self, status: str) -> None:
         """Update the status of the job.
         :param status: The new status of the job"""
@@ -229,6 +239,13 @@ class JobUpdates:
             )
         self.add_file_event(file_name, "Resolved size: " + str(human_filesize(size)))
 
+    def update_file_sizes(self, sizes: dict) -> None:
+        """Update the sizes of files at once.
+        :param sizes: The new sizes in a dictionary with the file name as the key"""
+        with self.lock:
+            for file_name, size in sizes.items():
+                self.update_file_size(file_name, size)
+
     def update_file_priority(self, file_name: str, priority: int) -> None:
         """Update the priority of a file.
         :param file_name: The name of the file to update
@@ -243,6 +260,44 @@ class JobUpdates:
             file_name, f"Priority changed to {human_priority(priority)}."
         )
 
+    def update_file_rate_limit(self, file_name: str, rate_limit_bps: int) -> None:
+        """Update the bandwidth limit of a file.
+        :param file_name: The name of the file to update
+        :param rate_limit_bps: The new limit in bytes per second, 0 for unlimited"""
+        if file_name in self.file_model_updates:
+            self.file_model_updates[file_name].rate_limit_bps = rate_limit_bps
+        else:
+            self.file_model_updates[file_name] = FileModelDTO(
+                job_name=self.job_name, name=file_name, rate_limit_bps=rate_limit_bps
+            )
+        self.add_file_event(
+            file_name,
+            f"Bandwidth limit changed to {human_rate(rate_limit_bps) or 'unlimited'}.",
+        )
+
+    def update_file_checksum(self, file_name: str, checksum: str) -> None:
+        """Update the checksum of a downloaded file.
+        :param file_name: The name of the file to update
+        :param checksum: The checksum as algorithm:hexdigest"""
+        if file_name in self.file_model_updates:
+            self.file_model_updates[file_name].checksum = checksum
+        else:
+            self.file_model_updates[file_name] = FileModelDTO(
+                job_name=self.job_name, name=file_name, checksum=checksum
+            )
+
+    def update_file_verification(self, file_name: str, size: int, mtime_ns: int) -> None:
+        """Record a successful deep integrity check of a file.
+        :param file_name: The name of the file checked
+        :param size: The size of the file checked
+        :param mtime_ns: The modification time of the file checked, in nanoseconds"""
+        if file_name not in self.file_model_updates:
+            self.file_model_updates[file_name] = FileModelDTO(
+                job_name=self.job_name, name=file_name
+            )
+        self.file_model_updates[file_name].verified_size = size
+        self.file_model_updates[file_name].verified_mtime_ns = mtime_ns
+
     def deselect_file(self, file_name: str) -> None:
         """Deselect a file.
         :param file_name: The name of the file to deselect"""
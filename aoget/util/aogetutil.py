@@ -1,4 +1,5 @@
 import os
+import time
 import urllib.parse
 from datetime import datetime
 from datetime import timedelta
@@ -155,6 +156,23 @@ def human_duration(duration_seconds: float) -> str:
     return f"{(duration_seconds // 3600):.1f} hours"
 
 
+def wait_for_all(events, timeout: float) -> list:
+    """Wait for all the given events with a single deadline, so that waiting for many takes
+    no longer than waiting for one.
+    :param events:
+        The threading.Events to wait for
+    :param timeout:
+        The seconds to wait for all of them
+    :return:
+        The events not set by the deadline"""
+    deadline = time.monotonic() + timeout
+    pending = []
+    for event in events:
+        if not event.wait(max(0.0, deadline - time.monotonic())):
+            pending.append(event)
+    return pending
+
+
 def human_priority(priority: int) -> str:
     """Get a human readable priority from the given priority.
     :param priority:
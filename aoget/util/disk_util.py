@@ -1,3 +1,4 @@
+import errno
 import os
 import re
 
@@ -11,6 +12,37 @@ def get_local_file_size(file_path: str) -> int:
     return os.path.getsize(file_path)
 
 
+def preallocate(file, size: int) -> bool:
+    """Reserve the disk space of a file up front, so that the filesystem can lay it out in
+    as few extents as possible instead of growing it one write at a time. The file size
+    becomes the given size, which therefore no longer tells how much was written.
+    On POSIX the blocks are really allocated, a sparse file would not help the layout, so
+    filesystems without fallocate support are left alone. On Windows extending the file
+    reserves its clusters.
+    :param file:
+        An open binary file, writable
+    :param size:
+        The final size of the file in bytes
+    :return:
+        True if the space was reserved"""
+    if size <= 0:
+        return False
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(file.fileno(), 0, size)
+            return True
+        except OSError as e:
+            if e.errno in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                return False
+            raise
+    if os.name == "nt":
+        position = file.tell()
+        file.truncate(size)
+        file.seek(position)
+        return True
+    return False
+
+
 def get_all_file_names_from_folders(folders: list) -> list:
     """Get all file names from a list of folders.
     :param folders: The list of folders
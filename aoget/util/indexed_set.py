@@ -0,0 +1,78 @@
+"""A thread-safe set of names keeping their insertion order, for the bookkeeping of which
+files of a job are queued or downloading. Membership tests, additions and removals are O(1)
+regardless of the size of the job, iteration goes over a snapshot."""
+
+import threading
+
+# the default of pops telling a missing item from one that is present
+ABSENT = object()
+
+
+class IndexedSet:
+    """An insertion-ordered set with the list methods the bookkeeping used to call. Adding
+    a name already in the set keeps its original position."""
+
+    def __init__(self, items=None):
+        """Create a set.
+        :param items:
+            The initial items, if any"""
+        self.__lock = threading.Lock()
+        # dicts keep insertion order, the values are unused
+        self.__items = dict.fromkeys(items) if items is not None else {}
+
+    def append(self, item) -> None:
+        """Add an item, if not in the set yet."""
+        with self.__lock:
+            self.__items[item] = None
+
+    def extend(self, items) -> None:
+        """Add all the given items not in the set yet."""
+        with self.__lock:
+            self.__items.update(dict.fromkeys(items))
+
+    def remove(self, item) -> None:
+        """Remove an item.
+        :raises ValueError:
+            If the item is not in the set, as list.remove does"""
+        if not self.discard(item):
+            raise ValueError(f"{item} is not in the set")
+
+    def discard(self, item) -> bool:
+        """Remove an item if in the set.
+        :return:
+            True if the item was removed, False if it was not in the set"""
+        with self.__lock:
+            return self.__items.pop(item, ABSENT) is not ABSENT
+
+    def discard_all(self, items) -> int:
+        """Remove all the given items that are in the set.
+        :return:
+            The number of items removed"""
+        removed = 0
+        with self.__lock:
+            for item in items:
+                if self.__items.pop(item, ABSENT) is not ABSENT:
+                    removed += 1
+        return removed
+
+    def clear(self) -> None:
+        """Remove all items."""
+        with self.__lock:
+            self.__items.clear()
+
+    def snapshot(self) -> list:
+        """Get the items in insertion order, as a list not affected by later changes."""
+        with self.__lock:
+            return list(self.__items)
+
+    def __contains__(self, item) -> bool:
+        return item in self.__items
+
+    def __len__(self) -> int:
+        return len(self.__items)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __repr__(self):
+        return f"IndexedSet({self.snapshot()})"
@@ -51,6 +51,31 @@ def confirmation_dialog(parent, message: str, header="Please confirm") -> bool:
     return msg.exec() == QtWidgets.QMessageBox.StandardButton.Yes
 
 
+def confirmation_dialog_with_option(
+    parent, message: str, option: str, header="Please confirm"
+) -> tuple:
+    """Show a confirmation dialog with the given message and an option to tick
+    :param parent:
+        The parent window
+    :param message:
+        The message to show in the dialog
+    :param option:
+        The label of the option checkbox, unticked by default
+    :return:
+        Whether the user confirmed and whether the option was ticked"""
+    msg = QtWidgets.QMessageBox(parent)
+    msg.setWindowTitle(header)
+    msg.setText(message)
+    msg.setCheckBox(QtWidgets.QCheckBox(option))
+    msg.setStandardButtons(
+        QtWidgets.QMessageBox.StandardButton.Yes
+        | QtWidgets.QMessageBox.StandardButton.No
+    )
+    msg.setDefaultButton(QtWidgets.QMessageBox.StandardButton.No)
+    confirmed = msg.exec() == QtWidgets.QMessageBox.StandardButton.Yes
+    return confirmed, msg.checkBox().isChecked()
+
+
 def show_warnings(parent, brief: str, messages: list, header="Warning") -> bool:
     """Show a confirmation dialog with the given message
     :param parent:
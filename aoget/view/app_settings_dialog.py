@@ -91,6 +91,15 @@ class AppSettingsDialog(QDialog):
                 self.spinThreadsPerJob.value()
             )
         )
+        self.spinSegmentsPerFile.setValue(
+            int(get_config_value(AppConfig.PER_JOB_DEFAULT_SEGMENT_COUNT))
+        )
+        self.spinSegmentsPerFile.valueChanged.connect(
+            lambda: set_config_value(
+                AppConfig.PER_JOB_DEFAULT_SEGMENT_COUNT,
+                self.spinSegmentsPerFile.value()
+            )
+        )
         self.spinRetriesPerFile.setValue(
             int(get_config_value(AppConfig.DOWNLOAD_RETRY_ATTEMPTS))
         )
@@ -0,0 +1,35 @@
+from PyQt6.QtWidgets import QMenu
+from config.app_config import AppConfig, get_config_value
+from util.aogetutil import human_rate
+
+
+def bandwidth_limit_presets() -> list:
+    """Get the selectable bandwidth limits in bytes per second: unlimited (0) and the high,
+    medium and low limits of the application settings."""
+    return [
+        0,
+        get_config_value(AppConfig.HIGH_BANDWIDTH_LIMIT) * 1024,
+        get_config_value(AppConfig.MEDIUM_BANDWIDTH_LIMIT) * 1024,
+        get_config_value(AppConfig.LOW_BANDWIDTH_LIMIT) * 1024,
+    ]
+
+
+def populate_bandwidth_menu(menu: QMenu, current_limit: int, on_limit_selected) -> None:
+    """Fill the given menu with the bandwidth limit presets, ticking the current one.
+    :param menu:
+        The menu to fill, existing actions are removed
+    :param current_limit:
+        The limit currently in effect in bytes per second, 0 for unlimited
+    :param on_limit_selected:
+        Called with the selected limit in bytes per second"""
+    menu.clear()
+    presets = bandwidth_limit_presets()
+    if current_limit and current_limit not in presets:
+        # the presets were changed in the settings since the limit was set
+        presets.append(current_limit)
+    for limit in presets:
+        action = menu.addAction(human_rate(limit) if limit > 0 else "Unlimited")
+        action.setCheckable(True)
+        action.setChecked(limit == (current_limit or 0))
+        action.setToolTip("You can adjust these limits in the application settings.")
+        action.triggered.connect(lambda checked, limit=limit: on_limit_selected(limit))
@@ -6,6 +6,7 @@ from PyQt6.QtWidgets import (
     QTableWidgetItem,
     QProgressBar,
     QApplication,
+    QMenu,
 )
 from PyQt6.QtCore import QUrl
 from PyQt6.QtGui import QDesktopServices
@@ -22,6 +23,7 @@ from view.priority_widget_item import PriorityWidgetItem
 from view.rate_widget_item import RateWidgetItem
 from view.size_widget_item import SizeWidgetItem
 from view.file_details_dialog import FileDetailsDialog
+from view.bandwidth_menu import populate_bandwidth_menu
 from view import PROGRESS_BAR_ACTIVE_STYLE, PROGRESS_BAR_PASSIVE_STYLE
 
 logger = logging.getLogger(__name__)
@@ -109,6 +111,9 @@ class MainWindowFiles:
         mw.btnFileOpenLink.clicked.connect(self.__on_file_open_link)
         mw.btnFilePriorityPlus.clicked.connect(self.__on_file_priority_plus)
         mw.btnFilePriorityMinus.clicked.connect(self.__on_file_priority_minus)
+        self.file_bandwidth_menu = QMenu(mw.btnFileBandwidth)
+        self.file_bandwidth_menu.aboutToShow.connect(self.__on_file_bandwidth_menu)
+        mw.btnFileBandwidth.setMenu(self.file_bandwidth_menu)
 
         # disable all file toolbar buttons
         mw.btnFileStartDownload.setEnabled(False)
@@ -122,6 +127,7 @@ class MainWindowFiles:
         mw.btnFileOpenLink.setEnabled(False)
         mw.btnFilePriorityPlus.setEnabled(False)
         mw.btnFilePriorityMinus.setEnabled(False)
+        mw.btnFileBandwidth.setEnabled(False)
 
         # issue #110: redownload currently disabled
         mw.btnFileRedownload.setHidden(True)
@@ -171,6 +177,7 @@ class MainWindowFiles:
             mw.btnFileOpenLink.setEnabled(False)
             mw.btnFilePriorityPlus.setEnabled(False)
             mw.btnFilePriorityMinus.setEnabled(False)
+            mw.btnFileBandwidth.setEnabled(False)
 
         elif self.__selected_file_count() == 1:
             mw.btnFileRedownload.setEnabled(True)
@@ -182,6 +189,7 @@ class MainWindowFiles:
             mw.btnFileOpenLink.setEnabled(True)
             mw.btnFilePriorityPlus.setEnabled(True)
             mw.btnFilePriorityMinus.setEnabled(True)
+            mw.btnFileBandwidth.setEnabled(True)
             file_status = self.get_current_file_status()
             self.__update_file_start_stop_buttons(file_status)
 
@@ -197,6 +205,7 @@ class MainWindowFiles:
             mw.btnFileOpenLink.setEnabled(False)
             mw.btnFilePriorityPlus.setEnabled(True)
             mw.btnFilePriorityMinus.setEnabled(True)
+            mw.btnFileBandwidth.setEnabled(True)
 
     def is_file_selected(self, filename=None) -> bool:
         """Determine whether a file is selected"""
@@ -540,6 +549,21 @@ class MainWindowFiles:
         job_name, selected_files = self.get_current_multi_selection()
         mw.controller.files.decrease_file_priorities(job_name, selected_files)
 
+    def __on_file_bandwidth_menu(self) -> None:
+        """Fill the bandwidth menu with the limit of the (first) selected file ticked"""
+        if self.nothing_selected():
+            return
+        mw = self.main_window
+        job_name, selected_files = self.get_current_multi_selection()
+        file_dto = mw.controller.files.get_selected_file_dtos(job_name)[selected_files[0]]
+        populate_bandwidth_menu(
+            self.file_bandwidth_menu,
+            file_dto.rate_limit_bps,
+            lambda limit: mw.controller.files.set_file_rate_limits(
+                job_name, selected_files, limit
+            ),
+        )
+
     def __restyleFileProgressBar(self, row: int, style: str) -> None:
         """Restyle the progress bar for the given row in the files table"""
         mw = self.main_window
@@ -1,6 +1,6 @@
 import logging
 
-from PyQt6.QtWidgets import QHeaderView, QTableWidgetItem, QFileDialog
+from PyQt6.QtWidgets import QHeaderView, QTableWidgetItem, QFileDialog, QMenu
 from PyQt6.QtCore import QUrl
 from PyQt6.QtGui import QDesktopServices
 from view.job_editor_dialog import JobEditorDialog
@@ -10,11 +10,13 @@ from view.files_widget_item import FilesWidgetItem
 from view.threads_widget_item import ThreadsWidgetItem
 from view.rate_widget_item import RateWidgetItem
 from view.size_widget_item import SizeWidgetItem
+from view.bandwidth_menu import populate_bandwidth_menu
 from model.job import Job
 from model.dto.job_dto import JobDTO
 
 from util.qt_util import (
     confirmation_dialog,
+    confirmation_dialog_with_option,
     show_warnings,
     message_dialog,
     error_dialog,
@@ -117,6 +119,9 @@ class MainWindowJobs:
         mw.btnJobStop.clicked.connect(self.__on_job_stop)
         mw.btnJobThreadsPlus.clicked.connect(self.__on_job_threads_plus)
         mw.btnJobThreadsMinus.clicked.connect(self.__on_job_threads_minus)
+        self.job_bandwidth_menu = QMenu(mw.btnJobBandwidth)
+        self.job_bandwidth_menu.aboutToShow.connect(self.__on_job_bandwidth_menu)
+        mw.btnJobBandwidth.setMenu(self.job_bandwidth_menu)
         mw.btnJobCreate.clicked.connect(self.__on_create_new_job)
         mw.btnJobEdit.clicked.connect(self.__on_edit_job)
         mw.btnJobRemoveFromList.clicked.connect(self.__on_job_remove_from_list)
@@ -160,6 +165,7 @@ class MainWindowJobs:
             mw.btnJobStop.setEnabled(False)
             mw.btnJobThreadsPlus.setEnabled(False)
             mw.btnJobThreadsMinus.setEnabled(False)
+            mw.btnJobBandwidth.setEnabled(False)
             mw.btnJobCreate.setEnabled(True)
             mw.btnJobEdit.setEnabled(False)
             mw.btnJobRemoveFromList.setEnabled(False)
@@ -180,6 +186,7 @@ class MainWindowJobs:
             mw.btnJobStop.setEnabled(True)
             mw.btnJobThreadsPlus.setEnabled(True)
             mw.btnJobThreadsMinus.setEnabled(True)
+            mw.btnJobBandwidth.setEnabled(True)
             mw.btnJobRemoveFromList.setEnabled(True)
             mw.btnJobRemove.setEnabled(True)
             mw.btnJobOpenLink.setEnabled(True)
@@ -226,6 +233,18 @@ class MainWindowJobs:
         current_job = mw.tblJobs.selectedItems()[0].text()
         mw.controller.jobs.remove_thread(current_job)
 
+    def __on_job_bandwidth_menu(self):
+        """Fill the bandwidth menu with the limit of the selected job ticked"""
+        if not self.is_job_selected():
+            return
+        mw = self.main_window
+        job_name = mw.tblJobs.selectedItems()[0].text()
+        populate_bandwidth_menu(
+            self.job_bandwidth_menu,
+            mw.controller.jobs.get_job_rate_limit(job_name),
+            lambda limit: mw.controller.jobs.set_job_rate_limit(job_name, limit),
+        )
+
     def __on_create_new_job(self):
         """Create a new job"""
         mw = self.main_window
@@ -403,7 +422,7 @@ class MainWindowJobs:
             return
         mw = self.main_window
         job_name = mw.tblJobs.selectedItems()[0].text()
-        if confirmation_dialog(
+        confirmed, deep = confirmation_dialog_with_option(
             mw,
             f"""Perform an integrity check on the job: <b>{job_name}</b>?<br>
             <p>This will check the status of all files in the job and update their status if
@@ -412,9 +431,14 @@ class MainWindowJobs:
             and already should be on disk (partially or completely downloaded).</p>
             <p>The process will not check the remote links for availability.
             It will be done in the background, with failing files being updated as the
-            process goes.</p>""",
-        ):
-            mw.controller.jobs.health_check(job_name)
+            process goes.</p>
+            <p>A deep check also reads the completed files and compares their contents to the
+            checksums recorded when downloaded. Files unchanged since their last deep check
+            are not read again.</p>""",
+            "Deep check (verify file contents)",
+        )
+        if confirmed:
+            mw.controller.jobs.health_check(job_name, deep=deep)
 
     def set_job_at_row(self, row, job: JobDTO):
         """Set the job at the given row in the jobs table"""
@@ -432,6 +456,10 @@ class MainWindowJobs:
                 else ""
             ),
         )
+        if job.rate_limit_bps:
+            mw.tblJobs.item(row, JOB_RATE_IDX).setToolTip(
+                f"Limited to {human_rate(job.rate_limit_bps)}"
+            )
         mw.tblJobs.setItem(
             row,
             JOB_THREADS_IDX,
@@ -439,6 +467,11 @@ class MainWindowJobs:
                 f"{job.threads_active or 0}/{job.threads_allocated or 0}"
             ),
         )
+        host_connections = mw.controller.jobs.get_host_connection_stats(job.name)
+        if host_connections:
+            mw.tblJobs.item(row, JOB_THREADS_IDX).setToolTip(
+                self.__host_connections_str(host_connections)
+            )
         mw.tblJobs.setItem(
             row,
             JOB_FILES_IDX,
@@ -466,6 +499,16 @@ class MainWindowJobs:
         )
         mw.tblJobs.item(row, JOB_TARGET_FOLDER_IDX).setToolTip(job.target_folder)
 
+    def __host_connections_str(self, host_connections: dict) -> str:
+        """Describe the connections in use to the hosts of a job for the threads tooltip"""
+        lines = ["Connections in use by all jobs:"]
+        for host, connections in host_connections.items():
+            if connections["limit"]:
+                lines.append(f"{host}: {connections['active']}/{connections['limit']}")
+            else:
+                lines.append(f"{host}: {connections['active']} (no limit)")
+        return "\n".join(lines)
+
     def __set_job_progress_item(self, row, job):
         """Set the progress cell for the given job based on the current state of the job"""
         mw = self.main_window
@@ -9,11 +9,21 @@ class AoPage:
         self.files_by_extension = defaultdict(list)
         self.extension_counts = defaultdict(lambda: 0)
         self.page_title = ""
+        # known without probing the files, e.g. from the archive.org metadata API
+        self.file_sizes = {}
+        self.file_checksums = {}
 
     def add_file_by_extension(self, extension, url):
         self.files_by_extension[extension].append(url)
         self.extension_counts[extension] += 1
 
+    def add_file_metadata(self, url, size_bytes=None, checksum=None):
+        """Record the size and the checksum (algorithm:hexdigest) of a file, if known."""
+        if size_bytes is not None:
+            self.file_sizes[url] = size_bytes
+        if checksum is not None:
+            self.file_checksums[url] = checksum
+
     def get_sorted_extensions(self):
         sorted_extensions = sorted(self.files_by_extension.keys())
         return sorted_extensions
@@ -0,0 +1,117 @@
+"""Listing of archive.org items through the item metadata API. A single JSON response has the
+name, size and checksums of every file of an item, so a job created from it needs neither
+the HTML crawler nor the size resolver."""
+
+import logging
+import re
+from pathlib import Path
+from urllib.parse import quote, urlparse
+import requests
+from web.aopage import AoPage
+from web.checksum import format_checksum
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ORG_URL = "https://archive.org"
+ARCHIVE_ORG_HOSTS = ("archive.org", "www.archive.org")
+TIMEOUT_SECONDS = 15
+# the strongest checksum archive.org lists first
+CHECKSUM_KEYS = ("sha1", "md5")
+# item pages, e.g. /details/<identifier> or /download/<identifier>/
+ITEM_PATH = re.compile(r"^/(?:details|download)/([^/]+)/?$")
+
+
+def item_identifier(page_url: str) -> str:
+    """Get the identifier of the archive.org item of a page.
+    :param page_url:
+        The URL of the page
+    :return:
+        The identifier, None if the page is not an archive.org item page"""
+    parsed = urlparse(page_url)
+    if parsed.scheme not in ("http", "https"):
+        return None
+    if parsed.hostname is None or parsed.hostname.lower() not in ARCHIVE_ORG_HOSTS:
+        return None
+    match = ITEM_PATH.match(parsed.path)
+    return match.group(1) if match else None
+
+
+def fetch_item_metadata(
+    identifier: str, base_url: str = ARCHIVE_ORG_URL, session: requests.Session = None
+) -> dict:
+    """Get the metadata of an archive.org item.
+    :param identifier:
+        The identifier of the item
+    :param base_url:
+        The archive.org server
+    :param session:
+        Keep-alive session to use, a one-off connection is made if None
+    :return:
+        The metadata as returned by the API"""
+    http = session if session is not None else requests
+    r = http.get(f"{base_url}/metadata/{quote(identifier)}", timeout=TIMEOUT_SECONDS)
+    r.raise_for_status()
+    metadata = r.json()
+    # unknown items are answered with an empty object
+    if not isinstance(metadata, dict) or not isinstance(metadata.get("files"), list):
+        raise ValueError(f"No archive.org item found with the identifier {identifier}.")
+    return metadata
+
+
+def fill_page_from_metadata(
+    page_url: str,
+    ao_page: AoPage,
+    base_url: str = ARCHIVE_ORG_URL,
+    session: requests.Session = None,
+) -> bool:
+    """Fill a page with the files of the archive.org item of the page URL, with their sizes
+    and checksums. Only the files at the root of the item are listed, the same as the HTML
+    crawler finds on the download page of the item.
+    :param page_url:
+        The URL of the page
+    :param ao_page:
+        The page to fill
+    :param base_url:
+        The archive.org server
+    :param session:
+        Keep-alive session to use, a one-off connection is made if None
+    :return:
+        True if the page was filled, False if the page is not an item page or its metadata
+        could not be fetched, in which case the page is left untouched"""
+    identifier = item_identifier(page_url)
+    if identifier is None:
+        return False
+    try:
+        metadata = fetch_item_metadata(identifier, base_url, session)
+    except (requests.RequestException, ValueError) as e:
+        logger.warning("Could not get the archive.org metadata of %s: %s", identifier, e)
+        return False
+    title = metadata.get("metadata", {}).get("title")
+    ao_page.page_title = title if isinstance(title, str) else identifier
+    listed = 0
+    for file in metadata["files"]:
+        name = file.get("name")
+        if not name or "/" in name:
+            continue
+        url = f"{base_url}/download/{quote(identifier)}/{quote(name)}"
+        ao_page.add_file_by_extension(Path(name).suffix, url)
+        ao_page.add_file_metadata(url, __size_of(file), __checksum_of(file))
+        listed += 1
+    logger.info("Listed %d files of archive.org item %s from its metadata.", listed, identifier)
+    return True
+
+
+def __size_of(file: dict) -> int:
+    """Get the size of a file of the metadata, sent as a string."""
+    try:
+        return int(file["size"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def __checksum_of(file: dict) -> str:
+    for algorithm in CHECKSUM_KEYS:
+        digest = file.get(algorithm)
+        if digest:
+            return format_checksum(algorithm, digest.lower())
+    return None
@@ -0,0 +1,778 @@
+"""Asyncio download engine, an alternative to the thread-per-download workers. All downloads
+run as coroutines on a single event loop thread with non-blocking HTTP, so idle connections
+cost neither a thread nor a context switch. The functions mirror the threaded ones in the
+downloader module and report through the same DownloadSignals contract."""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+import aiohttp
+import portalocker
+from util.aogetutil import human_filesize
+from util.disk_util import preallocate as preallocate_file
+from web.downloader import (
+    DownloadSignals,
+    HEAD_REJECTED_STATUSES,
+    STATUS_COMPLETED,
+    STATUS_FAILED,
+    STATUS_STOPPED,
+    TIMEOUT_SECONDS,
+    WRITTEN_OFFSET_CHECKPOINT_SECONDS,
+    assemble_parts,
+    clear_written_offset,
+    has_segment_parts,
+    open_target,
+    record_written_offset,
+    segment_part_path,
+    segment_ranges,
+    written_size,
+)
+from web.probe_cache import ProbeCache, UrlMetadata
+from web.rate_limiter import RateLimiter
+from web.chunk_sizer import AdaptiveChunkSizer
+from web.checksum import StreamingChecksum
+from web.stall_watchdog import StallGuard, StallWatchdog
+from web.retry_policy import RetryPolicy, ServerBusyError, busy_error
+from web.circuit_breaker import HostCircuitBreakers
+from web.host_limits import HostConnectionLimits
+
+logger = logging.getLogger(__name__)
+
+# how often segmented downloads report aggregated progress
+SEGMENT_PROGRESS_INTERVAL_SECONDS = 0.5
+# threads writing the downloads of the engine to disk, a slow disk never stalls the loop
+DISK_IO_THREADS = 4
+
+
+class AsyncDownloadEngine:
+    """A single event loop running on its own daemon thread, shared by all jobs that use the
+    asyncio engine. Coroutines are submitted from any thread and the loop-bound HTTP session
+    keeps connections alive per host. Disk writes run on a bounded executor of the engine,
+    apart from the default executor of the loop."""
+
+    def __init__(self, connections_per_host: int = 0, disk_io_threads: int = DISK_IO_THREADS):
+        """Create the engine, the loop thread is started on first use.
+        :param connections_per_host:
+            The maximum number of simultaneous connections to a single host, 0 for no limit
+            other than the number of workers and segments
+        :param disk_io_threads:
+            The number of threads writing the downloads to disk"""
+        self.connections_per_host = connections_per_host
+        self.disk_io_threads = disk_io_threads
+        self.disk_executor = None
+        self.__lock = threading.Lock()
+        self.__loop = None
+        self.__thread = None
+        self.__session = None
+
+    def start(self) -> None:
+        """Start the event loop thread if it is not running yet."""
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__loop = asyncio.new_event_loop()
+            self.disk_executor = ThreadPoolExecutor(
+                self.disk_io_threads, thread_name_prefix="async-disk-io"
+            )
+            self.__thread = threading.Thread(
+                target=self.__run_loop,
+                args=(self.__loop,),
+                name="async-download-engine",
+                daemon=True,
+            )
+            self.__thread.start()
+
+    def is_running(self) -> bool:
+        """Determine whether the event loop thread is running."""
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine loop.
+        :param coro:
+            The coroutine to run
+        :return:
+            A concurrent.futures.Future of the result"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.__loop)
+
+    def session(self) -> aiohttp.ClientSession:
+        """Get the HTTP session of the engine. Must be called on the engine loop."""
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=0, limit_per_host=self.connections_per_host
+            )
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=TIMEOUT_SECONDS, sock_read=TIMEOUT_SECONDS
+            )
+            self.__session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.__session
+
+    def stop(self, timeout: float = 5) -> None:
+        """Close the HTTP session and stop the event loop thread.
+        :param timeout:
+            Seconds to wait for the loop thread to finish"""
+        with self.__lock:
+            if self.__thread is None:
+                return
+            loop, thread, disk_executor = self.__loop, self.__thread, self.disk_executor
+            self.__loop = None
+            self.__thread = None
+            self.disk_executor = None
+        try:
+            asyncio.run_coroutine_threadsafe(self.__close_session(), loop).result(timeout)
+        except Exception as e:
+            logger.error("Failed to close the session of the async engine: %s", e)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        # writes already started are finished, so that no file is left half written
+        disk_executor.shutdown(wait=True)
+
+    async def __close_session(self) -> None:
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def __run_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+        loop.close()
+
+
+async def download_file(
+    url: str,
+    local_path: str,
+    session: aiohttp.ClientSession,
+    signals: DownloadSignals = None,
+    attempts: int = 5,
+    file_size: int = -1,
+    segments: int = 1,
+    probe_cache: ProbeCache = None,
+    rate_limiter: RateLimiter = None,
+    chunk_sizer: AdaptiveChunkSizer = None,
+    preallocate: bool = False,
+    checksum: StreamingChecksum = None,
+    stall_watchdog: StallWatchdog = None,
+    retry_policy: RetryPolicy = None,
+    circuit_breakers: HostCircuitBreakers = None,
+    host_limits: HostConnectionLimits = None,
+    disk_executor: ThreadPoolExecutor = None,
+) -> str:
+    """Download a file from the internet, the asyncio counterpart of downloader.download_file.
+    Parameters
+    ----------
+    url: str
+        Remote resource (file) url
+    local_path: str
+        Local path where to store the file
+    session: aiohttp.ClientSession
+        Session of the engine the coroutine runs on
+    signals: DownloadSignals
+        Observer for download progress
+    segments: int
+        Number of parallel ranged connections to use for the file
+    probe_cache: ProbeCache
+        Cache of URL probes shared with the size resolver
+    rate_limiter: RateLimiter
+        Bandwidth limiter shared by all downloads, unlimited if None
+    chunk_sizer: AdaptiveChunkSizer
+        Sizer of the reads from a single stream, a fresh one is used if None
+    preallocate: bool
+        Whether to reserve the disk space of the file up front if its size is known
+    checksum: StreamingChecksum
+        Checksum of the file computed while downloading, not computed if None
+    stall_watchdog: StallWatchdog
+        Watchdog of the throughput of the attempts, a stalled attempt is cancelled and the
+        download resumes on a fresh connection. Not watched if None
+    retry_policy: RetryPolicy
+        Delays between the attempts, retried right away if None
+    circuit_breakers: HostCircuitBreakers
+        Breakers of the hosts shared by all downloads, waited for while open. Not used if
+        None
+    host_limits: HostConnectionLimits
+        Connection limits of the hosts shared by all downloads. The file is split to at
+        most as many segments as the host allows, and each attempt runs them on the
+        connections free, waiting only if none is. Not limited if None
+    disk_executor: ThreadPoolExecutor
+        Executor of the disk writes of the engine, the default executor of the loop if None
+    """
+    loop = asyncio.get_running_loop()
+    is_cancelled = signals.is_cancelled if signals is not None else None
+    on_event = signals.on_event if signals is not None else None
+    if host_limits is not None:
+        segments = host_limits.cap(url, segments)
+    current_attempt = 0
+    while current_attempt < attempts:
+        if (
+            circuit_breakers is not None
+            and not await circuit_breakers.wait_until_closed_async(
+                url, is_cancelled, on_event
+            )
+        ):
+            return STATUS_STOPPED
+        connections = segments
+        if host_limits is not None:
+            connections = await host_limits.acquire_async(
+                url, segments, is_cancelled, on_event
+            )
+            if not connections:
+                return STATUS_STOPPED
+        error = None
+        stall_guard = (
+            stall_watchdog.watch(signals, rate_limiter) if stall_watchdog is not None else None
+        )
+        # a task of its own, so that aborting the connections cancels only the attempt
+        attempt = asyncio.ensure_future(
+            __attempt_download_file(
+                url,
+                local_path,
+                session,
+                signals,
+                file_size,
+                segments,
+                connections,
+                probe_cache,
+                rate_limiter,
+                chunk_sizer,
+                preallocate,
+                checksum,
+                stall_guard,
+                disk_executor,
+            )
+        )
+        abort = partial(loop.call_soon_threadsafe, attempt.cancel)
+        if signals is not None:
+            signals.register_abort(abort)
+        try:
+            result = await attempt
+            if result != STATUS_FAILED and not __stalled(stall_guard):
+                if circuit_breakers is not None and result == STATUS_COMPLETED:
+                    circuit_breakers.record_success(url, on_event)
+                return result
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # the download itself was cancelled, not just the attempt
+                raise
+            if signals is not None and signals.cancelled:
+                logger.debug(f"Download cancelled for {url}")
+                return STATUS_STOPPED
+        except Exception as e:
+            if signals is not None and signals.cancelled:
+                logger.debug(f"Download cancelled for {url}")
+                return STATUS_STOPPED
+            error = e
+            if circuit_breakers is not None and is_host_failure(e):
+                circuit_breakers.record_failure(url, e, on_event)
+            if not __stalled(stall_guard):
+                if probe_cache is not None:
+                    probe_cache.invalidate(url)
+                logger.error(f"Downloading {url} failed in attempt #{current_attempt + 1}: {e}")
+                logger.exception(e)
+                if on_event is not None:
+                    on_event(f"Download attempt {current_attempt + 1} failed: {e}")
+        finally:
+            if signals is not None:
+                signals.unregister_abort(abort)
+            if stall_guard is not None:
+                stall_guard.close()
+            if host_limits is not None:
+                host_limits.release(url, connections)
+        if __stalled(stall_guard):
+            # resumed on a fresh connection, probed again in case it redirects elsewhere
+            if probe_cache is not None:
+                probe_cache.invalidate(url)
+            logger.info("Download of %s stalled, recycling its connection.", url)
+            if on_event is not None:
+                on_event(stall_guard.describe())
+        current_attempt += 1
+        if (
+            retry_policy is not None
+            and not __stalled(stall_guard)
+            and current_attempt < attempts
+            and not await retry_policy.wait_async(current_attempt, error, is_cancelled)
+        ):
+            return STATUS_STOPPED
+
+    logger.error(f"Downloading {url} failed after {attempts} attempts, giving up.")
+    if on_event is not None:
+        on_event(f"Retries exceeded ({attempts}), giving up.")
+    return STATUS_FAILED
+
+
+def is_host_failure(error: Exception) -> bool:
+    """Determine whether a download failed because of its host rather than the file, see
+    downloader.is_host_failure."""
+    return isinstance(
+        error, (ServerBusyError, aiohttp.ClientConnectionError, asyncio.TimeoutError)
+    )
+
+
+def __raise_if_busy(response: aiohttp.ClientResponse, url: str) -> None:
+    """Raise a ServerBusyError if the response tells that the server is busy."""
+    error = busy_error(url, response.status, response.headers)
+    if error is not None:
+        raise error
+
+
+def __paused(stall_guard: StallGuard):
+    """Pause the guard, if any, while the download waits on the disk instead of its
+    connection."""
+    return stall_guard.pause() if stall_guard is not None else nullcontext()
+
+
+def __stalled(stall_guard: StallGuard) -> bool:
+    """Whether the attempt watched by the guard, if any, was aborted as stalled."""
+    return stall_guard is not None and stall_guard.tripped
+
+
+async def __attempt_download_file(
+    url: str,
+    local_path: str,
+    session: aiohttp.ClientSession,
+    signals: DownloadSignals,
+    file_size: int,
+    segments: int,
+    connections: int,
+    probe_cache: ProbeCache,
+    rate_limiter: RateLimiter,
+    chunk_sizer: AdaptiveChunkSizer,
+    preallocate: bool,
+    checksum: StreamingChecksum,
+    stall_guard: StallGuard,
+    disk_executor: ThreadPoolExecutor,
+) -> str:
+    """Probe the url once and resume, restart or split the download accordingly."""
+    metadata = await probe_url(url, session, probe_cache=probe_cache)
+    file_size_online = file_size if file_size != -1 else metadata.content_length
+    file = Path(local_path)
+
+    if (
+        segments > 1
+        and metadata.accept_ranges
+        and file_size_online > 0
+        and (not file.exists() or has_segment_parts(local_path, segments))
+    ):
+        return await __segmented_downloader(
+            url,
+            local_path,
+            session,
+            file_size_online,
+            segments,
+            connections,
+            signals,
+            metadata.final_url,
+            rate_limiter,
+            preallocate,
+            checksum,
+            stall_guard,
+            disk_executor,
+        )
+
+    if not file.exists():
+        return await __downloader(
+            url,
+            local_path,
+            session,
+            None,
+            signals,
+            metadata,
+            rate_limiter,
+            chunk_sizer,
+            preallocate,
+            checksum,
+            stall_guard,
+            disk_executor,
+        )
+    file_size_offline = written_size(local_path)
+    if file_size_online == file_size_offline:
+        clear_written_offset(local_path)
+        if checksum is not None:
+            await asyncio.to_thread(checksum.resume_at, local_path, file_size_offline)
+        signals.on_event("File was already on disk and complete.")
+        signals.on_update_progress(file_size_offline, file_size_offline)
+        return STATUS_COMPLETED
+    if metadata.accept_ranges:
+        signals.on_event(
+            "Resuming download at " + str(human_filesize(file_size_offline)) + "."
+        )
+        return await __downloader(
+            url,
+            local_path,
+            session,
+            file_size_offline,
+            signals,
+            metadata,
+            rate_limiter,
+            chunk_sizer,
+            preallocate,
+            checksum,
+            stall_guard,
+            disk_executor,
+        )
+    signals.on_event("Server does not support resume, restarting download.")
+    return await __downloader(
+        url,
+        local_path,
+        session,
+        None,
+        signals,
+        metadata,
+        rate_limiter,
+        chunk_sizer,
+        preallocate,
+        checksum,
+        stall_guard,
+        disk_executor,
+    )
+
+
+async def __downloader(
+    url: str,
+    local_path: str,
+    session: aiohttp.ClientSession,
+    resume_byte_pos: int,
+    signals: DownloadSignals,
+    metadata: UrlMetadata,
+    rate_limiter: RateLimiter,
+    chunk_sizer: AdaptiveChunkSizer,
+    preallocate: bool,
+    checksum: StreamingChecksum,
+    stall_guard: StallGuard = None,
+    disk_executor: ThreadPoolExecutor = None,
+) -> str:
+    """Stream the url to disk, resuming at the given byte position if set. A preallocated
+    file gets its written offset recorded as in the threaded downloader."""
+    headers = None
+    if resume_byte_pos:
+        headers = {"Range": f"bytes={resume_byte_pos}-"}
+        if metadata.validator():
+            headers["If-Range"] = metadata.validator()
+    cancelled = signals.is_cancelled if signals is not None else None
+
+    async with session.get(metadata.final_url, headers=headers) as r:
+        __raise_if_busy(r, url)
+        r.raise_for_status()
+        if resume_byte_pos and r.status == 200:
+            logger.debug("Server sent the full file instead of a range, restarting %s", url)
+            if signals is not None:
+                signals.on_event(
+                    "Remote file changed or range was ignored, restarting download."
+                )
+            resume_byte_pos = None
+        written = resume_byte_pos if resume_byte_pos else 0
+        total = metadata.content_length
+        file = Path(local_path)
+        if checksum is not None:
+            # reading back a prefix not hashed yet must not block the loop, nor the writes
+            await asyncio.to_thread(checksum.resume_at, local_path, written)
+        f, tracked = await __on_disk(
+            disk_executor, __open_locked_target, local_path, written, total, preallocate
+        )
+        with f:
+            next_checkpoint = time.monotonic() + WRITTEN_OFFSET_CHECKPOINT_SECONDS
+            try:
+                async for chunk in __iter_chunks(r, chunk_sizer, rate_limiter):
+                    if rate_limiter is not None and not await rate_limiter.acquire_async(
+                        len(chunk), cancelled
+                    ):
+                        return STATUS_STOPPED
+                    if stall_guard is not None:
+                        stall_guard.record(len(chunk))
+                    with __paused(stall_guard):
+                        await __on_disk(disk_executor, __write_chunk, f, chunk, checksum)
+                    written += len(chunk)
+                    if tracked and time.monotonic() >= next_checkpoint:
+                        await __on_disk(disk_executor, __checkpoint, f, local_path, written)
+                        next_checkpoint = time.monotonic() + WRITTEN_OFFSET_CHECKPOINT_SECONDS
+                    if signals is not None:
+                        signals.on_update_progress(written, total)
+                        if signals.cancelled:
+                            logger.debug(f"Download cancelled for {file}")
+                            return STATUS_STOPPED
+            finally:
+                if tracked:
+                    await __on_disk(disk_executor, __checkpoint, f, local_path, written)
+                if checksum is not None:
+                    checksum.checkpoint(written)
+            if tracked:
+                await __on_disk(disk_executor, f.truncate, written)
+        if tracked:
+            await __on_disk(disk_executor, clear_written_offset, local_path)
+
+    if signals is not None:
+        signals.on_update_progress(total, total)
+    logger.debug("Downloaded %s", url)
+    return STATUS_COMPLETED
+
+
+async def __on_disk(disk_executor: ThreadPoolExecutor, func, *args):
+    """Run blocking disk I/O on the disk executor, the default executor of the loop if None."""
+    return await asyncio.get_running_loop().run_in_executor(disk_executor, partial(func, *args))
+
+
+def __open_locked_target(
+    local_path: str, written: int, total: int, preallocate: bool
+) -> tuple:
+    """Open the target file as open_target does and lock it, on a worker thread."""
+    f, tracked = open_target(local_path, written, total, preallocate)
+    try:
+        portalocker.lock(f, portalocker.LOCK_EX | portalocker.LOCK_NB)
+    except Exception:
+        f.close()
+        raise
+    return f, tracked
+
+
+def __write_chunk(f, chunk: bytes, checksum: StreamingChecksum) -> None:
+    """Hash and write a chunk, on a worker thread."""
+    if checksum is not None:
+        checksum.update(chunk)
+    f.write(chunk)
+
+
+def __checkpoint(f, local_path: str, written: int) -> None:
+    """Flush a preallocated file and record its written offset, on a worker thread."""
+    f.flush()
+    record_written_offset(local_path, written)
+
+
+def __open_locked_part(part_path: str):
+    """Open a part file for appending and lock it, on a worker thread."""
+    f = open(part_path, "ab")
+    try:
+        portalocker.lock(f, portalocker.LOCK_EX | portalocker.LOCK_NB)
+    except Exception:
+        f.close()
+        raise
+    return f
+
+
+def __assemble(
+    local_path: str, part_paths: list, file_size: int, preallocate: bool, checksum
+) -> None:
+    """Assemble the parts of a segmented download into the target file and remove them,
+    on a worker thread."""
+    with open(local_path, "wb") as f:
+        portalocker.lock(f, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        if preallocate:
+            preallocate_file(f, file_size)
+        assemble_parts(f, part_paths, checksum)
+    for part_path in part_paths:
+        os.remove(part_path)
+
+
+async def __iter_chunks(
+    response, chunk_sizer: AdaptiveChunkSizer = None, rate_limiter: RateLimiter = None
+):
+    """Read the body of a response in chunks of at most the size given by the chunk sizer,
+    feeding the time of each read and its processing back to the sizer."""
+    chunk_sizer = chunk_sizer if chunk_sizer is not None else AdaptiveChunkSizer()
+    started = time.monotonic()
+    while True:
+        rate_limit = rate_limiter.effective_rate_limit() if rate_limiter else 0
+        chunk = await response.content.read(chunk_sizer.next_size(rate_limit))
+        if not chunk:
+            return
+        yield chunk
+        now = time.monotonic()
+        chunk_sizer.record(len(chunk), now - started)
+        started = now
+
+
+async def __segment_downloader(
+    session: aiohttp.ClientSession,
+    download_url: str,
+    part_path: str,
+    byte_range: tuple,
+    progress: list,
+    index: int,
+    is_cancelled,
+    rate_limiter: RateLimiter,
+    stall_guard: StallGuard = None,
+    disk_executor: ThreadPoolExecutor = None,
+) -> None:
+    """Download a single byte range of a file to its part file, resuming the part file."""
+    first_byte, last_byte = byte_range
+    segment_length = last_byte - first_byte + 1
+    part = Path(part_path)
+    written = part.stat().st_size if part.exists() else 0
+    progress[index] = written
+    if written >= segment_length:
+        return
+    headers = {"Range": f"bytes={first_byte + written}-{last_byte}"}
+    async with session.get(download_url, headers=headers) as r:
+        __raise_if_busy(r, download_url)
+        if r.status != 206:
+            raise ValueError(
+                f"Server did not honor range request for segment {index} (HTTP {r.status})."
+            )
+        f = await __on_disk(disk_executor, __open_locked_part, part_path)
+        with f:
+            async for chunk in __iter_chunks(r, rate_limiter=rate_limiter):
+                if rate_limiter is not None:
+                    await rate_limiter.acquire_async(len(chunk), is_cancelled)
+                if stall_guard is not None:
+                    stall_guard.record(len(chunk))
+                with __paused(stall_guard):
+                    await __on_disk(disk_executor, f.write, chunk)
+                written += len(chunk)
+                progress[index] = written
+                if is_cancelled():
+                    return
+    if written < segment_length:
+        raise ValueError(
+            f"Segment {index} ended prematurely at {written}/{segment_length} bytes."
+        )
+
+
+async def __segmented_downloader(
+    url: str,
+    local_path: str,
+    session: aiohttp.ClientSession,
+    file_size: int,
+    segments: int,
+    connections: int,
+    signals: DownloadSignals,
+    download_url: str,
+    rate_limiter: RateLimiter,
+    preallocate: bool,
+    checksum: StreamingChecksum,
+    stall_guard: StallGuard = None,
+    disk_executor: ThreadPoolExecutor = None,
+) -> str:
+    """Download the url in parallel byte ranges as concurrent tasks, then assemble the parts.
+    At most the given number of connections download segments at once, all if None."""
+    download_url = download_url if download_url else url
+    Path(local_path).parent.mkdir(parents=True, exist_ok=True)
+    ranges = segment_ranges(file_size, segments)
+    segments = len(ranges)
+    part_paths = [segment_part_path(local_path, segments, i) for i in range(segments)]
+    progress = [0] * segments
+    failed = asyncio.Event()
+    connection_slots = asyncio.Semaphore(min(connections or segments, segments))
+
+    def is_cancelled():
+        return failed.is_set() or (signals is not None and signals.cancelled)
+
+    async def segment_task(index):
+        # fewer connections than segments download them a few at a time
+        async with connection_slots:
+            if is_cancelled():
+                return
+            try:
+                await __segment_downloader(
+                    session,
+                    download_url,
+                    part_paths[index],
+                    ranges[index],
+                    progress,
+                    index,
+                    is_cancelled,
+                    rate_limiter,
+                    stall_guard,
+                    disk_executor,
+                )
+            except Exception:
+                failed.set()
+                raise
+
+    tasks = [asyncio.ensure_future(segment_task(i)) for i in range(segments)]
+    try:
+        while not all(task.done() for task in tasks):
+            await asyncio.wait(tasks, timeout=SEGMENT_PROGRESS_INTERVAL_SECONDS)
+            if signals is not None:
+                signals.on_update_progress(sum(progress), file_size)
+    finally:
+        # an aborted attempt takes its segments down with it
+        for task in tasks:
+            task.cancel()
+    for task in tasks:
+        if task.exception() is not None:
+            raise task.exception()
+    if signals is not None and signals.cancelled:
+        return STATUS_STOPPED
+
+    await __on_disk(
+        disk_executor, __assemble, local_path, part_paths, file_size, preallocate, checksum
+    )
+
+    if signals is not None:
+        signals.on_update_progress(file_size, file_size)
+    logger.debug("Downloaded %s in %d segments", url, segments)
+    return STATUS_COMPLETED
+
+
+async def probe_url(
+    url: str,
+    session: aiohttp.ClientSession,
+    probe_cache: ProbeCache = None,
+    redirects: int = 10,
+) -> UrlMetadata:
+    """Get the metadata of a remote file, the asyncio counterpart of downloader.probe_url.
+    Served from the cache if probed recently, stored in it otherwise."""
+    if probe_cache is not None:
+        metadata = probe_cache.get(url)
+        if metadata is not None:
+            return metadata
+    metadata = await __probe(url, session, redirects)
+    if probe_cache is not None:
+        probe_cache.put(metadata)
+    return metadata
+
+
+async def __probe(url: str, session: aiohttp.ClientSession, redirects: int) -> UrlMetadata:
+    """Probe with HEAD requests, following redirects, falling back to a ranged GET. Raises
+    on any other error status, see downloader.__probe."""
+    location = url
+    for _ in range(redirects):
+        async with session.head(location, allow_redirects=False) as r:
+            __raise_if_busy(r, location)
+            if r.status in HEAD_REJECTED_STATUSES:
+                return await __probe_with_ranged_get(url, location, session)
+            r.raise_for_status()
+            content_length = int(r.headers.get("content-length", 0))
+            actual_location = r.headers.get("location", None)
+            if content_length == 0 and actual_location is not None:
+                location = actual_location
+                continue
+            return UrlMetadata(
+                url,
+                content_length=content_length,
+                accept_ranges=r.headers.get("accept-ranges", "none") != "none",
+                etag=r.headers.get("etag"),
+                last_modified=r.headers.get("last-modified"),
+                final_url=location,
+                status=r.status,
+            )
+    raise ValueError(f"Too many redirects while probing {url}.")
+
+
+async def __probe_with_ranged_get(
+    url: str, location: str, session: aiohttp.ClientSession
+) -> UrlMetadata:
+    """Probe a remote file by requesting its first byte only."""
+    async with session.get(location, headers={"Range": "bytes=0-0"}) as r:
+        __raise_if_busy(r, location)
+        r.raise_for_status()
+        content_range = r.headers.get("content-range", "")
+        if r.status == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            content_length = int(total) if total.isdigit() else 0
+            accept_ranges = True
+        else:
+            content_length = int(r.headers.get("content-length", 0))
+            accept_ranges = False
+        return UrlMetadata(
+            url,
+            content_length=content_length,
+            accept_ranges=accept_ranges,
+            etag=r.headers.get("etag"),
+            last_modified=r.headers.get("last-modified"),
+            final_url=str(r.url) if r.url else location,
+            status=r.status,
+        )
@@ -0,0 +1,108 @@
+"""Checksums of downloaded files, computed from the chunks on their way to the disk instead of
+reading the files back after the download."""
+
+import hashlib
+import os
+
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256")
+# reads of the parts of a file that were not seen streaming
+CHECKSUM_READ_SIZE = 1024 * 1024
+
+
+def format_checksum(algorithm: str, digest: str) -> str:
+    """Format a checksum as stored on the file model, e.g. sha256:9f86d0...
+    :param algorithm:
+        One of the CHECKSUM_ALGORITHMS
+    :param digest:
+        The hex digest"""
+    return f"{algorithm}:{digest}"
+
+
+def parse_checksum(checksum: str) -> tuple:
+    """Split a stored checksum to algorithm and hex digest.
+    :return:
+        The algorithm and the digest, (None, None) if the checksum is not set or malformed"""
+    if not checksum or ":" not in checksum:
+        return None, None
+    algorithm, digest = checksum.split(":", 1)
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        return None, None
+    return algorithm, digest
+
+
+def file_checksum(local_path: str, algorithm: str = "sha256") -> str:
+    """Compute the checksum of a local file by reading it through.
+    :param local_path:
+        The path to the file
+    :param algorithm:
+        One of the CHECKSUM_ALGORITHMS
+    :return:
+        The formatted checksum"""
+    checksum = StreamingChecksum(algorithm)
+    checksum.resume_at(local_path, os.path.getsize(local_path))
+    return checksum.checksum()
+
+
+class StreamingChecksum:
+    """Hash of a file fed in order with the chunks written to it. The offset tells how many
+    bytes of the file the state covers. At the end of each download attempt the state is
+    checkpointed against what actually reached the disk, so a resumed download continues
+    hashing from there without reading the prefix again. Hash states cannot be persisted, so
+    after an app restart the prefix on disk is read once to catch up."""
+
+    def __init__(self, algorithm: str = "sha256"):
+        """Create an empty checksum.
+        :param algorithm:
+            One of the CHECKSUM_ALGORITHMS"""
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.offset = 0
+        self.__hash = hashlib.new(algorithm)
+
+    def update(self, data) -> None:
+        """Hash the next chunk of the file.
+        :param data:
+            A bytes-like object"""
+        self.__hash.update(data)
+        self.offset += len(data)
+
+    def reset(self) -> None:
+        """Drop the state, the file is hashed from its start again."""
+        self.offset = 0
+        self.__hash = hashlib.new(self.algorithm)
+
+    def checkpoint(self, offset: int) -> None:
+        """Settle the state at the end of a download attempt. If the bytes hashed are not the
+        bytes on disk, e.g. a write failed, the state cannot be trusted and is dropped.
+        :param offset:
+            The number of bytes of the file on disk"""
+        if offset != self.offset:
+            self.reset()
+
+    def resume_at(self, local_path: str, offset: int) -> None:
+        """Align the state with a download continuing at the given offset: the bytes on disk
+        not hashed yet are read from the file, a state ahead of the offset is dropped.
+        :param local_path:
+            The path to the file
+        :param offset:
+            The offset the download continues at, 0 if it starts over"""
+        if self.offset > offset:
+            self.reset()
+        if self.offset == offset:
+            return
+        with open(local_path, "rb") as f:
+            f.seek(self.offset)
+            while self.offset < offset:
+                block = f.read(min(CHECKSUM_READ_SIZE, offset - self.offset))
+                if not block:
+                    break
+                self.update(block)
+
+    def hexdigest(self) -> str:
+        """Get the hex digest of the bytes hashed so far."""
+        return self.__hash.hexdigest()
+
+    def checksum(self) -> str:
+        """Get the formatted checksum of the bytes hashed so far."""
+        return format_checksum(self.algorithm, self.hexdigest())
@@ -0,0 +1,129 @@
+"""Adaptive sizing of the reads of the download streams."""
+
+import threading
+
+MIN_CHUNK_SIZE = 8 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+INITIAL_CHUNK_SIZE = 64 * 1024
+# throughput is compared over windows of at least this length
+MEASUREMENT_WINDOW_SECONDS = 0.5
+# a window has to be this much faster than the previous one to keep growing the chunks
+GROWTH_THRESHOLD = 0.05
+# a single read should not take longer than this, it bounds the reaction time to cancellation
+MAX_CHUNK_SECONDS = 0.25
+# under a rate limit chunks are capped to this many seconds worth of the limit for smooth pacing
+RATE_LIMITED_CHUNK_SECONDS = 0.05
+
+
+class AdaptiveChunkSizer:
+    """Hill climber of the read size of a download stream. Small reads waste CPU on per-chunk
+    overhead (rate limiting, progress reporting, file writes), large reads delay cancellation
+    and make rate limiting bursty. The chunk size doubles while the throughput keeps rising,
+    steps back when growing made it worse, and shrinks when reads take too long or a rate limit
+    is in effect. One sizer is used by a single stream, but statistics may be read from any
+    thread."""
+
+    def __init__(
+        self,
+        initial_size: int = INITIAL_CHUNK_SIZE,
+        min_size: int = MIN_CHUNK_SIZE,
+        max_size: int = MAX_CHUNK_SIZE,
+    ):
+        """Create a chunk sizer.
+        :param initial_size:
+            The size of the first read in bytes
+        :param min_size:
+            The smallest read size in bytes
+        :param max_size:
+            The largest read size in bytes"""
+        self.min_size = min_size
+        self.max_size = max_size
+        self.chunk_size = max(min_size, min(initial_size, max_size))
+        self.__lock = threading.Lock()
+        self.__window_bytes = 0
+        self.__window_seconds = 0.0
+        self.__last_rate = None
+        self.__grew = False
+        self.__chunks = 0
+        self.__bytes = 0
+        self.__smallest = None
+        self.__largest = 0
+        self.__resizes = 0
+
+    def next_size(self, rate_limit_bps: int = 0) -> int:
+        """Get the size of the next read.
+        :param rate_limit_bps:
+            The bandwidth limit in effect for the stream, 0 if unlimited
+        :return:
+            The number of bytes to read"""
+        if rate_limit_bps > 0:
+            capped = int(rate_limit_bps * RATE_LIMITED_CHUNK_SECONDS)
+            return max(self.min_size, min(self.chunk_size, capped))
+        return self.chunk_size
+
+    def record(self, nbytes: int, seconds: float) -> None:
+        """Record a completed read and adjust the chunk size.
+        :param nbytes:
+            The number of bytes read
+        :param seconds:
+            The time the read and the processing of the chunk took"""
+        with self.__lock:
+            self.__chunks += 1
+            self.__bytes += nbytes
+            self.__largest = max(self.__largest, nbytes)
+            self.__smallest = (
+                nbytes if self.__smallest is None else min(self.__smallest, nbytes)
+            )
+        if seconds > MAX_CHUNK_SECONDS and self.chunk_size > self.min_size:
+            # the link is slower than the chunk size assumes, stay responsive
+            self.__resize(self.chunk_size // 2)
+            self.__grew = False
+            self.__reset_window()
+            return
+        self.__window_bytes += nbytes
+        self.__window_seconds += seconds
+        if self.__window_seconds < MEASUREMENT_WINDOW_SECONDS:
+            return
+        rate = self.__window_bytes / self.__window_seconds
+        if self.__last_rate is None or rate > self.__last_rate * (1 + GROWTH_THRESHOLD):
+            self.__grew = self.__resize(self.chunk_size * 2)
+        elif self.__grew and rate < self.__last_rate * (1 - GROWTH_THRESHOLD):
+            # growing made it worse, step back and stay there
+            self.__resize(self.chunk_size // 2)
+            self.__grew = False
+        else:
+            self.__grew = False
+        self.__last_rate = rate
+        self.__reset_window()
+
+    def stats(self) -> dict:
+        """Get the chunk statistics of the stream.
+        :return:
+            The number of chunks, the bytes read, the current, smallest, largest and average
+            chunk size in bytes and the number of resizes"""
+        with self.__lock:
+            return {
+                "chunks": self.__chunks,
+                "bytes": self.__bytes,
+                "current": self.chunk_size,
+                "smallest": self.__smallest or 0,
+                "largest": self.__largest,
+                "average": self.__bytes // self.__chunks if self.__chunks else 0,
+                "resizes": self.__resizes,
+            }
+
+    def __resize(self, chunk_size: int) -> bool:
+        """Set the chunk size within the bounds.
+        :return:
+            True if the size changed"""
+        chunk_size = max(self.min_size, min(chunk_size, self.max_size))
+        if chunk_size == self.chunk_size:
+            return False
+        with self.__lock:
+            self.chunk_size = chunk_size
+            self.__resizes += 1
+        return True
+
+    def __reset_window(self) -> None:
+        self.__window_bytes = 0
+        self.__window_seconds = 0.0
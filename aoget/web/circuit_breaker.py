@@ -0,0 +1,211 @@
+"""Per-host circuit breakers shared by all jobs. When a host keeps failing, the breaker of
+the host trips and every worker about to connect to it waits, instead of burning the
+attempts of its file. After a cooldown a single request probes the host: if it succeeds the
+breaker closes and the workers carry on, if it fails the breaker opens for longer."""
+
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+from web.retry_policy import sleep_unless_cancelled, sleep_unless_cancelled_async
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+# how often waiting workers look at the breaker
+WAIT_POLL_SECONDS = 0.5
+
+
+def host_of(url: str) -> str:
+    """Get the host a URL connects to, the key of its breaker."""
+    return urlparse(url).netloc.lower()
+
+
+class CircuitBreaker:
+    """The breaker of a single host."""
+
+    def __init__(
+        self,
+        host: str,
+        failure_threshold: int,
+        open_seconds: float,
+        max_open_seconds: float,
+    ):
+        """Create a closed breaker, see HostCircuitBreakers."""
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = STATE_CLOSED
+        self.failures = 0
+        # consecutive trips without a success, each one opens the breaker for longer
+        self.trips = 0
+        self.cooldown = 0
+        self.open_until = 0
+        self.__probe_started = 0
+        self.__lock = threading.Lock()
+
+    def allow_request(self, now: float = None) -> bool:
+        """Determine whether a request may go to the host. Once the cooldown is over, the
+        first caller is let through to probe the host, the others wait for its outcome.
+        :param now:
+            The current monotonic time, defaults to now"""
+        now = now if now is not None else time.monotonic()
+        with self.__lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN:
+                if now < self.open_until:
+                    return False
+                self.state = STATE_HALF_OPEN
+                self.__probe_started = now
+                return True
+            # a probe that never reported back does not hold the others forever
+            if now - self.__probe_started > self.open_seconds:
+                self.__probe_started = now
+                return True
+            return False
+
+    def record_success(self) -> bool:
+        """Record a successful request to the host.
+        :return:
+            True if this closed the breaker"""
+        with self.__lock:
+            recovered = self.state != STATE_CLOSED
+            self.state = STATE_CLOSED
+            self.failures = 0
+            self.trips = 0
+        if recovered:
+            logger.info("Circuit breaker of %s closed, the host recovered.", self.host)
+        return recovered
+
+    def record_failure(self, retry_after: float = None, now: float = None) -> bool:
+        """Record a failed request to the host.
+        :param retry_after:
+            The seconds the host asked to wait, if any
+        :param now:
+            The current monotonic time, defaults to now
+        :return:
+            True if this tripped the breaker"""
+        now = now if now is not None else time.monotonic()
+        with self.__lock:
+            if self.state == STATE_OPEN:
+                return False  # sent before the trip, already accounted for
+            if self.state == STATE_CLOSED:
+                self.failures += 1
+                if self.failures < self.failure_threshold:
+                    return False
+            self.trips += 1
+            self.cooldown = min(
+                self.max_open_seconds, self.open_seconds * 2 ** (self.trips - 1)
+            )
+            if retry_after is not None:
+                self.cooldown = min(self.max_open_seconds, max(self.cooldown, retry_after))
+            self.state = STATE_OPEN
+            self.open_until = now + self.cooldown
+            self.failures = 0
+        logger.warning(
+            "Circuit breaker of %s tripped, pausing for %d seconds.", self.host, self.cooldown
+        )
+        return True
+
+
+class HostCircuitBreakers:
+    """The circuit breakers of all hosts, created on first use."""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        open_seconds: float = 30,
+        max_open_seconds: float = 600,
+    ):
+        """Create the breakers.
+        :param failure_threshold:
+            The number of consecutive failed requests to a host that trip its breaker
+        :param open_seconds:
+            How long a tripped breaker stays open, doubled with each trip in a row
+        :param max_open_seconds:
+            The cap of how long a breaker stays open"""
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.__breakers = {}
+        self.__lock = threading.Lock()
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        """Get the breaker of the host of the given URL."""
+        host = host_of(url)
+        with self.__lock:
+            breaker = self.__breakers.get(host)
+            if breaker is None:
+                breaker = self.__breakers[host] = CircuitBreaker(
+                    host, self.failure_threshold, self.open_seconds, self.max_open_seconds
+                )
+            return breaker
+
+    def wait_until_closed(self, url: str, is_cancelled=None, on_event=None) -> bool:
+        """Block until a request may go to the host of the given URL.
+        :param url:
+            The URL about to be requested
+        :param is_cancelled:
+            Callable telling whether the wait was cancelled, never cancelled if None
+        :param on_event:
+            Called with a description when the wait starts and ends, if it has to wait
+        :return:
+            False if cancelled while waiting, True otherwise"""
+        breaker = self.breaker_for(url)
+        paused = False
+        while not breaker.allow_request():
+            if not paused:
+                paused = True
+                self.__pause_event(breaker, on_event)
+            if not sleep_unless_cancelled(WAIT_POLL_SECONDS, is_cancelled):
+                return False
+        if paused and on_event is not None:
+            on_event(f"Resuming, {breaker.host} is probed again.")
+        return True
+
+    async def wait_until_closed_async(
+        self, url: str, is_cancelled=None, on_event=None
+    ) -> bool:
+        """Wait on the event loop until a request may go to the host of the given URL, see
+        wait_until_closed."""
+        breaker = self.breaker_for(url)
+        paused = False
+        while not breaker.allow_request():
+            if not paused:
+                paused = True
+                self.__pause_event(breaker, on_event)
+            if not await sleep_unless_cancelled_async(WAIT_POLL_SECONDS, is_cancelled):
+                return False
+        if paused and on_event is not None:
+            on_event(f"Resuming, {breaker.host} is probed again.")
+        return True
+
+    def record_success(self, url: str, on_event=None) -> None:
+        """Record a successful request to the host of the given URL.
+        :param on_event:
+            Called with a description if this closed the breaker"""
+        breaker = self.breaker_for(url)
+        if breaker.record_success() and on_event is not None:
+            on_event(f"{breaker.host} recovered, circuit breaker closed.")
+
+    def record_failure(self, url: str, error: Exception = None, on_event=None) -> None:
+        """Record a failed request to the host of the given URL. Only failures of the host
+        are to be recorded, e.g. busy responses or refused connections.
+        :param error:
+            The error of the request, its retry_after is honored if it has one
+        :param on_event:
+            Called with a description if this tripped the breaker"""
+        breaker = self.breaker_for(url)
+        if breaker.record_failure(getattr(error, "retry_after", None)) and on_event is not None:
+            on_event(
+                f"{breaker.host} keeps failing, circuit breaker tripped, "
+                f"pausing its downloads for {breaker.cooldown:g} seconds."
+            )
+
+    def __pause_event(self, breaker: CircuitBreaker, on_event) -> None:
+        if on_event is not None:
+            on_event(f"Paused, circuit breaker of {breaker.host} is open.")
@@ -0,0 +1,284 @@
+"""Write-behind of downloaded data. Network threads hand their chunks over to a writer thread
+per storage device, which writes them in large sequential batches while the network threads
+keep reading."""
+
+import collections
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+# buffers written by a single writev call, stays below the IOV_MAX of the platforms
+MAX_BUFFERS_PER_WRITE = 512
+
+
+class DiskWriter:
+    """Writer thread of a single storage device. Chunks submitted by any number of streams are
+    queued and written in batches: everything queued since the last batch is grouped per file
+    and each file gets a single vectored write, instead of many small interleaved writes.
+    The bytes queued but not yet written are capped, a stream submitting beyond the cap waits
+    until the writer catches up (backpressure)."""
+
+    def __init__(self, name: str, max_in_flight_bytes: int = DEFAULT_MAX_IN_FLIGHT_BYTES):
+        """Create a writer, the thread is started on the first write.
+        :param name:
+            Name of the writer thread
+        :param max_in_flight_bytes:
+            The cap of bytes submitted but not yet written"""
+        self.name = name
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.in_flight_bytes = 0
+        self.batches = 0
+        self.writes = 0
+        self.__condition = threading.Condition()
+        self.__queue = collections.deque()
+        self.__thread = None
+        self.__stopped = False
+        # set once the thread exited, chunks not written by then never will be
+        self.__exited = False
+
+    def open_stream(self, file) -> "WriteStream":
+        """Get a stream that writes to the given file through this writer.
+        :param file:
+            An unbuffered binary file, positioned where the writes go"""
+        return WriteStream(self, file)
+
+    def submit(self, stream: "WriteStream", data) -> int:
+        """Queue a chunk for writing, waiting while the in-flight cap would be exceeded.
+        The chunk must not be modified until it is written.
+        :return:
+            The sequence number of the chunk within its stream
+        :raises OSError:
+            If the writer is stopped, also while waiting"""
+        with self.__condition:
+            self.__raise_if_stopped()
+            self.__start()
+            # a single chunk larger than the cap is let through when nothing else is queued
+            while (
+                self.in_flight_bytes > 0
+                and self.in_flight_bytes + len(data) > self.max_in_flight_bytes
+            ):
+                self.__condition.wait()
+                self.__raise_if_stopped()
+            stream.submitted += 1
+            self.in_flight_bytes += len(data)
+            self.__queue.append((stream, stream.submitted, data))
+            self.__condition.notify_all()
+            return stream.submitted
+
+    def wait_written(self, stream: "WriteStream", seq: int) -> None:
+        """Wait until the chunks of the stream up to the given sequence number are written."""
+        with self.__condition:
+            while stream.written < seq and stream.error is None:
+                if self.__exited:
+                    stream.error = OSError(f"Disk writer {self.name} stopped before writing.")
+                    break
+                self.__condition.wait()
+
+    def stop(self) -> None:
+        """Stop the writer thread once the queued chunks are written. Chunks submitted after
+        are rejected."""
+        with self.__condition:
+            self.__stopped = True
+            thread = self.__thread
+            if thread is None:
+                self.__exited = True
+            self.__condition.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def __raise_if_stopped(self) -> None:
+        """Reject a chunk submitted to a stopped writer. Condition must be held."""
+        if self.__stopped:
+            raise OSError(f"Disk writer {self.name} is stopped.")
+
+    def __start(self) -> None:
+        """Start the writer thread if not running. Condition must be held."""
+        if self.__thread is None:
+            self.__exited = False
+            self.__thread = threading.Thread(target=self.__run, name=self.name, daemon=True)
+            self.__thread.start()
+
+    def __run(self) -> None:
+        try:
+            self.__write_batches()
+        finally:
+            # waiters of chunks that can no longer be written fail instead of hanging
+            with self.__condition:
+                self.__thread = None
+                self.__exited = True
+                self.__condition.notify_all()
+
+    def __write_batches(self) -> None:
+        while True:
+            with self.__condition:
+                while not self.__queue and not self.__stopped:
+                    self.__condition.wait()
+                if not self.__queue:
+                    return
+                batch = list(self.__queue)
+                self.__queue.clear()
+            per_stream = {}
+            for stream, seq, data in batch:
+                per_stream.setdefault(stream, []).append((seq, data))
+            for stream, chunks in per_stream.items():
+                error = None
+                if stream.error is None:
+                    try:
+                        self.__write_all(stream.file.fileno(), [data for _, data in chunks])
+                    except OSError as e:
+                        logger.error("Write-behind failed for %s: %s", stream.file.name, e)
+                        error = e
+                nbytes = sum(len(data) for _, data in chunks)
+                with self.__condition:
+                    stream.error = stream.error or error
+                    stream.written = chunks[-1][0]
+                    if stream.error is None:
+                        stream.written_bytes += nbytes
+                    self.in_flight_bytes -= nbytes
+                    self.writes += 1
+                    self.__condition.notify_all()
+            self.batches += 1
+
+    @staticmethod
+    def __write_all(fd: int, buffers: list) -> None:
+        """Write all buffers to the file, in as few system calls as possible."""
+        buffers = [memoryview(buffer).cast("B") for buffer in buffers]
+        while buffers:
+            batch = buffers[:MAX_BUFFERS_PER_WRITE]
+            if hasattr(os, "writev"):
+                written = os.writev(fd, batch)
+            else:
+                written = os.write(fd, batch[0])
+            # drop what was written, a vectored write may stop anywhere
+            while written > 0:
+                if written >= len(buffers[0]):
+                    written -= len(buffers[0])
+                    buffers.pop(0)
+                else:
+                    buffers[0] = buffers[0][written:]
+                    written = 0
+
+
+class WriteStream:
+    """The writes of a single download to its file through a DiskWriter. Holds a pair of read
+    buffers, so that the network thread can read into one while the other is being written."""
+
+    def __init__(self, writer: DiskWriter, file):
+        self.writer = writer
+        self.file = file
+        # sequence numbers of the submitted and the written chunks, guarded by the writer
+        self.submitted = 0
+        self.written = 0
+        # bytes that reached the file, may be read from the network thread without locking
+        self.written_bytes = 0
+        self.error = None
+        self.__buffers = [bytearray(), bytearray()]
+        self.__buffer_seqs = [0, 0]
+        self.__next_buffer = 0
+
+    def buffer(self, size: int) -> memoryview:
+        """Get a buffer of at least the given size to read the next chunk into, waiting until
+        its previous content is written.
+        :param size:
+            The number of bytes about to be read"""
+        index = self.__next_buffer
+        self.__next_buffer = 1 - index
+        self.writer.wait_written(self, self.__buffer_seqs[index])
+        self.__raise_error()
+        if len(self.__buffers[index]) < size:
+            self.__buffers[index] = bytearray(size)
+        return memoryview(self.__buffers[index])
+
+    def write(self, data) -> None:
+        """Queue data for writing. Views of the buffers of this stream are tracked, so the
+        buffer is not handed out again until written."""
+        self.__raise_error()
+        seq = self.writer.submit(self, data)
+        if isinstance(data, memoryview):
+            for index, buffer in enumerate(self.__buffers):
+                if data.obj is buffer:
+                    self.__buffer_seqs[index] = seq
+
+    def close(self) -> None:
+        """Wait until everything queued is written and raise if any write failed."""
+        self.writer.wait_written(self, self.submitted)
+        self.__raise_error()
+
+    def __raise_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+
+class DirectWriteStream:
+    """Synchronous counterpart of the WriteStream, writing on the calling thread into the file
+    from a single reused buffer."""
+
+    def __init__(self, file):
+        self.file = file
+        self.written_bytes = 0
+        self.__buffer = bytearray()
+
+    def buffer(self, size: int) -> memoryview:
+        if len(self.__buffer) < size:
+            self.__buffer = bytearray(size)
+        return memoryview(self.__buffer)
+
+    def write(self, data) -> None:
+        self.file.write(data)
+        self.written_bytes += len(data)
+
+    def close(self) -> None:
+        pass
+
+
+class DiskWriterPool:
+    """The writers of the storage devices, shared by all downloads. Each device gets a single
+    writer thread, since concurrent writers of the same disk only make it seek more."""
+
+    def __init__(self, max_in_flight_bytes: int = DEFAULT_MAX_IN_FLIGHT_BYTES):
+        """Create a pool of disk writers.
+        :param max_in_flight_bytes:
+            The cap of bytes queued but not yet written, per device"""
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.__lock = threading.Lock()
+        self.__writers = {}  # type: Dict[int, DiskWriter]
+
+    def writer_for(self, path: str) -> DiskWriter:
+        """Get the writer of the device of the given path.
+        :param path:
+            A file or folder path, it does not need to exist yet"""
+        device = self.__device_of(path)
+        with self.__lock:
+            if device not in self.__writers:
+                self.__writers[device] = DiskWriter(
+                    f"disk-writer-{device}", self.max_in_flight_bytes
+                )
+            return self.__writers[device]
+
+    def set_max_in_flight_bytes(self, max_in_flight_bytes: int) -> None:
+        """Set the in-flight cap of all writers."""
+        with self.__lock:
+            self.max_in_flight_bytes = max_in_flight_bytes
+            for writer in self.__writers.values():
+                writer.max_in_flight_bytes = max_in_flight_bytes
+
+    def close(self) -> None:
+        """Stop the writer threads once their queues are written."""
+        with self.__lock:
+            writers = list(self.__writers.values())
+            self.__writers.clear()
+        for writer in writers:
+            writer.stop()
+
+    @staticmethod
+    def __device_of(path: str) -> int:
+        path = os.path.abspath(path)
+        while not os.path.exists(path):
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        return os.stat(path).st_dev
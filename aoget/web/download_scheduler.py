@@ -0,0 +1,201 @@
+"""Global download scheduler. Instead of every job running its own download threads, a
+fixed pool of workers is shared by all jobs, so the number of concurrent downloads is
+bounded no matter how many jobs run. Jobs get a weight (their allocated threads) and the
+slots are handed out with weighted fair queuing: a job gets a share of the workers
+proportional to its weight while it has files queued, and idle shares go to the others.
+Workers idle for a while take turns hedging the tail downloads of the jobs."""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# how long an idle worker waits for a notification before looking at the queues again
+IDLE_WAIT_SECONDS = 0.5
+
+
+class DownloadScheduler:
+    """Hands out the slots of a fixed worker pool to the registered downloaders. A
+    downloader takes part with its worker_pool_size as weight and is asked to download its
+    next file with download_next when it gets a slot, or to hedge with hedge_idle when the
+    worker has been idle."""
+
+    def __init__(self, worker_count: int = 16):
+        """Create a scheduler, its workers are started on first use.
+        :param worker_count:
+            The number of files downloaded at once across all jobs"""
+        self.worker_count = worker_count
+        self.__condition = threading.Condition()
+        self.__downloaders = []
+        # slots held by each downloader, kept after unregistering until its downloads end
+        self.__slots = {}
+        # virtual finish time of the last slot given to each downloader
+        self.__finish_tags = {}
+        self.__served = {}
+        self.__virtual_time = 0.0
+        self.__hedge_turn = 0
+        self.__workers = []
+        self.__stopped = False
+
+    def register(self, downloader) -> None:
+        """Start scheduling the downloads of a downloader.
+        :param downloader:
+            The QueuedDownloader of a job"""
+        with self.__condition:
+            if downloader in self.__downloaders:
+                return
+            self.__downloaders.append(downloader)
+            # no credit for the time spent idle, or it would starve the others on return
+            self.__finish_tags[downloader] = max(
+                self.__finish_tags.get(downloader, 0.0), self.__virtual_time
+            )
+            self.__served.setdefault(downloader, 0)
+            self.__start_workers()
+            self.__condition.notify_all()
+
+    def unregister(self, downloader, sync: bool = False) -> None:
+        """Stop scheduling the downloads of a downloader. Its running downloads are not
+        affected.
+        :param downloader:
+            The QueuedDownloader of a job
+        :param sync:
+            Whether to wait for its running downloads to end"""
+        with self.__condition:
+            if downloader in self.__downloaders:
+                self.__downloaders.remove(downloader)
+                self.__served.pop(downloader, None)
+                if downloader not in self.__slots:
+                    self.__finish_tags.pop(downloader, None)
+            if sync:
+                self.__condition.wait_for(lambda: self.__slots.get(downloader, 0) == 0)
+
+    def notify(self) -> None:
+        """Wake the idle workers, to be called when files were queued or a weight changed."""
+        with self.__condition:
+            self.__condition.notify_all()
+
+    def shutdown(self) -> None:
+        """Stop the workers once their current downloads end."""
+        with self.__condition:
+            self.__stopped = True
+            workers = self.__workers
+            self.__workers = []
+            self.__condition.notify_all()
+        for worker in workers:
+            worker.join(IDLE_WAIT_SECONDS * 2)
+
+    def get_stats(self) -> dict:
+        """Get the workers busy and the share of the slots of each job.
+        :return:
+            The number of workers, the busy ones and by job name the weight, the slots held
+            and the number of slots given so far"""
+        with self.__condition:
+            return {
+                "workers": self.worker_count,
+                "busy": sum(self.__slots.values()),
+                "jobs": {
+                    downloader.job.name: {
+                        "weight": downloader.worker_pool_size,
+                        "slots": self.__slots.get(downloader, 0),
+                        "served": self.__served[downloader],
+                    }
+                    for downloader in self.__downloaders
+                },
+            }
+
+    def __start_workers(self) -> None:
+        """Start the workers if not running yet. The condition must be held."""
+        if self.__workers or self.__stopped:
+            return
+        for i in range(self.worker_count):
+            worker = threading.Thread(
+                target=self.__run, name=f"download-scheduler-{i}", daemon=True
+            )
+            worker.start()
+            self.__workers.append(worker)
+
+    def __next_downloader(self):
+        """Pick the downloader to give the next slot to: of the ones with files queued, the
+        one holding the fewest slots for its weight, ties go to the one with the earliest
+        virtual finish time. The condition must be held.
+        :return:
+            The downloader, None if no downloader has files to download"""
+        best = None
+        best_key = None
+        for downloader in self.__downloaders:
+            weight = downloader.worker_pool_size
+            if weight <= 0 or not downloader.has_queued_files():
+                continue
+            key = (
+                self.__slots.get(downloader, 0) / weight,
+                self.__finish_tags[downloader],
+            )
+            if best_key is None or key < best_key:
+                best, best_key = downloader, key
+        return best
+
+    def __next_to_hedge(self):
+        """Pick the downloader an idle worker hedges for, the jobs take turns. The condition
+        must be held.
+        :return:
+            The downloader, None if there is none with a weight"""
+        candidates = [d for d in self.__downloaders if d.worker_pool_size > 0]
+        if not candidates:
+            return None
+        self.__hedge_turn += 1
+        return candidates[self.__hedge_turn % len(candidates)]
+
+    def __acquire(self) -> tuple:
+        """Wait for a downloader with files to download and take a slot for it.
+        :return:
+            The downloader and whether to hedge for it rather than download its next file,
+            None for the downloader if the scheduler was shut down"""
+        with self.__condition:
+            while not self.__stopped:
+                downloader = self.__next_downloader()
+                hedge = False
+                if downloader is None:
+                    if self.__condition.wait(IDLE_WAIT_SECONDS):
+                        continue
+                    # nothing queued for a while, the worker may race the tail of a download
+                    downloader = self.__next_to_hedge()
+                    if downloader is None:
+                        continue
+                    hedge = True
+                else:
+                    start = max(self.__virtual_time, self.__finish_tags[downloader])
+                    self.__virtual_time = start
+                    self.__finish_tags[downloader] = (
+                        start + 1.0 / downloader.worker_pool_size
+                    )
+                    self.__served[downloader] += 1
+                self.__slots[downloader] = self.__slots.get(downloader, 0) + 1
+                return downloader, hedge
+            return None, False
+
+    def __release(self, downloader) -> None:
+        """Give back the slot of a downloader."""
+        with self.__condition:
+            self.__slots[downloader] -= 1
+            if self.__slots[downloader] == 0:
+                del self.__slots[downloader]
+            if downloader not in self.__downloaders and downloader not in self.__slots:
+                self.__finish_tags.pop(downloader, None)
+            self.__condition.notify_all()
+
+    def __run(self) -> None:
+        while True:
+            downloader, hedge = self.__acquire()
+            if downloader is None:
+                return
+            try:
+                if hedge:
+                    downloader.hedge_idle()
+                else:
+                    downloader.download_next()
+            except Exception as e:
+                # This is a catch-all exception handler to prevent the worker from dying
+                logger.error("Unexpected error in scheduled download: %s", e)
+                logger.exception(e)
+            finally:
+                self.__release(downloader)
@@ -5,16 +5,38 @@ download files."""
 # based on https://gist.github.com/tobiasraabe/58adee67de619ce621464c1a6511d7d9
 
 from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+from functools import partial
 from pathlib import Path
-import hashlib
+import collections
+import io
 import logging
+import os
+import re
+import socket
+import threading
 import time
 import requests
 from util.aogetutil import human_filesize
+from util.disk_util import get_local_file_size, preallocate as preallocate_file
+from web.probe_cache import ProbeCache, UrlMetadata
+from web.rate_limiter import RateLimiter
+from web.chunk_sizer import AdaptiveChunkSizer
+from web.disk_writer import DirectWriteStream, DiskWriterPool
+from web.checksum import StreamingChecksum, format_checksum, parse_checksum
+from web.stall_watchdog import StallGuard, StallWatchdog
+from web.retry_policy import RetryPolicy, ServerBusyError, busy_error
+from web.circuit_breaker import HostCircuitBreakers
+from web.host_limits import HostConnectionLimits
 import portalocker
-import math
 
 TIMEOUT_SECONDS = 5
+# statuses with which servers reject HEAD requests while serving GETs just fine
+HEAD_REJECTED_STATUSES = (400, 403, 405, 501)
+# read response bodies straight into a reusable buffer when they are not content-encoded
+ZERO_COPY_READS = True
+# how often the written offset of a preallocated file is recorded while downloading
+WRITTEN_OFFSET_CHECKPOINT_SECONDS = 1.0
 
 logger = logging.getLogger(__name__)
 time_ns = time.monotonic_ns()
@@ -62,7 +84,8 @@ class DownloadSignals(ABC):
         pass
 
     def cancel(self, shutdown: bool = False) -> None:
-        """Cancel the download.
+        """Cancel the download. Open connections of the download are aborted, so that it
+        stops without waiting for the next chunk to arrive.
         Parameters:
         ----------
         shutdown: bool
@@ -70,14 +93,109 @@ class DownloadSignals(ABC):
             downloader (application) shutdown."""
         self.cancelled = True
         self.shutdown = shutdown
+        self.abort_connections()
 
-    def set_rate_limit(self, rate_limit_bps: int) -> None:
-        """Set the rate limit in bytes per second.
+    def abort_connections(self) -> None:
+        """Abort the open connections of the download without cancelling it, e.g. to resume
+        it on a fresh connection."""
+        for abort in list(self.__aborts()):
+            try:
+                abort()
+            except Exception as e:
+                logger.debug("Could not abort a connection of a download: %s", e)
+
+    def is_cancelled(self) -> bool:
+        """Whether the download was cancelled."""
+        return self.cancelled
+
+    def register_abort(self, abort) -> None:
+        """Register a callable aborting an open connection of the download, called from the
+        cancelling thread on cancellation. Called right away if already cancelled, it has to
+        tolerate being called more than once.
+        Parameters:
+        ----------
+        abort: callable
+            Aborts the connection, taking no arguments"""
+        self.__aborts().append(abort)
+        if self.cancelled:
+            abort()
+
+    def unregister_abort(self, abort) -> None:
+        """Unregister an abort callable once its connection is done with.
         Parameters:
         ----------
-        rate_limit_bps: int
-            The rate limit in bytes per second."""
-        self.rate_limit_bps = rate_limit_bps
+        abort: callable
+            A callable registered before"""
+        try:
+            self.__aborts().remove(abort)
+        except ValueError:
+            pass
+
+    def __aborts(self) -> list:
+        # subclasses do not call the constructor, so the list is made on first use
+        if "_abort_callbacks" not in self.__dict__:
+            self._abort_callbacks = []
+        return self._abort_callbacks
+
+
+def abort_response(response: requests.Response) -> None:
+    """Abort a streamed response from any thread. Its socket is shut down, so that a read
+    blocked on it returns right away instead of when the read times out.
+    Parameters
+    ----------
+    response: requests.Response
+        The response being read"""
+    sock = __socket_of(response)
+    if sock is None:
+        response.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # already closed or never connected
+        pass
+
+
+def __socket_of(response: requests.Response):
+    """Get the socket a streamed response is read from, None if it cannot be found. Once the
+    headers are read, http.client hands the socket over to the body reader."""
+    raw = getattr(response, "raw", None)
+    fp = getattr(getattr(raw, "_fp", None), "fp", None)
+    sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is None:
+        sock = getattr(getattr(raw, "connection", None), "sock", None)
+    return sock
+
+
+def __raise_if_busy(response: requests.Response, url: str) -> None:
+    """Raise a ServerBusyError if the response tells that the server is busy."""
+    error = busy_error(url, response.status_code, response.headers)
+    if error is not None:
+        response.close()
+        raise error
+
+
+def is_host_failure(error: Exception) -> bool:
+    """Determine whether a download failed because of its host rather than the file, to be
+    recorded with the circuit breaker of the host."""
+    return isinstance(
+        error,
+        (ServerBusyError, requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+    )
+
+
+@contextmanager
+def __abortable(response: requests.Response, signals: DownloadSignals = None):
+    """Let a cancellation of the download abort the response while in the block."""
+    if signals is None:
+        yield
+        return
+    abort = partial(abort_response, response)
+    signals.register_abort(abort)
+    try:
+        yield
+    finally:
+        signals.unregister_abort(abort)
 
 
 def __downloader(
@@ -85,6 +203,14 @@ def __downloader(
     local_path: str,
     resume_byte_pos: int = None,
     signals: DownloadSignals = None,
+    session: requests.Session = None,
+    metadata: UrlMetadata = None,
+    rate_limiter: RateLimiter = None,
+    chunk_sizer: AdaptiveChunkSizer = None,
+    disk_writers: DiskWriterPool = None,
+    preallocate: bool = False,
+    checksum: StreamingChecksum = None,
+    stall_guard: StallGuard = None,
 ) -> str:
     """Download url to disk with possible resumption.
     Parameters
@@ -97,72 +223,119 @@ def __downloader(
         Position of byte from where to resume the download
     progress_observer: ProgressObserver
         Observer for download progress
+    session: requests.Session
+        Keep-alive session to use, a one-off connection is made if None
+    metadata: UrlMetadata
+        Result of the probe of the url, probed here if None
+    rate_limiter: RateLimiter
+        Bandwidth limiter to draw each chunk from, unlimited if None
+    chunk_sizer: AdaptiveChunkSizer
+        Sizer of the reads from the stream, a fresh one is used if None
+    disk_writers: DiskWriterPool
+        Write-behind writers to hand the chunks over to, written synchronously if None
+    preallocate: bool
+        Whether to reserve the disk space of the file up front if its size is known
+    checksum: StreamingChecksum
+        Checksum to feed with the chunks, aligned to the resume position first. Not
+        computed if None
+    stall_guard: StallGuard
+        Throughput tracker to record the chunks with, the download is not watched if None
     """
-    # Get size of file
-    r = requests.head(url, timeout=TIMEOUT_SECONDS)
-    file_size = resolve_remote_file_size(url)
+    http = session if session is not None else requests
+    if metadata is None:
+        metadata = probe_url(url, session=session)
+    file_size = metadata.content_length
 
     # Append information to resume download at specific byte position
-    # to header
-    resume_header = {"Range": f"bytes={resume_byte_pos}-"} if resume_byte_pos else None
+    # to header. If-Range makes the server send the whole file instead if it
+    # changed since the probe, so that stale bytes are not appended to.
+    resume_header = None
+    if resume_byte_pos:
+        resume_header = {"Range": f"bytes={resume_byte_pos}-"}
+        if metadata.validator():
+            resume_header["If-Range"] = metadata.validator()
 
     # Establish connection
-    r = requests.get(url, stream=True, headers=resume_header, timeout=TIMEOUT_SECONDS)
+    r = http.get(
+        metadata.final_url, stream=True, headers=resume_header, timeout=TIMEOUT_SECONDS
+    )
+    __raise_if_busy(r, url)
+    if resume_byte_pos and r.status_code == 200:
+        logger.debug("Server sent the full file instead of a range, restarting %s", url)
+        if signals is not None:
+            signals.on_event("Remote file changed or range was ignored, restarting download.")
+        resume_byte_pos = None
 
     # Set configuration
-    block_size = 1024
     initial_pos = resume_byte_pos if resume_byte_pos else 0
-    mode = "ab" if initial_pos else "wb"
     file = Path(local_path)
+    if checksum is not None:
+        checksum.resume_at(local_path, initial_pos)
+    f, tracked = open_target(local_path, initial_pos, file_size, preallocate, buffering=0)
 
-    # create folder if it doesn't exist
-    file.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(file, mode) as f:
+    with f, __abortable(r, signals):
         portalocker.lock(f, portalocker.LOCK_EX | portalocker.LOCK_NB)
         total = file_size
         written = initial_pos
-        for chunk in r.iter_content(8 * block_size):
-
-            f.write(chunk)
-            chunk_size = len(chunk)
-            written += chunk_size
-
-            if signals and signals.rate_limit_bps and signals.rate_limit_bps > 0:
-                time_to_sleep = chunk_size / signals.rate_limit_bps
-                if time_to_sleep <= 1:
-                    time.sleep(chunk_size / signals.rate_limit_bps)
-                else:
-                    # ugly hack, but we need to make sure we emit progress updates each second
-                    # for rate calculation and also remain responsive to cancellation, so if
-                    # the time to sleep is more than 1 second, we sleep in segments of
-                    # <1 seconds
-                    cycles = time_to_sleep
-                    remaining_time = time_to_sleep
-                    for i in range(math.ceil(cycles)):
-                        fake_delta = (
-                            chunk_size / cycles if cycles > 1 else chunk_size * cycles
-                        )
-                        fake_written = int(written - chunk_size + (i + 1) * fake_delta)
-                        signals.on_update_progress(fake_written, total)
-                        if signals.cancelled:
-                            logger.info(f"Download cancelled for {file}")
-                            return STATUS_STOPPED
-                        logger.debug(
-                            "Sleeping for %f seconds in cycle %f for %s fakewritten=%d",
-                            remaining_time,
-                            i,
-                            file,
-                            fake_written,
-                        )
-                        time.sleep(min(remaining_time, 1 / cycles))
-                        remaining_time -= 1 / cycles
-            if signals is not None:
-                signals.on_update_progress(written, total)
-                if signals.cancelled:
+        stream = __open_stream(f, local_path, disk_writers)
+        next_checkpoint = time.monotonic() + WRITTEN_OFFSET_CHECKPOINT_SECONDS
+        try:
+            for chunk in __iter_chunks(r, stream, chunk_sizer, rate_limiter):
+                chunk_size = len(chunk)
+                if rate_limiter is not None and not rate_limiter.acquire(
+                    chunk_size, signals.is_cancelled if signals is not None else None
+                ):
                     logger.debug(f"Download cancelled for {file}")
+                    r.close()
                     return STATUS_STOPPED
 
+                if stall_guard is not None:
+                    stall_guard.record(chunk_size)
+                if checksum is not None:
+                    checksum.update(chunk)
+                with __paused(stall_guard):
+                    stream.write(chunk)
+                written += chunk_size
+                if tracked and time.monotonic() >= next_checkpoint:
+                    record_written_offset(local_path, initial_pos + stream.written_bytes)
+                    next_checkpoint = time.monotonic() + WRITTEN_OFFSET_CHECKPOINT_SECONDS
+
+                if signals is not None:
+                    signals.on_update_progress(written, total)
+                    if signals.cancelled:
+                        logger.debug(f"Download cancelled for {file}")
+                        r.close()
+                        return STATUS_STOPPED
+            if signals is not None and signals.cancelled:
+                # aborted while reading, the stream ended early
+                logger.debug(f"Download cancelled for {file}")
+                r.close()
+                return STATUS_STOPPED
+            if stall_guard is not None and stall_guard.tripped:
+                r.close()
+                raise ValueError(f"Download stalled at {written} bytes, connection aborted.")
+        except Exception:
+            if signals is None or not signals.cancelled:
+                raise
+            # aborted while reading, the read failed on the closed socket
+            logger.debug(f"Download cancelled for {file}")
+            r.close()
+            return STATUS_STOPPED
+        finally:
+            # whatever was read is on disk before the file is unlocked
+            try:
+                stream.close()
+            finally:
+                if tracked:
+                    record_written_offset(local_path, initial_pos + stream.written_bytes)
+                if checksum is not None:
+                    checksum.checkpoint(initial_pos + stream.written_bytes)
+        if tracked:
+            # the preallocated space beyond the end of the stream is not part of the file
+            f.truncate(written)
+    if tracked:
+        clear_written_offset(local_path)
+
     # there's an unlikely possibility that the file was resumed when already
     # completed, so we emit a completed update progress signal, which might
     # be redundant for proper downloads
@@ -172,12 +345,506 @@ def __downloader(
     return STATUS_COMPLETED
 
 
+def __open_stream(file, local_path: str, disk_writers: DiskWriterPool = None):
+    """Get the stream through which the chunks are written to the given open file."""
+    if disk_writers is None:
+        return DirectWriteStream(file)
+    return disk_writers.writer_for(local_path).open_stream(file)
+
+
+def __iter_chunks(
+    response,
+    stream,
+    chunk_sizer: AdaptiveChunkSizer = None,
+    rate_limiter: RateLimiter = None,
+):
+    """Read the body of a streamed response in chunks sized by the chunk sizer. The time from
+    one read to the next, i.e. reading and processing a chunk, is fed back to the sizer.
+    If possible the chunks are views of the read buffers of the write stream, so a chunk has
+    to be written to the stream before the next one is taken."""
+    chunk_sizer = chunk_sizer if chunk_sizer is not None else AdaptiveChunkSizer()
+    fp = __zero_copy_source(response)
+    started = time.monotonic()
+    while True:
+        rate_limit = rate_limiter.effective_rate_limit() if rate_limiter else 0
+        size = chunk_sizer.next_size(rate_limit)
+        if fp is None:
+            chunk = response.raw.read(size, decode_content=True)
+            chunk_size = len(chunk)
+        else:
+            view = stream.buffer(size)
+            chunk_size = fp.readinto(view[:size])
+            chunk = view[:chunk_size]
+        if not chunk_size:
+            if fp is not None:
+                # bypassed urllib3, so it does not know the connection is free
+                response.raw.release_conn()
+            return
+        yield chunk
+        now = time.monotonic()
+        chunk_sizer.record(chunk_size, now - started)
+        started = now
+
+
+def __zero_copy_source(response):
+    """Get the underlying http.client response if the body can be read into a buffer as is,
+    i.e. it has no content encoding to decode. None otherwise."""
+    if not ZERO_COPY_READS:
+        return None
+    fp = getattr(response.raw, "_fp", None)
+    if not isinstance(fp, io.BufferedIOBase):
+        return None
+    if response.headers.get("content-encoding", "identity").lower() != "identity":
+        return None
+    return fp
+
+
+def segment_ranges(file_size: int, segments: int) -> list:
+    """Split a file of the given size to (first byte, last byte) ranges, inclusive on both
+    ends as per the HTTP Range header semantics. The last segment takes the remainder.
+    Parameters
+    ----------
+    file_size: int
+        Size of the remote file
+    segments: int
+        Number of segments to split the file to"""
+    segments = max(1, min(segments, file_size))
+    segment_size = file_size // segments
+    ranges = []
+    for i in range(segments):
+        first_byte = i * segment_size
+        last_byte = file_size - 1 if i == segments - 1 else (i + 1) * segment_size - 1
+        ranges.append((first_byte, last_byte))
+    return ranges
+
+
+def segment_part_path(local_path: str, segments: int, index: int) -> str:
+    """Path of the temporary file of a segment. The segment count is part of the name, so
+    parts of a download split differently are never mixed up."""
+    return f"{local_path}.seg{segments}-{index}"
+
+
+def has_segment_parts(local_path: str, segments: int) -> bool:
+    """Determine whether a segmented download of the given file was started before."""
+    return any(
+        os.path.exists(segment_part_path(local_path, segments, i))
+        for i in range(segments)
+    )
+
+
+def __segment_part_paths(local_path: str) -> list:
+    """Paths of the segment parts of a file, whatever the number of segments it was split to."""
+    folder, name = os.path.split(local_path)
+    pattern = re.compile(re.escape(name) + r"\.seg\d+-\d+")
+    try:
+        entries = os.listdir(folder or ".")
+    except FileNotFoundError:
+        return []
+    return [os.path.join(folder, entry) for entry in entries if pattern.fullmatch(entry)]
+
+
+def remove_download_artifacts(local_path: str) -> list:
+    """Remove a local file along with the temporary files of its download, so that a new
+    download of it starts from scratch instead of resuming from leftovers.
+    Parameters
+    ----------
+    local_path: str
+        Path of the downloaded file
+    Returns
+    -------
+    list
+        The paths actually removed"""
+    removed = []
+    artifacts = [local_path, written_offset_path(local_path), hedge_part_path(local_path)]
+    for path in artifacts + __segment_part_paths(local_path):
+        try:
+            os.remove(path)
+            removed.append(path)
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def hedge_part_path(local_path: str) -> str:
+    """Get the path of the file the hedge of a download is written to."""
+    return local_path + ".hedge"
+
+
+def written_offset_path(local_path: str) -> str:
+    """Path of the record of how far a preallocated file is written. A preallocated file has
+    its final size from the start, so its size cannot tell where to resume."""
+    return f"{local_path}.written"
+
+
+def read_written_offset(local_path: str) -> int:
+    """Get the recorded written offset of a preallocated file, None if not preallocated.
+    A damaged record counts as nothing written."""
+    try:
+        with open(written_offset_path(local_path), "r") as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        return 0
+
+
+def record_written_offset(local_path: str, offset: int) -> None:
+    """Record how far a preallocated file is written. Only offsets of bytes already written
+    to the file may be recorded, so that a resumption never skips a hole."""
+    with open(written_offset_path(local_path), "w") as f:
+        f.write(str(offset))
+
+
+def clear_written_offset(local_path: str) -> None:
+    """Remove the written offset record of a file, if any."""
+    try:
+        os.remove(written_offset_path(local_path))
+    except FileNotFoundError:
+        pass
+
+
+def written_size(local_path: str) -> int:
+    """Get the number of bytes written to a local file: the recorded offset of a preallocated
+    file, the size of the file otherwise.
+    Parameters
+    ----------
+    local_path: str
+        Local path to the file
+    Returns
+    -------
+    int
+        The number of bytes written, -1 if the file does not exist"""
+    size = get_local_file_size(local_path)
+    if size == -1:
+        return -1
+    offset = read_written_offset(local_path)
+    return size if offset is None else min(offset, size)
+
+
+def open_target(
+    local_path: str,
+    initial_pos: int,
+    file_size: int = -1,
+    preallocate: bool = False,
+    buffering: int = -1,
+) -> tuple:
+    """Open the target file of a download for writing at the given position. A fresh download
+    of known size is preallocated if requested, a preallocated file is resumed in place and
+    keeps its written offset record until completed.
+    Parameters
+    ----------
+    local_path: str
+        Local path where to store the file
+    initial_pos: int
+        Position to write from, 0 starts the file over
+    file_size: int
+        Size of the remote file, -1 if unknown
+    preallocate: bool
+        Whether to reserve the disk space of a fresh download up front
+    buffering: int
+        Buffering policy of the opened file, as with open()
+    Returns
+    -------
+    tuple
+        The open file and whether its written offset is recorded"""
+    file = Path(local_path)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    if initial_pos:
+        if read_written_offset(local_path) is None:
+            return open(file, "ab", buffering=buffering), False
+        f = open(file, "r+b", buffering=buffering)
+        f.seek(initial_pos)
+        return f, True
+    f = open(file, "wb", buffering=buffering)
+    tracked = False
+    if preallocate and file_size > 0:
+        # recorded before allocating, so a crash never leaves a full size file unrecorded
+        record_written_offset(local_path, 0)
+        try:
+            tracked = preallocate_file(f, file_size)
+        except OSError as e:
+            logger.warning("Could not preallocate %s: %s", local_path, e)
+    if not tracked:
+        clear_written_offset(local_path)
+    return f, tracked
+
+
+def assemble_parts(
+    file, part_paths: list, checksum: StreamingChecksum = None
+) -> None:
+    """Copy the part files of a segmented download into the target file in order, hashing
+    the bytes on the way.
+    Parameters
+    ----------
+    file: file
+        The target file, open for writing at its start
+    part_paths: list
+        Paths of the part files in the order of the segments
+    checksum: StreamingChecksum
+        Checksum to compute from the whole file, not computed if None"""
+    if checksum is not None:
+        checksum.reset()
+    for part_path in part_paths:
+        with open(part_path, "rb") as part:
+            while True:
+                block = part.read(1024 * 1024)
+                if not block:
+                    break
+                if checksum is not None:
+                    checksum.update(block)
+                file.write(block)
+
+
+def __segment_downloader(
+    url: str,
+    part_path: str,
+    byte_range: tuple,
+    progress: list,
+    index: int,
+    signals: DownloadSignals,
+    failed: threading.Event,
+    session: requests.Session = None,
+    rate_limiter: RateLimiter = None,
+    disk_writers: DiskWriterPool = None,
+    stall_guard: StallGuard = None,
+) -> None:
+    """Download a single byte range of a file to its part file, resuming if the part file
+    is already partially on disk. Progress is reported in progress[index]."""
+    first_byte, last_byte = byte_range
+    segment_length = last_byte - first_byte + 1
+    part = Path(part_path)
+    written = part.stat().st_size if part.exists() else 0
+    progress[index] = written
+    if written >= segment_length:
+        return
+    headers = {"Range": f"bytes={first_byte + written}-{last_byte}"}
+    http = session if session is not None else requests
+    r = http.get(url, stream=True, headers=headers, timeout=TIMEOUT_SECONDS)
+    __raise_if_busy(r, url)
+    if r.status_code != 206:
+        raise ValueError(
+            f"Server did not honor range request for segment {index} (HTTP {r.status_code})."
+        )
+    with open(part, "ab", buffering=0) as f, __abortable(r, signals):
+        portalocker.lock(f, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        stream = __open_stream(f, part_path, disk_writers)
+        try:
+            for chunk in __iter_chunks(r, stream, rate_limiter=rate_limiter):
+                if rate_limiter is not None:
+                    rate_limiter.acquire(
+                        len(chunk),
+                        lambda: failed.is_set() or (signals is not None and signals.cancelled),
+                    )
+                if stall_guard is not None:
+                    stall_guard.record(len(chunk))
+                written += len(chunk)
+                with __paused(stall_guard):
+                    stream.write(chunk)
+                progress[index] = written
+                if failed.is_set() or (signals is not None and signals.cancelled):
+                    r.close()
+                    return
+        finally:
+            stream.close()
+    if written < segment_length:
+        raise ValueError(
+            f"Segment {index} ended prematurely at {written}/{segment_length} bytes."
+        )
+
+
+def __segmented_downloader(
+    url: str,
+    local_path: str,
+    file_size: int,
+    segments: int,
+    connections: int = None,
+    signals: DownloadSignals = None,
+    session: requests.Session = None,
+    download_url: str = None,
+    rate_limiter: RateLimiter = None,
+    disk_writers: DiskWriterPool = None,
+    preallocate: bool = False,
+    checksum: StreamingChecksum = None,
+    stall_guard: StallGuard = None,
+) -> str:
+    """Download url to disk in parallel byte ranges, each into its own part file, then
+    assemble the parts into the target file. Interrupted downloads resume per segment.
+    Parameters
+    ----------
+    url: str
+        Remote resource (file) url
+    local_path: str
+        Local path where to store the file
+    file_size: int
+        Size of the remote file
+    segments: int
+        Number of segments the file is split to
+    connections: int
+        Number of segments downloaded at once, all of them if None
+    signals: DownloadSignals
+        Observer for download progress
+    session: requests.Session
+        Keep-alive session to use, one-off connections are made if None
+    download_url: str
+        Where the url redirects to, if known from a probe
+    rate_limiter: RateLimiter
+        Bandwidth limiter the segments draw their chunks from, unlimited if None
+    disk_writers: DiskWriterPool
+        Write-behind writers of the part files, written synchronously if None
+    preallocate: bool
+        Whether to reserve the disk space of the target file before assembling it
+    checksum: StreamingChecksum
+        Checksum computed while assembling the parts, not computed if None
+    stall_guard: StallGuard
+        Throughput tracker the segments record their chunks with, not watched if None
+    """
+    download_url = download_url if download_url else url
+    file = Path(local_path)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    ranges = segment_ranges(file_size, segments)
+    segments = len(ranges)
+    part_paths = [segment_part_path(local_path, segments, i) for i in range(segments)]
+    progress = [0] * segments
+    errors = []
+    failed = threading.Event()
+
+    pending = collections.deque(range(segments))
+    pending_lock = threading.Lock()
+
+    def segment_task(index):
+        try:
+            __segment_downloader(
+                download_url,
+                part_paths[index],
+                ranges[index],
+                progress,
+                index,
+                signals,
+                failed,
+                session,
+                rate_limiter,
+                disk_writers,
+                stall_guard,
+            )
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+
+    def connection_task():
+        # one connection works through the segments left, fewer connections than segments
+        # download them a few at a time
+        while not failed.is_set() and not (signals is not None and signals.cancelled):
+            with pending_lock:
+                if not pending:
+                    return
+                index = pending.popleft()
+            segment_task(index)
+
+    connections = min(connections, segments) if connections else segments
+    threads = []
+    for i in range(connections):
+        t = threading.Thread(
+            target=connection_task,
+            name=f"{threading.current_thread().name}segment-{i}",
+            daemon=True,
+        )
+        t.start()
+        threads.append(t)
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(timeout=0.5)
+        if signals is not None:
+            signals.on_update_progress(sum(progress), file_size)
+    # segments aborted by a cancellation fail, that is not an error of the download
+    if signals is not None and signals.cancelled:
+        logger.debug(f"Segmented download cancelled for {file}")
+        return STATUS_STOPPED
+    if errors:
+        raise errors[0]
+
+    # all segments are in place, assemble them into the target file
+    with open(file, "wb") as f:
+        portalocker.lock(f, portalocker.LOCK_EX | portalocker.LOCK_NB)
+        if preallocate:
+            preallocate_file(f, file_size)
+        assemble_parts(f, part_paths, checksum)
+    for part_path in part_paths:
+        os.remove(part_path)
+
+    if signals is not None:
+        signals.on_update_progress(file_size, file_size)
+    logger.debug("Downloaded %s in %d segments", url, segments)
+    return STATUS_COMPLETED
+
+
+def download_range(
+    url: str,
+    part_path: str,
+    byte_range: tuple,
+    signals: DownloadSignals = None,
+    session: requests.Session = None,
+    rate_limiter: RateLimiter = None,
+    disk_writers: DiskWriterPool = None,
+) -> str:
+    """Download a byte range of a file into a file of its own, resuming it if partially on
+    disk. Unlike the other downloads, a single attempt is made.
+    Parameters
+    ----------
+    url: str
+        Remote resource (file) url, redirects are followed afresh
+    part_path: str
+        Local path where to store the range
+    byte_range: tuple
+        The first and the last byte of the range
+    signals: DownloadSignals
+        Cancels the download, progress is not reported
+    session: requests.Session
+        Keep-alive session to use, a one-off connection is made if None
+    rate_limiter: RateLimiter
+        Bandwidth limiter to draw each chunk from, unlimited if None
+    disk_writers: DiskWriterPool
+        Write-behind writers of the part file, written synchronously if None
+    """
+    try:
+        __segment_downloader(
+            url,
+            part_path,
+            byte_range,
+            [0],
+            0,
+            signals,
+            threading.Event(),
+            session,
+            rate_limiter,
+            disk_writers,
+        )
+    except Exception:
+        if signals is None or not signals.cancelled:
+            raise
+    if signals is not None and signals.cancelled:
+        return STATUS_STOPPED
+    return STATUS_COMPLETED
+
+
 def download_file(
     url: str,
     local_path: str,
     signals: DownloadSignals = None,
     attempts: int = 5,
     file_size: int = -1,
+    segments: int = 1,
+    session: requests.Session = None,
+    probe_cache: ProbeCache = None,
+    rate_limiter: RateLimiter = None,
+    chunk_sizer: AdaptiveChunkSizer = None,
+    disk_writers: DiskWriterPool = None,
+    preallocate: bool = False,
+    checksum: StreamingChecksum = None,
+    stall_watchdog: StallWatchdog = None,
+    retry_policy: RetryPolicy = None,
+    circuit_breakers: HostCircuitBreakers = None,
+    host_limits: HostConnectionLimits = None,
+    connections_held: int = 0,
 ) -> str:
     """Download a file from the internet.
     Parameters
@@ -188,30 +855,181 @@ def download_file(
         Local path where to store the file
     progress_observer: ProgressObserver
         Observer for download progress
+    segments: int
+        Number of parallel ranged connections to use for the file. Falls back to a single
+        stream if the server does not accept ranges.
+    session: requests.Session
+        Keep-alive session to use, one-off connections are made if None
+    probe_cache: ProbeCache
+        Cache of URL probes shared with the size resolver, the url is probed on each attempt
+        if None
+    rate_limiter: RateLimiter
+        Bandwidth limiter shared by all downloads, unlimited if None
+    chunk_sizer: AdaptiveChunkSizer
+        Sizer of the reads from a single stream, its statistics describe the download. A
+        fresh one is used if None
+    disk_writers: DiskWriterPool
+        Write-behind writers shared by all downloads, written synchronously if None
+    preallocate: bool
+        Whether to reserve the disk space of the file up front if its size is known. A
+        preallocated file is resumed from its recorded written offset instead of its size.
+    checksum: StreamingChecksum
+        Checksum of the file computed while downloading. Kept across attempts and stops, so
+        that a resumed download does not read back what it hashed before. Not computed if
+        None
+    stall_watchdog: StallWatchdog
+        Watchdog of the throughput of the attempts. A stalled attempt has its connections
+        aborted and the download resumes on a fresh connection. Not watched if None
+    retry_policy: RetryPolicy
+        Delays between the attempts, retried right away if None
+    circuit_breakers: HostCircuitBreakers
+        Breakers of the hosts shared by all downloads. While the breaker of the host is
+        open, the download waits instead of making attempts. Not used if None
+    host_limits: HostConnectionLimits
+        Connection limits of the hosts shared by all downloads. The file is split to at
+        most as many segments as the host allows, and each attempt runs them on the
+        connections free, waiting only if none is. Not limited if None
+    connections_held: int
+        Connections to the host already taken from host_limits by the caller, used by the
+        first attempt and released by the download
     """
+    is_cancelled = signals.is_cancelled if signals is not None else None
+    on_event = signals.on_event if signals is not None else None
+    if host_limits is not None:
+        segments = host_limits.cap(url, segments)
     current_attempt = 0
     while current_attempt < attempts:
+        if circuit_breakers is not None and not circuit_breakers.wait_until_closed(
+            url, is_cancelled, on_event
+        ):
+            if host_limits is not None:
+                host_limits.release(url, connections_held)
+            return STATUS_STOPPED
+        connections = segments
+        if host_limits is not None:
+            connections = __take_connections(
+                host_limits, url, segments, connections_held, is_cancelled, on_event
+            )
+            connections_held = 0
+            if not connections:
+                return STATUS_STOPPED
+        stall_guard = (
+            stall_watchdog.watch(signals, rate_limiter) if stall_watchdog is not None else None
+        )
+        error = None
         try:
-            result = __attempt_download_file(url, local_path, signals, file_size)
-            if result != STATUS_FAILED:
+            result = __attempt_download_file(
+                url,
+                local_path,
+                signals,
+                file_size,
+                segments,
+                connections,
+                session,
+                probe_cache,
+                rate_limiter,
+                chunk_sizer,
+                disk_writers,
+                preallocate,
+                checksum,
+                stall_guard,
+            )
+            if result != STATUS_FAILED and not __stalled(stall_guard):
+                if circuit_breakers is not None and result == STATUS_COMPLETED:
+                    circuit_breakers.record_success(url, on_event)
                 return result
         except Exception as e:
-            logger.error(f"Downloading {url} failed in attempt #{current_attempt + 1}: {e}")
-            logger.exception(e)
-            signals.on_event(f"Download attempt {current_attempt + 1} failed: {e}")
+            if signals is not None and signals.cancelled:
+                logger.debug(f"Download cancelled for {url}")
+                return STATUS_STOPPED
+            error = e
+            if circuit_breakers is not None and is_host_failure(e):
+                circuit_breakers.record_failure(url, e, on_event)
+            if not __stalled(stall_guard):
+                # the redirect target or the size may have changed, probe again on retry
+                if probe_cache is not None:
+                    probe_cache.invalidate(url)
+                logger.error(f"Downloading {url} failed in attempt #{current_attempt + 1}: {e}")
+                logger.exception(e)
+                if on_event is not None:
+                    on_event(f"Download attempt {current_attempt + 1} failed: {e}")
+        finally:
+            if stall_guard is not None:
+                stall_guard.close()
+            if host_limits is not None:
+                host_limits.release(url, connections)
+        if __stalled(stall_guard):
+            # resumed on a fresh connection, probed again in case it redirects elsewhere
+            if probe_cache is not None:
+                probe_cache.invalidate(url)
+            logger.info("Download of %s stalled, recycling its connection.", url)
+            if on_event is not None:
+                on_event(stall_guard.describe())
         current_attempt += 1
+        if (
+            retry_policy is not None
+            and not __stalled(stall_guard)
+            and current_attempt < attempts
+            and not retry_policy.wait(current_attempt, error, is_cancelled)
+        ):
+            return STATUS_STOPPED
 
     logger.error(f"Downloading {url} failed after {attempts} attempts, giving up.")
-    signals.on_event(f"Retries exceeded ({attempts}), giving up.")
+    if on_event is not None:
+        on_event(f"Retries exceeded ({attempts}), giving up.")
     return STATUS_FAILED
 
 
+def __paused(stall_guard: StallGuard):
+    """Pause the guard, if any, while the download waits on the disk instead of its
+    connection."""
+    return stall_guard.pause() if stall_guard is not None else nullcontext()
+
+
+def __stalled(stall_guard: StallGuard) -> bool:
+    """Whether the attempt watched by the guard, if any, was aborted as stalled."""
+    return stall_guard is not None and stall_guard.tripped
+
+
+def __take_connections(
+    host_limits: HostConnectionLimits,
+    url: str,
+    segments: int,
+    connections_held: int,
+    is_cancelled,
+    on_event,
+) -> int:
+    """Take the connections of an attempt: the held ones topped up with the free ones
+    without waiting, or as many as are free once one is.
+    :return:
+        The number of connections taken, 0 if cancelled while waiting"""
+    if not connections_held:
+        return host_limits.acquire(url, segments, is_cancelled, on_event)
+    if segments <= connections_held:
+        return connections_held
+    return connections_held + host_limits.try_acquire(url, segments - connections_held)
+
+
 def __attempt_download_file(
-    url: str, local_path: str, signals: DownloadSignals = None, file_size: int = -1
+    url: str,
+    local_path: str,
+    signals: DownloadSignals = None,
+    file_size: int = -1,
+    segments: int = 1,
+    connections: int = None,
+    session: requests.Session = None,
+    probe_cache: ProbeCache = None,
+    rate_limiter: RateLimiter = None,
+    chunk_sizer: AdaptiveChunkSizer = None,
+    disk_writers: DiskWriterPool = None,
+    preallocate: bool = False,
+    checksum: StreamingChecksum = None,
+    stall_guard: StallGuard = None,
 ) -> str:
     """Execute the correct download operation.
-    Depending on the size of the file online and offline, resume the
-    download if the file offline is smaller than online.
+    Depending on the size of the file online and the bytes written offline, resume the
+    download if the file offline is smaller than online. The url is probed
+    once, the result is used for every decision and by the actual download.
     Parameters
     ----------
     url: str
@@ -221,20 +1039,42 @@ def __attempt_download_file(
     progress_observer: ProgressObserver
         Observer for download progress
     """
-    # Establish connection to header of file
-    r = requests.head(url, timeout=TIMEOUT_SECONDS)
+    metadata = probe_url(url, session=session, probe_cache=probe_cache)
 
     # Get filesize of online and offline file
     if file_size != -1:
         file_size_online = file_size
     else:
-        file_size_online = resolve_remote_file_size(url)
-    server_resume_supported = r.headers.get("accept-ranges", None) is not None
-    logger.debug("Server supports resume for: %s", url)
+        file_size_online = metadata.content_length
+    server_resume_supported = metadata.accept_ranges
+    logger.debug("Server supports resume for %s: %s", url, server_resume_supported)
     file = Path(local_path)
 
+    if (
+        segments > 1
+        and server_resume_supported
+        and file_size_online > 0
+        and (not file.exists() or has_segment_parts(local_path, segments))
+    ):
+        logger.debug("Downloading %s in %d segments.", url, segments)
+        return __segmented_downloader(
+            url,
+            local_path,
+            file_size_online,
+            segments,
+            connections=connections,
+            signals=signals,
+            session=session,
+            download_url=metadata.final_url,
+            rate_limiter=rate_limiter,
+            disk_writers=disk_writers,
+            preallocate=preallocate,
+            checksum=checksum,
+            stall_guard=stall_guard,
+        )
+
     if file.exists():
-        file_size_offline = file.stat().st_size
+        file_size_offline = written_size(local_path)
 
         if file_size_online != file_size_offline:
             if server_resume_supported:
@@ -251,6 +1091,14 @@ def __attempt_download_file(
                     local_path,
                     file_size_offline,
                     signals=signals,
+                    session=session,
+                    metadata=metadata,
+                    rate_limiter=rate_limiter,
+                    chunk_sizer=chunk_sizer,
+                    disk_writers=disk_writers,
+                    preallocate=preallocate,
+                    checksum=checksum,
+                    stall_guard=stall_guard,
                 )
             else:
                 logger.debug(
@@ -258,77 +1106,233 @@ def __attempt_download_file(
                     url,
                 )
                 signals.on_event("Server does not support resume, restarting download.")
-                return __downloader(url, local_path, signals=signals)
+                return __downloader(
+                    url,
+                    local_path,
+                    signals=signals,
+                    session=session,
+                    metadata=metadata,
+                    rate_limiter=rate_limiter,
+                    chunk_sizer=chunk_sizer,
+                    disk_writers=disk_writers,
+                    preallocate=preallocate,
+                    checksum=checksum,
+                    stall_guard=stall_guard,
+                )
         else:
             logger.debug("File %s already downloaded.", url)
+            # a preallocated file completed just before its record could be removed
+            clear_written_offset(local_path)
+            if checksum is not None:
+                checksum.resume_at(local_path, file_size_offline)
             signals.on_event("File was already on disk and complete.")
             signals.on_update_progress(file_size_offline, file_size_offline)
             return STATUS_COMPLETED
     else:
         logger.debug("Downloading %s from scratch.", url)
-        return __downloader(url, local_path, signals=signals)
+        return __downloader(
+            url,
+            local_path,
+            signals=signals,
+            session=session,
+            metadata=metadata,
+            rate_limiter=rate_limiter,
+            chunk_sizer=chunk_sizer,
+            disk_writers=disk_writers,
+            preallocate=preallocate,
+            checksum=checksum,
+            stall_guard=stall_guard,
+        )
 
 
-def resolve_remote_file_size(url: str, attempts: int = 5):
+def resolve_remote_file_size(
+    url: str,
+    attempts: int = 5,
+    session: requests.Session = None,
+    probe_cache: ProbeCache = None,
+    retry_policy: RetryPolicy = None,
+    circuit_breakers: HostCircuitBreakers = None,
+    is_cancelled=None,
+    host_limits: HostConnectionLimits = None,
+):
     """Resolve the size of a remote file.
     Parameters
     ----------
     url: str
         Remote resource (file) url
     attempts: int
-        Number of attempts to resolve the file size"""
+        Number of attempts to resolve the file size
+    session: requests.Session
+        Keep-alive session to use, a one-off connection is made if None
+    probe_cache: ProbeCache
+        Cache to take the probe from and to store it in, so that the download does not
+        have to probe again
+    retry_policy: RetryPolicy
+        Delays between the attempts, retried right away if None
+    circuit_breakers: HostCircuitBreakers
+        Breakers of the hosts shared with the downloads, waited for while open. Not used if
+        None
+    is_cancelled: callable
+        Tells whether the resolution was cancelled, checked while waiting
+    host_limits: HostConnectionLimits
+        Connection limits of the hosts shared with the downloads, each attempt waits for a
+        connection. Not limited if None"""
     current_attempt = 0
     while current_attempt < attempts:
+        if circuit_breakers is not None and not circuit_breakers.wait_until_closed(
+            url, is_cancelled
+        ):
+            raise Exception(f"Resolving file size for {url} was cancelled.")
+        if host_limits is not None and not host_limits.acquire(url, 1, is_cancelled):
+            raise Exception(f"Resolving file size for {url} was cancelled.")
         try:
-            result = __attempt_resolve_remote_file_size(url)
+            result = __attempt_resolve_remote_file_size(url, session, probe_cache)
+            if circuit_breakers is not None:
+                circuit_breakers.record_success(url)
             return result
         except Exception as e:
             logger.error(f"Resolving file size for {url} failed in attempt #{current_attempt + 1}: {e}")
             logger.exception(e)
+            error = e
+            if circuit_breakers is not None and is_host_failure(e):
+                circuit_breakers.record_failure(url, e)
+        finally:
+            if host_limits is not None:
+                host_limits.release(url, 1)
         current_attempt += 1
+        if (
+            retry_policy is not None
+            and current_attempt < attempts
+            and not retry_policy.wait(current_attempt, error, is_cancelled)
+        ):
+            raise Exception(f"Resolving file size for {url} was cancelled.")
     logger.error(f"Resolving file size for {url} failed after {attempts} attempts, giving up.")
     raise Exception(f"Resolving file size for {url} failed after {attempts} attempts, giving up.")
 
 
-def __attempt_resolve_remote_file_size(url: str) -> int:
+def __attempt_resolve_remote_file_size(
+    url: str, session: requests.Session = None, probe_cache: ProbeCache = None
+) -> int:
     """Resolve the size of a remote file. Go through redirects if necessary.
     Parameters
     ----------
     url: str
-        Remote resource (file) url"""
-    r = requests.head(url, timeout=TIMEOUT_SECONDS)
-    content_length = int(r.headers.get("content-length", 0))
-    logger.debug("Length of %s is %d", url, content_length)
-    actual_location = r.headers.get("location", None)
-    if content_length == 0 and actual_location is not None:
-        logger.debug("Resolving redirect to %s from URL %s", actual_location, url)
-        return __attempt_resolve_remote_file_size(actual_location)
-    return content_length
-
-
-def validate_file(local_path: str, expected_hash: str) -> bool:
-    """Validate a given file with its hash if available.
+        Remote resource (file) url
+    session: requests.Session
+        Keep-alive session to use, a one-off connection is made if None
+    probe_cache: ProbeCache
+        Cache of URL probes, always probes if None"""
+    return probe_url(url, session=session, probe_cache=probe_cache).content_length
+
+
+def probe_url(
+    url: str, session: requests.Session = None, probe_cache: ProbeCache = None
+) -> UrlMetadata:
+    """Get the metadata of a remote file: size, range support, validators and the final
+    location after redirects. Served from the cache if probed recently.
     Parameters
     ----------
-    local_path: str
-        Local path to the file"""
-    file = Path(local_path)
+    url: str
+        Remote resource (file) url
+    session: requests.Session
+        Keep-alive session to use, a one-off connection is made if None
+    probe_cache: ProbeCache
+        Cache of URL probes, always probes if None"""
+    if probe_cache is not None:
+        metadata = probe_cache.get(url)
+        if metadata is not None:
+            return metadata
+    metadata = __probe(url, session)
+    if probe_cache is not None:
+        probe_cache.put(metadata)
+    return metadata
 
-    sha = hashlib.sha256()
-    with open(file, "rb") as f:
-        while True:
-            chunk = f.read(1000 * 1000)  # 1MB so that memory is not exhausted
-            if not chunk:
-                break
-            sha.update(chunk)
+
+def __probe(url: str, session: requests.Session = None, redirects: int = 10) -> UrlMetadata:
+    """Probe a remote file with a HEAD request, following redirects. If the server rejects
+    HEAD, fall back to a GET of the first byte and take the size from Content-Range. Raises
+    on any other error status, so that a failed probe is neither used nor cached."""
+    http = session if session is not None else requests
+    location = url
+    for _ in range(redirects):
+        r = http.head(location, timeout=TIMEOUT_SECONDS)
+        __raise_if_busy(r, location)
+        if r.status_code in HEAD_REJECTED_STATUSES:
+            logger.debug("HEAD rejected with HTTP %d for %s", r.status_code, location)
+            return __probe_with_ranged_get(url, location, http)
+        # an error status tells nothing about the file, e.g. a 404 is not an empty file
+        r.raise_for_status()
+        content_length = int(r.headers.get("content-length", 0))
+        actual_location = r.headers.get("location", None)
+        if content_length == 0 and actual_location is not None:
+            logger.debug("Resolving redirect to %s from URL %s", actual_location, location)
+            location = actual_location
+            continue
+        logger.debug("Length of %s is %d", location, content_length)
+        return UrlMetadata(
+            url,
+            content_length=content_length,
+            accept_ranges=r.headers.get("accept-ranges", "none") != "none",
+            etag=r.headers.get("etag"),
+            last_modified=r.headers.get("last-modified"),
+            final_url=location,
+            status=r.status_code,
+        )
+    raise ValueError(f"Too many redirects while probing {url}.")
+
+
+def __probe_with_ranged_get(url: str, location: str, http) -> UrlMetadata:
+    """Probe a remote file by requesting its first byte only."""
+    r = http.get(
+        location, stream=True, headers={"Range": "bytes=0-0"}, timeout=TIMEOUT_SECONDS
+    )
     try:
-        assert sha.hexdigest() == expected_hash
-    except AssertionError:
+        __raise_if_busy(r, location)
+        r.raise_for_status()
+        content_range = r.headers.get("content-range", "")
+        if r.status_code == 206 and "/" in content_range:
+            # e.g. bytes 0-0/1234, the total may be * if unknown
+            total = content_range.rsplit("/", 1)[1]
+            content_length = int(total) if total.isdigit() else 0
+            accept_ranges = True
+        else:
+            content_length = int(r.headers.get("content-length", 0))
+            accept_ranges = False
+        return UrlMetadata(
+            url,
+            content_length=content_length,
+            accept_ranges=accept_ranges,
+            etag=r.headers.get("etag"),
+            last_modified=r.headers.get("last-modified"),
+            final_url=r.url if r.url else location,
+            status=r.status_code,
+        )
+    finally:
+        r.close()
+
+
+def validate_file(local_path: str, expected_hash: str, algorithm: str = "sha256") -> bool:
+    """Validate a given file with its hash if available. This reads the whole file, a
+    checksum stored at download time only needs a comparison to the expected one.
+    Parameters
+    ----------
+    local_path: str
+        Local path to the file
+    expected_hash: str
+        The expected hex digest, or a stored checksum with its algorithm (algorithm:digest)
+    algorithm: str
+        One of the CHECKSUM_ALGORITHMS, used unless the expected hash names its own"""
+    stored_algorithm, stored_digest = parse_checksum(expected_hash)
+    if stored_algorithm is not None:
+        algorithm, expected_hash = stored_algorithm, stored_digest
+    checksum = StreamingChecksum(algorithm)
+    checksum.resume_at(local_path, os.path.getsize(local_path))
+    if checksum.hexdigest() != expected_hash:
         logger.debug(
-            "Failed validating %s, actual hexdigest=%s expected=%s",
+            "Failed validating %s, actual %s expected %s",
             local_path,
-            sha.hexdigest(),
-            expected_hash,
+            checksum.checksum(),
+            format_checksum(algorithm, expected_hash),
         )
         return False
     return True
@@ -1,22 +1,32 @@
+import heapq
+import itertools
 import queue
 from typing import List
 from model.dto.file_model_dto import FileModelDTO
 
 POISON_PILL = FileModelDTO(job_name="_poison_pill_", name="_poison_pill_", priority=0)
+# the heap is compacted when more than this share of it is removed entries...
+COMPACT_TOMBSTONE_RATIO = 0.5
+# ...and there are at least this many of them, small heaps are not worth it
+COMPACT_MIN_TOMBSTONES = 1024
 
 
 class FileQueue(queue.PriorityQueue):
     """A priority queue for files. Allows updating the priority of files
-    already in the queue."""
+    already in the queue. Files of the same priority are popped in the order they were put.
+
+    Removed files stay in the heap as tombstones until popped, the heap is compacted once
+    they make up most of it. The size of the queue (qsize, empty) counts live files only."""
 
     def __init__(self):
         """Create a new file queue."""
         super().__init__()
-        self.entry_finder = {}  # Mapping from item to priority
-        # this needs the be a FileModelDTO to keep elements sortable,
-        # although sort order won't matter for the placeholder, since
-        # it's always discarded
+        self.entry_finder = {}  # Mapping from file name to entry
+        # marks the entry of a removed file, never compared: ties are broken by the sequence
         self.REMOVED = FileModelDTO(job_name="_removed_", name="_removed_", priority=0)
+        self.sequence = itertools.count()
+        self.tombstones = 0
+        self.compactions = 0
 
     def is_poison_pill(entry: FileModelDTO) -> bool:
         """Returns True if the tested entry is a poison pill, False otherwise."""
@@ -31,53 +41,151 @@ class FileQueue(queue.PriorityQueue):
         self.put_file(POISON_PILL)
 
     def put_all(self, files: List[FileModelDTO]) -> None:
-        """Put all files into the queue with the given priority.
+        """Put all files into the queue with the given priority. A large batch is loaded
+        in linear time, instead of pushing the files one by one.
         :param files:
             The files to put into the queue"""
         for file in files:
-            self.put_file(file)
+            if file is None:
+                raise ValueError(
+                    "Can't add None to this queue. Use .poison_pill() instead."
+                )
+        with self.not_empty:
+            entries = [self.__entry_of(file) for file in files]
+            if len(entries) > len(self.queue) // 4:
+                self.queue.extend(entries)
+                heapq.heapify(self.queue)
+            else:
+                for entry in entries:
+                    heapq.heappush(self.queue, entry)
+            self.__compact_if_needed()
+            self.unfinished_tasks += len(entries)
+            self.not_empty.notify(len(entries))
 
     def remove_all(self, files: List[FileModelDTO]) -> None:
         """Remove all files from the queue.
         :param files:
             The files to remove"""
-        for file in files:
-            self.remove_file(file)
+        with self.mutex:
+            for file in files:
+                self.__remove(file)
+            self.__compact_if_needed()
 
     def put_file(self, file: FileModelDTO) -> None:
         """Put a file into the queue.
         :param file:
             The file to put into the queue"""
-        # poison pill has a priority treatment
-        if FileQueue.is_poison_pill(file):
-            self.put([0, file])
-        else:
-            if file is None:
-                raise ValueError(
-                    "Can't add None to this queue. Use .poison_pill() instead."
-                )
-            if file.name in self.entry_finder:
-                self.remove_file(file)
-            entry = [file.priority, file]
-            self.entry_finder[file.name] = entry
-            self.put(entry)
+        if file is None:
+            raise ValueError("Can't add None to this queue. Use .poison_pill() instead.")
+        with self.not_empty:
+            heapq.heappush(self.queue, self.__entry_of(file))
+            self.__compact_if_needed()
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
 
     def remove_file(self, file: FileModelDTO) -> None:
         """Remove a file from the queue.
         :param file:
             The file to remove"""
-        if file.name not in self.entry_finder:
-            return
-        entry = self.entry_finder.pop(file.name)
-        entry[-1] = self.REMOVED
+        with self.mutex:
+            self.__remove(file)
+            self.__compact_if_needed()
 
-    def pop_file(self) -> FileModelDTO:
+    def pop_file(self, block: bool = True, timeout: float = None) -> FileModelDTO:
         """Pop a file from the queue.
+        :param block:
+            Whether to wait for a file, otherwise queue.Empty is raised if there is none
+        :param timeout:
+            The seconds to wait for a file if blocking, queue.Empty is raised after. Waits
+            forever if None
         :return:
             The file"""
-        _, file = self.get()
-        while file is self.REMOVED:
-            _, file = self.get()
-        if file is not None and not FileQueue.is_poison_pill(file):
-            del self.entry_finder[file.name]
-        return file
+        return self.get(block=block, timeout=timeout)[-1]
+
+    def peek_files(self, count: int) -> List[FileModelDTO]:
+        """Get the files that would be popped next, without removing them. Only the top of
+        the heap is visited, a child is never smaller than its parent, so the cost depends
+        on the count and the tombstones near the top rather than on the size of the queue.
+        :param count:
+            The number of files to get at most
+        :return:
+            The files in the order they would be popped"""
+        files = []
+        with self.mutex:
+            heap = self.queue
+            # the entries are unique by their sequence, the index is never compared
+            frontier = [(heap[0], 0)] if heap else []
+            while frontier and len(files) < count:
+                entry, index = heapq.heappop(frontier)
+                file = entry[-1]
+                if file is not self.REMOVED and not FileQueue.is_poison_pill(file):
+                    files.append(file)
+                for child in (2 * index + 1, 2 * index + 2):
+                    if child < len(heap):
+                        heapq.heappush(frontier, (heap[child], child))
+        return files
+
+    def get_stats(self) -> dict:
+        """Get the size of the queue and of its heap.
+        :return:
+            The live files, the tombstones of removed ones, the size of the heap (both
+            together) and the number of compactions so far"""
+        with self.mutex:
+            return {
+                "size": self._qsize(),
+                "tombstones": self.tombstones,
+                "heap_size": len(self.queue),
+                "compactions": self.compactions,
+            }
+
+    def _qsize(self) -> int:
+        # only the live entries, so that get waits for a file rather than a tombstone
+        return len(self.queue) - self.tombstones
+
+    def _get(self) -> list:
+        # called by get with the mutex held, there is a live entry as per _qsize
+        while True:
+            entry = heapq.heappop(self.queue)
+            file = entry[-1]
+            if file is self.REMOVED:
+                self.tombstones -= 1
+                continue
+            if self.entry_finder.get(file.name) is entry:
+                del self.entry_finder[file.name]
+            if self.tombstones == len(self.queue):
+                # nothing live is left, the tombstones need not wait to be popped
+                self.queue.clear()
+                self.tombstones = 0
+            return entry
+
+    def __entry_of(self, file: FileModelDTO) -> list:
+        """Create the heap entry of a file, replacing the entry of the file if queued. The
+        mutex must be held."""
+        # poison pill has a priority treatment
+        if FileQueue.is_poison_pill(file):
+            return [0, next(self.sequence), file]
+        self.__remove(file)
+        entry = [file.priority, next(self.sequence), file]
+        self.entry_finder[file.name] = entry
+        return entry
+
+    def __remove(self, file: FileModelDTO) -> None:
+        """Turn the entry of a file into a tombstone. The mutex must be held."""
+        entry = self.entry_finder.pop(file.name, None)
+        if entry is None:
+            return
+        entry[-1] = self.REMOVED
+        self.tombstones += 1
+
+    def __compact_if_needed(self) -> None:
+        """Drop the tombstones from the heap if they make up most of it. The mutex must be
+        held."""
+        if (
+            self.tombstones < COMPACT_MIN_TOMBSTONES
+            or self.tombstones <= len(self.queue) * COMPACT_TOMBSTONE_RATIO
+        ):
+            return
+        self.queue = [entry for entry in self.queue if entry[-1] is not self.REMOVED]
+        heapq.heapify(self.queue)
+        self.tombstones = 0
+        self.compactions += 1
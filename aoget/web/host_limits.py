@@ -0,0 +1,140 @@
+"""Per-host connection limits shared by all jobs. Some hosts throttle or refuse clients
+opening too many connections at once, so the connections to each host are counted across
+jobs and a download waits for a free one before connecting. The limits are configured by
+host pattern, each matching host gets the limit of its own."""
+
+import fnmatch
+import threading
+from web.circuit_breaker import host_of
+from web.retry_policy import sleep_unless_cancelled_async
+
+# how often waiting downloads look at the count of a host
+WAIT_POLL_SECONDS = 0.5
+
+
+class HostConnectionLimits:
+    """Counting semaphores of the hosts, created on first use. A download asking for several
+    connections takes as many as are free, at least one, and runs its segments on those:
+    it neither holds some while waiting for the rest nor waits while any is free."""
+
+    def __init__(self, limits: dict = None):
+        """Create the limits.
+        :param limits:
+            The maximum number of connections by host pattern, e.g. {"*archive.org": 6}. The
+            first pattern matching a host applies, hosts matching none are not limited"""
+        self.limits = dict(limits) if limits else {}
+        self.__active = {}
+        self.__condition = threading.Condition()
+
+    def limit_of(self, host: str) -> int:
+        """Get the connection limit of a host.
+        :return:
+            The limit of the first pattern matching the host, 0 if not limited"""
+        for pattern, limit in self.limits.items():
+            if fnmatch.fnmatch(host, pattern.lower()):
+                return limit
+        return 0
+
+    def cap(self, url: str, connections: int) -> int:
+        """Cap a number of connections to the limit of the host of the given URL.
+        :return:
+            The connections, at most the limit of the host if limited"""
+        limit = self.limit_of(host_of(url))
+        return min(connections, limit) if limit else connections
+
+    def try_acquire(self, url: str, connections: int = 1) -> int:
+        """Take free connections to the host of the given URL, without waiting.
+        :param connections:
+            The number of connections wanted, capped to the free ones of the host
+        :return:
+            The number of connections taken, to be released, 0 if none is free"""
+        host = host_of(url)
+        with self.__condition:
+            return self.__take(host, connections)
+
+    def acquire(
+        self, url: str, connections: int = 1, is_cancelled=None, on_event=None
+    ) -> int:
+        """Block until a connection to the host of the given URL is free and take as many of
+        the wanted ones as are free.
+        :param connections:
+            The number of connections wanted, capped to the free ones of the host
+        :param is_cancelled:
+            Callable telling whether the wait was cancelled, never cancelled if None
+        :param on_event:
+            Called with a description if it has to wait
+        :return:
+            The number of connections taken, to be released, 0 if cancelled while waiting"""
+        host = host_of(url)
+        waiting = False
+        with self.__condition:
+            while True:
+                taken = self.__take(host, connections)
+                if taken:
+                    return taken
+                if is_cancelled is not None and is_cancelled():
+                    return 0
+                if not waiting:
+                    waiting = True
+                    self.__wait_event(host, on_event)
+                self.__condition.wait(WAIT_POLL_SECONDS)
+
+    async def acquire_async(
+        self, url: str, connections: int = 1, is_cancelled=None, on_event=None
+    ) -> int:
+        """Wait on the event loop until a connection to the host of the given URL is free
+        and take as many of the wanted ones as are free, see acquire."""
+        waiting = False
+        while True:
+            taken = self.try_acquire(url, connections)
+            if taken:
+                return taken
+            if not waiting:
+                waiting = True
+                self.__wait_event(host_of(url), on_event)
+            if not await sleep_unless_cancelled_async(WAIT_POLL_SECONDS, is_cancelled):
+                return 0
+
+    def release(self, url: str, connections: int) -> None:
+        """Give back the connections taken to the host of the given URL."""
+        if connections <= 0:
+            return
+        host = host_of(url)
+        with self.__condition:
+            active = self.__active.get(host, 0) - connections
+            if active > 0:
+                self.__active[host] = active
+            else:
+                self.__active.pop(host, None)
+            self.__condition.notify_all()
+
+    def get_stats(self, hosts=None) -> dict:
+        """Get the connections in use to the hosts.
+        :param hosts:
+            The hosts to get, all hosts with connections in use if None
+        :return:
+            By host the connections in use and the limit, 0 if not limited"""
+        with self.__condition:
+            hosts = list(self.__active) if hosts is None else hosts
+            return {
+                host: {"active": self.__active.get(host, 0), "limit": self.limit_of(host)}
+                for host in hosts
+            }
+
+    def __take(self, host: str, connections: int) -> int:
+        """Take up to the given connections to a host, as many as are free. The condition
+        must be held."""
+        limit = self.limit_of(host)
+        active = self.__active.get(host, 0)
+        if limit:
+            connections = min(connections, limit - active)
+        if connections <= 0:
+            return 0
+        self.__active[host] = active + connections
+        return connections
+
+    def __wait_event(self, host: str, on_event) -> None:
+        if on_event is not None:
+            on_event(
+                f"Waiting for a connection to {host}, all {self.limit_of(host)} are in use."
+            )
@@ -0,0 +1,200 @@
+"""Deep integrity check of downloaded files: the contents of completed files are hashed and
+compared to the checksums recorded when they were downloaded."""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from web.checksum import (
+    CHECKSUM_ALGORITHMS,
+    StreamingChecksum,
+    parse_checksum,
+)
+
+logger = logging.getLogger(__name__)
+
+# large sequential reads, the check is bound by the disk
+INTEGRITY_CHECK_READ_SIZE = 4 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 4
+
+RESULT_PASSED = "passed"
+# no checksum was recorded at download time, the one computed now is recorded
+RESULT_RECORDED = "recorded"
+# size and modification time are the same as at the last successful check
+RESULT_UNCHANGED = "unchanged"
+RESULT_MISMATCH = "mismatch"
+RESULT_MISSING = "missing"
+RESULT_SIZE_MISMATCH = "size mismatch"
+RESULT_ERROR = "error"
+RESULT_CANCELLED = "cancelled"
+
+
+class IntegrityCheckResult:
+    """Outcome of the deep check of a single file."""
+
+    def __init__(
+        self,
+        file,
+        local_path: str,
+        result: str,
+        checksum: str = None,
+        size: int = None,
+        mtime_ns: int = None,
+        error: str = None,
+    ):
+        """Create a result.
+        :param file:
+            The FileModelDTO checked
+        :param local_path:
+            The path of the file checked
+        :param result:
+            One of the RESULT_ constants
+        :param checksum:
+            The checksum computed from the contents, if hashed
+        :param size:
+            The size of the file checked
+        :param mtime_ns:
+            The modification time of the file checked, in nanoseconds
+        :param error:
+            The description of the error, if any"""
+        self.file = file
+        self.local_path = local_path
+        self.result = result
+        self.checksum = checksum
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.error = error
+
+    def is_success(self) -> bool:
+        """Determine whether the file was found intact."""
+        return self.result in (RESULT_PASSED, RESULT_RECORDED, RESULT_UNCHANGED)
+
+
+class DeepIntegrityCheck:
+    """Hashes the contents of files in a bounded thread pool. Files are grouped by the storage
+    device they are on and each device is read by a single worker, in the order of the inode
+    numbers which roughly follows the on-disk layout, so that a disk reads sequentially
+    instead of seeking between files. Separate devices are read in parallel. hashlib releases
+    the GIL while hashing, so threads keep the cores busy without a process pool.
+    Files unchanged in size and modification time since their last successful check are
+    skipped, which also makes an interrupted check resume where it stopped, as long as the
+    results are recorded as they come."""
+
+    def __init__(
+        self,
+        algorithm: str = "sha256",
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        is_cancelled=None,
+    ):
+        """Create a deep integrity check.
+        :param algorithm:
+            One of the CHECKSUM_ALGORITHMS, used for files without a recorded checksum
+        :param max_workers:
+            The number of devices read in parallel
+        :param is_cancelled:
+            Callable telling whether the check was cancelled, polled between reads"""
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.max_workers = max(1, max_workers)
+        self.is_cancelled = is_cancelled if is_cancelled is not None else lambda: False
+        self.__lock = threading.Lock()
+
+    def run(self, files: list, on_result) -> dict:
+        """Check the given files, blocking until done or cancelled.
+        :param files:
+            (FileModelDTO, local path) tuples of completed files
+        :param on_result:
+            Called with an IntegrityCheckResult as each file is checked, from the worker
+            threads
+        :return:
+            The number of files per result"""
+        counts = {}
+
+        def report(result: IntegrityCheckResult) -> None:
+            with self.__lock:
+                counts[result.result] = counts.get(result.result, 0) + 1
+            on_result(result)
+
+        per_device = self.__plan(files, report)
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, max(1, len(per_device))),
+            thread_name_prefix="integrity-check",
+        ) as executor:
+            for device_files in per_device:
+                executor.submit(self.__check_device, device_files, report)
+        return counts
+
+    def __plan(self, files: list, report) -> list:
+        """Group the files by device, each group in inode order. Missing files are reported
+        right away.
+        :return:
+            A list of lists of (file, local path, stat) tuples"""
+        devices = {}
+        for file, local_path in files:
+            try:
+                stat = os.stat(local_path)
+            except FileNotFoundError:
+                report(IntegrityCheckResult(file, local_path, RESULT_MISSING))
+                continue
+            except OSError as e:
+                report(IntegrityCheckResult(file, local_path, RESULT_ERROR, error=str(e)))
+                continue
+            devices.setdefault(stat.st_dev, []).append((file, local_path, stat))
+        for device_files in devices.values():
+            device_files.sort(key=lambda entry: entry[2].st_ino)
+        return list(devices.values())
+
+    def __check_device(self, device_files: list, report) -> None:
+        for file, local_path, stat in device_files:
+            if self.is_cancelled():
+                report(IntegrityCheckResult(file, local_path, RESULT_CANCELLED))
+                continue
+            try:
+                report(self.__check_file(file, local_path, stat))
+            except Exception as e:
+                logger.error("Deep integrity check of %s failed", local_path, exc_info=e)
+                report(IntegrityCheckResult(file, local_path, RESULT_ERROR, error=str(e)))
+
+    def __check_file(
+        self, file, local_path: str, stat: os.stat_result
+    ) -> IntegrityCheckResult:
+        size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        if file.size_bytes is not None and file.size_bytes > -1 and file.size_bytes != size:
+            return IntegrityCheckResult(
+                file, local_path, RESULT_SIZE_MISMATCH, size=size, mtime_ns=mtime_ns
+            )
+        algorithm, expected_digest = parse_checksum(file.checksum)
+        if (
+            expected_digest is not None
+            and file.verified_size == size
+            and file.verified_mtime_ns == mtime_ns
+        ):
+            return IntegrityCheckResult(
+                file, local_path, RESULT_UNCHANGED, size=size, mtime_ns=mtime_ns
+            )
+        checksum = StreamingChecksum(algorithm or self.algorithm)
+        with open(local_path, "rb") as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while True:
+                if self.is_cancelled():
+                    return IntegrityCheckResult(file, local_path, RESULT_CANCELLED)
+                block = f.read(INTEGRITY_CHECK_READ_SIZE)
+                if not block:
+                    break
+                checksum.update(block)
+        if expected_digest is None:
+            result = RESULT_RECORDED
+        elif checksum.hexdigest() == expected_digest:
+            result = RESULT_PASSED
+        else:
+            result = RESULT_MISMATCH
+        return IntegrityCheckResult(
+            file,
+            local_path,
+            result,
+            checksum=checksum.checksum(),
+            size=size,
+            mtime_ns=mtime_ns,
+        )
@@ -1,6 +1,7 @@
 from scrapy.crawler import CrawlerProcess
 from web.aopage import AoPage
 from web.aospider import AoSpider
+from web.archive_org import fill_page_from_metadata
 from util.aogetutil import is_valid_url
 from crochet import setup, wait_for
 from config.log_config import setup_logging
@@ -46,9 +47,11 @@ class PageCrawler():
         return result
 
     def fetch_links(self) -> map:
-        """Fetch the links from the given page url.
+        """Fetch the links from the given page url. Items of archive.org are listed from their
+        metadata, with the sizes and checksums of the files, other pages are crawled.
         Returns a map of extensions to file lists."""
-        self.run_spider()
+        if not fill_page_from_metadata(self.url, self.ao_page):
+            self.run_spider()
         return self.ao_page.files_by_extension
 
     def __allowed_domains_of(page_url):
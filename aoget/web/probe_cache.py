@@ -0,0 +1,258 @@
+"""Per-URL metadata as learned from a single probe of the remote resource, and a cache of it so
+that the size resolver, the downloader and the resume path don't probe the same URL again. The
+cache may be kept on disk, so that a restart does not probe every file of every job again."""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# a persistent cache is written at most this often as it changes, and when closed
+SAVE_INTERVAL_SECONDS = 60
+
+
+class UrlMetadata:
+    """What a single probe (HEAD, or ranged GET as a fallback) tells about a remote file."""
+
+    def __init__(
+        self,
+        url: str,
+        content_length: int = 0,
+        accept_ranges: bool = False,
+        etag: str = None,
+        last_modified: str = None,
+        final_url: str = None,
+        timestamp: float = None,
+        status: int = 200,
+    ):
+        """Create the metadata of a URL.
+        :param url:
+            The URL that was probed
+        :param content_length:
+            Size of the remote file in bytes, 0 if unknown
+        :param accept_ranges:
+            Whether the server accepts byte range requests for the file
+        :param etag:
+            The ETag of the remote file, if any
+        :param last_modified:
+            The Last-Modified header of the remote file, if any
+        :param final_url:
+            The URL after following redirects, same as url if there were none
+        :param timestamp:
+            When the probe happened, defaults to now
+        :param status:
+            The HTTP status the probe was answered with"""
+        self.url = url
+        self.content_length = content_length
+        self.accept_ranges = accept_ranges
+        self.etag = etag
+        self.last_modified = last_modified
+        self.final_url = final_url if final_url else url
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.status = status
+
+    def is_cacheable(self) -> bool:
+        """Determine whether the probe succeeded and told the size of the file, only such
+        metadata is worth reusing.
+        :return:
+            True if the status is 2xx and the length is known, False otherwise"""
+        return 200 <= self.status < 300 and self.content_length > 0
+
+    def validator(self) -> str:
+        """Get the validator to use in If-Range headers: the ETag if known, Last-Modified
+        otherwise.
+        :return:
+            The validator or None if neither is known"""
+        return self.etag if self.etag else self.last_modified
+
+    def is_expired(self, ttl_seconds: float) -> bool:
+        """Determine whether the metadata is older than the given time-to-live.
+        :param ttl_seconds:
+            The time-to-live in seconds
+        :return:
+            True if expired, False otherwise"""
+        return time.time() - self.timestamp > ttl_seconds
+
+    def to_dict(self) -> dict:
+        """Get the metadata as a JSON serializable dict."""
+        return {
+            "url": self.url,
+            "content_length": self.content_length,
+            "accept_ranges": self.accept_ranges,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "final_url": self.final_url,
+            "timestamp": self.timestamp,
+        }
+
+    @staticmethod
+    def from_dict(entry: dict) -> "UrlMetadata":
+        """Create the metadata from a dict created by to_dict."""
+        return UrlMetadata(
+            entry["url"],
+            content_length=entry.get("content_length", 0),
+            accept_ranges=entry.get("accept_ranges", False),
+            etag=entry.get("etag"),
+            last_modified=entry.get("last_modified"),
+            final_url=entry.get("final_url"),
+            timestamp=entry.get("timestamp", 0),
+        )
+
+    def __str__(self):
+        return (
+            f"UrlMetadata(url={self.url}, content_length={self.content_length}, "
+            f"accept_ranges={self.accept_ranges}, etag={self.etag}, "
+            f"last_modified={self.last_modified}, final_url={self.final_url})"
+        )
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ProbeCache:
+    """A thread-safe cache of URL metadata with time-based expiry, bounded to the most
+    recently used URLs. Kept in memory, and also on disk if given a path: a background
+    thread saves the changes periodically, so that the downloads never wait for the file."""
+
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = None, path: str = None):
+        """Create a probe cache.
+        :param ttl_seconds:
+            How long a probe result is considered valid. Defaults to 10 minutes.
+        :param max_entries:
+            The number of URLs kept, the least recently used ones are evicted beyond it.
+            Defaults to None, which keeps all.
+        :param path:
+            The JSON file the cache is loaded from and saved to. Defaults to None, which
+            keeps the cache in memory only."""
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__save_lock = threading.Lock()
+        self.__entries = OrderedDict()  # type: OrderedDict[str, UrlMetadata]
+        self.__dirty = False
+        self.__stopped = threading.Event()
+        self.__saver = None
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            self.__load()
+
+    def get(self, url: str) -> UrlMetadata:
+        """Get the cached metadata of the URL.
+        :param url:
+            The URL
+        :return:
+            The metadata or None if not cached or expired"""
+        with self.__lock:
+            metadata = self.__entries.get(url)
+            if metadata is not None and metadata.is_expired(self.ttl_seconds):
+                del self.__entries[url]
+                self.__dirty = True
+                metadata = None
+            if metadata is None:
+                self.misses += 1
+            else:
+                self.__entries.move_to_end(url)
+                self.hits += 1
+            return metadata
+
+    def put(self, metadata: UrlMetadata) -> None:
+        """Cache the metadata of a URL. Failed probes and probes of unknown length are not
+        cached, they would be served instead of probing again.
+        :param metadata:
+            The metadata to cache"""
+        if not metadata.is_cacheable():
+            logger.debug("Not caching the probe of %s: %s", metadata.url, metadata)
+            return
+        with self.__lock:
+            self.__entries[metadata.url] = metadata
+            self.__entries.move_to_end(metadata.url)
+            self.__evict()
+            self.__dirty = True
+            self.__start_saver()
+
+    def invalidate(self, url: str) -> None:
+        """Drop the cached metadata of the URL, if any.
+        :param url:
+            The URL"""
+        with self.__lock:
+            if self.__entries.pop(url, None) is not None:
+                self.__dirty = True
+
+    def save(self) -> None:
+        """Write the cache to its file if it changed since the last save. Does nothing for a
+        cache kept in memory only."""
+        if self.path is None:
+            return
+        with self.__save_lock:
+            with self.__lock:
+                if not self.__dirty:
+                    return
+                entries = [metadata.to_dict() for metadata in self.__entries.values()]
+                self.__dirty = False
+            # written aside and swapped in, a crash while writing leaves the old file
+            temp_path = self.path + ".tmp"
+            try:
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning("Could not save the URL metadata cache to %s: %s", self.path, e)
+                with self.__lock:
+                    self.__dirty = True
+
+    def close(self) -> None:
+        """Stop the background saves and save the cache a last time."""
+        with self.__lock:
+            saver = self.__saver
+            self.__saver = None
+        self.__stopped.set()
+        if saver is not None:
+            saver.join(SAVE_INTERVAL_SECONDS)
+        self.save()
+
+    def __start_saver(self) -> None:
+        """Start the thread saving a persistent cache if not running. Lock must be held."""
+        if self.path is None or self.__saver is not None or self.__stopped.is_set():
+            return
+        self.__saver = threading.Thread(
+            target=self.__save_periodically, name="probe-cache-saver", daemon=True
+        )
+        self.__saver.start()
+
+    def __save_periodically(self) -> None:
+        while not self.__stopped.wait(SAVE_INTERVAL_SECONDS):
+            self.save()
+
+    def __load(self) -> None:
+        """Load the unexpired entries of the cache file, in least recently used order."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for entry in entries:
+                metadata = UrlMetadata.from_dict(entry)
+                if not metadata.is_expired(self.ttl_seconds):
+                    self.__entries[metadata.url] = metadata
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # only a cache, start over
+            logger.warning("Could not load the URL metadata cache from %s: %s", self.path, e)
+            self.__entries.clear()
+        self.__evict()
+        logger.info("Loaded %d URLs to the URL metadata cache.", len(self.__entries))
+
+    def __evict(self) -> None:
+        if self.max_entries is None:
+            return
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return len(self.__entries)
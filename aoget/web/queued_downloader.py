@@ -1,22 +1,67 @@
 """A queue for downloading files in a job. """
 
+import asyncio
 import time
 import os
 import logging
+import queue
 import threading
 from model.job import Job
 from model.dto.job_dto import JobDTO
-from web.downloader import download_file, DownloadSignals, resolve_remote_file_size
+from web.downloader import (
+    download_file,
+    download_range,
+    DownloadSignals,
+    resolve_remote_file_size,
+    written_size,
+)
+from web import async_downloader
+from web.async_downloader import AsyncDownloadEngine
 from web.file_queue import FileQueue
+from web.checksum import StreamingChecksum, parse_checksum
+from web.integrity_checker import (
+    DeepIntegrityCheck,
+    IntegrityCheckResult,
+    RESULT_CANCELLED,
+    RESULT_MISMATCH,
+    RESULT_RECORDED,
+    RESULT_UNCHANGED,
+    RESULT_ERROR,
+)
+from web.session_pool import SessionPool
+from web.stall_watchdog import StallWatchdog
+from web.retry_policy import RetryPolicy
+from web.circuit_breaker import HostCircuitBreakers, host_of
+from web.host_limits import HostConnectionLimits
+from web.size_resolver import SizeResolver
+from web.download_scheduler import DownloadScheduler
+from web.tail_hedge import (
+    TailHedge,
+    HEDGE_POLL_SECONDS,
+    MIN_HEDGED_BYTES,
+    MIN_RUNNING_SECONDS,
+)
+from web.probe_cache import ProbeCache
+from web.rate_limiter import RateLimiter
+from web.chunk_sizer import AdaptiveChunkSizer
+from web.disk_writer import DiskWriterPool
 from model.dto.file_model_dto import FileModelDTO
 from model.file_model import FileModel
 from controller.journal_daemon import JournalDaemon
-from util.aogetutil import human_duration
+from util.aogetutil import human_duration, human_filesize, wait_for_all
 from util.disk_util import get_local_file_size
+from util.indexed_set import IndexedSet
 
 logger = logging.getLogger(__name__)
 
 SIZE_RESOLVER_ATTEMPTS = 10
+# the number of files next in the queue the size resolver puts ahead of the others
+SIZE_RESOLVER_LOOKAHEAD = 200
+# how long stopping active downloads synchronously waits for all of them together
+STOP_WAIT_SECONDS = 2
+# how long a job sits out the global scheduling when the host of its next file has no free
+# connection, unless one of its own downloads ends or files are queued earlier
+HOST_FULL_RETRY_SECONDS = 0.5
 
 
 class FileProgressSignals(DownloadSignals):
@@ -34,18 +79,41 @@ class FileProgressSignals(DownloadSignals):
         self.filename = filename
         self.monitor = monitor
         self.status_listeners = {}
-        self.rate_limit_bps = 0
         self.cancelled = False
+        self.progress_counter = monitor.register_progress_counter(jobname, filename)
+        # (monotonic time, written) of the first progress update, the rate is measured from it
+        self.first_progress = None
 
     def on_update_progress(self, written: int, total: int) -> None:
-        """Report progress to the monitor daemon.
+        """Report progress to the monitor daemon. Called for every chunk, so it only updates
+        the progress counter of the file, which the daemon harvests once per tick.
         :param written:
             The number of bytes written
         :param total:
             The total number of bytes to write"""
-        self.monitor.update_download_progress(
-            self.jobname, self.filename, written, total
-        )
+        if self.first_progress is None:
+            self.first_progress = (time.monotonic(), written)
+        self.progress_counter.update(written, total)
+
+    def remaining_seconds(self, now: float) -> float:
+        """Estimate the time the download needs to complete at its average rate so far.
+        :param now:
+            The current monotonic time
+        :return:
+            The estimate, None if the progress or the size is not known yet"""
+        progress = self.progress_counter.value
+        if self.first_progress is None or progress is None or progress[1] <= 0:
+            return None
+        started, first_written = self.first_progress
+        written, total = progress
+        if now <= started:
+            return None
+        rate = (written - first_written) / (now - started)
+        return (total - written) / rate if rate > 0 else float("inf")
+
+    def close(self) -> None:
+        """Flush the last progress to the monitor daemon and stop reporting progress."""
+        self.monitor.unregister_progress_counter(self.jobname, self.filename)
 
     def on_update_status(self, status: str, err: str = None) -> None:
         """Report status to the monitor daemon.
@@ -84,6 +152,21 @@ class QueuedDownloader:
         journal_daemon: JournalDaemon,  # Blank monitor suppresses progress reporting
         worker_pool_size: int = 3,
         download_retry_attempts: int = 5,
+        segments_per_file: int = 1,
+        session_pool: SessionPool = None,
+        probe_cache: ProbeCache = None,
+        rate_limiter: RateLimiter = None,
+        disk_writers: DiskWriterPool = None,
+        engine: AsyncDownloadEngine = None,
+        preallocate_files: bool = False,
+        checksum_algorithm: str = None,
+        stall_watchdog: StallWatchdog = None,
+        max_hedges: int = 0,
+        retry_policy: RetryPolicy = None,
+        circuit_breakers: HostCircuitBreakers = None,
+        size_resolver_threads: int = 8,
+        scheduler: DownloadScheduler = None,
+        host_limits: HostConnectionLimits = None,
     ):
         """Create a download queue for a job.
         :param job:
@@ -92,21 +175,107 @@ class QueuedDownloader:
             The journal daemon picking up progress updates. Defaults to a blank instance that
             suppresses progress reporting.
         :param worker_pool_size:
-            The number of workers to use for downloading files. Defaults to 3."""
+            The number of workers to use for downloading files. Defaults to 3.
+        :param segments_per_file:
+            The number of parallel byte range requests per file. Defaults to 1.
+        :param session_pool:
+            The keep-alive HTTP sessions shared with other jobs. Defaults to a private pool
+            sized to the worker pool.
+        :param probe_cache:
+            The cache of URL probes shared by the size resolver and the downloads. Defaults to
+            a private cache.
+        :param rate_limiter:
+            The global bandwidth limiter, parent of the limiter of the job. Defaults to no
+            global limit.
+        :param disk_writers:
+            The write-behind disk writers shared with other jobs. Defaults to a private pool.
+        :param engine:
+            The asyncio engine to run the workers on as coroutines. Defaults to None, which
+            runs a thread per worker.
+        :param preallocate_files:
+            Whether to reserve the disk space of files of known size before downloading.
+            Defaults to False.
+        :param checksum_algorithm:
+            The algorithm of the checksums computed while downloading, one of
+            CHECKSUM_ALGORITHMS. Defaults to None, which computes no checksums.
+        :param stall_watchdog:
+            The watchdog recycling the connections of stalled downloads, shared with other
+            jobs. Defaults to None, which does not watch the downloads.
+        :param max_hedges:
+            The number of downloads hedged at once when the queue is empty: idle workers
+            race the tail of the slowest downloads on a second connection. Only single
+            connection downloads of the threaded engine are hedged. Defaults to 0, which
+            does not hedge.
+        :param retry_policy:
+            The delays between the attempts of the downloads and the size resolver. Defaults
+            to exponential backoff with jitter.
+        :param circuit_breakers:
+            The breakers pausing the downloads from failing hosts, shared with other jobs.
+            Defaults to private breakers.
+        :param size_resolver_threads:
+            The number of file sizes resolved at once. Defaults to 8.
+        :param scheduler:
+            The global scheduler downloading the files of all jobs on a shared worker pool,
+            the worker pool size is then the weight of the job instead of its own threads.
+            Not used with the asyncio engine. Defaults to None, which runs the workers of
+            the job.
+        :param host_limits:
+            The connection limits of the hosts, shared with other jobs. Defaults to private
+            limits without any limit."""
         self.job = job
         self.journal_daemon = journal_daemon
         self.worker_pool_size = worker_pool_size
         self.download_retry_attempts = download_retry_attempts
+        self.segments_per_file = segments_per_file
+        self.session_pool = (
+            session_pool if session_pool is not None else SessionPool(worker_pool_size)
+        )
+        self.probe_cache = probe_cache if probe_cache is not None else ProbeCache()
+        self.rate_limiter = RateLimiter(parent=rate_limiter)
+        self.rate_limiter.set_rate_limit(job.rate_limit_bps or 0)
+        self.file_rate_limiters = {}
+        self.disk_writers = (
+            disk_writers if disk_writers is not None else DiskWriterPool()
+        )
+        # of the current or last download of each file
+        self.chunk_sizers = {}
+        self.engine = engine
+        self.preallocate_files = preallocate_files
+        self.checksum_algorithm = checksum_algorithm
+        self.stall_watchdog = stall_watchdog
+        self.max_hedges = max_hedges
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.circuit_breakers = (
+            circuit_breakers if circuit_breakers is not None else HostCircuitBreakers()
+        )
+        self.size_resolver_threads = size_resolver_threads
+        self.scheduler = scheduler if engine is None else None
+        self.host_limits = host_limits if host_limits is not None else HostConnectionLimits()
+        # until when the host of the next file is taken to have no free connection
+        self.host_full_until = 0.0
+        # of the hedged downloads by filename, until the hedged download ends
+        self.hedges = {}
+        self.hedge_lock = threading.Lock()
+        self.hedge_stats = {"hedges": 0, "won": 0, "saved_bytes": 0, "wasted_bytes": 0}
+        # of the files being downloaded by filename
+        self.active_files = {}
+        # of the files not completed yet, kept between stops so resumes continue hashing
+        self.checksums = {}
         self.queue = FileQueue()
+        # the loop of the asyncio workers and the event waking them when files are queued,
+        # they cannot block on the queue without blocking the loop
+        self.async_wakeup = None
         self.threads = []
         self.signals = {}
-        self.files_in_queue = []
-        self.files_downloading = []
+        # names of the files, indexed so that jobs of 100k+ files are not scanned per file
+        self.files_in_queue = IndexedSet()
+        self.files_downloading = IndexedSet()
         self.size_resolver_lock = threading.RLock()
         self.is_resolver_running = False
         self.is_resolved_all_file_sizes = False
         self.size_resolver_cancelled = False
         self.resolved_file_sizes = {}
+        self.size_resolver = None
         self.download_thread_lock = threading.Lock()
         self.are_download_threads_running = False
         self.active_thread_count = 0
@@ -148,6 +317,8 @@ class QueuedDownloader:
             The file to download"""
         self.files_in_queue.append(file.name)
         self.queue.put_file(file)
+        self.__notify_workers()
+        self.__prioritize_size_resolver()
         self.journal_daemon.update_file_status(
             self.job.name, file.name, FileModel.STATUS_QUEUED
         )
@@ -158,27 +329,32 @@ class QueuedDownloader:
             The files to download"""
         self.files_in_queue.extend([file.name for file in files])
         self.queue.put_all(files)
+        self.__notify_workers()
+        self.__prioritize_size_resolver()
         logger.info(f"Added {len(files)} files to the queue for job {self.job.name}")
 
     def dequeue_files(self, files: list) -> None:
         """Dequeue the given files.
         :param files:
             The files to dequeue"""
-        for file in files:
-            if file.name in self.files_in_queue:
-                self.files_in_queue.remove(file.name)
+        self.files_in_queue.discard_all(file.name for file in files)
         self.queue.remove_all(files)
+        self.__prioritize_size_resolver()
 
-    def stop_active_downloads(self, files: list, sync: bool = False) -> None:
-        """Stop the active downloads of the given files.
+    def stop_active_downloads(
+        self, files: list, sync: bool = False, timeout: float = STOP_WAIT_SECONDS
+    ) -> list:
+        """Stop the active downloads of the given files. Cancelling aborts the connections,
+        so the downloads stop at once even if stalled.
         :param files:
             The files to stop
         :param sync:
-            Whether to wait for the downloads to stop.
-            Timeout is 2 seconds. Defaults to False.
-        """
-        if sync:
-            events = {}
+            Whether to wait for the downloads to stop. Defaults to False.
+        :param timeout:
+            The seconds to wait for all the downloads together if sync
+        :return:
+            The names of the files not stopped by the deadline, empty if not sync"""
+        events = {}
         for file in files:
             if file.name in self.files_downloading:
                 if sync:
@@ -187,16 +363,24 @@ class QueuedDownloader:
                         event, FileModel.STATUS_STOPPED
                     )
                 self.signals[file.name].cancel(shutdown=False)
-        if sync:
-            for event in events.values():
-                event.wait(2)
+        if not sync:
+            return []
+        pending = set(wait_for_all(events.values(), timeout))
+        not_stopped = [name for name, event in events.items() if event in pending]
+        if not_stopped:
+            logger.warning(
+                "%d download(s) of %s did not stop in %s seconds.",
+                len(not_stopped),
+                self.job.name,
+                timeout,
+            )
+        return not_stopped
 
     def cancel_download(self, filename: str) -> None:
         """Cancel the download of the given file.
         :param filename:
             The name of the file to cancel"""
-        if filename in self.files_in_queue:
-            self.files_in_queue.remove(filename)
+        self.files_in_queue.discard(filename)
 
     def register_listener(self, event, filename: str, status: str) -> None:
         """Register a listener for a file status update.
@@ -236,25 +420,134 @@ class QueuedDownloader:
             The file to update the priority for"""
         if file.name in self.files_in_queue:
             self.queue.put_file(file)
+            self.__notify_workers()
+            self.__prioritize_size_resolver()
+
+    def set_job_rate_limit(self, rate_limit_bps: int) -> None:
+        """Set the bandwidth limit of the job.
+        :param rate_limit_bps:
+            The limit in bytes per second, 0 for unlimited"""
+        self.rate_limiter.set_rate_limit(rate_limit_bps)
+
+    def update_rate_limit(self, file: FileModelDTO) -> None:
+        """Apply the bandwidth limit of the given file if it is being downloaded, otherwise
+        it will be applied when the download starts.
+        :param file:
+            The file to update the limit for"""
+        limiter = self.file_rate_limiters.get(file.name)
+        if limiter is not None:
+            limiter.set_rate_limit(file.rate_limit_bps or 0)
+
+    def get_chunk_stats(self, filename: str) -> dict:
+        """Get the read chunk statistics of the current or last download of the given file.
+        :param filename:
+            The name of the file
+        :return:
+            The statistics as per AdaptiveChunkSizer.stats, None if the file was not
+            downloaded by this downloader"""
+        chunk_sizer = self.chunk_sizers.get(filename)
+        return chunk_sizer.stats() if chunk_sizer is not None else None
+
+    def has_queued_files(self) -> bool:
+        """Determine whether there are files in the queue waiting for a worker.
+        :return:
+            True if there is at least one file queued and its host was not found at its
+            connection limit lately, False otherwise"""
+        return self.queue.qsize() > 0 and time.monotonic() >= self.host_full_until
+
+    def download_next(self) -> bool:
+        """Download the next file of the queue on the calling thread, a worker of the global
+        scheduler. A connection to the host of the file is taken first without waiting, a
+        worker never sits on its slot waiting for a host: if the host is at its limit, the
+        file stays queued and the job sits out the scheduling for a while.
+        :return:
+            True if a file was downloaded, False if there was none to download"""
+        next_files = self.queue.peek_files(1)
+        connections = 0
+        if next_files:
+            connections = self.host_limits.try_acquire(next_files[0].url)
+            if not connections:
+                self.host_full_until = time.monotonic() + HOST_FULL_RETRY_SECONDS
+                return False
+        try:
+            file_to_download = self.queue.pop_file(block=False)
+        except queue.Empty:
+            file_to_download = None
+        if connections and (
+            file_to_download is None
+            or FileQueue.is_poison_pill(file_to_download)
+            or host_of(file_to_download.url) != host_of(next_files[0].url)
+        ):
+            # another worker took the file meanwhile, a different one is waited for as usual
+            self.host_limits.release(next_files[0].url, connections)
+            connections = 0
+        if file_to_download is None:
+            return False
+        if FileQueue.is_poison_pill(file_to_download):
+            self.queue.task_done()
+            return False
+        if not self.__take_from_queue(file_to_download):
+            self.host_limits.release(file_to_download.url, connections)
+            return False
+        self.__download(file_to_download, connections)
+        return True
+
+    def hedge_idle(self) -> None:
+        """Race the tail of the slowest download of the job on the calling thread, an idle
+        worker of the global scheduler, if the job hedges."""
+        if self.__idle_timeout() is not None:
+            self.__hedge_tail()
+
+    def __notify_workers(self) -> None:
+        """Let the global scheduler or the idle asyncio workers know that the job has files
+        to download."""
+        self.host_full_until = 0.0
+        if self.scheduler is not None:
+            self.scheduler.notify()
+        wakeup = self.async_wakeup
+        if wakeup is not None:
+            loop, event = wakeup
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # the engine was stopped, its workers with it
 
     def __start_workers(self):
-        """Start the workers as per the worker pool size."""
+        """Start the workers as per the worker pool size, or have the global scheduler
+        download the files if there is one."""
+        if self.scheduler is not None:
+            self.scheduler.register(self)
+            return
         for i in range(self.worker_pool_size):
-            t = threading.Thread(
-                target=self.__download_worker,
-                name=f"download-{self.job.name}-{i}-",
-                daemon=True,
-            )
-            t.start()
-            self.threads.insert(i, t)
+            self.threads.insert(i, self.__start_worker(i))
+
+    def __start_worker(self, index: int):
+        """Start a worker, a thread or a coroutine on the asyncio engine if there is one.
+        :return:
+            The thread or the future of the coroutine"""
+        if self.engine is not None:
+            return self.engine.submit(self.__async_download_worker())
+        t = threading.Thread(
+            target=self.__download_worker,
+            name=f"download-{self.job.name}-{index}-",
+            daemon=True,
+        )
+        t.start()
+        return t
 
     def __stop_workers(self, sync=False) -> None:
         """Stop the workers by putting None (poison pill) on the queue and joining the threads"""
+        if self.scheduler is not None:
+            self.scheduler.unregister(self, sync=sync)
         for i in enumerate(self.threads):
             self.queue.poison_pill()
+        self.__notify_workers()
         if sync:
             for t in self.threads:
-                t.join()
+                if isinstance(t, threading.Thread):
+                    t.join()
+                else:
+                    t.result()
         with self.download_thread_lock:
             self.are_download_threads_running = False
 
@@ -262,40 +555,261 @@ class QueuedDownloader:
         """The worker thread that downloads files from the queue."""
         while True:
             try:
-                file_to_download = self.queue.pop_file()
+                try:
+                    file_to_download = self.queue.pop_file(timeout=self.__idle_timeout())
+                except queue.Empty:
+                    self.__hedge_tail()
+                    continue
                 if FileQueue.is_poison_pill(file_to_download):
                     logger.debug("Worker received poison pill, stopping.")
                     return
-                logger.debug("Worker took file: %s", file_to_download.name)
-                if file_to_download.name not in self.files_in_queue:
-                    logger.debug(
-                        "File was cancelled before download started, not doing anything."
-                    )
-                    self.queue.task_done()
+                if not self.__take_from_queue(file_to_download):
                     continue
-                self.files_in_queue.remove(file_to_download.name)
-                self.files_downloading.append(file_to_download.name)
+                self.__download(file_to_download)
+
+            except Exception as e:
+                # This is a catch-all exception handler to prevent the worker from dying
+                logger.error("Unexpected error in worker: %s", e)
+                logger.exception(e)
 
-                with self.download_thread_lock:
-                    self.active_thread_count += 1
+    async def __async_download_worker(self):
+        """The worker coroutine that downloads files from the queue on the asyncio engine."""
+        while True:
+            try:
+                try:
+                    file_to_download = self.queue.pop_file(block=False)
+                except queue.Empty:
+                    await self.__wait_queued_async()
+                    continue
+                if FileQueue.is_poison_pill(file_to_download):
+                    logger.debug("Worker received poison pill, stopping.")
+                    return
+                if not self.__take_from_queue(file_to_download):
+                    continue
                 try:
-                    self.__start_download(file_to_download)
+                    await self.__start_download_async(file_to_download)
                 except Exception as e:
-                    logger.error("Worker failed with file: %s", file_to_download.name)
-                    logging.exception(e)
-                    self.__post_download(
-                        file_to_download, new_status=FileModel.STATUS_FAILED, err=str(e)
-                    )
-                with self.download_thread_lock:
-                    self.active_thread_count -= 1
-                self.files_downloading.remove(file_to_download.name)
-                self.queue.task_done()
+                    self.__fail_download(file_to_download, e)
+                self.__release_download(file_to_download)
 
             except Exception as e:
                 # This is a catch-all exception handler to prevent the worker from dying
                 logger.error("Unexpected error in worker: %s", e)
                 logger.exception(e)
 
+    async def __wait_queued_async(self) -> None:
+        """Wait on the engine loop until files are queued, or a poison pill."""
+        loop = asyncio.get_running_loop()
+        wakeup = self.async_wakeup
+        if wakeup is None or wakeup[0] is not loop:
+            wakeup = self.async_wakeup = (loop, asyncio.Event())
+        event = wakeup[1]
+        event.clear()
+        # a file queued before the clear would not set the event again; one queued after
+        # it sets the event in a callback that runs after this check
+        if self.queue.qsize() > 0:
+            return
+        await event.wait()
+
+    def __take_from_queue(self, file_to_download: FileModelDTO) -> bool:
+        """Move a file popped from the queue to the downloading ones.
+        :return:
+            False if the file was cancelled while in the queue, True otherwise"""
+        logger.debug("Worker took file: %s", file_to_download.name)
+        if not self.files_in_queue.discard(file_to_download.name):
+            logger.debug(
+                "File was cancelled before download started, not doing anything."
+            )
+            self.queue.task_done()
+            return False
+        self.files_downloading.append(file_to_download.name)
+        self.active_files[file_to_download.name] = file_to_download
+        with self.download_thread_lock:
+            self.active_thread_count += 1
+        self.__prioritize_size_resolver()
+        return True
+
+    def __download(self, file_to_download: FileModelDTO, connections_held: int = 0) -> None:
+        """Download a file taken from the queue on the calling thread.
+        :param connections_held:
+            Connections to the host of the file already taken, released by the download"""
+        try:
+            self.__start_download(file_to_download, connections_held)
+        except Exception as e:
+            self.__fail_download(file_to_download, e)
+        self.__release_download(file_to_download)
+        if self.host_full_until:
+            # a connection to the host the job may be waiting for was just released
+            self.__notify_workers()
+
+    def __fail_download(self, file_to_download: FileModelDTO, e: Exception) -> None:
+        """Mark a download failed when the worker ran into an error with it."""
+        logger.error("Worker failed with file: %s", file_to_download.name)
+        logging.exception(e)
+        self.__post_download(
+            file_to_download, new_status=FileModel.STATUS_FAILED, err=str(e)
+        )
+
+    def __release_download(self, file_to_download: FileModelDTO) -> None:
+        """Remove a file from the downloading ones after its download ended."""
+        with self.download_thread_lock:
+            self.active_thread_count -= 1
+        self.active_files.pop(file_to_download.name, None)
+        self.files_downloading.discard(file_to_download.name)
+        self.queue.task_done()
+
+    def __idle_timeout(self) -> float:
+        """Get how long an idle worker waits for the queue before it looks for a download to
+        hedge, None to wait for the queue only."""
+        if self.max_hedges > 0 and self.segments_per_file == 1:
+            return HEDGE_POLL_SECONDS
+        return None
+
+    def __hedge_tail(self) -> None:
+        """Race the tail of the slowest download on a second connection, if there is one
+        worth hedging. Runs on the idle worker until the race is decided."""
+        picked = self.__pick_hedge()
+        if picked is None:
+            return
+        hedge, file, signals = picked
+        hedge.discard()  # of an earlier hedge, from another offset
+        logger.info(
+            "Hedging %s of %s from %d.", file.name, self.job.name, hedge.offset
+        )
+        self.journal_daemon.add_file_event(
+            self.job.name,
+            file.name,
+            f"Hedging the last {human_filesize(hedge.total - hedge.offset)} "
+            "on a second connection.",
+        )
+        try:
+            result = download_range(
+                file.url,
+                hedge.part_path,
+                hedge.byte_range(),
+                hedge.signals,
+                session=self.session_pool.session_for(file.url),
+                rate_limiter=self.rate_limiter,
+                disk_writers=self.disk_writers,
+            )
+        except Exception as e:
+            logger.warning("Hedge of %s failed: %s", file.name, e)
+            result = FileModel.STATUS_FAILED
+        finally:
+            self.host_limits.release(file.url, 1)
+        if result == FileModel.STATUS_COMPLETED and hedge.claim():
+            # stop the hedged download, its worker splices the hedge into the file
+            signals.cancel()
+            return
+        wasted = hedge.downloaded_bytes()
+        hedge.discard()
+        self.__record_hedge(file.name, won=False, saved=0, wasted=wasted)
+
+    def __pick_hedge(self) -> tuple:
+        """Pick the download expected to finish last and register a hedge for it.
+        :return:
+            The hedge, the file and the signals of its download, None if no download is
+            worth hedging or the job hedges as many as it may"""
+        now = time.monotonic()
+        with self.hedge_lock:
+            if len(self.hedges) >= self.max_hedges:
+                return None
+            slowest, slowest_remaining = None, 0
+            for name, file in list(self.active_files.items()):
+                signals = self.signals.get(name)
+                if name in self.hedges or signals is None or signals.cancelled:
+                    continue
+                progress = signals.progress_counter.value
+                if (
+                    progress is None
+                    or progress[1] - progress[0] < MIN_HEDGED_BYTES
+                    or now - signals.first_progress[0] < MIN_RUNNING_SECONDS
+                ):
+                    continue
+                remaining = signals.remaining_seconds(now)
+                if remaining is not None and remaining > slowest_remaining:
+                    slowest, slowest_remaining = (file, signals, progress), remaining
+            if slowest is None:
+                return None
+            file, signals, (written, total) = slowest
+            # a hedge does not wait for a connection, its host may be at its limit
+            if not self.host_limits.try_acquire(file.url):
+                return None
+            hedge = TailHedge(file.name, self.__target_path_of_file(file), written, total)
+            self.hedges[file.name] = hedge
+            self.hedge_stats["hedges"] += 1
+        return hedge, file, signals
+
+    def __settle_hedge(
+        self, file_to_download: FileModelDTO, signals, result_state: str
+    ) -> str:
+        """Decide the race of a download with its hedge, if hedged, once the download ended.
+        A hedge that won is spliced into the file, one that lost is cancelled.
+        :return:
+            The result of the download, completed if the hedge won"""
+        with self.hedge_lock:
+            hedge = self.hedges.pop(file_to_download.name, None)
+        if hedge is None:
+            return result_state
+        if not hedge.settle():
+            hedge.cancel()
+            return result_state
+        if result_state == FileModel.STATUS_COMPLETED:
+            # both made it, the download was first to write the file
+            hedge.discard()
+            self.__record_hedge(
+                hedge.filename, won=False, saved=0, wasted=hedge.total - hedge.offset
+            )
+            return result_state
+        written = max(written_size(hedge.local_path), hedge.offset)
+        try:
+            hedge.splice()
+        except Exception as e:
+            logger.warning("Could not splice the hedge of %s: %s", hedge.filename, e)
+            hedge.discard()
+            return result_state
+        checksum = self.checksums.get(hedge.filename)
+        if checksum is not None:
+            checksum.resume_at(hedge.local_path, hedge.total)
+        signals.on_update_progress(hedge.total, hedge.total)
+        self.__record_hedge(
+            hedge.filename,
+            won=True,
+            saved=hedge.total - written,
+            wasted=written - hedge.offset,
+        )
+        return FileModel.STATUS_COMPLETED
+
+    def __record_hedge(self, filename: str, won: bool, saved: int, wasted: int) -> None:
+        """Account for the bandwidth a decided hedge saved or wasted."""
+        with self.hedge_lock:
+            self.hedge_stats["won"] += 1 if won else 0
+            self.hedge_stats["saved_bytes"] += saved
+            self.hedge_stats["wasted_bytes"] += wasted
+            stats = dict(self.hedge_stats)
+        if won:
+            event = (
+                f"Hedge won, saved {human_filesize(saved)}, "
+                f"duplicated {human_filesize(wasted)}."
+            )
+        else:
+            event = f"Hedge lost, duplicated {human_filesize(wasted)}."
+        self.journal_daemon.add_file_event(self.job.name, filename, event)
+        logger.info("Hedge of %s decided, hedge stats of %s: %s", filename, self.job.name, stats)
+
+    def get_hedge_stats(self) -> dict:
+        """Get the statistics of the hedges of the job: the number of hedges started and
+        won, the bytes hedges saved by winning and the bytes downloaded twice."""
+        with self.hedge_lock:
+            return dict(self.hedge_stats)
+
+    def get_host_connection_stats(self) -> dict:
+        """Get the connections in use to the hosts the job is downloading from, by all jobs.
+        :return:
+            By host the connections in use and the limit of the host, 0 if not limited"""
+        hosts = {host_of(file.url) for file in list(self.active_files.values())}
+        return self.host_limits.get_stats(sorted(hosts))
+
     def get_active_thread_count(self) -> int:
         """Get the number of active threads.
         :return:
@@ -304,50 +818,150 @@ class QueuedDownloader:
             return self.active_thread_count
 
     def add_thread(self) -> None:
-        """Add a thread to the worker pool."""
+        """Add a thread to the worker pool, or raise the weight of the job with the global
+        scheduler."""
         self.worker_pool_size += 1
-        t = threading.Thread(
-            target=self.__download_worker,
-            name=f"download-{self.job.name}-{len(self.threads)}-",
-            daemon=True,
-        )
-        t.start()
-        self.threads.append(t)
+        if self.scheduler is not None:
+            self.scheduler.notify()
+            return
+        self.threads.append(self.__start_worker(len(self.threads)))
 
     def remove_thread(self) -> None:
-        """Kill a thread from the worker pool."""
+        """Kill a thread from the worker pool, or lower the weight of the job with the
+        global scheduler."""
         if self.worker_pool_size <= 0:
             return
         self.worker_pool_size -= 1
-        if len(self.threads) > 1:
+        if self.scheduler is None and len(self.threads) > 1:
             self.queue.poison_pill()
+            self.__notify_workers()
 
-    def set_rate_limit(self, rate_limit_bps: int) -> None:
-        """Set the rate limit for the downloaders.
-        :param rate_limit_bps:
-            The rate limit in bytes per second"""
-        for signal in self.signals.values():
-            signal.set_rate_limit(rate_limit_bps)
-
-    def __start_download(self, file_to_download: FileModel) -> None:
+    def __start_download(self, file_to_download: FileModel, connections_held: int = 0) -> None:
         """Start the download of a file.
         :param file_to_download:
-            The file to download"""
-        signal = self.__create_download_signals_for(file_to_download.name)
-        signal.on_update_status(FileModel.STATUS_DOWNLOADING)
-        file_size = -1
-        with self.size_resolver_lock:
-            if file_to_download.name in self.resolved_file_sizes:
-                file_size = self.resolved_file_sizes[file_to_download.name]
+            The file to download
+        :param connections_held:
+            Connections to the host of the file already taken, see download_file"""
+        signal, file_rate_limiter, chunk_sizer, file_size = self.__prepare_download(
+            file_to_download
+        )
         result_state = download_file(
             url=file_to_download.url,
             local_path=os.path.join(self.job.target_folder, file_to_download.name),
             signals=signal,
             file_size=file_size,
             attempts=self.download_retry_attempts,
+            segments=self.segments_per_file,
+            session=self.session_pool.session_for(file_to_download.url),
+            probe_cache=self.probe_cache,
+            rate_limiter=file_rate_limiter,
+            chunk_sizer=chunk_sizer,
+            disk_writers=self.disk_writers,
+            preallocate=self.preallocate_files,
+            checksum=self.__checksum_of(file_to_download),
+            stall_watchdog=self.stall_watchdog,
+            retry_policy=self.retry_policy,
+            circuit_breakers=self.circuit_breakers,
+            host_limits=self.host_limits,
+            connections_held=connections_held,
+        )
+        result_state = self.__settle_hedge(file_to_download, signal, result_state)
+        self.__finish_download(file_to_download, result_state)
+
+    async def __start_download_async(self, file_to_download: FileModel) -> None:
+        """Start the download of a file on the asyncio engine.
+        :param file_to_download:
+            The file to download"""
+        signal, file_rate_limiter, chunk_sizer, file_size = self.__prepare_download(
+            file_to_download
+        )
+        result_state = await async_downloader.download_file(
+            url=file_to_download.url,
+            local_path=os.path.join(self.job.target_folder, file_to_download.name),
+            session=self.engine.session(),
+            signals=signal,
+            file_size=file_size,
+            attempts=self.download_retry_attempts,
+            segments=self.segments_per_file,
+            probe_cache=self.probe_cache,
+            rate_limiter=file_rate_limiter,
+            chunk_sizer=chunk_sizer,
+            preallocate=self.preallocate_files,
+            checksum=self.__checksum_of(file_to_download),
+            stall_watchdog=self.stall_watchdog,
+            retry_policy=self.retry_policy,
+            circuit_breakers=self.circuit_breakers,
+            host_limits=self.host_limits,
+            disk_executor=self.engine.disk_executor,
+        )
+        self.__finish_download(file_to_download, result_state)
+
+    def __prepare_download(self, file_to_download: FileModel) -> tuple:
+        """Set up the signals, the bandwidth limiter and the chunk sizer of a file about to be
+        downloaded.
+        :return:
+            The signals, the rate limiter, the chunk sizer and the resolved size of the file
+            (-1 if unknown)"""
+        signal = self.__create_download_signals_for(file_to_download.name)
+        signal.on_update_status(FileModel.STATUS_DOWNLOADING)
+        file_rate_limiter = RateLimiter(parent=self.rate_limiter)
+        file_rate_limiter.set_rate_limit(file_to_download.rate_limit_bps or 0)
+        self.file_rate_limiters[file_to_download.name] = file_rate_limiter
+        chunk_sizer = self.chunk_sizers[file_to_download.name] = AdaptiveChunkSizer()
+        with self.size_resolver_lock:
+            file_size = self.resolved_file_sizes.get(file_to_download.name, -1)
+        # an unknown size is probed by the download rather than taken as an empty file
+        if file_size <= 0:
+            file_size = -1
+        return signal, file_rate_limiter, chunk_sizer, file_size
+
+    def __checksum_of(self, file_to_download: FileModelDTO) -> StreamingChecksum:
+        """Get the checksum of a file about to be downloaded, continuing the one of an earlier
+        download of the file if any. A file with a recorded checksum, e.g. listed with its
+        archive.org item, is hashed with the algorithm of that to verify it.
+        :return:
+            The checksum, None if checksums are not computed"""
+        expected_algorithm, _ = parse_checksum(file_to_download.checksum)
+        algorithm = expected_algorithm or self.checksum_algorithm
+        if algorithm is None:
+            return None
+        checksum = self.checksums.get(file_to_download.name)
+        if checksum is None or checksum.algorithm != algorithm:
+            checksum = self.checksums[file_to_download.name] = StreamingChecksum(algorithm)
+        return checksum
+
+    def __store_checksum(self, file_to_download: FileModelDTO) -> str:
+        """Store the checksum of a completed file, if it covers the whole file.
+        :return:
+            The error if the checksum differs from the one recorded for the file, None
+            otherwise"""
+        checksum = self.checksums.pop(file_to_download.name, None)
+        if checksum is None:
+            return None
+        local_path = self.__target_path_of_file(file_to_download)
+        if checksum.offset != written_size(local_path):
+            logger.warning("Checksum of %s does not cover the file.", file_to_download.name)
+            return None
+        expected = file_to_download.checksum
+        if parse_checksum(expected)[0] == checksum.algorithm:
+            if checksum.checksum() != expected.lower():
+                return f"Checksum mismatch, expected {expected}, downloaded {checksum.checksum()}."
+            return None  # verified, already recorded
+        self.journal_daemon.update_file_checksum(
+            self.job.name, file_to_download.name, checksum.checksum()
         )
+        return None
+
+    def __finish_download(self, file_to_download: FileModel, result_state: str) -> None:
+        self.file_rate_limiters.pop(file_to_download.name, None)
+        err = None
+        if result_state == FileModel.STATUS_COMPLETED:
+            err = self.__store_checksum(file_to_download)
+            if err is not None:
+                result_state = FileModel.STATUS_INVALID
+                self.journal_daemon.add_file_event(self.job.name, file_to_download.name, err)
         logger.debug("Worker finished with file: %s", file_to_download.name)
-        self.__post_download(file_to_download, new_status=result_state)
+        self.__post_download(file_to_download, new_status=result_state, err=err)
 
     def __target_path_of_file(self, file_model_dto):
         if self.job is None:
@@ -365,6 +979,7 @@ class QueuedDownloader:
         :param success:
             Whether the download was successful or not"""
         signals = self.signals[file.name]
+        signals.close()
         if new_status == FileModel.STATUS_STOPPED and signals.shutdown:
             self.journal_daemon.add_file_event(
                 self.job.name, file.name, "Stopped due to app shutdown."
@@ -505,12 +1120,15 @@ class QueuedDownloader:
 
         threading.Thread(target=resume_task, name=f"resume-files-{job_name}").start()
 
-    def health_check(self, filemodels: list, callback: any) -> None:
+    def health_check(self, filemodels: list, callback: any, deep: bool = False) -> None:
         """Check the health of the given filemodels.
         :param job_name:
             The name of the job
         :param filemodels:
-            The filemodels to check the health for"""
+            The filemodels to check the health for
+        :param deep:
+            Whether to also hash the contents of the completed files and compare them to
+            the checksums recorded at download time"""
         if self.is_checking_health():
             return
 
@@ -527,14 +1145,14 @@ class QueuedDownloader:
             crashed = 0
             files_indeed_done = 0
             total_size_local = 0
+            completed_files = []
             for filemodel in filemodels:
                 if self.health_check_cancelled:
                     return
                 try:
                     local_path = self.__target_path_of_file(filemodel)
-                    local_size = (
-                        os.path.getsize(local_path) if os.path.isfile(local_path) else 0
-                    )
+                    # preallocated files are as large as complete ones, count what is written
+                    local_size = max(written_size(local_path), 0)
                     total_size_local += local_size
                     # if completed, assumed size must match size on disk
                     if filemodel.status == FileModel.STATUS_COMPLETED:
@@ -555,6 +1173,7 @@ class QueuedDownloader:
                         else:
                             success += 1
                             files_indeed_done += 1
+                            completed_files.append((filemodel, local_path))
                     # if has downloaded bytes, disk should match
                     elif (
                         filemodel.status != FileModel.STATUS_DOWNLOADING
@@ -599,6 +1218,17 @@ class QueuedDownloader:
             # self.monitor.update_job_downloaded_bytes(job_name, total_size_local)
             self.journal_daemon.update_job_files_done(job_name, files_indeed_done)
 
+            deep_counts = None
+            if deep and not self.health_check_cancelled:
+                deep_check = DeepIntegrityCheck(
+                    algorithm=self.checksum_algorithm or "sha256",
+                    is_cancelled=lambda: self.health_check_cancelled,
+                )
+                deep_counts = deep_check.run(
+                    completed_files,
+                    lambda result: self.__record_deep_check_result(job_name, result),
+                )
+
             logger.debug(
                 "Finished checking health in background for %d files",
                 len(filemodels),
@@ -612,6 +1242,14 @@ class QueuedDownloader:
             report += "(Active downloads and files not yet started are skipped by design.)<br/>"
             if crashed > 0:
                 report += f"For {crashed} file(s) the integrity checking process crashed.<br/>"
+            if deep_counts is not None:
+                report += (
+                    "<b>Contents of completed files: "
+                    + ", ".join(f"{count} {result}" for result, count in deep_counts.items())
+                    + ".</b><br/>"
+                    if deep_counts
+                    else "No completed files to check the contents of.<br/>"
+                )
             report += """</p><p>Individual results are available in the files table,
                          filter for <b>Failed</b> or <b>Invalid</b> status.</p>"""
 
@@ -621,6 +1259,43 @@ class QueuedDownloader:
             target=health_check_task, name=f"health-check-{self.job.name}"
         ).start()
 
+    def __record_deep_check_result(self, job_name: str, result: IntegrityCheckResult) -> None:
+        """Journal the outcome of the deep check of a file as it comes, so that an
+        interrupted check does not have to hash it again."""
+        name = result.file.name
+        if result.result in (RESULT_UNCHANGED, RESULT_CANCELLED):
+            return
+        if result.is_success():
+            if result.result == RESULT_RECORDED:
+                self.journal_daemon.update_file_checksum(job_name, name, result.checksum)
+                event = f"Deep integrity check recorded checksum {result.checksum}."
+            else:
+                event = "Deep integrity check passed."
+            self.journal_daemon.update_file_verification(
+                job_name, name, result.size, result.mtime_ns
+            )
+            self.journal_daemon.add_file_event(job_name, name, event)
+            return
+        if result.result == RESULT_MISMATCH:
+            err = f"Deep integrity check found a checksum mismatch, contents are {result.checksum}."
+        elif result.result == RESULT_ERROR:
+            err = f"Deep integrity check failed: {result.error}"
+        else:
+            err = f"Deep integrity check found the file {result.result}."
+        self.journal_daemon.update_file_status(
+            job_name, name, FileModel.STATUS_INVALID, err=err
+        )
+        self.journal_daemon.add_file_event(job_name, name, err)
+
+    def __prioritize_size_resolver(self) -> None:
+        """Have the running size resolver, if any, resolve the files next in the queue first,
+        so that their sizes are known by the time they start downloading."""
+        with self.size_resolver_lock:
+            resolver = self.size_resolver
+        if resolver is not None:
+            next_files = self.queue.peek_files(SIZE_RESOLVER_LOOKAHEAD)
+            resolver.prioritize([file.name for file in next_files])
+
     def stop_resolving_file_sizes(self) -> None:
         """Stop resolving the file sizes."""
         self.size_resolver_cancelled = True
@@ -634,62 +1309,57 @@ class QueuedDownloader:
         if self.is_resolving_file_sizes() or self.is_resolved_all_file_sizes:
             return
 
+        def resolve_size(filemodel: FileModelDTO) -> int:
+            return resolve_remote_file_size(
+                filemodel.url,
+                attempts=1,
+                session=self.session_pool.session_for(filemodel.url),
+                probe_cache=self.probe_cache,
+                circuit_breakers=self.circuit_breakers,
+                is_cancelled=lambda: self.size_resolver_cancelled,
+                host_limits=self.host_limits,
+            )
+
+        def on_resolved(filemodel: FileModelDTO, size_bytes: int) -> None:
+            # available to the downloads right away, the journal gets it with the batch
+            with self.size_resolver_lock:
+                self.resolved_file_sizes[filemodel.name] = size_bytes
+
         def resolve_size_task():
             with self.size_resolver_lock:
                 self.is_resolver_running = True
-
-            attempt = 1
-            had_failures = True
-            while attempt <= SIZE_RESOLVER_ATTEMPTS and had_failures:
-
-                had_failures = False
-                logger.debug(
-                    "Resolving file sizes in background for %d files", len(filemodels)
-                )
-                for filemodel in filemodels:
-                    if self.size_resolver_cancelled:
-                        with self.size_resolver_lock:
-                            self.is_resolver_running = False
-                        return
-                    if filemodel.size_bytes is not None and filemodel.size_bytes > 0:
-                        continue
-                    try:
-                        size_bytes = resolve_remote_file_size(filemodel.url)
-                        self.journal_daemon.update_file_size(
-                            job_name, filemodel.name, size_bytes
-                        )
-                        with self.size_resolver_lock:
-                            self.resolved_file_sizes[filemodel.name] = (
-                                filemodel.size_bytes
-                            )
-                    except Exception as e:
-                        logger.error(
-                            "Failed to resolve file size for %s",
-                            filemodel.name,
-                            exc_info=e,
-                        )
-                        self.journal_daemon.add_file_event(
-                            job_name, filemodel.name, "Size resolver failed: " + str(e)
-                        )
-                        had_failures = True
-                    logger.debug(
-                        "Size resolver attempt %d for job %s finished with sucess: %b",
-                        attempt,
-                        job_name,
-                        not had_failures,
-                    )
-                attempt += 1
+            resolver = SizeResolver(
+                job_name,
+                self.journal_daemon,
+                resolve_size,
+                concurrency=self.size_resolver_threads,
+                attempts=SIZE_RESOLVER_ATTEMPTS,
+                retry_policy=self.retry_policy,
+                is_cancelled=lambda: self.size_resolver_cancelled,
+                on_resolved=on_resolved,
+            )
+            with self.size_resolver_lock:
+                self.size_resolver = resolver
+            self.__prioritize_size_resolver()
+            try:
+                failed = resolver.run(filemodels)
+            finally:
+                with self.size_resolver_lock:
+                    self.size_resolver = None
             logger.debug(
                 "Finished resolving file sizes in background for %d files of job %s",
                 len(filemodels),
                 job_name,
             )
             with self.size_resolver_lock:
-                self.resolved_all_file_sizes = had_failures
+                self.is_resolved_all_file_sizes = (
+                    not failed and not self.size_resolver_cancelled
+                )
                 self.is_resolver_running = False
-            if had_failures:
+            if failed:
                 logger.error(
-                    "Failed to resolve file sizes for job %s after %d attempts",
+                    "Failed to resolve file sizes of %d files of job %s after %d attempts",
+                    len(failed),
                     job_name,
                     SIZE_RESOLVER_ATTEMPTS,
                 )
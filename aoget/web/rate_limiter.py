@@ -1,18 +1,166 @@
+import asyncio
+import threading
+import time
+
+# longest uninterrupted sleep while waiting for tokens, bounds the reaction time to
+# cancellation and to the limit being lifted
+MAX_WAIT_SLICE_SECONDS = 0.1
+
+
 class RateLimiter:
-    """Rate limiter of download bandwidth."""
+    """Rate limiter of download bandwidth. A token bucket shared by all download threads, which
+    draw from it before writing each chunk. Tokens are bytes and refill at the rate limit. The
+    bucket holds at most a burst worth of tokens, so idle periods don't turn into a flood
+    later. Threads reserve their chunk even if it puts the bucket into debt and then wait for
+    the debt to be paid off, which paces the threads precisely and in order of arrival.
+
+    Limiters form a hierarchy (global -> job -> file): a chunk is drawn from the limiter of the
+    file first, then from its parents. A child only takes from its parent what it actually
+    transfers, so capacity a capped or idle child leaves unused goes to its siblings."""
 
-    def __init__(self, time_window_seconds: int = 1):
+    def __init__(self, burst_seconds: float = 0.25, parent: "RateLimiter" = None):
         """Rate limiter of download bandwidth.
-        :param time_window: Time window in seconds in which the limiter calculatiosn are donw.
+        :param burst_seconds:
+            The bucket capacity expressed in seconds of the rate limit, i.e. how many seconds
+            worth of data may be transferred at once after an idle period.
+        :param parent:
+            The limiter one level up in the hierarchy, if any.
         """
-        self.time_window_seconds = time_window_seconds
+        self.parent = parent
+        self.burst_seconds = burst_seconds
         self.rate_limit_bps = 0
+        self.__lock = threading.Lock()
+        self.__tokens = 0.0
+        self.__last_refill = time.monotonic()
 
     def set_global_rate_limit(self, rate_limit_bps: int):
-        """Set the global rate limit in bytes per second."""
-        self.rate_limit_bps = rate_limit_bps
+        """Set the global rate limit in bytes per second, 0 for unlimited."""
+        self.set_rate_limit(rate_limit_bps)
+
+    def set_rate_limit(self, rate_limit_bps: int):
+        """Set the rate limit of this level in bytes per second, 0 for unlimited."""
+        with self.__lock:
+            self.rate_limit_bps = rate_limit_bps
+            self.__tokens = min(self.__tokens, self.__capacity())
+            self.__last_refill = time.monotonic()
+
+    def set_burst(self, burst_seconds: float):
+        """Set the bucket capacity in seconds of the rate limit."""
+        with self.__lock:
+            self.burst_seconds = burst_seconds
+            self.__tokens = min(self.__tokens, self.__capacity())
+
+    def is_limited(self) -> bool:
+        """Determine whether a rate limit is in effect on this level or above."""
+        return self.rate_limit_bps > 0 or (
+            self.parent is not None and self.parent.is_limited()
+        )
+
+    def effective_rate_limit(self) -> int:
+        """Get the tightest rate limit on this level or above.
+        :return:
+            The limit in bytes per second, 0 if unlimited"""
+        limits = [self.rate_limit_bps] if self.rate_limit_bps > 0 else []
+        if self.parent is not None and self.parent.effective_rate_limit() > 0:
+            limits.append(self.parent.effective_rate_limit())
+        return min(limits) if limits else 0
 
-    def get_per_thread_limit(self, download_thread_count: int) -> int:
-        if self.rate_limit_bps == 0:
+    def acquire(self, nbytes: int, cancelled=None) -> bool:
+        """Draw the given number of bytes from this bucket and then from the parents, blocking
+        until they are available.
+        :param nbytes:
+            The number of bytes about to be written
+        :param cancelled:
+            Optional callable, the wait is abandoned when it returns True
+        :return:
+            False if the wait was cancelled, True otherwise. A cancelled wait takes nothing
+            from any level"""
+        acquired, reserved = self.__acquire_own(nbytes, cancelled)
+        if not acquired:
+            return False
+        if self.parent is not None and not self.parent.acquire(nbytes, cancelled):
+            # nothing is transferred, give back what this level took
+            if reserved:
+                self.__refund(nbytes)
+            return False
+        return True
+
+    async def acquire_async(self, nbytes: int, cancelled=None) -> bool:
+        """Same as acquire, but waits without blocking the event loop. Used by the asyncio
+        download engine."""
+        acquired, reserved = await self.__acquire_own_async(nbytes, cancelled)
+        if not acquired:
+            return False
+        if self.parent is not None and not await self.parent.acquire_async(
+            nbytes, cancelled
+        ):
+            if reserved:
+                self.__refund(nbytes)
+            return False
+        return True
+
+    def __acquire_own(self, nbytes: int, cancelled) -> tuple:
+        """Draw from this level of the hierarchy only.
+        :return:
+            Whether the bytes were acquired and whether they were taken from the bucket, a
+            cancelled wait is refunded"""
+        wait_until = self.__reserve(nbytes)
+        while wait_until is not None:
+            remaining = self.__remaining(wait_until)
+            if remaining <= 0:
+                return True, True
+            if cancelled is not None and cancelled():
+                self.__refund(nbytes)
+                return False, False
+            time.sleep(min(remaining, MAX_WAIT_SLICE_SECONDS))
+        return True, False
+
+    async def __acquire_own_async(self, nbytes: int, cancelled) -> tuple:
+        """Draw from this level of the hierarchy only, without blocking the event loop, see
+        __acquire_own."""
+        wait_until = self.__reserve(nbytes)
+        while wait_until is not None:
+            remaining = self.__remaining(wait_until)
+            if remaining <= 0:
+                return True, True
+            if cancelled is not None and cancelled():
+                self.__refund(nbytes)
+                return False, False
+            await asyncio.sleep(min(remaining, MAX_WAIT_SLICE_SECONDS))
+        return True, False
+
+    def __reserve(self, nbytes: int):
+        """Take the bytes from the bucket, possibly into debt.
+        :return:
+            The monotonic time until which the caller has to wait, None if unlimited"""
+        if self.rate_limit_bps <= 0:
+            return None
+        with self.__lock:
+            rate = self.rate_limit_bps
+            if rate <= 0:
+                return None
+            self.__refill(rate)
+            self.__tokens -= nbytes
+            return time.monotonic() + max(0.0, -self.__tokens) / rate
+
+    def __remaining(self, wait_until: float) -> float:
+        """Seconds left to wait, 0 if the limit was lifted in the meantime."""
+        if self.rate_limit_bps <= 0:
             return 0
-        return self.rate_limit_bps / download_thread_count
+        return wait_until - time.monotonic()
+
+    def __refund(self, nbytes: int) -> None:
+        """Give back a reservation for which nothing was transferred."""
+        with self.__lock:
+            self.__tokens += nbytes
+
+    def __refill(self, rate: int) -> None:
+        """Add the tokens accrued since the last refill, up to the capacity. Lock must be held."""
+        now = time.monotonic()
+        self.__tokens = min(
+            self.__capacity(), self.__tokens + (now - self.__last_refill) * rate
+        )
+        self.__last_refill = now
+
+    def __capacity(self) -> float:
+        return self.rate_limit_bps * self.burst_seconds
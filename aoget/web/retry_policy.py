@@ -0,0 +1,145 @@
+"""Retry policy of the downloads and the size resolver: exponential backoff with jitter, so
+that workers failing together do not retry together, and the Retry-After of busy servers."""
+
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# the server is overloaded or rate limits, worth retrying later
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+# waits are sliced so that a cancellation is noticed
+WAIT_SLICE_SECONDS = 0.25
+
+
+class ServerBusyError(Exception):
+    """A server responded with one of the RETRYABLE_STATUSES."""
+
+    def __init__(self, url: str, status: int, retry_after: float = None):
+        """Create an error.
+        :param url:
+            The URL requested
+        :param status:
+            The HTTP status of the response
+        :param retry_after:
+            The seconds to wait as per the Retry-After header, None if not sent"""
+        super().__init__(f"Server busy (HTTP {status}) for {url}")
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str) -> float:
+    """Parse a Retry-After header, either delay seconds or an HTTP date.
+    :return:
+        The seconds to wait, None if the value is missing or malformed"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def busy_error(url: str, status: int, headers) -> ServerBusyError:
+    """Get the error of a response of a busy server.
+    :param url:
+        The URL requested
+    :param status:
+        The HTTP status of the response
+    :param headers:
+        The headers of the response
+    :return:
+        The error to raise, None if the status is not one of the RETRYABLE_STATUSES"""
+    if status not in RETRYABLE_STATUSES:
+        return None
+    return ServerBusyError(url, status, parse_retry_after(headers.get("retry-after")))
+
+
+def sleep_unless_cancelled(seconds: float, is_cancelled=None) -> bool:
+    """Sleep, waking up early if cancelled.
+    :param is_cancelled:
+        Callable telling whether the wait was cancelled, never cancelled if None
+    :return:
+        False if cancelled, True otherwise"""
+    deadline = time.monotonic() + seconds
+    while True:
+        if is_cancelled is not None and is_cancelled():
+            return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        time.sleep(min(remaining, WAIT_SLICE_SECONDS))
+
+
+async def sleep_unless_cancelled_async(seconds: float, is_cancelled=None) -> bool:
+    """Sleep on the event loop, waking up early if cancelled, see sleep_unless_cancelled."""
+    deadline = time.monotonic() + seconds
+    while True:
+        if is_cancelled is not None and is_cancelled():
+            return False
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return True
+        await asyncio.sleep(min(remaining, WAIT_SLICE_SECONDS))
+
+
+class RetryPolicy:
+    """Delays between the attempts of a download: exponential backoff with full jitter,
+    at least as long as the Retry-After of a busy server."""
+
+    def __init__(
+        self,
+        base_delay_seconds: float = 1.0,
+        max_delay_seconds: float = 60.0,
+        max_retry_after_seconds: float = 300.0,
+    ):
+        """Create a retry policy.
+        :param base_delay_seconds:
+            The longest delay after the first failure, doubled after each one after
+        :param max_delay_seconds:
+            The cap of the backoff
+        :param max_retry_after_seconds:
+            The cap of the Retry-After honored, servers may ask for hours"""
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.max_retry_after_seconds = max_retry_after_seconds
+
+    def delay(self, failures: int, error: Exception = None) -> float:
+        """Get the delay before the next attempt.
+        :param failures:
+            The number of failed attempts so far, at least 1
+        :param error:
+            The error of the last attempt, if any
+        :return:
+            The seconds to wait"""
+        ceiling = min(
+            self.max_delay_seconds, self.base_delay_seconds * 2 ** max(0, failures - 1)
+        )
+        delay = random.uniform(0, ceiling)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after_seconds))
+        return delay
+
+    def wait(self, failures: int, error: Exception = None, is_cancelled=None) -> bool:
+        """Wait before the next attempt.
+        :return:
+            False if cancelled while waiting, True otherwise"""
+        delay = self.delay(failures, error)
+        logger.debug("Retrying in %.1f seconds after %d failure(s).", delay, failures)
+        return sleep_unless_cancelled(delay, is_cancelled)
+
+    async def wait_async(
+        self, failures: int, error: Exception = None, is_cancelled=None
+    ) -> bool:
+        """Wait on the event loop before the next attempt, see wait."""
+        delay = self.delay(failures, error)
+        logger.debug("Retrying in %.1f seconds after %d failure(s).", delay, failures)
+        return await sleep_unless_cancelled_async(delay, is_cancelled)
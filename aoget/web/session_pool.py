@@ -0,0 +1,126 @@
+"""Keep-alive HTTP sessions shared by the downloaders, the size resolvers and any other
+component that talks to the download hosts."""
+
+import logging
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTP adapter that counts the requests sent through it, so that connection reuse can be
+    calculated against the connections opened by the underlying urllib3 pools."""
+
+    def __init__(self, *args, **kwargs):
+        self.request_count = 0
+        self.__count_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        with self.__count_lock:
+            self.request_count += 1
+        return super().send(request, *args, **kwargs)
+
+    def connection_count(self) -> int:
+        """Get the number of connections opened by this adapter so far.
+        :return:
+            The number of TCP(+TLS) connections opened"""
+        pools = self.poolmanager.pools
+        count = 0
+        with pools.lock:
+            for key in pools.keys():
+                count += pools._container[key].num_connections
+        return count
+
+
+class SessionPool:
+    """A thread-safe, per-host pool of keep-alive HTTP sessions. Every host gets a single
+    session whose connection pool is bounded by the pool size, which should follow the number
+    of threads that may talk to the host at the same time."""
+
+    def __init__(self, pool_size: int = 10):
+        """Create a session pool.
+        :param pool_size:
+            The maximum number of connections kept alive per host"""
+        self.pool_size = pool_size
+        self.__lock = threading.RLock()
+        self.__sessions = {}  # type: Dict[str, requests.Session]
+        # counts of adapters that were replaced on resize
+        self.__retired_requests = 0
+        self.__retired_connections = 0
+
+    def session_for(self, url: str) -> requests.Session:
+        """Get the shared session for the host of the given URL.
+        :param url:
+            The URL to be requested
+        :return:
+            The session of the host"""
+        host = urlparse(url).netloc
+        with self.__lock:
+            if host not in self.__sessions:
+                session = requests.Session()
+                self.__mount_adapter(session)
+                self.__sessions[host] = session
+                logger.debug("Created keep-alive session for host %s", host)
+            return self.__sessions[host]
+
+    def set_pool_size(self, pool_size: int) -> None:
+        """Set the maximum number of connections kept alive per host. Existing sessions get
+        a resized adapter, connections of the old adapter are closed when idle.
+        :param pool_size:
+            The new pool size"""
+        pool_size = max(1, pool_size)
+        with self.__lock:
+            if pool_size == self.pool_size:
+                return
+            logger.debug("Resizing connection pools to %d", pool_size)
+            self.pool_size = pool_size
+            for session in self.__sessions.values():
+                self.__mount_adapter(session)
+
+    def __mount_adapter(self, session: requests.Session) -> None:
+        """Mount a counting adapter of the current pool size on the session, retiring the
+        previous one."""
+        old_adapter = session.adapters.get("https://")
+        if isinstance(old_adapter, CountingHTTPAdapter):
+            self.__retired_requests += old_adapter.request_count
+            self.__retired_connections += old_adapter.connection_count()
+        adapter = CountingHTTPAdapter(
+            pool_connections=4, pool_maxsize=self.pool_size, pool_block=False
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if old_adapter is not None:
+            # idle connections are closed now, the ones in use when they are returned
+            old_adapter.close()
+
+    def get_stats(self) -> dict:
+        """Get the connection reuse statistics of all hosts.
+        :return:
+            A dict with the number of hosts, requests sent, connections opened, requests
+            served over reused connections and the reuse (hit) rate."""
+        with self.__lock:
+            requests_sent = self.__retired_requests
+            connections = self.__retired_connections
+            for session in self.__sessions.values():
+                adapter = session.adapters["https://"]
+                requests_sent += adapter.request_count
+                connections += adapter.connection_count()
+            reused = max(0, requests_sent - connections)
+            return {
+                "hosts": len(self.__sessions),
+                "requests": requests_sent,
+                "connections": connections,
+                "reused": reused,
+                "hit_rate": reused / requests_sent if requests_sent > 0 else 0.0,
+            }
+
+    def close(self) -> None:
+        """Close all sessions and their connections."""
+        with self.__lock:
+            for session in self.__sessions.values():
+                session.close()
+            self.__sessions.clear()
@@ -0,0 +1,267 @@
+"""Resolution of the sizes of the files of a job, on a bounded pool of threads working through
+a shared queue. Only the files that failed are retried, each after its own backoff, and the
+results are handed over to the journal in batches. Files about to be downloaded can be put
+ahead, so that their sizes are known by the time they start."""
+
+import itertools
+import logging
+import queue
+import threading
+import time
+from web.retry_policy import RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_ATTEMPTS = 10
+# the results are pushed to the journal when this many are pending, or this often
+BATCH_SIZE = 200
+BATCH_SECONDS = 1.0
+# how long an idle worker waits for a retry to come due before looking again
+POLL_SECONDS = 0.25
+# the rank of the files not put ahead, after all that are
+UNRANKED = float("inf")
+
+
+class SizeResolver:
+    """Resolves the sizes of files with a single probe each, concurrently. A failed file is
+    put back on the queue with the time it may be retried at, so that workers do not sleep
+    through the backoff of one file while others are waiting. Among the files due, the ones
+    ranked by prioritize go first, the others in the order they were given.
+
+    A file whose rank changes gets a new queue entry and its old one is skipped when popped,
+    so that re-ranking costs as much as the ranks that changed, not the size of the queue."""
+
+    def __init__(
+        self,
+        job_name: str,
+        journal_daemon,
+        resolve,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        attempts: int = DEFAULT_ATTEMPTS,
+        retry_policy: RetryPolicy = None,
+        is_cancelled=None,
+        on_resolved=None,
+    ):
+        """Create a size resolver.
+        :param job_name:
+            The name of the job of the files
+        :param journal_daemon:
+            The journal the sizes and the failures are reported to
+        :param resolve:
+            Callable resolving the size of a FileModelDTO in a single attempt, raising on
+            failure
+        :param concurrency:
+            The number of files resolved at once
+        :param attempts:
+            The number of attempts per file
+        :param retry_policy:
+            The delays before the retries of a file, retried right away if None
+        :param is_cancelled:
+            Callable telling whether the resolution was cancelled
+        :param on_resolved:
+            Called with the file and its size as each file is resolved, from the workers"""
+        self.job_name = job_name
+        self.journal_daemon = journal_daemon
+        self.resolve = resolve
+        self.concurrency = max(1, concurrency)
+        self.attempts = max(1, attempts)
+        self.retry_policy = retry_policy
+        self.is_cancelled = is_cancelled if is_cancelled is not None else lambda: False
+        self.on_resolved = on_resolved
+        self.failed = {}
+        self.__queue = queue.PriorityQueue()
+        # unique per entry, so that an entry and its replacement never compare equal
+        self.__sequence = itertools.count()
+        # the current queue entry of each file waiting, older entries of a file are stale
+        self.__entries = {}
+        self.__lock = threading.Lock()
+        self.__pending = 0
+        self.__done = threading.Event()
+        self.__sizes = {}
+        self.__last_flush = time.monotonic()
+        self.__ranks = {}
+
+    def run(self, filemodels: list) -> dict:
+        """Resolve the sizes of the given files, blocking until all are resolved, failed for
+        good or the resolution is cancelled. Files with a known size are skipped.
+        :param filemodels:
+            The FileModelDTOs to resolve, their size_bytes is set as resolved
+        :return:
+            The names of the files that failed for good, with their last error"""
+        unresolved = [
+            filemodel
+            for filemodel in filemodels
+            if filemodel.size_bytes is None or filemodel.size_bytes <= 0
+        ]
+        if not unresolved:
+            return {}
+        self.__pending = len(unresolved)
+        # ties of the due time and the rank are taken in the order the files were given
+        for order, filemodel in enumerate(unresolved):
+            self.__put(filemodel, order, failures=0, due=0)
+        logger.debug(
+            "Resolving the sizes of %d files of job %s on %d threads",
+            len(unresolved),
+            self.job_name,
+            self.concurrency,
+        )
+        workers = [
+            threading.Thread(
+                target=self.__work,
+                name=f"{threading.current_thread().name}-{i}",
+                daemon=True,
+            )
+            for i in range(min(self.concurrency, len(unresolved)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.__flush(force=True)
+        return dict(self.failed)
+
+    def prioritize(self, filenames: list) -> None:
+        """Put the given files ahead of the others, in the given order, e.g. the next files of
+        the download queue. Replaces the ranks of an earlier call, can be called while
+        running.
+        :param filenames:
+            The names of the files to resolve first"""
+        with self.__lock:
+            old_ranks = self.__ranks
+            # numbered from the old rank of the first file still ranked, so that the usual
+            # change, the head of the download queue started and a file joined at the end,
+            # keeps the ranks of all other files
+            base = 0
+            for index, name in enumerate(filenames):
+                if name in old_ranks:
+                    base = old_ranks[name] - index
+                    break
+            ranks = {name: base + index for index, name in enumerate(filenames)}
+            if ranks == old_ranks:
+                return
+            self.__ranks = ranks
+            # only the files ranked before or now can change, not the whole queue
+            changed = [
+                self.__entries[name]
+                for name in old_ranks.keys() | ranks.keys()
+                if name in self.__entries
+                and old_ranks.get(name, UNRANKED) != ranks.get(name, UNRANKED)
+            ]
+            for due, _, order, _, filemodel, failures in changed:
+                self.__put_locked(filemodel, order, failures, due)
+
+    def __put(self, filemodel, order: int, failures: int, due: float) -> None:
+        with self.__lock:
+            self.__put_locked(filemodel, order, failures, due)
+
+    def __put_locked(self, filemodel, order: int, failures: int, due: float) -> None:
+        """Queue a file, replacing its entry if queued. The lock must be held."""
+        rank = self.__ranks.get(filemodel.name, UNRANKED)
+        entry = (due, rank, order, next(self.__sequence), filemodel, failures)
+        self.__entries[filemodel.name] = entry
+        self.__queue.put(entry)
+
+    def __is_current(self, entry) -> bool:
+        """Whether a popped entry was not replaced by a newer one of its file."""
+        with self.__lock:
+            return self.__entries.get(entry[4].name) is entry
+
+    def __take(self, entry) -> bool:
+        """Take a popped entry for resolution, unless it was replaced meanwhile.
+        :return:
+            False if the entry is stale"""
+        with self.__lock:
+            if self.__entries.get(entry[4].name) is not entry:
+                return False
+            del self.__entries[entry[4].name]
+            return True
+
+    def __work(self) -> None:
+        while not self.__done.is_set():
+            if self.is_cancelled():
+                self.__done.set()
+                return
+            try:
+                entry = self.__queue.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if not self.__is_current(entry):
+                continue
+            due, _, order, _, filemodel, failures = entry
+            wait = due - time.monotonic()
+            if wait > 0:
+                # the earliest retry is not due yet, the entry stays current
+                self.__queue.put(entry)
+                self.__done.wait(min(wait, POLL_SECONDS))
+                continue
+            if not self.__take(entry):
+                continue
+            self.__resolve(filemodel, order, failures)
+            self.__flush()
+
+    def __resolve(self, filemodel, order: int, failures: int) -> None:
+        try:
+            size = self.resolve(filemodel)
+            if size is None or size <= 0:
+                # e.g. no Content-Length, not a size to download against
+                raise ValueError(f"Remote size is unknown ({size}).")
+        except Exception as e:
+            if self.is_cancelled():
+                return  # not a failure of the file, the workers stop
+            failures += 1
+            if failures < self.attempts:
+                delay = (
+                    self.retry_policy.delay(failures, e) if self.retry_policy is not None else 0
+                )
+                logger.debug(
+                    "Resolving the size of %s failed (%s), retrying in %.1f seconds",
+                    filemodel.name,
+                    e,
+                    delay,
+                )
+                self.__put(filemodel, order, failures, time.monotonic() + delay)
+                return
+            logger.error(
+                "Failed to resolve the size of %s after %d attempts: %s",
+                filemodel.name,
+                failures,
+                e,
+            )
+            with self.__lock:
+                self.failed[filemodel.name] = str(e)
+            self.__complete()
+            return
+        filemodel.size_bytes = size
+        with self.__lock:
+            self.__sizes[filemodel.name] = size
+        if self.on_resolved is not None:
+            self.on_resolved(filemodel, size)
+        self.__complete()
+
+    def __complete(self) -> None:
+        with self.__lock:
+            self.__pending -= 1
+            if self.__pending == 0:
+                self.__done.set()
+
+    def __flush(self, force: bool = False) -> None:
+        """Push the pending results to the journal if there are enough or it is time."""
+        with self.__lock:
+            if not force and (
+                len(self.__sizes) < BATCH_SIZE
+                and time.monotonic() - self.__last_flush < BATCH_SECONDS
+            ):
+                return
+            sizes, self.__sizes = self.__sizes, {}
+            self.__last_flush = time.monotonic()
+        if sizes:
+            self.journal_daemon.update_file_sizes(self.job_name, sizes)
+        if force and self.failed:
+            self.journal_daemon.add_file_events(
+                self.job_name,
+                {
+                    name: f"Size resolver failed after {self.attempts} attempts: {error}"
+                    for name, error in self.failed.items()
+                },
+            )
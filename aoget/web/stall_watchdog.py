@@ -0,0 +1,181 @@
+"""Watchdog of stalled downloads. A connection trickling a few bytes per second never times
+out, so the throughput of each download is sampled and a download staying below a floor
+for too long gets its connections aborted, to be resumed on a fresh one."""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from util.aogetutil import human_rate
+
+logger = logging.getLogger(__name__)
+
+# how often the throughput of the downloads is sampled
+CHECK_INTERVAL_SECONDS = 1.0
+# a rate limited download may be slow by design, its floor is this fraction of the limit
+RATE_LIMITED_FLOOR_RATIO = 0.25
+
+
+class StallGuard:
+    """Throughput tracker of a single download attempt. The downloader records every chunk
+    received, the watchdog samples the total and trips the guard if the download stalls.
+    Tripping aborts the connections registered with the signals of the download, without
+    cancelling it."""
+
+    def __init__(self, watchdog: "StallWatchdog", signals, rate_limiter=None):
+        """Create a guard, see StallWatchdog.watch."""
+        self.watchdog = watchdog
+        self.signals = signals
+        self.rate_limiter = rate_limiter
+        self.received = 0
+        self.tripped = False
+        self.__paused = 0
+        self.__lock = threading.Lock()
+        self.__samples = deque([(time.monotonic(), 0)])
+
+    def record(self, nbytes: int) -> None:
+        """Record bytes received, called by the download threads.
+        :param nbytes:
+            The number of bytes received"""
+        with self.__lock:
+            self.received += nbytes
+
+    @contextmanager
+    def pause(self):
+        """Stop watching while the download waits on something other than its connection,
+        like a disk writer applying backpressure. The stall window starts over once no
+        download thread is paused."""
+        with self.__lock:
+            self.__paused += 1
+        try:
+            yield
+        finally:
+            with self.__lock:
+                self.__paused -= 1
+
+    def min_rate_bps(self) -> float:
+        """Get the throughput floor of the download, lowered for rate limited downloads."""
+        floor = self.watchdog.min_rate_bps
+        if self.rate_limiter is not None and self.rate_limiter.is_limited():
+            floor = min(floor, self.rate_limiter.effective_rate_limit() * RATE_LIMITED_FLOOR_RATIO)
+        return floor
+
+    def check(self, now: float) -> bool:
+        """Sample the bytes received and trip the guard if the throughput over the last
+        stall window stayed below the floor.
+        :param now:
+            The current monotonic time
+        :return:
+            True if the guard tripped with this check"""
+        if self.tripped:
+            return False
+        with self.__lock:
+            received = self.received
+            paused = self.__paused > 0
+        samples = self.__samples
+        if paused:
+            samples.clear()
+            samples.append((now, received))
+            return False
+        window_start = now - self.watchdog.stall_seconds
+        samples.append((now, received))
+        # keep the last sample at or before the start of the window
+        while len(samples) > 1 and samples[1][0] <= window_start:
+            samples.popleft()
+        since, received_since = samples[0]
+        if since > window_start:
+            return False  # not watched for a whole window yet
+        rate = (received - received_since) / (now - since)
+        if rate >= self.min_rate_bps():
+            return False
+        self.trip()
+        return True
+
+    def trip(self) -> None:
+        """Abort the connections of the download as stalled."""
+        self.tripped = True
+        logger.info("Download stalled, aborting its connections.")
+        if self.signals is not None:
+            self.signals.abort_connections()
+
+    def describe(self) -> str:
+        """Describe the stall for the file events."""
+        return (
+            f"Stalled below {human_rate(self.min_rate_bps())} for "
+            f"{self.watchdog.stall_seconds:g} seconds, resuming on a fresh connection."
+        )
+
+    def close(self) -> None:
+        """Stop watching the download attempt."""
+        self.watchdog.unwatch(self)
+
+
+class StallWatchdog:
+    """Samples the throughput of the watched download attempts on a single daemon thread,
+    shared by all jobs and both download engines."""
+
+    def __init__(
+        self,
+        min_rate_bps: int,
+        stall_seconds: float,
+        check_interval_seconds: float = CHECK_INTERVAL_SECONDS,
+    ):
+        """Create a watchdog, its thread is started on first use.
+        :param min_rate_bps:
+            The throughput floor in bytes per second
+        :param stall_seconds:
+            How long a download may stay below the floor before it is recycled
+        :param check_interval_seconds:
+            How often the downloads are sampled"""
+        self.min_rate_bps = min_rate_bps
+        self.stall_seconds = stall_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self.__guards = set()
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__thread = None
+
+    def watch(self, signals, rate_limiter=None) -> StallGuard:
+        """Start watching a download attempt.
+        :param signals:
+            The DownloadSignals of the download, its connections are aborted if it stalls
+        :param rate_limiter:
+            The bandwidth limiter of the download, if any
+        :return:
+            The guard to record the received bytes with and to close after the attempt"""
+        guard = StallGuard(self, signals, rate_limiter)
+        with self.__lock:
+            self.__guards.add(guard)
+            if self.__thread is None:
+                self.__stopped.clear()
+                self.__thread = threading.Thread(
+                    target=self.__run, name="stall-watchdog", daemon=True
+                )
+                self.__thread.start()
+        return guard
+
+    def unwatch(self, guard: StallGuard) -> None:
+        """Stop watching a download attempt."""
+        with self.__lock:
+            self.__guards.discard(guard)
+
+    def stop(self) -> None:
+        """Stop the watchdog thread."""
+        with self.__lock:
+            thread = self.__thread
+            self.__thread = None
+        self.__stopped.set()
+        if thread is not None:
+            thread.join(self.check_interval_seconds * 2)
+
+    def __run(self) -> None:
+        while not self.__stopped.wait(self.check_interval_seconds):
+            with self.__lock:
+                guards = list(self.__guards)
+            now = time.monotonic()
+            for guard in guards:
+                try:
+                    guard.check(now)
+                except Exception as e:
+                    logger.error("Stall check failed: %s", e)
@@ -0,0 +1,123 @@
+"""Hedged requests for the tail of a job. When the queue of a job runs dry, an idle worker
+races a second range request against the remaining bytes of its slowest download, often
+served by another host behind the same URL. Whichever finishes first wins, the other one
+is cancelled."""
+
+import logging
+import os
+import threading
+from web.downloader import DownloadSignals, clear_written_offset, hedge_part_path
+
+logger = logging.getLogger(__name__)
+
+# hedging a download about to finish anyway only wastes bandwidth
+MIN_HEDGED_BYTES = 1024 * 1024
+# the rate of a download is not known well enough before it ran this long
+MIN_RUNNING_SECONDS = 10
+# how often idle workers look for a download to hedge
+HEDGE_POLL_SECONDS = 1.0
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+class HedgeSignals(DownloadSignals):
+    """Signals of a hedge, only used to cancel it. Its progress is not reported, the file
+    shows the progress of the download it hedges."""
+
+    def on_update_progress(self, written: int, total: int) -> None:
+        pass
+
+    def on_update_status(self, status: str) -> None:
+        pass
+
+    def on_event(self, event: str) -> None:
+        pass
+
+
+class TailHedge:
+    """A hedge of the tail of a single download: the bytes from the offset the download
+    was at when the hedge started, to the end of the file, written to a part file. The
+    download and the hedge race, the first one done claims the file."""
+
+    def __init__(self, filename: str, local_path: str, offset: int, total: int):
+        """Create a hedge.
+        :param filename:
+            The name of the file hedged
+        :param local_path:
+            The path of the file hedged
+        :param offset:
+            The first byte of the hedge, where the hedged download was at
+        :param total:
+            The size of the file"""
+        self.filename = filename
+        self.local_path = local_path
+        self.offset = offset
+        self.total = total
+        self.part_path = hedge_part_path(local_path)
+        self.signals = HedgeSignals()
+        self.won = False
+        self.__settled = False
+        self.__lock = threading.Lock()
+
+    def byte_range(self) -> tuple:
+        """Get the first and the last byte of the hedge."""
+        return self.offset, self.total - 1
+
+    def claim(self) -> bool:
+        """Claim the file for the hedge, called when it downloaded its whole range.
+        :return:
+            True if the hedge won, False if the hedged download ended first"""
+        with self.__lock:
+            if self.__settled:
+                return False
+            self.won = True
+            return True
+
+    def settle(self) -> bool:
+        """Close the race, called when the hedged download ended.
+        :return:
+            True if the hedge won the race before"""
+        with self.__lock:
+            self.__settled = True
+            return self.won
+
+    def cancel(self) -> None:
+        """Cancel the hedge, it lost the race."""
+        self.signals.cancel()
+
+    def downloaded_bytes(self) -> int:
+        """Get the number of bytes the hedge downloaded."""
+        try:
+            return os.path.getsize(self.part_path)
+        except OSError:
+            return 0
+
+    def splice(self) -> None:
+        """Replace the tail of the file with the bytes of the hedge. The hedged download must
+        have ended, the part file is removed after."""
+        with open(self.local_path, "r+b") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self.offset:
+                raise ValueError(
+                    f"{self.filename} is shorter than the hedge offset {self.offset}."
+                )
+            # bytes past the offset are the same as the ones of the hedge, or a
+            # preallocated space not written yet
+            f.truncate(self.offset)
+            f.seek(self.offset)
+            with open(self.part_path, "rb") as part:
+                while True:
+                    block = part.read(COPY_BLOCK_SIZE)
+                    if not block:
+                        break
+                    f.write(block)
+        clear_written_offset(self.local_path)
+        self.discard()
+
+    def discard(self) -> None:
+        """Remove the part file of the hedge."""
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Could not remove hedge %s: %s", self.part_path, e)
@@ -0,0 +1,128 @@
+"""Compare the CPU cost of the threaded and the asyncio download engines.
+
+Downloads the same set of files with each engine from a local HTTP server running in a
+separate process, so that only the client side is measured, and reports the throughput and
+the CPU time spent per MB transferred (CPU per MB/s).
+
+Usage: python benchmarks/bench_download_engines.py [--files 32] [--size-mb 16] [--workers 8]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "aoget"))
+
+from controller.journal_daemon import JournalDaemon  # noqa: E402
+from model.dto.file_model_dto import FileModelDTO  # noqa: E402
+from model.dto.job_dto import JobDTO  # noqa: E402
+from web.async_downloader import AsyncDownloadEngine  # noqa: E402
+from web.queued_downloader import QueuedDownloader  # noqa: E402
+
+
+def serve(port: int, size_mb: int) -> None:
+    """Serve the same in-memory file on every path, with range support."""
+    content = os.urandom(1024 * 1024) * size_mb
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+
+        def do_GET(self):
+            body = memoryview(content)
+            range_header = self.headers.get("Range")
+            if range_header:
+                first, last = range_header.replace("bytes=", "").split("-")
+                last = int(last) if last else len(content) - 1
+                body = body[int(first) : last + 1]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {first}-{last}/{len(content)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def run(engine_name: str, base_url: str, args) -> dict:
+    """Download all files with the given engine and measure wall and CPU time."""
+    engine = AsyncDownloadEngine() if engine_name == "asyncio" else None
+    with tempfile.TemporaryDirectory() as target_folder:
+        job = JobDTO(id=1, name=f"bench-{engine_name}", target_folder=target_folder)
+        downloader = QueuedDownloader(
+            job=job,
+            journal_daemon=JournalDaemon(start_daemon=False),
+            worker_pool_size=args.workers,
+            engine=engine,
+        )
+        files = [
+            FileModelDTO(job_name=job.name, name=f"file{i}.bin", url=f"{base_url}/file{i}.bin")
+            for i in range(args.files)
+        ]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        downloader.start_download_threads()
+        downloader.download_files(files)
+        while downloader.is_downloading():
+            time.sleep(0.01)
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        downloader.stop(sync=True)
+        if engine is not None:
+            engine.stop()
+    megabytes = args.files * args.size_mb
+    return {
+        "engine": engine_name,
+        "mb_per_s": megabytes / wall,
+        "cpu_s_per_mb": cpu / megabytes,
+        "cpu_percent": 100 * cpu / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=32)
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port, args.size_mb)
+        return
+
+    server = subprocess.Popen(
+        [sys.executable, __file__, "--serve", "--port", str(args.port),
+         "--size-mb", str(args.size_mb)]
+    )
+    try:
+        time.sleep(1)
+        base_url = f"http://127.0.0.1:{args.port}"
+        print(f"{args.files} files x {args.size_mb} MB, {args.workers} workers")
+        print(f"{'engine':<10}{'MB/s':>10}{'CPU ms/MB':>12}{'CPU %':>8}")
+        for engine_name in ("threaded", "asyncio"):
+            result = run(engine_name, base_url, args)
+            print(
+                f"{result['engine']:<10}{result['mb_per_s']:>10.1f}"
+                f"{result['cpu_s_per_mb'] * 1000:>12.2f}{result['cpu_percent']:>8.1f}"
+            )
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Compare the on-disk layout of concurrent downloads with and without preallocation.
+
+Downloads several files at once from a local HTTP server running in a separate process into
+a freshly made ext4 filesystem on a loopback device, so that the results do not depend on
+the state of the disk the benchmark is run from. Files growing side by side get their
+blocks interleaved, preallocated ones are reserved in one go. Reports the download
+throughput, the extents per file (by filefrag) and the cold read throughput of the files.
+
+Mounting needs root and the e2fsprogs tools, use --folder to run on an existing folder
+instead.
+
+Usage: python benchmarks/bench_preallocation.py [--files 8] [--size-mb 64] [--folder PATH]
+"""
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "aoget"))
+
+from web.disk_writer import DiskWriterPool  # noqa: E402
+from web.downloader import DownloadSignals, download_file  # noqa: E402
+from web.session_pool import SessionPool  # noqa: E402
+
+
+class BlankSignals(DownloadSignals):
+    def on_update_progress(self, written: int, total: int) -> None:
+        pass
+
+
+def mount_loopback(image_size_mb: int) -> tuple:
+    """Make an ext4 filesystem in an image file and mount it.
+    :return:
+        The mount point and the folder holding the image, None if it could not be mounted"""
+    workdir = tempfile.mkdtemp(prefix="bench-preallocation-")
+    image = os.path.join(workdir, "fs.img")
+    mount_point = os.path.join(workdir, "mnt")
+    os.mkdir(mount_point)
+    with open(image, "wb") as f:
+        f.truncate(image_size_mb * 1024 * 1024)
+    try:
+        subprocess.run(["mkfs.ext4", "-q", "-F", image], check=True, capture_output=True)
+        subprocess.run(["mount", "-o", "loop", image, mount_point], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Could not mount a loopback filesystem ({e}), use --folder instead.")
+        shutil.rmtree(workdir)
+        return None, None
+    return mount_point, workdir
+
+
+def unmount_loopback(mount_point: str, workdir: str) -> None:
+    subprocess.run(["umount", mount_point], check=False)
+    shutil.rmtree(workdir)
+
+
+def extents_of(path: str) -> int:
+    """Number of extents of a file as reported by filefrag, -1 if not available."""
+    try:
+        output = subprocess.run(
+            ["filefrag", path], check=True, capture_output=True, text=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return -1
+    match = re.search(r"(\d+) extents? found", output)
+    return int(match.group(1)) if match else -1
+
+
+def cold_read_seconds(path: str) -> float:
+    """Time of reading the file after evicting it from the page cache."""
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        started = time.monotonic()
+        while f.read(4 * 1024 * 1024):
+            pass
+        return time.monotonic() - started
+
+
+def run(base_url: str, folder: str, files: int, preallocate: bool) -> dict:
+    """Download the files concurrently into the folder and measure the result."""
+    pool = SessionPool(pool_size=files)
+    disk_writers = DiskWriterPool()
+    paths = [os.path.join(folder, f"file{i}.bin") for i in range(files)]
+
+    def task(index):
+        url = f"{base_url}/file{index}.bin"
+        download_file(
+            url,
+            paths[index],
+            BlankSignals(),
+            session=pool.session_for(url),
+            disk_writers=disk_writers,
+            preallocate=preallocate,
+        )
+
+    threads = [threading.Thread(target=task, args=(i,)) for i in range(files)]
+    started = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    seconds = time.monotonic() - started
+    disk_writers.close()
+    pool.close()
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    result = {
+        "download_mbps": total_bytes / seconds / 1024 / 1024,
+        "extents": sum(extents_of(path) for path in paths) / files,
+        "read_mbps": total_bytes / sum(cold_read_seconds(path) for path in paths) / 1024 / 1024,
+    }
+    for path in paths:
+        os.remove(path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--port", type=int, default=18767)
+    parser.add_argument("--folder", help="existing folder to download to, no loopback mount")
+    args = parser.parse_args()
+
+    if args.folder:
+        folder, workdir = args.folder, None
+    else:
+        # room for both rounds with plenty to spare, a nearly full disk fragments anyway
+        folder, workdir = mount_loopback(args.files * args.size_mb * 4 + 256)
+        if folder is None:
+            return
+
+    bench_engines = os.path.join(os.path.dirname(__file__), "bench_download_engines.py")
+    server = subprocess.Popen(
+        [sys.executable, bench_engines, "--serve", "--port", str(args.port),
+         "--size-mb", str(args.size_mb)]
+    )
+    try:
+        time.sleep(1)
+        base_url = f"http://127.0.0.1:{args.port}"
+        print(f"{args.files} concurrent downloads x {args.size_mb} MB into {folder}")
+        print(f"{'allocation':<14}{'download MB/s':>15}{'extents/file':>14}{'read MB/s':>11}")
+        for name, preallocate in (("on demand", False), ("preallocated", True)):
+            result = run(base_url, folder, args.files, preallocate)
+            print(
+                f"{name:<14}{result['download_mbps']:>15.1f}"
+                f"{result['extents']:>14.1f}{result['read_mbps']:>11.1f}"
+            )
+    finally:
+        server.terminate()
+        if workdir is not None:
+            unmount_loopback(folder, workdir)
+
+
+if __name__ == "__main__":
+    main()
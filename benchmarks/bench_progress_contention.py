@@ -0,0 +1,80 @@
+"""Measure the cost of progress reporting from many download threads.
+
+Each thread reports progress as if it wrote a chunk, as fast as it can, while the journal
+daemon ticks in the background. Compares reporting through the daemon lock on every chunk
+(the former approach) with the per-file progress counters harvested once per tick.
+
+Usage: python benchmarks/bench_progress_contention.py [--threads 16] [--updates 200000]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "aoget"))
+
+from controller.journal_daemon import JournalDaemon  # noqa: E402
+from web.queued_downloader import FileProgressSignals  # noqa: E402
+
+
+class BlankProcessor:
+    def update_tick(self, journal):
+        pass
+
+
+class LockingSignals(FileProgressSignals):
+    """Progress signals reporting every chunk through the daemon lock."""
+
+    def on_update_progress(self, written: int, total: int) -> None:
+        self.monitor.update_download_progress(self.jobname, self.filename, written, total)
+
+
+def run(signals_class, threads: int, updates: int) -> tuple:
+    """Report the given number of updates per thread.
+    :return:
+        Wall time and CPU time in seconds"""
+    daemon = JournalDaemon(update_interval_seconds=0.1, journal_processor=BlankProcessor())
+    signals = [
+        signals_class(f"job-{i % 4}", f"file-{i}", daemon) for i in range(threads)
+    ]
+    start = threading.Barrier(threads + 1)
+
+    def report(index):
+        start.wait()
+        for written in range(0, updates * 8192, 8192):
+            signals[index].on_update_progress(written, updates * 8192)
+
+    workers = [threading.Thread(target=report, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    start.wait()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for t in workers:
+        t.join()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    daemon.stop()
+    return wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--updates", type=int, default=200000)
+    args = parser.parse_args()
+    total = args.threads * args.updates
+    print(f"{args.threads} threads x {args.updates} progress updates")
+    print(f"{'reporting':<18}{'updates/s':>14}{'ns/update':>12}{'CPU s':>8}")
+    for name, signals_class in (
+        ("lock per chunk", LockingSignals),
+        ("counters", FileProgressSignals),
+    ):
+        wall, cpu = run(signals_class, args.threads, args.updates)
+        print(f"{name:<18}{total / wall:>14,.0f}{wall / total * 1e9:>12.0f}{cpu:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
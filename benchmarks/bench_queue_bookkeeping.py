@@ -0,0 +1,82 @@
+"""Measure the bookkeeping of queued files as jobs grow.
+
+Queues a job of n files on a QueuedDownloader without workers, asks whether each file is
+queued the way the UI does, then dequeues them all as stopping the job does. The list based
+bookkeeping used before is measured alongside, up to a size it finishes at in reasonable
+time. Time per file staying flat as n grows means linear scaling.
+
+Usage: python benchmarks/bench_queue_bookkeeping.py [--max-files 1000000] [--max-list-files 20000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "aoget"))
+
+from controller.journal_daemon import JournalDaemon  # noqa: E402
+from model.dto.file_model_dto import FileModelDTO  # noqa: E402
+from model.dto.job_dto import JobDTO  # noqa: E402
+from web.queued_downloader import QueuedDownloader  # noqa: E402
+
+
+class BlankProcessor:
+    def update_tick(self, journal):
+        pass
+
+
+def run_indexed(files: list) -> float:
+    """Queue, look up and dequeue the files on a downloader.
+    :return:
+        Wall time in seconds"""
+    daemon = JournalDaemon(update_interval_seconds=1, journal_processor=BlankProcessor())
+    job = JobDTO(id=1, name="bench", page_url="", target_folder="", status="")
+    downloader = QueuedDownloader(job=job, journal_daemon=daemon)
+    start = time.perf_counter()
+    downloader.download_files(files)
+    queued = sum(1 for file in files if file.name in downloader.files_in_queue)
+    downloader.dequeue_files(files)
+    wall = time.perf_counter() - start
+    daemon.stop()
+    assert queued == len(files) and not downloader.is_downloading()
+    return wall
+
+
+def run_list(files: list) -> float:
+    """The same bookkeeping on a plain list, as it was done before."""
+    start = time.perf_counter()
+    files_in_queue = []
+    files_in_queue.extend([file.name for file in files])
+    queued = sum(1 for file in files if file.name in files_in_queue)
+    for file in files:
+        if file.name in files_in_queue:
+            files_in_queue.remove(file.name)
+    wall = time.perf_counter() - start
+    assert queued == len(files) and not files_in_queue
+    return wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-files", type=int, default=1000000)
+    parser.add_argument("--max-list-files", type=int, default=20000)
+    args = parser.parse_args()
+    print(f"{'files':>10}{'indexed s':>12}{'ns/file':>10}{'list s':>12}{'ns/file':>10}")
+    n = 1000
+    while n <= args.max_files:
+        files = [
+            FileModelDTO(job_name="bench", name=f"file-{i:07d}.bin", priority=2)
+            for i in range(n)
+        ]
+        indexed = run_indexed(files)
+        line = f"{n:>10,}{indexed:>12.3f}{indexed / n * 1e9:>10.0f}"
+        if n <= args.max_list_files:
+            listed = run_list(files)
+            line += f"{listed:>12.3f}{listed / n * 1e9:>10.0f}"
+        print(line)
+        n *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare copying and zero-copy reads of the threaded downloader.
+
+Downloads a file from a local HTTP server running in a separate process, reading the body
+either through urllib3 (a new bytes object per chunk) or straight into a reusable buffer,
+and reports the CPU time and the minor page faults (a proxy of allocation churn: large
+chunks are mmap-ed and faulted in on every allocation) per GB.
+
+Usage: python benchmarks/bench_zero_copy.py [--size-mb 256] [--repeat 4]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "aoget"))
+
+from web import downloader  # noqa: E402
+from web.downloader import DownloadSignals, download_file  # noqa: E402
+from web.session_pool import SessionPool  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class BlankSignals(DownloadSignals):
+    def on_update_progress(self, written: int, total: int) -> None:
+        pass
+
+
+def minor_faults() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_minflt if resource else 0
+
+
+def run(url: str, repeat: int, zero_copy: bool) -> tuple:
+    """Download the file the given number of times.
+    :return:
+        CPU seconds and minor page faults"""
+    pool = SessionPool(pool_size=1)
+    with patch.object(downloader, "ZERO_COPY_READS", zero_copy), \
+            tempfile.TemporaryDirectory() as folder:
+        local_path = os.path.join(folder, "file.bin")
+        session = pool.session_for(url)
+        faults_start = minor_faults()
+        cpu_start = time.process_time()
+        for _ in range(repeat):
+            if os.path.exists(local_path):
+                os.remove(local_path)
+            download_file(url, local_path, BlankSignals(), session=session)
+        cpu = time.process_time() - cpu_start
+        faults = minor_faults() - faults_start
+    pool.close()
+    return cpu, faults
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=4)
+    parser.add_argument("--port", type=int, default=18766)
+    args = parser.parse_args()
+
+    bench_engines = os.path.join(os.path.dirname(__file__), "bench_download_engines.py")
+    server = subprocess.Popen(
+        [sys.executable, bench_engines, "--serve", "--port", str(args.port),
+         "--size-mb", str(args.size_mb)]
+    )
+    try:
+        time.sleep(1)
+        url = f"http://127.0.0.1:{args.port}/file.bin"
+        gigabytes = args.size_mb * args.repeat / 1024
+        print(f"{args.repeat} x {args.size_mb} MB")
+        print(f"{'reads':<12}{'CPU s/GB':>10}{'faults/GB':>12}")
+        for name, zero_copy in (("copying", False), ("zero-copy", True)):
+            cpu, faults = run(url, args.repeat, zero_copy)
+            print(f"{name:<12}{cpu / gigabytes:>10.3f}{faults / gigabytes:>12,.0f}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
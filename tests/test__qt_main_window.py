@@ -27,6 +27,7 @@ class TestMainWindow(unittest.TestCase):
         self.window.btnJobStop = QPushButton()
         self.window.btnJobThreadsPlus = QPushButton()
         self.window.btnJobThreadsMinus = QPushButton()
+        self.window.btnJobBandwidth = QPushButton()
         self.window.btnJobCreate = QPushButton()
         self.window.btnJobEdit = QPushButton()
         self.window.btnJobRemoveFromList = QPushButton()
@@ -51,6 +52,7 @@ class TestMainWindow(unittest.TestCase):
         self.window.btnFileOpenLink = QPushButton()
         self.window.btnFilePriorityPlus = QPushButton()
         self.window.btnFilePriorityMinus = QPushButton()
+        self.window.btnFileBandwidth = QPushButton()
 
     def test_setup_ui(self):
         self.window._MainWindow__setup_ui()
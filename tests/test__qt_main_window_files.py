@@ -59,6 +59,7 @@ class TestMainWindowFiles(unittest.TestCase):
         self.window.btnFileOpenLink = QPushButton()
         self.window.btnFilePriorityPlus = QPushButton()
         self.window.btnFilePriorityMinus = QPushButton()
+        self.window.btnFileBandwidth = QPushButton()
         self.controller_mock = MagicMock()
         self.main_window_files = MainWindowFiles(self.window)
         self.window.controller = self.controller_mock
@@ -7,7 +7,7 @@ from PyQt6.QtWidgets import (
     QPushButton,
     QTableWidgetItem,
 )
-from aoget.view.main_window_jobs import MainWindowJobs
+from aoget.view.main_window_jobs import MainWindowJobs, JOB_THREADS_IDX
 from aoget.model.dto.job_dto import JobDTO
 
 
@@ -28,6 +28,7 @@ class TestMainWindowJobs(unittest.TestCase):
         self.window.btnJobStop = QPushButton()
         self.window.btnJobThreadsPlus = QPushButton()
         self.window.btnJobThreadsMinus = QPushButton()
+        self.window.btnJobBandwidth = QPushButton()
         self.window.btnJobCreate = QPushButton()
         self.window.btnJobEdit = QPushButton()
         self.window.btnJobRemoveFromList = QPushButton()
@@ -70,6 +71,19 @@ class TestMainWindowJobs(unittest.TestCase):
         self.main_window_jobs.update_job(updated_job)
         self.assertEqual(self.window.tblJobs.rowCount(), 1)
 
+    def test_threads_tooltip_shows_host_connections(self):
+        self.main_window_jobs.setup_ui()
+        job = JobDTO(id=-1, name="Test Job", status="Running")
+        self.controller_mock.jobs.get_job_dtos.return_value = [job]
+        self.controller_mock.jobs.get_host_connection_stats.return_value = {
+            "ia800.us.archive.org": {"active": 4, "limit": 6},
+            "example.com": {"active": 2, "limit": 0},
+        }
+        self.main_window_jobs.update_table()
+        tooltip = self.window.tblJobs.item(0, JOB_THREADS_IDX).toolTip()
+        self.assertIn("ia800.us.archive.org: 4/6", tooltip)
+        self.assertIn("example.com: 2 (no limit)", tooltip)
+
     def test_get_row_index_of_job(self):
         self.main_window_jobs.setup_ui()
         job = JobDTO(id=-1, name="Test Job", status="Running")
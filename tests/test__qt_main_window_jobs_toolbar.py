@@ -38,6 +38,7 @@ class TestMainWindowJobs(unittest.TestCase):
         self.window.btnJobStop = QPushButton()
         self.window.btnJobThreadsPlus = QPushButton()
         self.window.btnJobThreadsMinus = QPushButton()
+        self.window.btnJobBandwidth = QPushButton()
         self.window.btnJobCreate = QPushButton()
         self.window.btnJobEdit = QPushButton()
         self.window.btnJobRemoveFromList = QPushButton()
@@ -1,3 +1,5 @@
+import threading
+import time
 import unittest
 from aoget.util.aogetutil import (
     is_valid_url,
@@ -6,7 +8,8 @@ from aoget.util.aogetutil import (
     human_filesize,
     dehumanized_filesize,
     human_eta,
-    human_rate
+    human_rate,
+    wait_for_all,
 )
 
 
@@ -178,6 +181,14 @@ class TestAogetutil(unittest.TestCase):
         result = human_eta(eta_seconds)
         self.assertEqual(result, expected_result)
 
+    def test_wait_for_all_shares_one_deadline(self):
+        events = [threading.Event() for _ in range(10)]
+        events[0].set()
+        started = time.monotonic()
+        pending = wait_for_all(events, 0.2)
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(pending, events[1:])
+
     def test_human_rate(self):
         # Test case for a rate of 0 bytes per second
         rate_bytes_per_second = 0
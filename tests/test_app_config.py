@@ -123,6 +123,24 @@ class TestAppConfig(unittest.TestCase):
             app_config.load_config_from_file(filename)
         os.remove(filename)
 
+    def test_validate_host_connection_limits_not_a_number(self):
+        filename = "test_config.json"
+        temp_dir = os.path.abspath(tempfile.gettempdir())
+        filename = os.path.join(temp_dir, filename)
+        settings_folder = os.path.join(temp_dir, "test_settings")
+        downloads_folder = os.path.join(temp_dir, "test_downloads_folder")
+        config = {
+            AppConfig.DEBUG: True,
+            AppConfig.SETTINGS_FOLDER: settings_folder,
+            AppConfig.DEFAULT_DOWNLOAD_FOLDER: downloads_folder,
+            AppConfig.HOST_CONNECTION_LIMITS: {"*archive.org": "six"},
+        }
+        with open(filename, "w") as file:
+            file.write(json.dumps(config))
+        with self.assertRaises(Exception):
+            app_config.load_config_from_file(filename)
+        os.remove(filename)
+
         
 if __name__ == "__main__":
     unittest.main()
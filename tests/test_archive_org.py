@@ -0,0 +1,105 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+import pytest
+from aoget.web.aopage import AoPage
+from aoget.web.archive_org import fill_page_from_metadata, item_identifier
+from aoget.web.page_crawler import PageCrawler
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "archive_org_metadata.json")
+IDENTIFIER = "aoget-test-item"
+
+
+class MetadataHandler(BaseHTTPRequestHandler):
+    """Replays a recorded response of the archive.org metadata API. Unknown items get an
+    empty object, as from archive.org."""
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        if self.path == f"/metadata/{IDENTIFIER}":
+            with open(FIXTURE, "rb") as f:
+                body = f.read()
+        else:
+            body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def metadata_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MetadataHandler)
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_item_identifier():
+    assert item_identifier("https://archive.org/details/some-item") == "some-item"
+    assert item_identifier("https://archive.org/download/some-item/") == "some-item"
+    assert item_identifier("http://www.archive.org/details/some-item") == "some-item"
+    # a file or a directory of the item, not the item itself
+    assert item_identifier("https://archive.org/download/some-item/file.mp3") is None
+    assert item_identifier("https://archive.org/search?query=x") is None
+    assert item_identifier("https://example.com/details/some-item") is None
+
+
+def test_page_filled_from_metadata(metadata_server):
+    page = AoPage()
+    filled = fill_page_from_metadata(
+        f"https://archive.org/details/{IDENTIFIER}", page, base_url=metadata_server.base_url
+    )
+    assert filled
+    assert page.page_title == "AOGet Test Item"
+    download = f"{metadata_server.base_url}/download/{IDENTIFIER}"
+    mp3 = f"{download}/01%20-%20Opening.mp3"
+    flac = f"{download}/02%20-%20Closing.flac"
+    meta = f"{download}/{IDENTIFIER}_meta.xml"
+    assert dict(page.files_by_extension) == {".mp3": [mp3], ".flac": [flac], ".xml": [meta]}
+    assert page.file_sizes == {mp3: 4812345, flac: 28123456}
+    # sha1 where listed, md5 otherwise
+    assert page.file_checksums[mp3] == "sha1:86f7e437faa5a7fce15d1ddcb9eaeaea377667b8"
+    assert page.file_checksums[flac] == "md5:92eb5ffee6ae2fec3ad71c777531578f"
+    assert meta not in page.file_checksums
+
+
+def test_unknown_item_is_not_filled(metadata_server):
+    page = AoPage()
+    filled = fill_page_from_metadata(
+        "https://archive.org/details/no-such-item", page, base_url=metadata_server.base_url
+    )
+    assert not filled
+    assert page.files_by_extension == {}
+
+
+def test_other_pages_do_not_query_the_metadata(metadata_server):
+    filled = fill_page_from_metadata(
+        "https://example.com/files/", AoPage(), base_url=metadata_server.base_url
+    )
+    assert not filled
+    assert metadata_server.requests == []
+
+
+def test_crawler_falls_back_to_the_spider():
+    with patch("aoget.web.page_crawler.setup"), patch(
+        "aoget.web.page_crawler.fill_page_from_metadata", return_value=False
+    ), patch.object(PageCrawler, "run_spider") as run_spider:
+        PageCrawler("https://example.com/files/").fetch_links()
+    run_spider.assert_called_once()
+
+
+def test_crawler_takes_the_fast_path():
+    with patch("aoget.web.page_crawler.setup"), patch(
+        "aoget.web.page_crawler.fill_page_from_metadata", return_value=True
+    ), patch.object(PageCrawler, "run_spider") as run_spider:
+        PageCrawler(f"https://archive.org/details/{IDENTIFIER}").fetch_links()
+    run_spider.assert_not_called()
@@ -0,0 +1,451 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+import aiohttp
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from aoget.util.aogetutil import human_filesize
+from aoget.web import async_downloader
+from aoget.web.async_downloader import AsyncDownloadEngine
+from aoget.web.checksum import StreamingChecksum
+from aoget.web.probe_cache import ProbeCache
+from aoget.web.downloader import (
+    DownloadSignals,
+    STATUS_COMPLETED,
+    STATUS_STOPPED,
+    read_written_offset,
+    remove_download_artifacts,
+    written_offset_path,
+)
+from aoget.web.queued_downloader import QueuedDownloader
+from aoget.web.stall_watchdog import StallWatchdog
+from aoget.web.retry_policy import RetryPolicy
+from aoget.web.circuit_breaker import HostCircuitBreakers
+from aoget.web.host_limits import HostConnectionLimits
+from aoget.model.dto.file_model_dto import FileModelDTO
+from aoget.model.dto.job_dto import JobDTO
+
+CONTENT = bytes(range(256)) * 4096  # 1 MB
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        if self.path.endswith(".missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.endswith(".busy") and self.server.busy_responses > 0:
+            self.server.busy_responses -= 1
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = CONTENT
+        range_header = self.headers.get("Range")
+        if range_header:
+            first, last = range_header.replace("bytes=", "").split("-")
+            last = int(last) if last else len(CONTENT) - 1
+            body = CONTENT[int(first) : last + 1]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {first}-{last}/{len(CONTENT)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.path.endswith(".stall"):
+            # send a little, then hang until released like a stalled server
+            self.wfile.write(body[:1024])
+            self.wfile.flush()
+            self.server.stalled.release()
+            self.server.unstall.wait(10)
+            return
+        if self.path.endswith(".trickle") and self.path not in self.server.trickled:
+            # the first connection stalls without ever timing out, later ones do not
+            self.server.trickled.add(self.path)
+            sent = 1024
+            self.wfile.write(body[:sent])
+            self.wfile.flush()
+            while not self.server.unstall.wait(0.05):
+                try:
+                    self.wfile.write(body[sent : sent + 1])
+                    self.wfile.flush()
+                except OSError:
+                    return
+                sent += 1
+            return
+        # trickle the body so that cancellation can be observed mid-download
+        for i in range(0, len(body), 64 * 1024):
+            self.wfile.write(body[i : i + 64 * 1024])
+            if self.server.delay:
+                time.sleep(self.server.delay)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RecordingSignals(DownloadSignals):
+    def __init__(self, cancel_after_bytes=None):
+        self.progress = []
+        self.events = []
+        self.statuses = []
+        self.cancel_after_bytes = cancel_after_bytes
+
+    def on_update_progress(self, written, total):
+        self.progress.append((written, total))
+        if self.cancel_after_bytes is not None and written >= self.cancel_after_bytes:
+            self.cancel()
+
+    def on_update_status(self, status, err=None):
+        self.statuses.append(status)
+
+    def on_event(self, event):
+        self.events.append(event)
+
+
+class TestAsyncDownloader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+        cls.server.delay = 0
+        cls.server.stalled = threading.Semaphore(0)
+        cls.server.unstall = threading.Event()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.engine = AsyncDownloadEngine()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.delay = 0
+        self.server.unstall.clear()
+        self.server.trickled = set()
+        self.server.busy_responses = 0
+        self.tmp = tempfile.TemporaryDirectory()
+        self.local_path = os.path.join(self.tmp.name, "file.bin")
+
+    def tearDown(self):
+        self.server.unstall.set()
+        self.tmp.cleanup()
+
+    def download(
+        self,
+        signals,
+        segments=1,
+        preallocate=False,
+        checksum=None,
+        name="file.bin",
+        stall_watchdog=None,
+    ):
+        return self.submit(
+            signals, segments, preallocate, checksum, name, stall_watchdog
+        ).result(10)
+
+    def submit(
+        self,
+        signals,
+        segments=1,
+        preallocate=False,
+        checksum=None,
+        name="file.bin",
+        stall_watchdog=None,
+    ):
+        async def run():
+            return await async_downloader.download_file(
+                f"{self.base_url}/{name}",
+                self.local_path,
+                self.engine.session(),
+                signals=signals,
+                segments=segments,
+                preallocate=preallocate,
+                checksum=checksum,
+                stall_watchdog=stall_watchdog,
+                disk_executor=self.engine.disk_executor,
+            )
+
+        return self.engine.submit(run())
+
+    def read_local(self):
+        with open(self.local_path, "rb") as f:
+            return f.read()
+
+    def test_download(self):
+        signals = RecordingSignals()
+        self.assertEqual(self.download(signals), STATUS_COMPLETED)
+        self.assertEqual(self.read_local(), CONTENT)
+        self.assertEqual(signals.progress[-1], (len(CONTENT), len(CONTENT)))
+
+    def test_writes_run_on_the_disk_threads_of_the_engine(self):
+        with open(self.local_path, "wb") as f:
+            f.write(CONTENT[:1000])
+        checksum = StreamingChecksum("sha1")
+        threads = {"write": set(), "resume": set()}
+
+        def on_thread(kind, func):
+            def run(*args):
+                threads[kind].add(threading.current_thread().name)
+                return func(*args)
+
+            return run
+
+        write_chunk = getattr(async_downloader, "__write_chunk")
+        with patch.object(
+            async_downloader, "__write_chunk", on_thread("write", write_chunk)
+        ), patch.object(checksum, "resume_at", on_thread("resume", checksum.resume_at)):
+            self.assertEqual(
+                self.download(RecordingSignals(), checksum=checksum), STATUS_COMPLETED
+            )
+        self.assertEqual(self.read_local(), CONTENT)
+        self.assertTrue(threads["write"])
+        self.assertTrue(all(name.startswith("async-disk-io") for name in threads["write"]))
+        # reading back the resumed prefix does not hold up the writes of other downloads
+        self.assertTrue(threads["resume"])
+        self.assertFalse(any(name.startswith("async-disk-io") for name in threads["resume"]))
+
+    def test_resume(self):
+        with open(self.local_path, "wb") as f:
+            f.write(CONTENT[:1000])
+        signals = RecordingSignals()
+        self.assertEqual(self.download(signals), STATUS_COMPLETED)
+        self.assertEqual(self.read_local(), CONTENT)
+        self.assertTrue(any("Resuming" in event for event in signals.events))
+
+    def test_segmented_download(self):
+        signals = RecordingSignals()
+        self.assertEqual(self.download(signals, segments=4), STATUS_COMPLETED)
+        self.assertEqual(self.read_local(), CONTENT)
+        self.assertFalse(os.path.exists(self.local_path + ".seg4-0"))
+
+    def test_checksum_of_segmented_download(self):
+        checksum = StreamingChecksum("sha1")
+        self.download(RecordingSignals(), segments=4, checksum=checksum)
+        self.assertEqual(checksum.hexdigest(), hashlib.sha1(CONTENT).hexdigest())
+
+    def test_checksum_continues_after_cancel(self):
+        self.server.delay = 0.05
+        checksum = StreamingChecksum("md5")
+        signals = RecordingSignals(cancel_after_bytes=128 * 1024)
+        self.assertEqual(self.download(signals, checksum=checksum), STATUS_STOPPED)
+        self.assertEqual(checksum.offset, os.path.getsize(self.local_path))
+        self.server.delay = 0
+        self.assertEqual(self.download(RecordingSignals(), checksum=checksum), STATUS_COMPLETED)
+        self.assertEqual(checksum.hexdigest(), hashlib.md5(CONTENT).hexdigest())
+
+    def test_disk_io_runs_off_the_event_loop(self):
+        class ThreadRecordingChecksum(StreamingChecksum):
+            def __init__(self):
+                super().__init__("md5")
+                self.threads = set()
+
+            def update(self, data):
+                self.threads.add(threading.current_thread().name)
+                super().update(data)
+
+        for segments in (1, 4):
+            checksum = ThreadRecordingChecksum()
+            self.assertEqual(
+                self.download(RecordingSignals(), segments=segments, checksum=checksum),
+                STATUS_COMPLETED,
+            )
+            self.assertEqual(checksum.hexdigest(), hashlib.md5(CONTENT).hexdigest())
+            # hashed and written next to each other, on the worker threads
+            self.assertTrue(checksum.threads)
+            self.assertNotIn("async-download-engine", checksum.threads)
+            os.remove(self.local_path)
+
+    def test_failed_probe_raises_and_is_not_cached(self):
+        url = f"{self.base_url}/file.missing"
+        probe_cache = ProbeCache()
+
+        async def run():
+            return await async_downloader.probe_url(
+                url, self.engine.session(), probe_cache=probe_cache
+            )
+
+        with self.assertRaises(aiohttp.ClientResponseError):
+            self.engine.submit(run()).result(10)
+        self.assertIsNone(probe_cache.get(url))
+
+    def test_cancel(self):
+        self.server.delay = 0.05
+        signals = RecordingSignals(cancel_after_bytes=128 * 1024)
+        self.assertEqual(self.download(signals), STATUS_STOPPED)
+        self.assertLess(os.path.getsize(self.local_path), len(CONTENT))
+
+    def test_cancel_aborts_stalled_read(self):
+        for segments in (1, 3):
+            signals = RecordingSignals()
+            future = self.submit(signals, segments=segments, name="file.stall")
+            for _ in range(segments):
+                self.assertTrue(self.server.stalled.acquire(timeout=5))
+            started = time.monotonic()
+            signals.cancel()
+            self.assertEqual(future.result(5), STATUS_STOPPED)
+            # without cancelling the task the read would block for TIMEOUT_SECONDS
+            self.assertLess(time.monotonic() - started, 1)
+            # a leftover of the single stream would be resumed instead of split
+            remove_download_artifacts(self.local_path)
+
+    def test_engine_keeps_running_after_abort(self):
+        signals = RecordingSignals()
+        future = self.submit(signals, name="file.stall")
+        self.assertTrue(self.server.stalled.acquire(timeout=5))
+        signals.cancel()
+        self.assertEqual(future.result(5), STATUS_STOPPED)
+        self.assertEqual(self.download(RecordingSignals()), STATUS_COMPLETED)
+
+    def test_stalled_download_is_resumed_on_a_fresh_connection(self):
+        signals = RecordingSignals()
+        watchdog = StallWatchdog(
+            min_rate_bps=64 * 1024, stall_seconds=0.3, check_interval_seconds=0.05
+        )
+        try:
+            result = self.download(signals, name="file.trickle", stall_watchdog=watchdog)
+        finally:
+            watchdog.stop()
+        self.assertEqual(result, STATUS_COMPLETED)
+        self.assertEqual(self.read_local(), CONTENT)
+        stalls = [e for e in signals.events if e.startswith("Stalled below")]
+        self.assertEqual(len(stalls), 1)
+
+    def test_busy_host_is_retried_with_backoff(self):
+        self.server.busy_responses = 2
+        signals = RecordingSignals()
+        breakers = HostCircuitBreakers(failure_threshold=2, open_seconds=0.3)
+
+        async def run():
+            return await async_downloader.download_file(
+                f"{self.base_url}/file.busy",
+                self.local_path,
+                self.engine.session(),
+                signals=signals,
+                attempts=3,
+                retry_policy=RetryPolicy(base_delay_seconds=0.01),
+                circuit_breakers=breakers,
+            )
+
+        self.assertEqual(self.engine.submit(run()).result(10), STATUS_COMPLETED)
+        self.assertEqual(self.read_local(), CONTENT)
+        self.assertTrue(any("circuit breaker tripped" in e for e in signals.events))
+        self.assertTrue(any("recovered" in e for e in signals.events))
+
+    def test_busy_host_is_retried_without_signals(self):
+        self.server.busy_responses = 2
+        breakers = HostCircuitBreakers(failure_threshold=2, open_seconds=0.3)
+        limits = HostConnectionLimits({"127.0.0.1:*": 2})
+
+        async def run():
+            return await async_downloader.download_file(
+                f"{self.base_url}/file.busy",
+                self.local_path,
+                self.engine.session(),
+                attempts=3,
+                retry_policy=RetryPolicy(base_delay_seconds=0.01),
+                circuit_breakers=breakers,
+                host_limits=limits,
+            )
+
+        self.assertEqual(self.engine.submit(run()).result(10), STATUS_COMPLETED)
+        self.assertEqual(self.read_local(), CONTENT)
+        self.assertEqual(limits.get_stats(), {})
+
+    def test_preallocated_download_resumes_from_written_offset(self):
+        self.server.delay = 0.05
+        signals = RecordingSignals(cancel_after_bytes=128 * 1024)
+        self.assertEqual(self.download(signals, preallocate=True), STATUS_STOPPED)
+        offset = read_written_offset(self.local_path)
+        if offset is None:
+            self.skipTest("Preallocation is not supported by the filesystem")
+        self.assertEqual(os.path.getsize(self.local_path), len(CONTENT))
+        self.server.delay = 0
+        signals = RecordingSignals()
+        self.assertEqual(self.download(signals, preallocate=True), STATUS_COMPLETED)
+        self.assertEqual(self.read_local(), CONTENT)
+        self.assertFalse(os.path.exists(written_offset_path(self.local_path)))
+        # resumed at the recorded offset, not at the preallocated size
+        self.assertIn(f"Resuming download at {human_filesize(offset)}.", signals.events)
+
+    def test_queued_downloader_on_engine(self):
+        job = JobDTO(id=1, name="job", target_folder=self.tmp.name)
+        journal = MagicMock()
+        downloader = QueuedDownloader(
+            job=job,
+            journal_daemon=journal,
+            worker_pool_size=2,
+            engine=self.engine,
+            checksum_algorithm="sha256",
+        )
+        downloader.start_download_threads()
+        files = [
+            FileModelDTO(
+                job_name="job", name=f"file{i}.bin", url=f"{self.base_url}/file{i}.bin"
+            )
+            for i in range(3)
+        ]
+        downloader.download_files(files)
+        deadline = time.time() + 10
+        while downloader.is_downloading() and time.time() < deadline:
+            time.sleep(0.05)
+        downloader.stop()
+        for i in range(3):
+            with open(os.path.join(self.tmp.name, f"file{i}.bin"), "rb") as f:
+                self.assertEqual(f.read(), CONTENT)
+        journal.update_file_checksum.assert_any_call(
+            "job", "file0.bin", "sha256:" + hashlib.sha256(CONTENT).hexdigest()
+        )
+        # all workers are coroutines on the single engine thread
+        self.assertFalse(
+            any(t.name.startswith("download-job") for t in threading.enumerate())
+        )
+
+    def test_idle_workers_wait_for_files_without_polling(self):
+        job = JobDTO(id=1, name="job", target_folder=self.tmp.name)
+        downloader = QueuedDownloader(
+            job=job, journal_daemon=MagicMock(), worker_pool_size=2, engine=self.engine
+        )
+        pops = []
+        pop_file = downloader.queue.pop_file
+
+        def counting_pop_file(*args, **kwargs):
+            pops.append(time.monotonic())
+            return pop_file(*args, **kwargs)
+
+        downloader.queue.pop_file = counting_pop_file
+        downloader.start_download_threads()
+        time.sleep(0.5)
+        # one look at the empty queue each, then they sleep until woken
+        self.assertLessEqual(len(pops), 2)
+        downloader.download_file(
+            FileModelDTO(job_name="job", name="file0.bin", url=f"{self.base_url}/file0.bin")
+        )
+        deadline = time.time() + 10
+        while downloader.is_downloading() and time.time() < deadline:
+            time.sleep(0.05)
+        downloader.stop()
+        with open(os.path.join(self.tmp.name, "file0.bin"), "rb") as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertFalse(any(not t.done() for t in downloader.threads))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import hashlib
+import pytest
+from aoget.web.checksum import (
+    StreamingChecksum,
+    file_checksum,
+    format_checksum,
+    parse_checksum,
+)
+
+CONTENT = bytes(range(256)) * 64
+
+
+@pytest.fixture
+def local_path(tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+@pytest.mark.parametrize("algorithm", ["md5", "sha1", "sha256"])
+def test_streamed_chunks_give_the_digest_of_the_file(algorithm):
+    checksum = StreamingChecksum(algorithm)
+    for i in range(0, len(CONTENT), 1000):
+        checksum.update(memoryview(CONTENT)[i : i + 1000])
+    assert checksum.offset == len(CONTENT)
+    assert checksum.hexdigest() == hashlib.new(algorithm, CONTENT).hexdigest()
+
+
+def test_unsupported_algorithm():
+    with pytest.raises(ValueError):
+        StreamingChecksum("crc32")
+
+
+def test_resume_reads_only_what_was_not_hashed(local_path, monkeypatch):
+    checksum = StreamingChecksum()
+    checksum.update(CONTENT[:1000])
+    reads = []
+    real_open = open
+
+    def recording_open(path, mode):
+        f = real_open(path, mode)
+        real_read = f.read
+        f.read = lambda size: reads.append(size) or real_read(size)
+        return f
+
+    monkeypatch.setattr("builtins.open", recording_open)
+    checksum.resume_at(local_path, 3000)
+    assert sum(reads) == 2000
+    checksum.update(CONTENT[3000:])
+    assert checksum.hexdigest() == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_resume_behind_the_state_starts_over(local_path):
+    checksum = StreamingChecksum()
+    checksum.update(b"stale bytes of an earlier version of the file")
+    checksum.resume_at(local_path, 0)
+    assert checksum.offset == 0
+    checksum.update(CONTENT)
+    assert checksum.hexdigest() == hashlib.sha256(CONTENT).hexdigest()
+
+
+def test_checkpoint_drops_state_not_matching_the_disk():
+    checksum = StreamingChecksum()
+    checksum.update(CONTENT[:1000])
+    checksum.checkpoint(1000)
+    assert checksum.offset == 1000
+    checksum.update(CONTENT[1000:2000])
+    # the second chunk failed to be written
+    checksum.checkpoint(1000)
+    assert checksum.offset == 0
+
+
+def test_file_checksum(local_path):
+    assert file_checksum(local_path, "md5") == format_checksum(
+        "md5", hashlib.md5(CONTENT).hexdigest()
+    )
+
+
+def test_parse_checksum():
+    assert parse_checksum("sha1:abc") == ("sha1", "abc")
+    assert parse_checksum("abc") == (None, None)
+    assert parse_checksum("crc32:abc") == (None, None)
+    assert parse_checksum(None) == (None, None)
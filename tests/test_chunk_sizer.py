@@ -0,0 +1,61 @@
+from aoget.web.chunk_sizer import (
+    AdaptiveChunkSizer,
+    MAX_CHUNK_SECONDS,
+    MEASUREMENT_WINDOW_SECONDS,
+)
+
+
+def __feed(chunk_sizer: AdaptiveChunkSizer, link_bps: float, overhead_seconds: float):
+    """Feed the sizer a measurement window of reads over a link of the given speed, each read
+    costing a fixed per-chunk overhead on top of the transfer time."""
+    elapsed = 0.0
+    while elapsed < MEASUREMENT_WINDOW_SECONDS:
+        size = chunk_sizer.next_size()
+        seconds = size / link_bps + overhead_seconds
+        chunk_sizer.record(size, seconds)
+        elapsed += seconds
+
+
+def test_grows_while_throughput_rises():
+    chunk_sizer = AdaptiveChunkSizer(initial_size=8 * 1024, max_size=4 * 1024 * 1024)
+    link_bps = 125 * 1024 * 1024  # 1 Gbps
+    overhead_seconds = 0.0001
+    # larger chunks amortize the per-chunk overhead
+    for _ in range(20):
+        __feed(chunk_sizer, link_bps, overhead_seconds)
+    size = chunk_sizer.next_size()
+    assert size >= 256 * 1024
+    assert size / (size / link_bps + overhead_seconds) > 0.9 * link_bps
+
+
+def test_stops_growing_on_plateau():
+    chunk_sizer = AdaptiveChunkSizer(initial_size=64 * 1024)
+    # no per-chunk overhead, the chunk size does not matter for the throughput
+    for _ in range(10):
+        __feed(chunk_sizer, 10 * 1024 * 1024, 0)
+    assert chunk_sizer.next_size() == 128 * 1024
+
+
+def test_shrinks_when_reads_are_slow():
+    chunk_sizer = AdaptiveChunkSizer(initial_size=1024 * 1024)
+    chunk_sizer.record(1024 * 1024, MAX_CHUNK_SECONDS * 2)
+    assert chunk_sizer.next_size() == 512 * 1024
+
+
+def test_capped_under_rate_limit():
+    chunk_sizer = AdaptiveChunkSizer(initial_size=1024 * 1024)
+    assert chunk_sizer.next_size(rate_limit_bps=100 * 1024) < 100 * 1024
+    assert chunk_sizer.next_size(rate_limit_bps=1) == chunk_sizer.min_size
+    assert chunk_sizer.next_size() == 1024 * 1024
+
+
+def test_stats():
+    chunk_sizer = AdaptiveChunkSizer()
+    chunk_sizer.record(1000, 0.01)
+    chunk_sizer.record(3000, 0.01)
+    stats = chunk_sizer.stats()
+    assert stats["chunks"] == 2
+    assert stats["bytes"] == 4000
+    assert stats["smallest"] == 1000
+    assert stats["largest"] == 3000
+    assert stats["average"] == 2000
@@ -0,0 +1,126 @@
+import time
+from unittest.mock import MagicMock
+from aoget.web.circuit_breaker import (
+    CircuitBreaker,
+    HostCircuitBreakers,
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    host_of,
+)
+from aoget.web.retry_policy import ServerBusyError
+
+
+def __breaker():
+    return CircuitBreaker("host", failure_threshold=3, open_seconds=10, max_open_seconds=100)
+
+
+def test_host_of():
+    assert host_of("https://IA800.us.archive.org/12/items/x") == "ia800.us.archive.org"
+
+
+def test_trips_after_consecutive_failures():
+    breaker = __breaker()
+    assert not breaker.record_failure(now=0)
+    assert not breaker.record_failure(now=0)
+    assert breaker.record_failure(now=0)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow_request(now=5)
+
+
+def test_success_resets_the_failures():
+    breaker = __breaker()
+    breaker.record_failure(now=0)
+    breaker.record_failure(now=0)
+    breaker.record_success()
+    assert not breaker.record_failure(now=0)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_single_probe_after_cooldown():
+    breaker = __breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0)
+    assert breaker.allow_request(now=10)
+    assert breaker.state == STATE_HALF_OPEN
+    # the others wait for the outcome of the probe
+    assert not breaker.allow_request(now=11)
+    assert breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.allow_request(now=11)
+
+
+def test_failed_probe_opens_for_longer():
+    breaker = __breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0)
+    assert breaker.allow_request(now=10)
+    assert breaker.record_failure(now=10)
+    assert breaker.cooldown == 20
+    assert not breaker.allow_request(now=29)
+    assert breaker.allow_request(now=30)
+
+
+def test_cooldown_is_capped():
+    breaker = __breaker()
+    now = 0
+    for _ in range(3):
+        breaker.record_failure(now=now)
+    for _ in range(10):
+        now = breaker.open_until
+        breaker.allow_request(now=now)
+        breaker.record_failure(now=now)
+    assert breaker.cooldown == 100
+
+
+def test_retry_after_extends_cooldown():
+    breaker = __breaker()
+    for _ in range(2):
+        breaker.record_failure(now=0)
+    breaker.record_failure(retry_after=50, now=0)
+    assert breaker.open_until == 50
+
+
+def test_failures_while_open_are_ignored():
+    breaker = __breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0)
+    assert not breaker.record_failure(now=1)
+    assert breaker.open_until == 10
+
+
+def test_silent_probe_does_not_hold_the_others_forever():
+    breaker = __breaker()
+    for _ in range(3):
+        breaker.record_failure(now=0)
+    assert breaker.allow_request(now=10)
+    assert not breaker.allow_request(now=15)
+    assert breaker.allow_request(now=21)
+
+
+def test_breakers_are_per_host():
+    breakers = HostCircuitBreakers(failure_threshold=1)
+    breakers.record_failure("http://a.org/1", ServerBusyError("http://a.org/1", 503))
+    assert not breakers.breaker_for("http://a.org/2").allow_request()
+    assert breakers.breaker_for("http://b.org/1").allow_request()
+
+
+def test_trip_and_recovery_are_reported():
+    breakers = HostCircuitBreakers(failure_threshold=1, open_seconds=0.1)
+    on_event = MagicMock()
+    breakers.record_failure("http://a.org/1", None, on_event)
+    assert "tripped" in on_event.call_args.args[0]
+    assert breakers.wait_until_closed("http://a.org/2", on_event=on_event)
+    events = [call.args[0] for call in on_event.call_args_list]
+    assert events[1].startswith("Paused")
+    assert events[2].startswith("Resuming")
+    breakers.record_success("http://a.org/2", on_event)
+    assert "recovered" in on_event.call_args.args[0]
+
+
+def test_wait_is_cancellable():
+    breakers = HostCircuitBreakers(failure_threshold=1, open_seconds=60)
+    breakers.record_failure("http://a.org/1")
+    started = time.monotonic()
+    assert not breakers.wait_until_closed("http://a.org/1", is_cancelled=lambda: True)
+    assert time.monotonic() - started < 1
@@ -1,5 +1,7 @@
+import os
 import tempfile
-from aoget.util.disk_util import get_local_file_size
+import pytest
+from aoget.util.disk_util import get_local_file_size, preallocate
 
 
 def test_get_local_file_size_existing_file():
@@ -19,3 +21,19 @@ def test_get_local_file_size_non_existing_file():
 
     # Check that the function returns -1 for a non-existing file
     assert get_local_file_size(non_existing_file_path) == -1
+
+
+def test_preallocate_sets_file_size(tmp_path):
+    with open(tmp_path / "file.bin", "wb") as f:
+        if not preallocate(f, 1024 * 1024):
+            pytest.skip("Preallocation is not supported by the filesystem")
+        assert os.fstat(f.fileno()).st_size == 1024 * 1024
+        # written from the start, the reserved space is overwritten in place
+        f.write(b"data")
+    assert get_local_file_size(str(tmp_path / "file.bin")) == 1024 * 1024
+
+
+def test_preallocate_of_unknown_size_is_skipped(tmp_path):
+    with open(tmp_path / "file.bin", "wb") as f:
+        assert not preallocate(f, -1)
+    assert get_local_file_size(str(tmp_path / "file.bin")) == 0
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+import pytest
+from aoget.web.disk_writer import DiskWriter, DiskWriterPool
+
+
+@pytest.fixture
+def writer():
+    writer = DiskWriter("test-disk-writer", max_in_flight_bytes=1024)
+    yield writer
+    writer.stop()
+
+
+def __read(path) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def __hold_writes(monkeypatch) -> threading.Event:
+    """Make the writer thread wait for the returned event before each batch."""
+    release = threading.Event()
+    write_all = DiskWriter._DiskWriter__write_all
+
+    def held_write_all(fd, buffers):
+        release.wait()
+        write_all(fd, buffers)
+
+    monkeypatch.setattr(DiskWriter, "_DiskWriter__write_all", staticmethod(held_write_all))
+    return release
+
+
+def test_streams_are_written_in_order(writer, tmp_path):
+    paths = [tmp_path / f"file{i}.bin" for i in range(3)]
+    files = [open(path, "wb", buffering=0) for path in paths]
+    streams = [writer.open_stream(f) for f in files]
+    for i in range(100):
+        for index, stream in enumerate(streams):
+            stream.write(bytes([index, i]))
+    for stream, f in zip(streams, files):
+        stream.close()
+        f.close()
+    for index, path in enumerate(paths):
+        assert __read(path) == b"".join(bytes([index, i]) for i in range(100))
+
+
+def test_backpressure_caps_in_flight_bytes(writer, tmp_path, monkeypatch):
+    release = __hold_writes(monkeypatch)
+    with open(tmp_path / "file.bin", "wb", buffering=0) as f:
+        stream = writer.open_stream(f)
+        submitter = threading.Thread(
+            target=lambda: [stream.write(b"x" * 512) for _ in range(8)]
+        )
+        submitter.start()
+        time.sleep(0.2)
+        # the writer is held, so the submitter waits at the cap
+        assert submitter.is_alive()
+        assert writer.in_flight_bytes <= writer.max_in_flight_bytes
+        release.set()
+        submitter.join(2)
+        assert not submitter.is_alive()
+        stream.close()
+    assert __read(tmp_path / "file.bin") == b"x" * 4096
+
+
+def test_queued_chunks_are_coalesced(tmp_path, monkeypatch):
+    release = __hold_writes(monkeypatch)
+    writer = DiskWriter("test-disk-writer")
+    with open(tmp_path / "file.bin", "wb", buffering=0) as f:
+        stream = writer.open_stream(f)
+        stream.write(b"first")
+        time.sleep(0.1)  # the writer takes the first chunk and waits
+        for i in range(50):
+            stream.write(b"%02d" % i)
+        release.set()
+        stream.close()
+    writer.stop()
+    # one write for the first chunk, one for all queued while it was held
+    assert writer.writes == 2
+    assert __read(tmp_path / "file.bin") == b"first" + b"".join(
+        b"%02d" % i for i in range(50)
+    )
+
+
+def test_read_buffers_are_reused_after_written(writer, tmp_path):
+    with open(tmp_path / "file.bin", "wb", buffering=0) as f:
+        stream = writer.open_stream(f)
+        for i in range(20):
+            view = stream.buffer(4)
+            view[:4] = bytes([i]) * 4
+            stream.write(view[:4])
+        stream.close()
+    assert __read(tmp_path / "file.bin") == b"".join(bytes([i]) * 4 for i in range(20))
+
+
+def test_write_error_is_raised(writer, tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"")
+    with open(path, "rb", buffering=0) as f:
+        stream = writer.open_stream(f)
+        stream.write(b"data")
+        with pytest.raises(OSError):
+            stream.close()
+
+
+def test_submit_after_stop_is_rejected(writer, tmp_path):
+    with open(tmp_path / "file.bin", "wb", buffering=0) as f:
+        stream = writer.open_stream(f)
+        stream.write(b"data")
+        writer.stop()
+        with pytest.raises(OSError):
+            stream.write(b"more")
+        stream.close()
+    assert __read(tmp_path / "file.bin") == b"data"
+
+
+def test_stop_fails_the_writes_waiting_for_backpressure(writer, tmp_path, monkeypatch):
+    release = __hold_writes(monkeypatch)
+    errors = []
+    with open(tmp_path / "file.bin", "wb", buffering=0) as f:
+        stream = writer.open_stream(f)
+        stream.write(b"x" * 1024)
+
+        def write_beyond_the_cap():
+            try:
+                stream.write(b"y" * 1024)
+            except OSError as e:
+                errors.append(e)
+
+        waiter = threading.Thread(target=write_beyond_the_cap)
+        waiter.start()
+        time.sleep(0.1)
+        stopper = threading.Thread(target=writer.stop)
+        stopper.start()
+        release.set()
+        waiter.join(5)
+        stopper.join(5)
+        assert not waiter.is_alive()
+        assert len(errors) == 1
+    # the chunk queued before the stop is written, the rejected one is not
+    assert __read(tmp_path / "file.bin") == b"x" * 1024
+
+
+def test_pool_shares_writer_per_device(tmp_path):
+    pool = DiskWriterPool()
+    writer = pool.writer_for(os.path.join(tmp_path, "a", "file.bin"))
+    assert pool.writer_for(os.path.join(tmp_path, "b.bin")) is writer
+    pool.close()
@@ -0,0 +1,114 @@
+import threading
+import time
+from unittest.mock import MagicMock
+from aoget.web.download_scheduler import DownloadScheduler
+
+
+class FakeDownloader:
+    """Downloads block until released, so that the slots held can be observed."""
+
+    def __init__(self, name: str, weight: int, files: int = 100):
+        self.job = MagicMock()
+        self.job.name = name
+        self.worker_pool_size = weight
+        self.files = files
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.hedges = 0
+
+    def has_queued_files(self) -> bool:
+        return self.files > 0
+
+    def download_next(self) -> bool:
+        with self.lock:
+            if self.files == 0:
+                return False
+            self.files -= 1
+        self.release.wait(5)
+        return True
+
+    def hedge_idle(self) -> None:
+        self.hedges += 1
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def slots_of(scheduler: DownloadScheduler) -> dict:
+    return {name: job["slots"] for name, job in scheduler.get_stats()["jobs"].items()}
+
+
+def test_slots_are_shared_by_weight():
+    scheduler = DownloadScheduler(worker_count=4)
+    light = FakeDownloader("light", weight=1, files=0)
+    heavy = FakeDownloader("heavy", weight=3, files=0)
+    scheduler.register(light)
+    scheduler.register(heavy)
+    # both queued at once, or the first one would take the idle workers
+    light.files = heavy.files = 100
+    scheduler.notify()
+    try:
+        assert wait_until(lambda: scheduler.get_stats()["busy"] == 4)
+        assert slots_of(scheduler) == {"light": 1, "heavy": 3}
+    finally:
+        light.release.set()
+        heavy.release.set()
+        scheduler.shutdown()
+
+
+def test_idle_shares_go_to_the_other_jobs():
+    scheduler = DownloadScheduler(worker_count=4)
+    busy = FakeDownloader("busy", weight=1)
+    idle = FakeDownloader("idle", weight=3, files=0)
+    scheduler.register(busy)
+    scheduler.register(idle)
+    try:
+        assert wait_until(lambda: scheduler.get_stats()["busy"] == 4)
+        assert slots_of(scheduler) == {"busy": 4, "idle": 0}
+    finally:
+        busy.release.set()
+        scheduler.shutdown()
+
+
+def test_jobs_without_weight_are_not_served():
+    scheduler = DownloadScheduler(worker_count=2)
+    paused = FakeDownloader("paused", weight=0)
+    scheduler.register(paused)
+    try:
+        time.sleep(0.1)
+        assert scheduler.get_stats()["busy"] == 0
+        paused.worker_pool_size = 1
+        scheduler.notify()
+        assert wait_until(lambda: scheduler.get_stats()["busy"] == 2)
+    finally:
+        paused.release.set()
+        scheduler.shutdown()
+
+
+def test_unregister_waits_for_the_running_downloads():
+    scheduler = DownloadScheduler(worker_count=2)
+    downloader = FakeDownloader("job", weight=1)
+    scheduler.register(downloader)
+    assert wait_until(lambda: scheduler.get_stats()["busy"] == 2)
+    threading.Timer(0.1, downloader.release.set).start()
+    scheduler.unregister(downloader, sync=True)
+    assert scheduler.get_stats() == {"workers": 2, "busy": 0, "jobs": {}}
+    # no new slots after unregistering
+    assert downloader.files == 98
+    scheduler.shutdown()
+
+
+def test_idle_workers_hedge_for_the_jobs():
+    scheduler = DownloadScheduler(worker_count=1)
+    downloader = FakeDownloader("job", weight=1, files=0)
+    scheduler.register(downloader)
+    try:
+        assert wait_until(lambda: downloader.hedges > 0)
+    finally:
+        scheduler.shutdown()
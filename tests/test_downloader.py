@@ -1,13 +1,50 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import time
 import unittest
-import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
 from pathlib import Path
+import requests
+from aoget.web import downloader
+from aoget.web.session_pool import SessionPool
+from aoget.web.disk_writer import DiskWriter, DiskWriterPool
 from aoget.web.downloader import (
     DownloadSignals,
+    STATUS_COMPLETED,
+    STATUS_STOPPED,
     download_file,
+    hedge_part_path,
     validate_file,
     resolve_remote_file_size,
+    segment_ranges,
+    segment_part_path,
+    probe_url,
+    remove_download_artifacts,
+    read_written_offset,
+    record_written_offset,
+    written_offset_path,
+    written_size,
 )
+from aoget.web.probe_cache import ProbeCache
+from aoget.web.checksum import StreamingChecksum
+from aoget.web.stall_watchdog import StallWatchdog
+from aoget.web.retry_policy import RetryPolicy
+from aoget.web.circuit_breaker import HostCircuitBreakers
+from aoget.web.host_limits import HostConnectionLimits
+
+
+def read_chunks(chunks: list):
+    """Build a side effect for response.raw.read which returns the given chunks, then EOF."""
+    remaining = list(chunks)
+
+    def read(amt=None, decode_content=None):
+        return remaining.pop(0) if remaining else b""
+
+    return read
 
 
 class TestProgressObserver(DownloadSignals):
@@ -41,7 +78,7 @@ class TestDownloader(unittest.TestCase):
             mock_requests.head.return_value = mock_head
 
             mock_get = MagicMock()
-            mock_get.iter_content.return_value = [b"chunk1", b"chunk2"]
+            mock_get.raw.read.side_effect = read_chunks([b"chunk1", b"chunk2"])
             mock_requests.get.return_value = mock_get
 
             download_file(self.url, self.local_path, progress_observer)
@@ -62,7 +99,7 @@ class TestDownloader(unittest.TestCase):
             mock_requests.head.return_value = mock_head
 
             mock_get = MagicMock()
-            mock_get.iter_content.return_value = [b"chunk1", b"chunk2"]
+            mock_get.raw.read.side_effect = read_chunks([b"chunk1", b"chunk2"])
             mock_requests.get.return_value = mock_get
 
             # Create a partially downloaded file
@@ -76,6 +113,157 @@ class TestDownloader(unittest.TestCase):
             with file.open("rb") as f:
                 self.assertEqual(f.read(), b"partial_datachunk1chunk2")
 
+    def __ranged_get(self, content: bytes):
+        """Build a side effect for requests.get which honors the Range header."""
+
+        def ranged_get(url, stream=True, headers=None, timeout=None):
+            response = MagicMock()
+            first_byte, last_byte = 0, len(content) - 1
+            if headers and "Range" in headers:
+                byte_range = headers["Range"].split("=")[1]
+                first, last = byte_range.split("-")
+                first_byte = int(first)
+                last_byte = int(last) if last else last_byte
+                response.status_code = 206
+            else:
+                response.status_code = 200
+            response.raw.read.side_effect = read_chunks([content[first_byte:last_byte + 1]])
+            return response
+
+        return ranged_get
+
+    def test_segment_ranges(self):
+        self.assertEqual(segment_ranges(10, 3), [(0, 2), (3, 5), (6, 9)])
+        self.assertEqual(segment_ranges(10, 1), [(0, 9)])
+        self.assertEqual(segment_ranges(2, 4), [(0, 0), (1, 1)])
+
+    def test_download_file_segmented(self):
+        progress_observer = TestProgressObserver()
+        content = b"0123456789abcdefghij"
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            mock_head = MagicMock()
+            mock_head.headers = {
+                "content-length": str(len(content)),
+                "accept-ranges": "bytes",
+            }
+            mock_requests.head.return_value = mock_head
+            mock_requests.get.side_effect = self.__ranged_get(content)
+
+            result = download_file(
+                self.url, self.local_path, progress_observer, segments=4
+            )
+
+            self.assertEqual(result, "Completed")
+            self.assertEqual(mock_requests.get.call_count, 4)
+            with Path(self.local_path).open("rb") as f:
+                self.assertEqual(f.read(), content)
+            for i in range(4):
+                self.assertFalse(
+                    Path(segment_part_path(self.local_path, 4, i)).exists()
+                )
+
+    def test_download_file_segmented_resumes_parts(self):
+        progress_observer = TestProgressObserver()
+        content = b"0123456789abcdefghij"
+        # segment 0 complete, segment 1 partially on disk
+        with open(segment_part_path(self.local_path, 2, 0), "wb") as f:
+            f.write(content[:10])
+        with open(segment_part_path(self.local_path, 2, 1), "wb") as f:
+            f.write(content[10:15])
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            mock_head = MagicMock()
+            mock_head.headers = {
+                "content-length": str(len(content)),
+                "accept-ranges": "bytes",
+            }
+            mock_requests.head.return_value = mock_head
+            mock_requests.get.side_effect = self.__ranged_get(content)
+
+            download_file(self.url, self.local_path, progress_observer, segments=2)
+
+            mock_requests.get.assert_called_once()
+            self.assertEqual(
+                mock_requests.get.call_args.kwargs["headers"], {"Range": "bytes=15-19"}
+            )
+            with Path(self.local_path).open("rb") as f:
+                self.assertEqual(f.read(), content)
+
+    def test_remove_download_artifacts_of_half_done_segmented_download(self):
+        progress_observer = TestProgressObserver()
+        content = b"0123456789abcdefghij"
+        with open(segment_part_path(self.local_path, 2, 0), "wb") as f:
+            f.write(content[:10])
+        with open(segment_part_path(self.local_path, 2, 1), "wb") as f:
+            f.write(content[10:15])
+        # a leftover of an earlier split and a part of another file
+        with open(segment_part_path(self.local_path, 4, 3), "wb") as f:
+            f.write(content[15:])
+        other_part = segment_part_path(self.local_path + ".bak", 2, 0)
+        with open(other_part, "wb") as f:
+            f.write(content[:10])
+        try:
+            removed = remove_download_artifacts(self.local_path)
+
+            self.assertEqual(len(removed), 3)
+            self.assertFalse(Path(segment_part_path(self.local_path, 2, 0)).exists())
+            self.assertFalse(Path(segment_part_path(self.local_path, 2, 1)).exists())
+            self.assertFalse(Path(segment_part_path(self.local_path, 4, 3)).exists())
+            self.assertTrue(Path(other_part).exists())
+        finally:
+            Path(other_part).unlink()
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            mock_head = MagicMock()
+            mock_head.headers = {
+                "content-length": str(len(content)),
+                "accept-ranges": "bytes",
+            }
+            mock_requests.head.return_value = mock_head
+            mock_requests.get.side_effect = self.__ranged_get(content)
+
+            download_file(self.url, self.local_path, progress_observer, segments=2)
+
+            # downloaded from scratch, nothing resumed
+            self.assertEqual(mock_requests.get.call_count, 2)
+            with Path(self.local_path).open("rb") as f:
+                self.assertEqual(f.read(), content)
+
+    def test_remove_download_artifacts_removes_written_offset(self):
+        with open(self.local_path, "wb") as f:
+            f.truncate(self.file_size)
+        record_written_offset(self.local_path, 4)
+
+        removed = remove_download_artifacts(self.local_path)
+
+        self.assertEqual(removed, [self.local_path, written_offset_path(self.local_path)])
+        self.assertIsNone(read_written_offset(self.local_path))
+        self.assertEqual(written_size(self.local_path), -1)
+
+    def test_remove_download_artifacts_removes_unsettled_hedge(self):
+        with open(self.local_path, "wb") as f:
+            f.write(b"0123")
+        with open(hedge_part_path(self.local_path), "wb") as f:
+            f.write(b"4567")
+
+        removed = remove_download_artifacts(self.local_path)
+
+        self.assertEqual(removed, [self.local_path, hedge_part_path(self.local_path)])
+        self.assertFalse(Path(hedge_part_path(self.local_path)).exists())
+
+    def test_download_file_segmented_falls_back_without_ranges(self):
+        progress_observer = TestProgressObserver()
+        content = b"0123456789abcdefghij"
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            mock_head = MagicMock()
+            mock_head.headers = {"content-length": str(len(content))}
+            mock_requests.head.return_value = mock_head
+            mock_requests.get.side_effect = self.__ranged_get(content)
+
+            download_file(self.url, self.local_path, progress_observer, segments=4)
+
+            mock_requests.get.assert_called_once()
+            with Path(self.local_path).open("rb") as f:
+                self.assertEqual(f.read(), content)
+
     def test_validate_file(self):
         expected_hash = (
             "e7d87b738825c33824cf3fd32b7314161fc8c425129163ff5e7260fc7288da36"
@@ -103,7 +291,7 @@ class TestDownloader(unittest.TestCase):
             mock_head.headers = {"content-length": str(self.file_size)}
             mock_requests.head.return_value = mock_head
             mock_get = MagicMock()
-            mock_get.iter_content.return_value = [b"chunk1", b"chunk2"]
+            mock_get.raw.read.side_effect = read_chunks([b"chunk1", b"chunk2"])
             mock_requests.get.return_value = mock_get
 
             download_file(self.url, self.local_path, progress_observer)
@@ -138,7 +326,7 @@ class TestDownloader(unittest.TestCase):
             mock_requests.head.return_value = mock_head
 
             mock_get = MagicMock()
-            mock_get.iter_content.return_value = [b"chunk1", b"chunk2"]
+            mock_get.raw.read.side_effect = read_chunks([b"chunk1", b"chunk2"])
             mock_requests.get.return_value = mock_get
 
             # Create a partially downloaded file
@@ -165,74 +353,480 @@ class TestDownloader(unittest.TestCase):
             with file.open("rb") as f:
                 self.assertEqual(f.read(), b"partial_data")
 
-    def test_cycle_timings_1(self):
-        written = 100
-        chunk_size = 32
-        time_to_sleep = 2
-        cycles = time_to_sleep  # 2
-        remaining_time = time_to_sleep
-        expected_fake_written = [84, 100]
-        expected_sleep_times = [0.5, 0.5]
-        fake_written = []
-        sleep_times = []
-        for i in range(math.ceil(cycles)):
-            fake_delta = (
-                (i + 1) * (chunk_size / cycles)
-                if cycles > 1
-                else (i + 1) * (chunk_size * cycles)
+    def test_probe_url_falls_back_to_ranged_get(self):
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            mock_head = MagicMock()
+            mock_head.status_code = 405
+            mock_requests.head.return_value = mock_head
+            mock_get = MagicMock()
+            mock_get.status_code = 206
+            mock_get.url = "https://mirror.example.com/file.txt"
+            mock_get.headers = {"content-range": "bytes 0-0/1234", "etag": '"abc"'}
+            mock_requests.get.return_value = mock_get
+
+            metadata = probe_url(self.url)
+
+            self.assertEqual(metadata.content_length, 1234)
+            self.assertTrue(metadata.accept_ranges)
+            self.assertEqual(metadata.validator(), '"abc"')
+            self.assertEqual(metadata.final_url, "https://mirror.example.com/file.txt")
+            self.assertEqual(
+                mock_requests.get.call_args.kwargs["headers"], {"Range": "bytes=0-0"}
             )
-            fake_written.append(int(written - chunk_size + fake_delta))
-            sleep_times.append(min(remaining_time, 1 / cycles))
-            remaining_time -= 1 / cycles
-
-        self.assertEqual(fake_written, expected_fake_written)
-        self.assertEqual(sleep_times, expected_sleep_times)
-
-    def test_cycle_timings_2(self):
-        written = 100
-        chunk_size = 32
-        time_to_sleep = 3
-        cycles = time_to_sleep  # 2
-        remaining_time = time_to_sleep
-        expected_fake_written = [78, 89, 100]
-        expected_sleep_times = [1 / 3, 1 / 3, 1 / 3]
-        fake_written = []
-        sleep_times = []
-        for i in range(math.ceil(cycles)):
-            fake_delta = (
-                (i + 1) * (chunk_size / cycles)
-                if cycles > 1
-                else (i + 1) * (chunk_size * cycles)
+            mock_get.close.assert_called_once()
+
+    def test_probe_url_follows_redirect(self):
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            redirect = MagicMock()
+            redirect.headers = {"location": "https://mirror.example.com/file.txt"}
+            target = MagicMock()
+            target.headers = {"content-length": "42", "accept-ranges": "bytes"}
+            mock_requests.head.side_effect = [redirect, target]
+
+            metadata = probe_url(self.url)
+
+            self.assertEqual(metadata.content_length, 42)
+            self.assertEqual(metadata.final_url, "https://mirror.example.com/file.txt")
+            self.assertEqual(metadata.url, self.url)
+
+    def test_single_probe_for_resolve_and_download(self):
+        progress_observer = TestProgressObserver()
+        probe_cache = ProbeCache()
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            mock_head = MagicMock()
+            mock_head.status_code = 200
+            mock_head.headers = {"content-length": str(self.file_size)}
+            mock_requests.head.return_value = mock_head
+            mock_get = MagicMock()
+            mock_get.raw.read.side_effect = read_chunks([b"chunk1", b"chunk2"])
+            mock_requests.get.return_value = mock_get
+
+            size = resolve_remote_file_size(self.url, probe_cache=probe_cache)
+            download_file(
+                self.url,
+                self.local_path,
+                progress_observer,
+                file_size=size,
+                probe_cache=probe_cache,
             )
-            fake_written.append(int(written - chunk_size + fake_delta))
-            sleep_times.append(min(remaining_time, 1 / cycles))
-            remaining_time -= 1 / cycles
-
-        self.assertEqual(fake_written, expected_fake_written)
-        self.assertEqual(sleep_times, expected_sleep_times)
-
-    def test_cycle_timings_3(self):
-        written = 100
-        chunk_size = 32
-        time_to_sleep = 0.8
-        cycles = time_to_sleep  # 2
-        remaining_time = time_to_sleep
-        expected_fake_written = [93]
-        expected_sleep_times = [0.8]
-        fake_written = []
-        sleep_times = []
-        for i in range(math.ceil(cycles)):
-            fake_delta = (
-                (i + 1) * (chunk_size / cycles)
-                if cycles > 1
-                else (i + 1) * (chunk_size * cycles)
+
+            self.assertEqual(Path(self.local_path).stat().st_size, self.file_size)
+            self.assertEqual(mock_requests.head.call_count, 1)
+            self.assertEqual(mock_requests.get.call_count, 1)
+
+    def test_resume_restarts_if_remote_file_changed(self):
+        progress_observer = TestProgressObserver()
+        with patch("aoget.web.downloader.requests") as mock_requests:
+            mock_head = MagicMock()
+            mock_head.headers = {
+                "content-length": str(self.file_size),
+                "accept-ranges": "bytes",
+                "etag": '"v2"',
+            }
+            mock_requests.head.return_value = mock_head
+            mock_get = MagicMock()
+            mock_get.status_code = 200
+            mock_get.raw.read.side_effect = read_chunks([b"chunk1", b"chunk2"])
+            mock_requests.get.return_value = mock_get
+
+            file = Path(self.local_path)
+            with file.open("wb") as f:
+                f.write(b"stale")
+
+            download_file(self.url, self.local_path, progress_observer)
+
+            self.assertEqual(
+                mock_requests.get.call_args.kwargs["headers"],
+                {"Range": "bytes=5-", "If-Range": '"v2"'},
             )
-            fake_written.append(int(written - chunk_size + fake_delta))
-            sleep_times.append(min(remaining_time, 1 / cycles))
-            remaining_time -= 1 / cycles
+            with file.open("rb") as f:
+                self.assertEqual(f.read(), b"chunk1chunk2")
+
+
+BODY = os.urandom(3 * 1024 * 1024 + 17)
+
+
+class BodyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def __body(self):
+        if self.path.endswith(".gz"):
+            return gzip.compress(BODY), {"Content-Encoding": "gzip"}
+        return BODY, {}
+
+    def do_HEAD(self):
+        if self.path.endswith(".missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.endswith(".busy") and self.server.busy_responses > 0:
+            self.server.busy_responses -= 1
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body, headers = self.__body()
+        range_header = self.headers.get("Range")
+        if range_header:
+            first, last = range_header.split("=")[1].split("-")
+            first_byte, last_byte = int(first), int(last) if last else len(body) - 1
+            headers["Content-Range"] = f"bytes {first_byte}-{last_byte}/{len(body)}"
+            body = body[first_byte : last_byte + 1]
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.path.endswith(".stall"):
+            # send a little, then hang until released like a stalled server
+            self.wfile.write(body[:1024])
+            self.wfile.flush()
+            self.server.stalled.release()
+            self.server.unstall.wait(10)
+            return
+        if self.path.endswith(".trickle") and self.path not in self.server.trickled:
+            # the first connection stalls without ever timing out, later ones do not
+            self.server.trickled.add(self.path)
+            sent = 1024
+            self.wfile.write(body[:sent])
+            self.wfile.flush()
+            while not self.server.unstall.wait(0.05):
+                try:
+                    self.wfile.write(body[sent : sent + 1])
+                    self.wfile.flush()
+                except OSError:
+                    return
+                sent += 1
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestStreamingReads(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), BodyHandler)
+        cls.server.stalled = threading.Semaphore(0)
+        cls.server.unstall = threading.Event()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
 
-        self.assertEqual(fake_written, expected_fake_written)
-        self.assertEqual(sleep_times, expected_sleep_times)
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pool = SessionPool(pool_size=1)
+        self.server.unstall.clear()
+        self.server.trickled = set()
+        self.server.busy_responses = 0
+
+    def tearDown(self):
+        self.server.unstall.set()
+        self.pool.close()
+        self.tmp.cleanup()
+
+    def __cancel_stalled_download(self, segments: int = 1) -> tuple:
+        """Start a download from a server that stalls, cancel it once all its connections
+        stall and measure how long it takes to stop."""
+        url = f"{self.base_url}/a.stall"
+        signals = TestProgressObserver()
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(
+                download_file(
+                    url,
+                    os.path.join(self.tmp.name, "a.stall"),
+                    signals,
+                    segments=segments,
+                    session=self.pool.session_for(url),
+                )
+            )
+        )
+        thread.start()
+        for _ in range(segments):
+            self.assertTrue(self.server.stalled.acquire(timeout=5))
+        started = time.monotonic()
+        signals.cancel()
+        thread.join(5)
+        return result, time.monotonic() - started
+
+    def __download(
+        self,
+        name: str,
+        signals=None,
+        preallocate=False,
+        checksum=None,
+        stall_watchdog=None,
+        disk_writers=None,
+    ) -> bytes:
+        url = f"{self.base_url}/{name}"
+        local_path = os.path.join(self.tmp.name, name)
+        download_file(
+            url,
+            local_path,
+            signals if signals is not None else TestProgressObserver(),
+            session=self.pool.session_for(url),
+            preallocate=preallocate,
+            checksum=checksum,
+            stall_watchdog=stall_watchdog,
+            disk_writers=disk_writers,
+        )
+        with open(local_path, "rb") as f:
+            return f.read()
+
+    def test_zero_copy_and_copying_reads_match(self):
+        self.assertEqual(self.__download("a.bin"), BODY)
+        with patch.object(downloader, "ZERO_COPY_READS", False):
+            self.assertEqual(self.__download("b.bin"), BODY)
+
+    def test_zero_copy_reads_release_connection(self):
+        self.__download("a.bin")
+        self.__download("b.bin")
+        # 2 probes and 2 downloads over a single kept-alive connection
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["requests"], 4)
+        self.assertEqual(stats["connections"], 1)
+
+    def test_content_encoded_body_is_decoded(self):
+        self.assertEqual(self.__download("c.gz"), BODY)
+
+    def test_preallocated_download_completes(self):
+        self.assertEqual(self.__download("a.bin", preallocate=True), BODY)
+        local_path = os.path.join(self.tmp.name, "a.bin")
+        self.assertFalse(os.path.exists(written_offset_path(local_path)))
+
+    def test_cancelled_preallocated_download_records_written_offset(self):
+        class CancellingObserver(TestProgressObserver):
+            def on_update_progress(self, written: int, total: int) -> None:
+                self.cancelled = written < total
+
+        local_path = os.path.join(self.tmp.name, "a.bin")
+        self.__download("a.bin", CancellingObserver(), preallocate=True)
+        offset = read_written_offset(local_path)
+        if offset is None:
+            self.skipTest("Preallocation is not supported by the filesystem")
+        self.assertGreater(offset, 0)
+        self.assertLess(offset, len(BODY))
+        self.assertEqual(os.path.getsize(local_path), len(BODY))
+        self.assertEqual(written_size(local_path), offset)
+        with open(local_path, "rb") as f:
+            self.assertEqual(f.read(offset), BODY[:offset])
+
+    def test_preallocated_file_resumes_from_written_offset(self):
+        local_path = os.path.join(self.tmp.name, "a.bin")
+        half = len(BODY) // 2
+        # full size on disk, but only the first half written
+        with open(local_path, "wb") as f:
+            f.write(BODY[:half] + bytes(len(BODY) - half))
+        record_written_offset(local_path, half)
+        self.assertEqual(self.__download("a.bin"), BODY)
+        self.assertFalse(os.path.exists(written_offset_path(local_path)))
+
+    def test_checksum_is_computed_while_downloading(self):
+        checksum = StreamingChecksum("sha256")
+        # the downloader imports the checksum module from the aoget folder
+        with patch("web.checksum.open", create=True) as mock_open:
+            self.__download("a.bin", checksum=checksum)
+        # nothing was read back from the file
+        mock_open.assert_not_called()
+        self.assertEqual(checksum.hexdigest(), hashlib.sha256(BODY).hexdigest())
+
+    def test_checksum_of_resumed_download_reads_back_the_prefix_once(self):
+        local_path = os.path.join(self.tmp.name, "a.bin")
+        Path(local_path).write_bytes(BODY[:1000])
+        checksum = StreamingChecksum("sha1")
+        self.__download("a.bin", checksum=checksum)
+        self.assertEqual(checksum.hexdigest(), hashlib.sha1(BODY).hexdigest())
+
+    def test_cancel_aborts_stalled_read(self):
+        result, seconds = self.__cancel_stalled_download()
+        self.assertEqual(result, [STATUS_STOPPED])
+        # without aborting the connection the read would block for TIMEOUT_SECONDS
+        self.assertLess(seconds, 1)
+
+    def test_cancel_aborts_stalled_segments(self):
+        result, seconds = self.__cancel_stalled_download(segments=3)
+        self.assertEqual(result, [STATUS_STOPPED])
+        self.assertLess(seconds, 1)
+
+    def test_abort_registered_after_cancel_is_called(self):
+        signals = TestProgressObserver()
+        signals.cancel()
+        abort = MagicMock()
+        signals.register_abort(abort)
+        abort.assert_called_once()
+
+    def test_unregistered_abort_is_not_called(self):
+        signals = TestProgressObserver()
+        abort = MagicMock()
+        signals.register_abort(abort)
+        signals.unregister_abort(abort)
+        signals.cancel()
+        abort.assert_not_called()
+
+    def test_stalled_download_is_resumed_on_a_fresh_connection(self):
+        signals = TestProgressObserver()
+        events = []
+        signals.on_event = events.append
+        watchdog = StallWatchdog(
+            min_rate_bps=64 * 1024, stall_seconds=0.3, check_interval_seconds=0.05
+        )
+        try:
+            # the trickle never trips the read timeout, only the watchdog recycles it
+            self.assertEqual(self.__download("a.trickle", signals, stall_watchdog=watchdog), BODY)
+        finally:
+            watchdog.stop()
+        self.assertEqual(len([e for e in events if e.startswith("Stalled below")]), 1)
+
+    def test_download_held_back_by_the_disk_writer_is_not_stalled(self):
+        signals = TestProgressObserver()
+        events = []
+        signals.on_event = events.append
+        watchdog = StallWatchdog(
+            min_rate_bps=64 * 1024, stall_seconds=0.3, check_interval_seconds=0.05
+        )
+        disk_writers = DiskWriterPool(max_in_flight_bytes=64 * 1024)
+        write_all = DiskWriter._DiskWriter__write_all
+        held = []
+
+        def held_write_all(fd, buffers):
+            # the disk stops for longer than the stall window, once
+            if not held:
+                held.append(True)
+                time.sleep(0.6)
+            write_all(fd, buffers)
+
+        try:
+            with patch.object(DiskWriter, "_DiskWriter__write_all", staticmethod(held_write_all)):
+                self.assertEqual(
+                    self.__download(
+                        "a.bin", signals, stall_watchdog=watchdog, disk_writers=disk_writers
+                    ),
+                    BODY,
+                )
+        finally:
+            watchdog.stop()
+            disk_writers.close()
+        self.assertTrue(held)
+        self.assertFalse([e for e in events if e.startswith("Stalled below")])
+
+    def test_busy_host_trips_the_circuit_breaker_until_it_recovers(self):
+        self.server.busy_responses = 2
+        signals = TestProgressObserver()
+        events = []
+        signals.on_event = events.append
+        url = f"{self.base_url}/a.busy"
+        local_path = os.path.join(self.tmp.name, "a.busy")
+        started = time.monotonic()
+        result = download_file(
+            url,
+            local_path,
+            signals,
+            attempts=3,
+            session=self.pool.session_for(url),
+            retry_policy=RetryPolicy(base_delay_seconds=0.01),
+            circuit_breakers=HostCircuitBreakers(failure_threshold=2, open_seconds=0.3),
+        )
+        self.assertEqual(result, STATUS_COMPLETED)
+        self.assertEqual(Path(local_path).read_bytes(), BODY)
+        # the third attempt waited for the cooldown of the breaker
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+        self.assertTrue(any("circuit breaker tripped" in e for e in events))
+        self.assertTrue(any(e.startswith("Paused") for e in events))
+        self.assertTrue(any("recovered" in e for e in events))
+
+    def test_busy_host_is_retried_without_signals(self):
+        self.server.busy_responses = 2
+        url = f"{self.base_url}/a.busy"
+        local_path = os.path.join(self.tmp.name, "a.busy")
+        limits = HostConnectionLimits({"127.0.0.1:*": 2})
+        result = download_file(
+            url,
+            local_path,
+            None,
+            attempts=3,
+            session=self.pool.session_for(url),
+            retry_policy=RetryPolicy(base_delay_seconds=0.01),
+            circuit_breakers=HostCircuitBreakers(failure_threshold=2, open_seconds=0.3),
+            host_limits=limits,
+        )
+        self.assertEqual(result, STATUS_COMPLETED)
+        self.assertEqual(Path(local_path).read_bytes(), BODY)
+        self.assertEqual(limits.get_stats(), {})
+
+    def test_segments_are_capped_to_the_connection_limit_of_the_host(self):
+        url = f"{self.base_url}/a.bin"
+        local_path = os.path.join(self.tmp.name, "a.bin")
+        limits = HostConnectionLimits({"127.0.0.1:*": 2})
+        with patch.object(limits, "release", wraps=limits.release) as release:
+            result = download_file(
+                url,
+                local_path,
+                TestProgressObserver(),
+                segments=4,
+                session=self.pool.session_for(url),
+                host_limits=limits,
+            )
+        self.assertEqual(result, STATUS_COMPLETED)
+        self.assertEqual(Path(local_path).read_bytes(), BODY)
+        release.assert_called_once_with(url, 2)
+        self.assertEqual(limits.get_stats(), {})
+
+    def test_failed_probe_raises_and_is_not_cached(self):
+        url = f"{self.base_url}/a.missing"
+        probe_cache = ProbeCache()
+        with self.assertRaises(requests.exceptions.HTTPError):
+            probe_url(url, session=self.pool.session_for(url), probe_cache=probe_cache)
+        self.assertIsNone(probe_cache.get(url))
+        with self.assertRaises(Exception):
+            resolve_remote_file_size(url, attempts=1, probe_cache=probe_cache)
+
+    def test_segments_share_the_free_connections_of_a_busy_host(self):
+        url = f"{self.base_url}/a.bin"
+        local_path = os.path.join(self.tmp.name, "a.bin")
+        limits = HostConnectionLimits({"127.0.0.1:*": 4})
+        # another download holds 3 of the 4 connections
+        self.assertEqual(limits.try_acquire(url, 3), 3)
+        started = time.monotonic()
+        with patch.object(limits, "release", wraps=limits.release) as release:
+            result = download_file(
+                url,
+                local_path,
+                TestProgressObserver(),
+                segments=4,
+                session=self.pool.session_for(url),
+                host_limits=limits,
+            )
+        self.assertEqual(result, STATUS_COMPLETED)
+        self.assertEqual(Path(local_path).read_bytes(), BODY)
+        # split in 4 all the same, downloaded one after the other on the free connection
+        release.assert_called_once_with(url, 1)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([stats["active"] for stats in limits.get_stats().values()], [3])
+
+    def test_written_size_of_file_without_record_is_its_size(self):
+        local_path = os.path.join(self.tmp.name, "a.bin")
+        self.assertEqual(written_size(local_path), -1)
+        Path(local_path).write_bytes(b"12345")
+        self.assertEqual(written_size(local_path), 5)
+        record_written_offset(local_path, 3)
+        self.assertEqual(written_size(local_path), 3)
 
 
 if __name__ == "__main__":
@@ -8,6 +8,7 @@ class TestDownloads(unittest.TestCase):
 
     def setUp(self):
         self.app_state_handlers_mock = MagicMock()
+        self.app_state_handlers_mock.download_scheduler = None
         self.downloads = Downloads(self.app_state_handlers_mock)
 
     def test_init(self):
@@ -159,6 +160,43 @@ class TestDownloads(unittest.TestCase):
         self.downloads.drop_job(job_name)
         self.assertFalse(job_name in self.downloads.job_downloaders)
 
+    def test_update_connection_pool_size(self):
+        downloader1 = MagicMock(
+            worker_pool_size=3, segments_per_file=1, size_resolver_threads=1
+        )
+        downloader2 = MagicMock(
+            worker_pool_size=2, segments_per_file=4, size_resolver_threads=8
+        )
+        self.downloads.job_downloaders = {"job1": downloader1, "job2": downloader2}
+        self.downloads.update_connection_pool_size()
+        # 3 + 8 download connections and the 8 size resolver threads
+        self.app_state_handlers_mock.session_pool.set_pool_size.assert_called_with(19)
+
+    def test_update_connection_pool_size_with_scheduler(self):
+        downloader1 = MagicMock(
+            worker_pool_size=3, segments_per_file=1, size_resolver_threads=1
+        )
+        downloader2 = MagicMock(
+            worker_pool_size=2, segments_per_file=4, size_resolver_threads=8
+        )
+        self.app_state_handlers_mock.download_scheduler = MagicMock(worker_count=2)
+        self.downloads.job_downloaders = {"job1": downloader1, "job2": downloader2}
+        self.downloads.update_connection_pool_size()
+        # 2 scheduler workers of up to 4 segments and the 8 size resolver threads
+        self.app_state_handlers_mock.session_pool.set_pool_size.assert_called_with(16)
+
+
+    def test_get_host_connection_stats(self):
+        downloader = MagicMock()
+        downloader.get_host_connection_stats.return_value = {
+            "archive.org": {"active": 2, "limit": 6}
+        }
+        self.downloads.job_downloaders = {"test_job": downloader}
+        self.assertEqual(
+            self.downloads.get_host_connection_stats("test_job"),
+            {"archive.org": {"active": 2, "limit": 6}},
+        )
+        self.assertEqual(self.downloads.get_host_connection_stats("other_job"), {})
 
 if __name__ == '__main__':
     unittest.main()
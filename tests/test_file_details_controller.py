@@ -13,10 +13,12 @@ def mock_main_window_controller(mocker):
         url='http://example.com/testfile',
         target_path='/path/to/testfile',
         size_bytes=1024,
+        checksum=None,
     )
 
     mock_event_dto = mocker.Mock(timestamp='20210101', event='Downloaded')
     mock.files.get_file_event_dtos.return_value = [mock_event_dto]
+    mock.files.get_chunk_stats.return_value = None
 
     return mock
 
@@ -29,6 +31,32 @@ def file_details_controller(mock_main_window_controller):
     )
 
 
+def test_get_properties_with_chunk_stats(
+    file_details_controller, mock_main_window_controller
+):
+    """Chunk statistics are shown for files downloaded in this session."""
+    mock_main_window_controller.files.get_chunk_stats.return_value = {
+        "chunks": 3,
+        "bytes": 3072,
+        "current": 2048,
+        "smallest": 512,
+        "largest": 2048,
+        "average": 1024,
+        "resizes": 1,
+    }
+    properties = file_details_controller.get_properties()
+    assert properties["Read Chunks"] == "3 chunks, avg 1.0KB, 512.0B - 2.0KB"
+
+
+def test_get_properties_with_checksum(
+    file_details_controller, mock_main_window_controller
+):
+    """The checksum computed while downloading is shown once stored."""
+    mock_main_window_controller.files.get_file_dto.return_value.checksum = "md5:abc"
+    properties = file_details_controller.get_properties()
+    assert properties["Checksum"] == "md5:abc"
+
+
 def test_get_properties(file_details_controller):
     """Test get_properties method of FileDetailsController."""
     properties = file_details_controller.get_properties()
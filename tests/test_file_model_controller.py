@@ -1,4 +1,5 @@
 import os
+import time
 import pytest
 from unittest.mock import MagicMock, patch
 from aoget.controller.file_model_controller import FileModelController
@@ -9,6 +10,7 @@ from aoget.model.dto.job_dto import JobDTO
 from aoget.controller.app_cache import AppCache
 from aoget.controller.app_state_handlers import AppStateHandlers
 from aoget.model.file_event import FileEvent
+from aoget.web.downloader import segment_part_path
 
 
 class TestFileModelController:
@@ -161,6 +163,21 @@ class TestFileModelController:
         assert "file_name" in journal.file_model_updates
         assert journal.file_model_updates["file_name"].selected is False
 
+    def test_remove_file_from_job_deletes_segment_parts(self, file_model_controller, tmp_path):
+        local_path = str(tmp_path / 'file_name')
+        parts = [segment_part_path(local_path, 4, i) for i in range(2)]
+        for part in parts:
+            with open(part, 'wb') as f:
+                f.write(b'0123')
+        with patch.object(
+            file_model_controller, 'resolve_local_file_path', return_value=local_path
+        ):
+            (result, _) = file_model_controller.remove_file_from_job(
+                'test_job', 'file_name', delete_from_disk=True
+            )
+        assert result is True
+        assert os.listdir(tmp_path) == []
+
     def test_stop_download_download_did_not_start_yet(self, file_model_controller):
         dl = MagicMock()
         file_model_controller.app.downloads = dl
@@ -596,6 +613,36 @@ class TestFileModelController:
                 'test_job', ['file_name', 'file_name2']
             )
 
+    def test_remove_files_from_job_waits_once_for_all_stops(self, file_model_controller):
+        downloads = MagicMock()
+        downloads.is_file_queued.return_value = False
+        downloads.is_file_downloading.return_value = True
+        file_model_controller.app.downloads = downloads
+        file_names = [f'file_name{i}' for i in range(5)]
+        signals = {name: MagicMock() for name in file_names}
+        downloads.get_downloader.return_value.signals = signals
+        cache = AppCache()
+        cache.set_cache(
+            {
+                'test_job': {
+                    name: FileModelDTO(job_name='test_job', name=name, status='Downloading')
+                    for name in file_names
+                }
+            }
+        )
+        file_model_controller.app.cache = cache
+        file_model_controller.FILE_DELETION_WAIT_SECONDS = 0.2
+
+        started = time.monotonic()
+        # the mocked downloads never signal stopped, each wait runs to the deadline
+        file_model_controller.remove_files_from_job('test_job', file_names)
+        assert time.monotonic() - started < 0.5
+        for name in file_names:
+            signals[name].cancel.assert_called_once()
+        journal = file_model_controller.app.update_cycle.journal_of_job('test_job')
+        for name in file_names:
+            assert journal.file_model_updates[name].selected is False
+
     def test_get_all_files_in_job_folders(self, file_model_controller):
         with patch(
             'aoget.controller.file_model_controller.get_all_file_names_from_folders',
@@ -47,12 +47,16 @@ def test_on_update_progress(mock_journal_daemon):
     written = 100
     total = 200
 
-    signals = FileProgressSignals(jobname, filename, mock_journal_daemon)
+    journal_daemon = JournalDaemon(start_daemon=False)
+    signals = FileProgressSignals(jobname, filename, journal_daemon)
     signals.on_update_progress(written, total)
 
-    mock_journal_daemon.update_download_progress.assert_called_once_with(
-        jobname, filename, written, total
-    )
+    # the hot path only updates the counter, the daemon picks it up on its tick
+    assert signals.progress_counter.value == (written, total)
+    assert jobname not in journal_daemon._JournalDaemon__journal
+    signals.close()
+    journal = journal_daemon._JournalDaemon__journal
+    assert journal[jobname].file_model_updates[filename].downloaded_bytes == written
 
 
 def test_on_update_status(mock_journal_daemon):
@@ -1,4 +1,6 @@
+import queue as stdqueue
 import unittest
+from unittest.mock import patch
 from aoget.web.file_queue import FileQueue
 from aoget.model.dto.file_model_dto import FileModelDTO
 
@@ -30,6 +32,89 @@ class TestFileQueue(unittest.TestCase):
         popped = queue.pop_file()
         assert FileQueue.is_poison_pill(popped)
 
+    def test_peek_files(self):
+        queue = FileQueue()
+        files = [
+            FileModelDTO(name=f"testfile{i}", job_name="test_job", priority=priority)
+            for i, priority in enumerate([3, 1, 2, 1])
+        ]
+        queue.put_all(files)
+        queue.remove_file(files[3])
+        queue.poison_pill()
+        peeked = queue.peek_files(2)
+        assert [file.name for file in peeked] == ["testfile1", "testfile2"]
+        # nothing was taken from the queue
+        assert queue.pop_file().name == "_poison_pill_"
+        assert queue.pop_file().name == "testfile1"
+        assert [file.name for file in queue.peek_files(5)] == ["testfile2", "testfile0"]
+
+    def test_peek_files_matches_the_pop_order(self):
+        queue = FileQueue()
+        files = [
+            FileModelDTO(name=f"testfile{i}", job_name="test_job", priority=(i * 7) % 13)
+            for i in range(500)
+        ]
+        queue.put_all(files)
+        queue.remove_all(files[::3])
+        peeked = [file.name for file in queue.peek_files(50)]
+        popped = [queue.pop_file().name for _ in range(50)]
+        assert peeked == popped
+
+    def test_ties_are_popped_in_the_order_put(self):
+        queue = FileQueue()
+        queue.put_file(FileModelDTO(name="b", job_name="test_job", priority=2))
+        queue.put_all(
+            [
+                FileModelDTO(name="c", job_name="test_job", priority=2),
+                FileModelDTO(name="a", job_name="test_job", priority=2),
+                FileModelDTO(name="d", job_name="test_job", priority=1),
+            ]
+        )
+        assert [queue.pop_file().name for _ in range(4)] == ["d", "b", "c", "a"]
+
+    def test_put_again_replaces_the_entry(self):
+        queue = FileQueue()
+        file = FileModelDTO(name="a", job_name="test_job", priority=3)
+        queue.put_file(file)
+        queue.put_file(FileModelDTO(name="b", job_name="test_job", priority=2))
+        file.priority = 1
+        queue.put_all([file])
+        assert queue.qsize() == 2
+        assert queue.pop_file().name == "a"
+        assert queue.pop_file().name == "b"
+        assert queue.get_stats()["tombstones"] == 0
+
+    def test_removed_files_are_not_counted(self):
+        queue = FileQueue()
+        files = [FileModelDTO(name=f"f{i}", job_name="test_job", priority=2) for i in range(3)]
+        queue.put_all(files)
+        queue.remove_all(files[:2])
+        assert queue.get_stats() == {
+            "size": 1,
+            "tombstones": 2,
+            "heap_size": 3,
+            "compactions": 0,
+        }
+        assert queue.pop_file().name == "f2"
+        assert queue.empty()
+        with self.assertRaises(stdqueue.Empty):
+            queue.pop_file(block=False)
+
+    def test_compacts_when_mostly_tombstones(self):
+        queue = FileQueue()
+        files = [FileModelDTO(name=f"f{i}", job_name="test_job", priority=2) for i in range(10)]
+        with patch("aoget.web.file_queue.COMPACT_MIN_TOMBSTONES", 4):
+            queue.put_all(files)
+            queue.remove_all(files[:5])
+            assert queue.get_stats()["compactions"] == 0
+            # the 6th tombstone is more than half of the heap
+            queue.remove_file(files[5])
+        stats = queue.get_stats()
+        assert stats["compactions"] == 1
+        assert stats["tombstones"] == 0
+        assert stats["heap_size"] == 4
+        assert [queue.pop_file().name for _ in range(4)] == ["f6", "f7", "f8", "f9"]
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from aoget.web.host_limits import HostConnectionLimits
+
+
+def test_hosts_matching_no_pattern_are_not_limited():
+    limits = HostConnectionLimits({"*archive.org": 2})
+    assert limits.limit_of("example.com") == 0
+    assert limits.try_acquire("http://example.com/a", 10) == 10
+    assert limits.get_stats() == {"example.com": {"active": 10, "limit": 0}}
+
+
+def test_limit_is_per_host():
+    limits = HostConnectionLimits({"*archive.org": 2})
+    assert limits.try_acquire("http://ia800.us.archive.org/a") == 1
+    assert limits.try_acquire("http://ia800.us.archive.org/b") == 1
+    assert limits.try_acquire("http://ia800.us.archive.org/c") == 0
+    # another host of the same pattern has its own connections
+    assert limits.try_acquire("http://ia900.us.archive.org/a") == 1
+    limits.release("http://ia800.us.archive.org/a", 1)
+    assert limits.try_acquire("http://ia800.us.archive.org/c") == 1
+
+
+def test_first_matching_pattern_applies():
+    limits = HostConnectionLimits({"ia800.us.archive.org": 1, "*archive.org": 6})
+    assert limits.limit_of("ia800.us.archive.org") == 1
+    assert limits.limit_of("archive.org") == 6
+
+
+def test_segments_take_the_free_connections():
+    limits = HostConnectionLimits({"*archive.org": 4})
+    assert limits.cap("http://archive.org/a", 8) == 4
+    assert limits.try_acquire("http://archive.org/a", 8) == 4
+    limits.release("http://archive.org/a", 4)
+    assert limits.try_acquire("http://archive.org/a", 3) == 3
+    # 2 wanted, 1 free: the free one is taken rather than waiting for both
+    assert limits.try_acquire("http://archive.org/b", 2) == 1
+    assert limits.try_acquire("http://archive.org/c", 2) == 0
+    assert limits.get_stats()["archive.org"] == {"active": 4, "limit": 4}
+
+
+def test_acquire_waits_for_a_release():
+    limits = HostConnectionLimits({"example.com": 1})
+    limits.acquire("http://example.com/a")
+    events = []
+    threading.Timer(0.1, limits.release, args=("http://example.com/a", 1)).start()
+    assert limits.acquire("http://example.com/b", on_event=events.append) == 1
+    assert events == ["Waiting for a connection to example.com, all 1 are in use."]
+
+
+def test_acquire_is_cancellable():
+    limits = HostConnectionLimits({"example.com": 1})
+    limits.acquire("http://example.com/a")
+    started = time.monotonic()
+    cancelled = threading.Event()
+    threading.Timer(0.1, cancelled.set).start()
+    assert limits.acquire("http://example.com/b", is_cancelled=cancelled.is_set) == 0
+    assert time.monotonic() - started < 2
+    assert limits.get_stats()["example.com"]["active"] == 1
+
+
+def test_acquire_async():
+    limits = HostConnectionLimits({"example.com": 1})
+    limits.acquire("http://example.com/a")
+
+    async def acquire():
+        asyncio.get_running_loop().call_later(
+            0.1, limits.release, "http://example.com/a", 1
+        )
+        return await limits.acquire_async("http://example.com/b")
+
+    assert asyncio.run(acquire()) == 1
@@ -0,0 +1,47 @@
+import threading
+import pytest
+from aoget.util.indexed_set import IndexedSet
+
+
+def test_keeps_insertion_order():
+    items = IndexedSet(["b", "a"])
+    items.append("c")
+    items.extend(["a", "d"])
+    assert list(items) == ["b", "a", "c", "d"]
+    assert len(items) == 4
+
+
+def test_membership_and_removal():
+    items = IndexedSet(["a", "b", "c"])
+    assert "b" in items
+    items.remove("b")
+    assert "b" not in items
+    with pytest.raises(ValueError):
+        items.remove("b")
+    assert items.discard("a")
+    assert not items.discard("a")
+    assert items.discard_all(["c", "x"]) == 1
+    assert len(items) == 0
+    assert not items
+
+
+def test_iteration_goes_over_a_snapshot():
+    items = IndexedSet(["a", "b", "c"])
+    for item in items:
+        items.discard(item)
+    assert len(items) == 0
+
+
+def test_concurrent_discards_remove_each_item_once():
+    items = IndexedSet(range(10000))
+    removed = []
+
+    def take():
+        removed.append(sum(1 for i in range(10000) if items.discard(i)))
+
+    threads = [threading.Thread(target=take) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(removed) == 10000
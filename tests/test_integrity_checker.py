@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+from types import SimpleNamespace
+import pytest
+from aoget.web import integrity_checker
+from aoget.web.integrity_checker import (
+    DeepIntegrityCheck,
+    RESULT_CANCELLED,
+    RESULT_MISMATCH,
+    RESULT_MISSING,
+    RESULT_PASSED,
+    RESULT_RECORDED,
+    RESULT_SIZE_MISMATCH,
+    RESULT_UNCHANGED,
+)
+
+CONTENT = bytes(range(256)) * 64
+
+
+def __file(tmp_path, name, checksum=None, content=CONTENT, size_bytes=None, **kwargs):
+    path = tmp_path / name
+    if content is not None:
+        path.write_bytes(content)
+    file = SimpleNamespace(
+        name=name,
+        size_bytes=len(CONTENT) if size_bytes is None else size_bytes,
+        checksum=checksum,
+        verified_size=kwargs.get("verified_size"),
+        verified_mtime_ns=kwargs.get("verified_mtime_ns"),
+    )
+    return file, str(path)
+
+
+def __run(files, **kwargs) -> tuple:
+    results = {}
+    lock = threading.Lock()
+
+    def on_result(result):
+        with lock:
+            results[result.file.name] = result
+
+    counts = DeepIntegrityCheck(**kwargs).run(files, on_result)
+    return counts, results
+
+
+def test_results_per_file(tmp_path):
+    digest = hashlib.sha256(CONTENT).hexdigest()
+    files = [
+        __file(tmp_path, "passed.bin", f"sha256:{digest}"),
+        __file(tmp_path, "mismatch.bin", f"sha256:{digest}", content=CONTENT[::-1]),
+        __file(tmp_path, "recorded.bin"),
+        __file(tmp_path, "missing.bin", content=None),
+        __file(tmp_path, "short.bin", content=CONTENT[:10]),
+    ]
+    counts, results = __run(files)
+    assert results["passed.bin"].result == RESULT_PASSED
+    assert results["mismatch.bin"].result == RESULT_MISMATCH
+    assert not results["mismatch.bin"].is_success()
+    assert results["recorded.bin"].result == RESULT_RECORDED
+    assert results["recorded.bin"].checksum == f"sha256:{digest}"
+    assert results["recorded.bin"].size == len(CONTENT)
+    assert results["missing.bin"].result == RESULT_MISSING
+    assert results["short.bin"].result == RESULT_SIZE_MISMATCH
+    assert sum(counts.values()) == len(files)
+
+
+def test_recorded_algorithm_is_used(tmp_path):
+    digest = hashlib.md5(CONTENT).hexdigest()
+    _, results = __run([__file(tmp_path, "file.bin", f"md5:{digest}")], algorithm="sha1")
+    assert results["file.bin"].result == RESULT_PASSED
+    assert results["file.bin"].checksum == f"md5:{digest}"
+
+
+def test_unchanged_files_are_not_read(tmp_path, monkeypatch):
+    path = tmp_path / "file.bin"
+    path.write_bytes(CONTENT)
+    stat = os.stat(path)
+    checked = __file(
+        tmp_path,
+        "file.bin",
+        "sha256:0000",
+        content=None,
+        verified_size=stat.st_size,
+        verified_mtime_ns=stat.st_mtime_ns,
+    )
+    monkeypatch.setattr(integrity_checker, "open", None, raising=False)
+    _, results = __run([checked])
+    assert results["file.bin"].result == RESULT_UNCHANGED
+
+
+def test_touched_files_are_read_again(tmp_path):
+    file, local_path = __file(tmp_path, "file.bin", "sha256:0000", verified_size=len(CONTENT))
+    file.verified_mtime_ns = os.stat(local_path).st_mtime_ns - 1
+    _, results = __run([(file, local_path)])
+    assert results["file.bin"].result == RESULT_MISMATCH
+
+
+def test_files_of_a_device_are_read_in_inode_order(tmp_path, monkeypatch):
+    files = [__file(tmp_path, f"file{i}.bin") for i in range(8)]
+    order = []
+    real_open = open
+
+    def recording_open(path, *args, **kwargs):
+        order.append(path)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(integrity_checker, "open", recording_open, raising=False)
+    __run(list(reversed(files)))
+    assert order == sorted(order, key=lambda path: os.stat(path).st_ino)
+    assert len(order) == len(files)
+
+
+def test_cancelled_check_reads_nothing(tmp_path):
+    files = [__file(tmp_path, f"file{i}.bin") for i in range(3)]
+    counts, results = __run(files, is_cancelled=lambda: True)
+    assert counts == {RESULT_CANCELLED: 3}
+    assert all(result.checksum is None for result in results.values())
+
+
+def test_unsupported_algorithm():
+    with pytest.raises(ValueError):
+        DeepIntegrityCheck(algorithm="crc32")
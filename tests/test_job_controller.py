@@ -175,6 +175,7 @@ class TestJobController:
     ):
         downloader_mock = mock_app_state_handlers.downloads.get_downloader.return_value
         downloader_mock.worker_pool_size = 2
+        downloader_mock.scheduler = None
         downloader_mock.get_active_thread_count.return_value = 2
         downloader_mock.files_downloading = ["Test File HI", "Test File LO"]
         higher_priority_file = FileModelDTO(
@@ -213,10 +214,8 @@ class TestJobController:
         self, job_controller, mock_app_state_handlers, mock_file_controller
     ):
         with patch("aoget.controller.job_controller.get_job_dao") as mock_dao, patch(
-            "aoget.controller.job_controller.os.path.exists"
-        ) as mock_path_exists, patch(
-            "aoget.controller.job_controller.os.remove"
-        ) as mock_os_remove:
+            "aoget.controller.job_controller.remove_download_artifacts"
+        ) as mock_remove_artifacts:
             higher_priority_file = FileModelDTO(
                 job_name="Test Job",
                 name="Test File HI",
@@ -245,14 +244,14 @@ class TestJobController:
             )
             update_cycle = mock_app_state_handlers.update_cycle
             cache = mock_app_state_handlers.cache
-            mock_path_exists.return_value = True
+            mock_remove_artifacts.side_effect = lambda path: [path]
             job_controller.delete_job("Test Job", delete_from_disk=True)
 
-            assert mock_os_remove.call_count == 2
-            assert mock_os_remove.call_args_list[0].args == (os.path.join(
+            assert mock_remove_artifacts.call_count == 2
+            assert mock_remove_artifacts.call_args_list[0].args == (os.path.join(
                 "fake_path", "Test File HI"
             ),)
-            assert mock_os_remove.call_args_list[1].args == (os.path.join(
+            assert mock_remove_artifacts.call_args_list[1].args == (os.path.join(
                 "fake_path", "Test File LO"
             ),)
 
@@ -1,10 +1,11 @@
 import unittest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import Session
 from aoget.model.job import Job
 from aoget.model.file_model import FileModel
 from aoget.model.dao.job_dao import JobDAO
 from aoget.model.dao.file_model_dao import FileModelDAO
+from aoget.model import add_missing_columns
 
 
 class TestJobDAO(unittest.TestCase):
@@ -144,6 +145,29 @@ class TestJobDAO(unittest.TestCase):
         # Assert that no jobs are left
         self.assertEqual(len(self.job_dao.get_all_jobs()), 0)
 
+    def test_add_missing_columns(self):
+        engine = create_engine('sqlite:///:memory:')
+        with engine.begin() as connection:
+            # job table as created by an earlier app version
+            connection.execute(
+                text(
+                    "CREATE TABLE job (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, "
+                    "status VARCHAR, page_url VARCHAR NOT NULL, total_size_bytes INTEGER, "
+                    "target_folder VARCHAR, selected_files_with_known_size INTEGER, "
+                    "selected_files_count INTEGER, downloaded_bytes INTEGER, "
+                    "files_done INTEGER, threads_allocated INTEGER)"
+                )
+            )
+            connection.execute(
+                text("INSERT INTO job (id, name, page_url) VALUES (1, 'old', 'http://x')")
+            )
+        add_missing_columns(engine)
+        columns = [column["name"] for column in inspect(engine).get_columns("job")]
+        self.assertIn("segments_allocated", columns)
+        with Session(engine) as session:
+            self.assertEqual(session.get(Job, 1).segments_allocated, 1)
+        engine.dispose()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -30,6 +30,7 @@ class TestJobDTO(unittest.TestCase):
             selected_files_count=10,
             selected_files_with_known_size=5,
             threads_allocated=2,
+            segments_allocated=4,
             files_done=5,
         )
 
@@ -44,8 +45,17 @@ class TestJobDTO(unittest.TestCase):
         self.assertEqual(job.selected_files_count, 10)
         self.assertEqual(job.selected_files_with_known_size, 5)
         self.assertEqual(job.threads_allocated, 2)
+        self.assertEqual(job.segments_allocated, 4)
         self.assertEqual(job.files_done, 5)
 
+    def test_merge_rate_limit(self):
+        job = JobDTO(id=-1, name="Test Job", rate_limit_bps=1024)
+        job.merge(JobDTO(id=-1, name="Test Job"))
+        self.assertEqual(job.rate_limit_bps, 1024)
+        # lifting the limit is an update, not a missing value
+        job.merge(JobDTO(id=-1, name="Test Job", rate_limit_bps=0))
+        self.assertEqual(job.rate_limit_bps, 0)
+
 
 if __name__ == "__main__":
     unittest.main()
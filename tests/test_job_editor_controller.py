@@ -1,6 +1,8 @@
 import unittest
 from unittest.mock import MagicMock, patch
 from aoget.controller.job_editor_controller import JobEditorController
+from aoget.web.aopage import AoPage
+from aoget.web.probe_cache import ProbeCache, UrlMetadata
 
 
 class TestJobEditorController(unittest.TestCase):
@@ -8,6 +10,7 @@ class TestJobEditorController(unittest.TestCase):
     def setUp(self):
         self.mock_job_editor_dialog = MagicMock()
         self.mock_main_window_controller = MagicMock()
+        self.mock_main_window_controller.handlers.probe_cache = ProbeCache()
         self.controller = JobEditorController(
             self.mock_job_editor_dialog, self.mock_main_window_controller, False
         )
@@ -15,6 +18,7 @@ class TestJobEditorController(unittest.TestCase):
     @patch('aoget.controller.job_editor_controller.PageCrawler')
     def test_build_fileset(self, mock_page_crawler):
         # Setting up the mock PageCrawler
+        mock_page_crawler.return_value.ao_page = AoPage()
         mock_page_crawler.return_value.fetch_links.return_value = {
             'pdf': ['http://example.com/file.pdf']
         }
@@ -27,6 +31,39 @@ class TestJobEditorController(unittest.TestCase):
         self.assertEqual(len(result['pdf']), 1)
         self.assertEqual(result['pdf'][0].url, 'http://example.com/file.pdf')
 
+    @patch('aoget.controller.job_editor_controller.PageCrawler')
+    def test_build_fileset_takes_sizes_from_probe_cache(self, mock_page_crawler):
+        mock_page_crawler.return_value.ao_page = AoPage()
+        mock_page_crawler.return_value.fetch_links.return_value = {
+            'pdf': ['http://example.com/a.pdf', 'http://example.com/b.pdf']
+        }
+        self.mock_main_window_controller.handlers.probe_cache.put(
+            UrlMetadata('http://example.com/a.pdf', content_length=1234)
+        )
+        result = self.controller.build_fileset('http://example.com')
+        sizes = {file.url: file.size_bytes for file in result['pdf']}
+        self.assertEqual(sizes['http://example.com/a.pdf'], 1234)
+        self.assertIsNone(sizes['http://example.com/b.pdf'])
+
+    @patch('aoget.controller.job_editor_controller.PageCrawler')
+    def test_build_fileset_takes_sizes_and_checksums_listed_by_the_page(
+        self, mock_page_crawler
+    ):
+        page = AoPage()
+        page.add_file_metadata('http://example.com/a.pdf', 1234, 'sha1:abcd')
+        page.add_file_metadata('http://example.com/b.pdf', 0)
+        mock_page_crawler.return_value.ao_page = page
+        mock_page_crawler.return_value.fetch_links.return_value = {
+            'pdf': ['http://example.com/a.pdf', 'http://example.com/b.pdf']
+        }
+        result = self.controller.build_fileset('http://example.com')
+        files = {file.url: file for file in result['pdf']}
+        self.assertEqual(files['http://example.com/a.pdf'].size_bytes, 1234)
+        self.assertEqual(files['http://example.com/a.pdf'].checksum, 'sha1:abcd')
+        # an empty file is known too
+        self.assertEqual(files['http://example.com/b.pdf'].size_bytes, 0)
+        self.assertIsNone(files['http://example.com/b.pdf'].checksum)
+
     def test_set_file_selected(self):
         # Setup
         self.controller.files_by_name = {'file1.pdf': MagicMock()}
@@ -21,6 +21,32 @@ class TestJobUpdates(unittest.TestCase):
         self.assertEqual(self.job_updates.job_update.threads_allocated, 5)
         self.assertEqual(self.job_updates.job_update.threads_active, 3)
 
+    def test_update_job_rate_limit(self):
+        self.job_updates.update_job_rate_limit(2048)
+        self.assertEqual(self.job_updates.job_update.rate_limit_bps, 2048)
+        self.job_updates.update_job_rate_limit(0)
+        self.assertEqual(self.job_updates.job_update.rate_limit_bps, 0)
+
+    def test_update_file_rate_limit(self):
+        self.job_updates.update_file_rate_limit("file1.txt", 1024)
+        self.assertEqual(
+            self.job_updates.file_model_updates["file1.txt"].rate_limit_bps, 1024
+        )
+        self.assertEqual(len(self.job_updates.file_event_updates["file1.txt"]), 1)
+
+    def test_update_file_checksum(self):
+        self.job_updates.update_file_download_progress("file1.txt", 10, 10)
+        self.job_updates.update_file_checksum("file1.txt", "sha256:abc")
+        file_model_update = self.job_updates.file_model_updates["file1.txt"]
+        self.assertEqual(file_model_update.checksum, "sha256:abc")
+        self.assertEqual(file_model_update.downloaded_bytes, 10)
+
+    def test_update_file_verification(self):
+        self.job_updates.update_file_verification("file1.txt", 10, 123456789)
+        file_model_update = self.job_updates.file_model_updates["file1.txt"]
+        self.assertEqual(file_model_update.verified_size, 10)
+        self.assertEqual(file_model_update.verified_mtime_ns, 123456789)
+
     def test_update_job_downloaded_bytes(self):
         self.job_updates.update_job_downloaded_bytes(1000)
         self.assertEqual(self.job_updates.job_update.downloaded_bytes, 1000)
@@ -39,6 +39,12 @@ class TestJournalDaemon:
             == 1000
         )
 
+    def test_update_file_sizes(self, daemon):
+        daemon.update_file_sizes("job1", {"file1": 1000, "file2": 2000})
+        updates = daemon._JournalDaemon__journal["job1"].file_model_updates
+        assert updates["file1"].size_bytes == 1000
+        assert updates["file2"].size_bytes == 2000
+
     def test_journal_processing(self, daemon, mock_journal_processor):
         # Simulate update call
         daemon.update_download_progress("job1", "file1", 500, 1000)
@@ -94,3 +100,35 @@ class TestJournalDaemon:
     def test_update_job_donwloaded_bytes(self, daemon):
         daemon.update_job_downloaded_bytes("job1", 1000)
         assert daemon._JournalDaemon__journal["job1"].job_update.downloaded_bytes == 1000
+
+    def test_progress_counter_harvested_once_per_tick(self, mock_journal_processor):
+        harvested = []
+
+        def update_tick(journal):
+            # the journal is cleared after the tick, record what was in it
+            if "job1" in journal:
+                harvested.append(
+                    journal["job1"].file_model_updates["file1"].downloaded_bytes
+                )
+
+        mock_journal_processor.update_tick.side_effect = update_tick
+        daemon = JournalDaemon(
+            update_interval_seconds=0.05, journal_processor=mock_journal_processor
+        )
+        counter = daemon.register_progress_counter("job1", "file1")
+        for written in range(0, 1001, 100):
+            counter.update(written, 1000)
+        time.sleep(0.12)
+        daemon.stop()
+        # the latest value is journaled once, unchanged counters are not journaled again
+        assert harvested[-1] == 1000
+        assert harvested.count(1000) == 1
+
+    def test_unregister_progress_counter_flushes_last_value(self, mock_journal_processor):
+        daemon = JournalDaemon(journal_processor=mock_journal_processor, start_daemon=False)
+        counter = daemon.register_progress_counter("job1", "file1")
+        counter.update(500, 1000)
+        daemon.unregister_progress_counter("job1", "file1")
+        counter.update(800, 1000)
+        journal = daemon._JournalDaemon__journal
+        assert journal["job1"].file_model_updates["file1"].downloaded_bytes == 500
@@ -0,0 +1,103 @@
+import time
+from aoget.web.probe_cache import ProbeCache, UrlMetadata
+
+
+def test_put_and_get():
+    cache = ProbeCache()
+    cache.put(UrlMetadata("http://example.com/a", content_length=10))
+    assert cache.get("http://example.com/a").content_length == 10
+    assert cache.get("http://example.com/b") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_expired_entries_are_dropped():
+    cache = ProbeCache(ttl_seconds=60)
+    cache.put(UrlMetadata("http://example.com/a", content_length=10, timestamp=time.time() - 120))
+    assert cache.get("http://example.com/a") is None
+    assert len(cache) == 0
+
+
+def test_invalidate():
+    cache = ProbeCache()
+    cache.put(UrlMetadata("http://example.com/a", content_length=10))
+    cache.invalidate("http://example.com/a")
+    cache.invalidate("http://example.com/missing")
+    assert cache.get("http://example.com/a") is None
+
+
+def test_final_url_and_validator_defaults():
+    metadata = UrlMetadata("http://example.com/a", last_modified="yesterday")
+    assert metadata.final_url == "http://example.com/a"
+    assert metadata.validator() == "yesterday"
+    metadata.etag = '"x"'
+    assert metadata.validator() == '"x"'
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ProbeCache(max_entries=2)
+    cache.put(UrlMetadata("http://example.com/a", content_length=10))
+    cache.put(UrlMetadata("http://example.com/b", content_length=10))
+    cache.get("http://example.com/a")
+    cache.put(UrlMetadata("http://example.com/c", content_length=10))
+    assert len(cache) == 2
+    assert cache.get("http://example.com/b") is None
+    assert cache.get("http://example.com/a") is not None
+
+
+def test_persisted_across_instances(tmp_path):
+    path = str(tmp_path / "url_metadata.json")
+    cache = ProbeCache(ttl_seconds=60, path=path)
+    cache.put(
+        UrlMetadata(
+            "http://example.com/a",
+            content_length=10,
+            accept_ranges=True,
+            etag='"x"',
+            final_url="http://mirror.example.com/a",
+        )
+    )
+    cache.put(UrlMetadata("http://example.com/old", content_length=10, timestamp=time.time() - 120))
+    cache.save()
+
+    reloaded = ProbeCache(ttl_seconds=60, path=path)
+    metadata = reloaded.get("http://example.com/a")
+    assert metadata.content_length == 10
+    assert metadata.accept_ranges
+    assert metadata.validator() == '"x"'
+    assert metadata.final_url == "http://mirror.example.com/a"
+    # expired entries are not loaded
+    assert len(reloaded) == 1
+
+
+def test_corrupt_cache_file_is_ignored(tmp_path):
+    path = tmp_path / "url_metadata.json"
+    path.write_text("{not json")
+    cache = ProbeCache(path=str(path))
+    assert len(cache) == 0
+    cache.put(UrlMetadata("http://example.com/a", content_length=10))
+    cache.save()
+    assert ProbeCache(path=str(path)).get("http://example.com/a").content_length == 10
+
+
+def test_failed_and_empty_probes_are_not_cached():
+    cache = ProbeCache()
+    cache.put(UrlMetadata("http://example.com/missing", content_length=10, status=404))
+    cache.put(UrlMetadata("http://example.com/empty", content_length=0))
+    cache.put(UrlMetadata("http://example.com/unknown", content_length=-1))
+    assert len(cache) == 0
+
+
+def test_saved_in_the_background_and_when_closed(tmp_path, monkeypatch):
+    monkeypatch.setattr("aoget.web.probe_cache.SAVE_INTERVAL_SECONDS", 0.1)
+    path = tmp_path / "url_metadata.json"
+    cache = ProbeCache(path=str(path))
+    cache.put(UrlMetadata("http://example.com/a", content_length=10))
+    # put returns without writing the file, the saver thread does
+    deadline = time.monotonic() + 5
+    while not path.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert ProbeCache(path=str(path)).get("http://example.com/a").content_length == 10
+    cache.put(UrlMetadata("http://example.com/b", content_length=20))
+    cache.close()
+    assert ProbeCache(path=str(path)).get("http://example.com/b").content_length == 20
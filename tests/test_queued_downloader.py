@@ -1,11 +1,19 @@
+import hashlib
 import pytest
 import time
 import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import MagicMock, patch
 from aoget.model.dto.job_dto import JobDTO
 from aoget.model.dto.file_model_dto import FileModelDTO
 from aoget.web.queued_downloader import QueuedDownloader
-from aoget.controller.journal_daemon import JournalDaemon
+from aoget.controller.journal_daemon import JournalDaemon, ProgressCounter
+from aoget.model.file_model import FileModel
+from aoget.web.rate_limiter import RateLimiter
+from aoget.web.retry_policy import RetryPolicy
+from aoget.web.download_scheduler import DownloadScheduler
+from aoget.web.host_limits import HostConnectionLimits
+from aoget.util.indexed_set import IndexedSet
 
 
 @pytest.fixture
@@ -37,8 +45,12 @@ def file_model_dto():
 
 @pytest.fixture
 def queued_downloader(job_dto, mock_journal_daemon):
+    # no backoff between the attempts of downloads failing in the sandbox
     return QueuedDownloader(
-        job=job_dto, journal_daemon=mock_journal_daemon, worker_pool_size=1
+        job=job_dto,
+        journal_daemon=mock_journal_daemon,
+        worker_pool_size=1,
+        retry_policy=RetryPolicy(base_delay_seconds=0),
     )
 
 
@@ -109,7 +121,7 @@ def test_dequeue_files(queued_downloader):
         url="http://example.com/testfile3",
         priority=4,
     )
-    queued_downloader.files_in_queue = ["testfile2", "testfile3"]
+    queued_downloader.files_in_queue = IndexedSet(["testfile2", "testfile3"])
     queued_downloader.queue = MagicMock()
     queued_downloader.dequeue_files(
         [file_model_dto_1, file_model_dto_2, file_model_dto_3]
@@ -185,46 +197,45 @@ def test_size_resolver(queued_downloader):
             "test_job", [file_model_dto_1, file_model_dto_2, file_model_dto_3]
         )
         thread.join()
-        assert queued_downloader.journal_daemon.update_file_size.call_count == 3
-        # first call was with "test_job", "testfile1", 100
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[0][0][0]
-            == "test_job"
+        # resolved in a single batch
+        queued_downloader.journal_daemon.update_file_sizes.assert_called_once_with(
+            "test_job", {"testfile1": 100, "testfile2": 100, "testfile3": 100}
         )
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[0][0][1]
-            == "testfile1"
-        )
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[0][0][2]
-            == 100
-        )
-        # second call was with "test_job", "testfile2", 100
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[1][0][0]
-            == "test_job"
-        )
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[1][0][1]
-            == "testfile2"
-        )
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[1][0][2]
-            == 100
-        )
-        # third call was with "test_job", "testfile3", 100
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[2][0][0]
-            == "test_job"
-        )
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[2][0][1]
-            == "testfile3"
-        )
-        assert (
-            queued_downloader.journal_daemon.update_file_size.call_args_list[2][0][2]
-            == 100
+        assert file_model_dto_1.size_bytes == 100
+        assert file_model_dto_2.size_bytes == 100
+        assert file_model_dto_3.size_bytes == 100
+        assert queued_downloader.is_resolved_all_file_sizes
+
+
+def test_size_resolver_follows_the_download_queue(queued_downloader):
+    files = [
+        FileModelDTO(
+            name=f"testfile{i}",
+            job_name="test_job",
+            url=f"http://example.com/testfile{i}",
+            priority=priority,
         )
+        for i, priority in enumerate([3, 2, 1])
+    ]
+    queued_downloader.size_resolver_threads = 1
+    # not started, the files stay in the queue
+    queued_downloader.download_files(files[1:])
+    resolved = []
+    with patch(
+        "aoget.web.queued_downloader.resolve_remote_file_size"
+    ) as mock_resolve_remote_file_size:
+
+        def resolve(url, **kwargs):
+            resolved.append(url.rsplit("/", 1)[1])
+            if len(resolved) == 1:
+                # bumped ahead while resolving
+                files[0].priority = 0
+                queued_downloader.download_file(files[0])
+            return 100
+
+        mock_resolve_remote_file_size.side_effect = resolve
+        queued_downloader.resolve_file_sizes("test_job", files).join()
+    assert resolved == ["testfile2", "testfile0", "testfile1"]
 
 
 def test_size_resolver_but_it_cant_resolve(queued_downloader):
@@ -255,9 +266,12 @@ def test_size_resolver_but_it_cant_resolve(queued_downloader):
             "test_job", [file_model_dto_1, file_model_dto_2, file_model_dto_3]
         )
         thread.join()
-        assert queued_downloader.journal_daemon.update_file_size.call_count == 0
-        # journal daemon was called 10 attempts * 3 files = 30 times
-        assert queued_downloader.journal_daemon.add_file_event.call_count == 30
+        assert queued_downloader.journal_daemon.update_file_sizes.call_count == 0
+        # 10 attempts * 3 files, the final failures reported once per file
+        assert mock_resolve_remote_file_size.call_count == 30
+        events = queued_downloader.journal_daemon.add_file_events.call_args[0][1]
+        assert sorted(events) == ["testfile1", "testfile2", "testfile3"]
+        assert not queued_downloader.is_resolved_all_file_sizes
 
 
 def test_size_resolver_cancelled(queued_downloader):
@@ -282,8 +296,8 @@ def test_size_resolver_cancelled(queued_downloader):
     queued_downloader.size_resolver_cancelled = True
     queued_downloader.resolve_file_sizes(
         "test_job", [file_model_dto_1, file_model_dto_2, file_model_dto_3]
-    )
-    assert queued_downloader.journal_daemon.update_file_size.call_count == 0
+    ).join()
+    assert queued_downloader.journal_daemon.update_file_sizes.call_count == 0
 
 
 def test_register_listener(queued_downloader):
@@ -317,3 +331,397 @@ def test_remove_thread(queued_downloader):
         assert queued_downloader.worker_pool_size == 2
         queued_downloader.remove_thread()
         assert queued_downloader.worker_pool_size == 1
+
+
+def test_rate_limiter_hierarchy(job_dto, mock_journal_daemon, file_model_dto):
+    global_limiter = RateLimiter()
+    job_dto.rate_limit_bps = 4096
+    downloader = QueuedDownloader(
+        job=job_dto, journal_daemon=mock_journal_daemon, rate_limiter=global_limiter
+    )
+    assert downloader.rate_limiter.parent is global_limiter
+    assert downloader.rate_limiter.rate_limit_bps == 4096
+    downloader.set_job_rate_limit(0)
+    assert downloader.rate_limiter.rate_limit_bps == 0
+
+    file_limiter = RateLimiter(parent=downloader.rate_limiter)
+    downloader.file_rate_limiters[file_model_dto.name] = file_limiter
+    file_model_dto.rate_limit_bps = 1024
+    downloader.update_rate_limit(file_model_dto)
+    assert file_limiter.rate_limit_bps == 1024
+
+
+def test_deep_health_check(job_dto, mock_journal_daemon, tmp_path):
+    job_dto.target_folder = str(tmp_path)
+    downloader = QueuedDownloader(job=job_dto, journal_daemon=mock_journal_daemon)
+    content = b"x" * 1000
+    filemodels = []
+    for name, checksum in (
+        ("intact.bin", "sha256:" + hashlib.sha256(content).hexdigest()),
+        ("corrupt.bin", "sha256:" + hashlib.sha256(b"y" * 1000).hexdigest()),
+        ("unrecorded.bin", None),
+    ):
+        (tmp_path / name).write_bytes(content)
+        filemodels.append(
+            FileModelDTO(
+                name=name,
+                job_name="test_job",
+                size_bytes=len(content),
+                status="Completed",
+                checksum=checksum,
+            )
+        )
+    done = threading.Event()
+    callback = MagicMock()
+    callback.emit.side_effect = lambda title, report: done.set()
+    downloader.health_check(filemodels, callback, deep=True)
+    assert done.wait(5)
+    assert "1 mismatch" in callback.emit.call_args.args[1]
+
+    verified = {
+        call.args[1] for call in mock_journal_daemon.update_file_verification.call_args_list
+    }
+    assert verified == {"intact.bin", "unrecorded.bin"}
+    mock_journal_daemon.update_file_checksum.assert_called_once_with(
+        "test_job", "unrecorded.bin", "sha256:" + hashlib.sha256(content).hexdigest()
+    )
+    invalid = [
+        call.args[1]
+        for call in mock_journal_daemon.update_file_status.call_args_list
+        if call.args[2] == "Invalid"
+    ]
+    assert invalid == ["corrupt.bin"]
+
+
+class StallingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "1000000")
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "1000000")
+        self.end_headers()
+        self.wfile.write(b"x" * 1024)
+        self.wfile.flush()
+        self.server.stalled.release()
+        self.server.unstall.wait(10)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stalling_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StallingHandler)
+    server.stalled = threading.Semaphore(0)
+    server.unstall = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.unstall.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("count", [1, 8])
+def test_stopping_stalled_downloads_takes_constant_time(
+    job_dto, mock_journal_daemon, stalling_server, tmp_path, count
+):
+    job_dto.target_folder = str(tmp_path)
+    downloader = QueuedDownloader(
+        job=job_dto, journal_daemon=mock_journal_daemon, worker_pool_size=count
+    )
+    base_url = f"http://127.0.0.1:{stalling_server.server_address[1]}"
+    files = [
+        FileModelDTO(name=f"file{i}", job_name="test_job", url=f"{base_url}/file{i}")
+        for i in range(count)
+    ]
+    downloader.start_download_threads()
+    downloader.download_files(files)
+    for _ in range(count):
+        assert stalling_server.stalled.acquire(timeout=5)
+
+    started = time.monotonic()
+    not_stopped = downloader.stop_active_downloads(files, sync=True)
+    # each stalled read would otherwise block for TIMEOUT_SECONDS, one after the other
+    assert time.monotonic() - started < 1
+    assert not_stopped == []
+    downloader.stop()
+
+
+TAIL_CONTENT = bytes(range(256)) * 8 * 1024  # 2 MB
+
+
+class TailHandler(BaseHTTPRequestHandler):
+    """Serves the whole file slowly, ranges fast. A .slowrange path serves them the other way
+    around: the whole file at a steady pace, ranges stalled."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(TAIL_CONTENT)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        body = TAIL_CONTENT
+        if range_header:
+            first, last = range_header.replace("bytes=", "").split("-")
+            body = TAIL_CONTENT[int(first) : int(last) + 1]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {first}-{last}/{len(TAIL_CONTENT)}"
+            )
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        slow_range = self.path.endswith(".slowrange")
+        try:
+            if range_header and slow_range:
+                self.wfile.write(body[:1024])
+                self.wfile.flush()
+                self.server.unstall.wait(10)
+            elif range_header or slow_range:
+                for i in range(0, len(body), 64 * 1024):
+                    self.wfile.write(body[i : i + 64 * 1024])
+                    if slow_range:
+                        time.sleep(0.05)
+            else:
+                # a fast start, then a trickle from a slow host
+                sent = 256 * 1024
+                self.wfile.write(body[:sent])
+                self.wfile.flush()
+                while sent < len(body) and not self.server.unstall.wait(0.02):
+                    self.wfile.write(body[sent : sent + 16])
+                    self.wfile.flush()
+                    sent += 16
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tail_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TailHandler)
+    server.unstall = threading.Event()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.unstall.set()
+    server.shutdown()
+    server.server_close()
+
+
+def __hedged_download(job_dto, mock_journal_daemon, tail_server, tmp_path, name) -> tuple:
+    """Download a single file on two workers allowed to hedge, until the hedge is decided."""
+    job_dto.target_folder = str(tmp_path)
+    mock_journal_daemon.register_progress_counter.side_effect = (
+        lambda jobname, filename: ProgressCounter()
+    )
+    downloader = QueuedDownloader(
+        job=job_dto, journal_daemon=mock_journal_daemon, worker_pool_size=2, max_hedges=1
+    )
+    base_url = f"http://127.0.0.1:{tail_server.server_address[1]}"
+    downloader.start_download_threads()
+    downloader.download_file(
+        FileModelDTO(name=name, job_name="test_job", url=f"{base_url}/{name}")
+    )
+
+    def decided():
+        stats = downloader.get_hedge_stats()
+        return stats["saved_bytes"] + stats["wasted_bytes"] > 0
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and (downloader.is_downloading() or not decided()):
+        time.sleep(0.05)
+    downloader.stop(sync=False)
+    statuses = [
+        call.args[2]
+        for call in mock_journal_daemon.update_file_status.call_args_list
+        if call.args[1] == name
+    ]
+    return downloader.get_hedge_stats(), statuses, (tmp_path / name).read_bytes()
+
+
+@pytest.fixture
+def hedge_timing():
+    with patch("aoget.web.queued_downloader.MIN_RUNNING_SECONDS", 0.2), patch(
+        "aoget.web.queued_downloader.HEDGE_POLL_SECONDS", 0.05
+    ):
+        yield
+
+
+def test_hedge_wins_over_slow_download(
+    job_dto, mock_journal_daemon, tail_server, tmp_path, hedge_timing
+):
+    stats, statuses, content = __hedged_download(
+        job_dto, mock_journal_daemon, tail_server, tmp_path, "file.bin"
+    )
+    assert stats["hedges"] == 1
+    assert stats["won"] == 1
+    assert stats["saved_bytes"] > 1024 * 1024
+    assert statuses[-1] == FileModel.STATUS_COMPLETED
+    assert content == TAIL_CONTENT
+    assert not (tmp_path / "file.bin.hedge").exists()
+
+
+def test_hedge_loses_to_download_finishing_first(
+    job_dto, mock_journal_daemon, tail_server, tmp_path, hedge_timing
+):
+    stats, statuses, content = __hedged_download(
+        job_dto, mock_journal_daemon, tail_server, tmp_path, "file.slowrange"
+    )
+    assert stats["hedges"] == 1
+    assert stats["won"] == 0
+    assert stats["saved_bytes"] == 0
+    assert stats["wasted_bytes"] > 0
+    assert statuses[-1] == FileModel.STATUS_COMPLETED
+    assert content == TAIL_CONTENT
+    assert not (tmp_path / "file.slowrange.hedge").exists()
+
+
+SMALL_CONTENT = b"listed with its checksum" * 1000
+
+
+class ContentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(SMALL_CONTENT)))
+        self.end_headers()
+
+    def do_GET(self):
+        self.do_HEAD()
+        self.wfile.write(SMALL_CONTENT)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def content_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ContentHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def __download_with_checksum(job_dto, mock_journal_daemon, content_server, tmp_path, checksum):
+    """Download a file listed with the given checksum, return its final status."""
+    job_dto.target_folder = str(tmp_path)
+    downloader = QueuedDownloader(
+        job=job_dto,
+        journal_daemon=mock_journal_daemon,
+        worker_pool_size=1,
+        checksum_algorithm="sha256",
+    )
+    downloader.start_download_threads()
+    downloader.download_file(
+        FileModelDTO(
+            name="file.bin",
+            job_name="test_job",
+            url=f"{content_server}/file.bin",
+            checksum=checksum,
+        )
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and downloader.is_downloading():
+        time.sleep(0.05)
+    downloader.stop(sync=False)
+    return mock_journal_daemon.update_file_status.call_args_list[-1].args[2]
+
+
+def test_download_is_verified_against_the_listed_checksum(
+    job_dto, mock_journal_daemon, content_server, tmp_path
+):
+    listed = "sha1:" + hashlib.sha1(SMALL_CONTENT).hexdigest()
+    status = __download_with_checksum(
+        job_dto, mock_journal_daemon, content_server, tmp_path, listed
+    )
+    assert status == FileModel.STATUS_COMPLETED
+    # hashed with the algorithm of the listed checksum, which stays recorded
+    mock_journal_daemon.update_file_checksum.assert_not_called()
+
+
+def test_download_not_matching_the_listed_checksum_is_invalid(
+    job_dto, mock_journal_daemon, content_server, tmp_path
+):
+    listed = "sha1:" + hashlib.sha1(b"something else").hexdigest()
+    status = __download_with_checksum(
+        job_dto, mock_journal_daemon, content_server, tmp_path, listed
+    )
+    assert status == FileModel.STATUS_INVALID
+    events = [call.args[2] for call in mock_journal_daemon.add_file_event.call_args_list]
+    assert any(event.startswith("Checksum mismatch, expected " + listed) for event in events)
+
+
+def test_downloads_on_the_workers_of_the_global_scheduler(
+    job_dto, mock_journal_daemon, content_server, tmp_path
+):
+    job_dto.target_folder = str(tmp_path)
+    scheduler = DownloadScheduler(worker_count=2)
+    downloader = QueuedDownloader(
+        job=job_dto,
+        journal_daemon=mock_journal_daemon,
+        worker_pool_size=1,
+        scheduler=scheduler,
+    )
+    downloader.start_download_threads()
+    assert downloader.threads == []
+    downloader.download_files(
+        [
+            FileModelDTO(name=f"file{i}.bin", job_name="test_job", url=f"{content_server}/{i}")
+            for i in range(4)
+        ]
+    )
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and downloader.is_downloading():
+        time.sleep(0.05)
+    downloader.stop(sync=True)
+    scheduler.shutdown()
+    for i in range(4):
+        assert (tmp_path / f"file{i}.bin").read_bytes() == SMALL_CONTENT
+
+
+def test_scheduler_workers_do_not_wait_for_a_full_host(
+    job_dto, mock_journal_daemon, content_server, tmp_path
+):
+    job_dto.target_folder = str(tmp_path)
+    scheduler = DownloadScheduler(worker_count=2)
+    host_limits = HostConnectionLimits({"127.0.0.1:*": 1})
+    downloader = QueuedDownloader(
+        job=job_dto,
+        journal_daemon=mock_journal_daemon,
+        worker_pool_size=2,
+        scheduler=scheduler,
+        host_limits=host_limits,
+    )
+    downloader.start_download_threads()
+    with patch.object(host_limits, "acquire", wraps=host_limits.acquire) as acquire:
+        downloader.download_files(
+            [
+                FileModelDTO(
+                    name=f"file{i}.bin", job_name="test_job", url=f"{content_server}/{i}"
+                )
+                for i in range(3)
+            ]
+        )
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline and downloader.is_downloading():
+            time.sleep(0.05)
+        downloader.stop(sync=True)
+        scheduler.shutdown()
+    for i in range(3):
+        assert (tmp_path / f"file{i}.bin").read_bytes() == SMALL_CONTENT
+    # the connection was taken before the download, the second worker never blocked on it
+    acquire.assert_not_called()
+    assert host_limits.get_stats() == {}
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from aoget.web.rate_limiter import RateLimiter
+
+CHUNK_SIZE = 8 * 1024
+
+
+def __drain_all(rate_limiters: list, duration: float) -> list:
+    """Let a thread per limiter draw chunks as fast as it can for the given duration and return
+    the throughput of each in bytes per second."""
+    transferred = [0] * len(rate_limiters)
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        while time.monotonic() < deadline:
+            rate_limiters[index].acquire(CHUNK_SIZE)
+            transferred[index] += CHUNK_SIZE
+
+    threads = [
+        threading.Thread(target=worker, args=(i,)) for i in range(len(rate_limiters))
+    ]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+    return [total / elapsed for total in transferred]
+
+
+def __drain(rate_limiter: RateLimiter, thread_count: int, duration: float) -> float:
+    """Let the given number of threads draw chunks from the same limiter as fast as they can
+    and return the aggregate throughput in bytes per second."""
+    return sum(__drain_all([rate_limiter] * thread_count, duration))
+
+
+def test_unlimited_does_not_block():
+    rate_limiter = RateLimiter()
+    start = time.monotonic()
+    for _ in range(1000):
+        assert rate_limiter.acquire(CHUNK_SIZE)
+    assert time.monotonic() - start < 0.5
+
+
+def test_aggregate_throughput_stays_within_cap():
+    rate_limiter = RateLimiter(burst_seconds=0.1)
+    rate_limit_bps = 1024 * 1024
+    rate_limiter.set_global_rate_limit(rate_limit_bps)
+    throughput = __drain(rate_limiter, thread_count=8, duration=2)
+    assert abs(throughput - rate_limit_bps) / rate_limit_bps < 0.05
+
+
+def test_slow_threads_leave_bandwidth_to_others():
+    rate_limiter = RateLimiter(burst_seconds=0.1)
+    rate_limit_bps = 512 * 1024
+    rate_limiter.set_global_rate_limit(rate_limit_bps)
+    stop = threading.Event()
+
+    def idle_worker():
+        # draws a single chunk now and then, far below an even share
+        while not stop.wait(0.5):
+            rate_limiter.acquire(CHUNK_SIZE)
+
+    idle_threads = [threading.Thread(target=idle_worker) for _ in range(3)]
+    for t in idle_threads:
+        t.start()
+    throughput = __drain(rate_limiter, thread_count=1, duration=2)
+    stop.set()
+    for t in idle_threads:
+        t.join()
+    # an even split would have given the busy thread a quarter of the cap
+    assert throughput > rate_limit_bps * 0.75
+
+
+def test_cancelled_wait_returns_false():
+    rate_limiter = RateLimiter(burst_seconds=0.1)
+    rate_limiter.set_global_rate_limit(1024)
+    start = time.monotonic()
+    assert not rate_limiter.acquire(1024 * 1024, cancelled=lambda: True)
+    assert time.monotonic() - start < 0.5
+
+
+def test_cancelled_wait_on_parent_refunds_the_child():
+    parent = RateLimiter(burst_seconds=0.1)
+    parent.set_rate_limit(1)
+    child = RateLimiter(burst_seconds=0.1, parent=parent)
+    child.set_rate_limit(100)
+    cancelled = threading.Event()
+    # the child is paid off after 0.5 seconds, the parent never is
+    threading.Timer(0.7, cancelled.set).start()
+    assert not child.acquire(50, cancelled=cancelled.is_set)
+    # not left 50 bytes in debt for bytes never transferred
+    assert child._RateLimiter__tokens >= 0
+    assert parent._RateLimiter__tokens >= 0
+
+
+def test_cancelled_async_wait_on_parent_refunds_the_child():
+    parent = RateLimiter(burst_seconds=0.1)
+    parent.set_rate_limit(1)
+    child = RateLimiter(burst_seconds=0.1, parent=parent)
+    child.set_rate_limit(100)
+    cancelled = threading.Event()
+    threading.Timer(0.7, cancelled.set).start()
+    assert not asyncio.run(child.acquire_async(50, cancelled=cancelled.is_set))
+    assert child._RateLimiter__tokens >= 0
+
+
+def test_lifting_limit_releases_waiters():
+    rate_limiter = RateLimiter()
+    rate_limiter.set_global_rate_limit(1024)
+    threading.Timer(0.2, rate_limiter.set_global_rate_limit, args=(0,)).start()
+    start = time.monotonic()
+    assert rate_limiter.acquire(1024 * 1024)
+    assert time.monotonic() - start < 1
+
+
+def test_capped_job_leaves_bandwidth_to_uncapped_sibling():
+    global_limiter = RateLimiter(burst_seconds=0.1)
+    global_limiter.set_global_rate_limit(1024 * 1024)
+    bulk_job = RateLimiter(burst_seconds=0.1, parent=global_limiter)
+    bulk_job.set_rate_limit(256 * 1024)
+    critical_job = RateLimiter(burst_seconds=0.1, parent=global_limiter)
+    threads_per_job = 4
+    rates = __drain_all(
+        [bulk_job] * threads_per_job + [critical_job] * threads_per_job, duration=2
+    )
+    bulk_rate = sum(rates[:threads_per_job])
+    critical_rate = sum(rates[threads_per_job:])
+    assert abs(bulk_rate - 256 * 1024) / (256 * 1024) < 0.1
+    # not an even split of the global limit: the critical job takes all the bulk job leaves
+    assert abs(critical_rate - 768 * 1024) / (768 * 1024) < 0.1
+
+
+def test_file_limit_within_job_limit():
+    job_limiter = RateLimiter(burst_seconds=0.1)
+    job_limiter.set_rate_limit(512 * 1024)
+    capped_file = RateLimiter(burst_seconds=0.1, parent=job_limiter)
+    capped_file.set_rate_limit(128 * 1024)
+    other_file = RateLimiter(burst_seconds=0.1, parent=job_limiter)
+    capped_rate, other_rate = __drain_all([capped_file, other_file], duration=2)
+    assert abs(capped_rate - 128 * 1024) / (128 * 1024) < 0.1
+    assert abs(other_rate - 384 * 1024) / (384 * 1024) < 0.1
+
+
+def test_async_acquire_stays_within_cap():
+    rate_limiter = RateLimiter(burst_seconds=0.1)
+    rate_limit_bps = 1024 * 1024
+    rate_limiter.set_global_rate_limit(rate_limit_bps)
+
+    async def drain(duration):
+        transferred = 0
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            nonlocal transferred
+            while time.monotonic() < deadline:
+                await rate_limiter.acquire_async(CHUNK_SIZE)
+                transferred += CHUNK_SIZE
+
+        start = time.monotonic()
+        await asyncio.gather(*[worker() for _ in range(8)])
+        return transferred / (time.monotonic() - start)
+
+    throughput = asyncio.run(drain(2))
+    assert abs(throughput - rate_limit_bps) / rate_limit_bps < 0.05
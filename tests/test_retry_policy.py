@@ -0,0 +1,75 @@
+import time
+from email.utils import formatdate
+from unittest.mock import MagicMock
+from aoget.web.retry_policy import (
+    RetryPolicy,
+    ServerBusyError,
+    busy_error,
+    parse_retry_after,
+    sleep_unless_cancelled,
+)
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after("120") == 120
+
+
+def test_parse_retry_after_http_date():
+    seconds = parse_retry_after(formatdate(time.time() + 60, usegmt=True))
+    assert 55 <= seconds <= 60
+
+
+def test_parse_retry_after_in_the_past():
+    assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0
+
+
+def test_parse_retry_after_malformed():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+
+
+def test_busy_error_of_busy_status():
+    error = busy_error("http://host/file", 503, {"retry-after": "7"})
+    assert isinstance(error, ServerBusyError)
+    assert error.status == 503
+    assert error.retry_after == 7
+
+
+def test_no_busy_error_of_other_status():
+    assert busy_error("http://host/file", 404, {}) is None
+    assert busy_error("http://host/file", 200, {"retry-after": "7"}) is None
+
+
+def test_backoff_grows_exponentially_with_jitter():
+    policy = RetryPolicy(base_delay_seconds=1, max_delay_seconds=60)
+    for failures, ceiling in ((1, 1), (2, 2), (4, 8), (10, 60)):
+        delays = [policy.delay(failures) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        # jittered, not the same for everyone
+        assert len(set(delays)) > 100
+
+
+def test_retry_after_is_honored():
+    policy = RetryPolicy(base_delay_seconds=1)
+    error = ServerBusyError("http://host/file", 503, retry_after=30)
+    assert all(policy.delay(1, error) >= 30 for _ in range(100))
+
+
+def test_retry_after_is_capped():
+    policy = RetryPolicy(max_retry_after_seconds=120)
+    error = ServerBusyError("http://host/file", 429, retry_after=86400)
+    assert policy.delay(1, error) == 120
+
+
+def test_wait_returns_early_if_cancelled():
+    policy = RetryPolicy(base_delay_seconds=60)
+    is_cancelled = MagicMock(side_effect=[False, True])
+    started = time.monotonic()
+    assert not policy.wait(10, is_cancelled=is_cancelled)
+    assert time.monotonic() - started < 1
+
+
+def test_sleep_unless_cancelled_sleeps():
+    started = time.monotonic()
+    assert sleep_unless_cancelled(0.1)
+    assert time.monotonic() - started >= 0.1
@@ -0,0 +1,94 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from aoget.web.session_pool import SessionPool
+from aoget.web.downloader import resolve_remote_file_size
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "1234")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestSessionPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.pool = SessionPool(pool_size=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_same_host_shares_session(self):
+        session1 = self.pool.session_for("http://example.com/a.bin")
+        session2 = self.pool.session_for("http://example.com/b.bin")
+        session3 = self.pool.session_for("http://other.example.com/a.bin")
+        self.assertIs(session1, session2)
+        self.assertIsNot(session1, session3)
+
+    def test_connections_are_reused(self):
+        for i in range(10):
+            url = f"{self.base_url}/file{i}.bin"
+            size = resolve_remote_file_size(url, session=self.pool.session_for(url))
+            self.assertEqual(size, 1234)
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["hosts"], 1)
+        self.assertEqual(stats["requests"], 10)
+        self.assertEqual(stats["connections"], 1)
+        self.assertEqual(stats["reused"], 9)
+        self.assertAlmostEqual(stats["hit_rate"], 0.9)
+
+    def test_resize_keeps_stats(self):
+        url = f"{self.base_url}/file.bin"
+        resolve_remote_file_size(url, session=self.pool.session_for(url))
+        self.pool.set_pool_size(5)
+        resolve_remote_file_size(url, session=self.pool.session_for(url))
+        self.assertEqual(self.pool.pool_size, 5)
+        self.assertEqual(self.pool.get_stats()["requests"], 2)
+
+    def test_resize_closes_the_old_connections(self):
+        url = f"{self.base_url}/file.bin"
+        session = self.pool.session_for(url)
+        resolve_remote_file_size(url, session=session)
+        old_adapter = session.get_adapter(url)
+        self.assertEqual(len(old_adapter.poolmanager.pools), 1)
+        self.pool.set_pool_size(5)
+        self.assertIsNot(session.get_adapter(url), old_adapter)
+        self.assertEqual(len(old_adapter.poolmanager.pools), 0)
+
+    def test_concurrent_use_is_bounded(self):
+        url = f"{self.base_url}/file.bin"
+
+        def probe():
+            for _ in range(5):
+                resolve_remote_file_size(url, session=self.pool.session_for(url))
+
+        threads = [threading.Thread(target=probe) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = self.pool.get_stats()
+        self.assertEqual(stats["requests"], 20)
+        self.assertLess(stats["connections"], 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
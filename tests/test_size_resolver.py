@@ -0,0 +1,191 @@
+import threading
+import time
+from unittest.mock import Mock
+from aoget.model.dto.file_model_dto import FileModelDTO
+from aoget.web.retry_policy import RetryPolicy
+from aoget.web.size_resolver import SizeResolver
+
+
+def filemodels(count: int, size_bytes: int = None) -> list:
+    return [
+        FileModelDTO(
+            name=f"file{i}",
+            job_name="job",
+            url=f"http://example.com/file{i}",
+            size_bytes=size_bytes,
+        )
+        for i in range(count)
+    ]
+
+
+def test_resolves_files_concurrently():
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def resolve(filemodel):
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return 10
+
+    files = filemodels(12)
+    journal = Mock()
+    failed = SizeResolver("job", journal, resolve, concurrency=4).run(files)
+    assert failed == {}
+    assert peak == 4
+    assert all(f.size_bytes == 10 for f in files)
+
+
+def test_retries_only_the_failures():
+    calls = {}
+    lock = threading.Lock()
+
+    def resolve(filemodel):
+        with lock:
+            calls[filemodel.name] = calls.get(filemodel.name, 0) + 1
+            if filemodel.name == "file1" and calls[filemodel.name] < 3:
+                raise Exception("busy")
+        return 10
+
+    files = filemodels(3)
+    journal = Mock()
+    resolver = SizeResolver(
+        "job",
+        journal,
+        resolve,
+        attempts=5,
+        retry_policy=RetryPolicy(base_delay_seconds=0.01),
+    )
+    assert resolver.run(files) == {}
+    assert calls == {"file0": 1, "file1": 3, "file2": 1}
+    journal.add_file_events.assert_not_called()
+
+
+def test_gives_up_after_the_attempts():
+    resolve = Mock(side_effect=Exception("gone"))
+    journal = Mock()
+    failed = SizeResolver("job", journal, resolve, attempts=3).run(filemodels(2))
+    assert failed == {"file0": "gone", "file1": "gone"}
+    assert resolve.call_count == 6
+    journal.add_file_events.assert_called_once_with(
+        "job",
+        {
+            "file0": "Size resolver failed after 3 attempts: gone",
+            "file1": "Size resolver failed after 3 attempts: gone",
+        },
+    )
+    journal.update_file_sizes.assert_not_called()
+
+
+def test_results_are_pushed_in_batches(monkeypatch):
+    monkeypatch.setattr("aoget.web.size_resolver.BATCH_SIZE", 5)
+    monkeypatch.setattr("aoget.web.size_resolver.BATCH_SECONDS", 60)
+    journal = Mock()
+    SizeResolver("job", journal, lambda f: 10, concurrency=1).run(filemodels(12))
+    batches = [c[0][1] for c in journal.update_file_sizes.call_args_list]
+    assert [len(batch) for batch in batches] == [5, 5, 2]
+    journal.update_file_size.assert_not_called()
+
+
+def test_prioritized_files_are_resolved_first():
+    order = []
+    journal = Mock()
+    resolver = SizeResolver(
+        "job", journal, lambda f: order.append(f.name) or 10, concurrency=1
+    )
+    resolver.prioritize(["file3", "file1"])
+    resolver.run(filemodels(5))
+    assert order == ["file3", "file1", "file0", "file2", "file4"]
+
+
+def test_prioritized_while_running():
+    order = []
+    resolver = None
+
+    def resolve(filemodel):
+        if not order:
+            resolver.prioritize(["file4"])
+        order.append(filemodel.name)
+        return 10
+
+    resolver = SizeResolver("job", Mock(), resolve, concurrency=1)
+    resolver.run(filemodels(5))
+    assert order == ["file0", "file4", "file1", "file2", "file3"]
+
+
+def test_unknown_size_is_retried_and_not_stored():
+    sizes = {"file0": [0, 10], "file1": [-1, -1]}
+    on_resolved = Mock()
+    journal = Mock()
+    resolver = SizeResolver(
+        "job",
+        journal,
+        lambda f: sizes[f.name].pop(0),
+        attempts=2,
+        on_resolved=on_resolved,
+    )
+    files = filemodels(2)
+    failed = resolver.run(files)
+    assert list(failed) == ["file1"]
+    on_resolved.assert_called_once_with(files[0], 10)
+    journal.update_file_sizes.assert_called_once_with("job", {"file0": 10})
+    assert files[1].size_bytes is None
+
+
+def test_skips_files_of_known_size():
+    resolve = Mock(return_value=10)
+    journal = Mock()
+    SizeResolver("job", journal, resolve).run(filemodels(3, size_bytes=5))
+    resolve.assert_not_called()
+    journal.update_file_sizes.assert_not_called()
+
+
+def test_cancelled():
+    cancelled = threading.Event()
+
+    def resolve(filemodel):
+        cancelled.set()
+        raise Exception("busy")
+
+    journal = Mock()
+    resolver = SizeResolver(
+        "job",
+        journal,
+        resolve,
+        concurrency=1,
+        retry_policy=RetryPolicy(base_delay_seconds=0),
+        is_cancelled=cancelled.is_set,
+    )
+    assert resolver.run(filemodels(5)) == {}
+    journal.update_file_sizes.assert_not_called()
+    journal.add_file_events.assert_not_called()
+
+
+def test_reranking_requeues_only_the_changed_files(monkeypatch):
+    resolver = SizeResolver("job", Mock(), lambda f: 10)
+    puts = []
+    original_put = SizeResolver._SizeResolver__put_locked
+
+    def recording_put(self, filemodel, *args):
+        puts.append(filemodel.name)
+        original_put(self, filemodel, *args)
+
+    monkeypatch.setattr(SizeResolver, "_SizeResolver__put_locked", recording_put)
+    files = filemodels(1000)
+    for order, filemodel in enumerate(files):
+        resolver._SizeResolver__put(filemodel, order, failures=0, due=0)
+    puts.clear()
+    resolver.prioritize([f"file{i}" for i in range(10, 20)])
+    assert sorted(puts) == sorted(f"file{i}" for i in range(10, 20))
+    puts.clear()
+    # the head left and the next file joined, the others keep their ranks
+    resolver.prioritize([f"file{i}" for i in range(11, 21)])
+    assert sorted(puts) == ["file10", "file20"]
+    puts.clear()
+    resolver.prioritize([f"file{i}" for i in range(11, 21)])
+    assert puts == []
@@ -0,0 +1,91 @@
+import threading
+import time
+from unittest.mock import MagicMock
+from aoget.web.stall_watchdog import StallGuard, StallWatchdog
+
+
+def __guard(rate_limiter=None) -> tuple:
+    watchdog = StallWatchdog(min_rate_bps=1000, stall_seconds=10)
+    signals = MagicMock()
+    guard = StallGuard(watchdog, signals, rate_limiter)
+    return guard, signals, time.monotonic()
+
+
+def __feed(guard, started, seconds, bytes_per_second) -> bool:
+    """Record the given rate for the given seconds, checking once a second."""
+    tripped = False
+    for second in range(1, seconds + 1):
+        guard.record(bytes_per_second)
+        tripped = guard.check(started + second) or tripped
+    return tripped
+
+
+def test_not_tripped_before_a_whole_window():
+    guard, signals, started = __guard()
+    assert not __feed(guard, started, 9, 0)
+    signals.abort_connections.assert_not_called()
+
+
+def test_trickle_below_the_floor_trips():
+    guard, signals, started = __guard()
+    assert __feed(guard, started, 11, 100)
+    assert guard.tripped
+    signals.abort_connections.assert_called_once()
+    assert "Stalled below" in guard.describe()
+
+
+def test_download_above_the_floor_is_not_tripped():
+    guard, signals, started = __guard()
+    assert not __feed(guard, started, 30, 5000)
+
+
+def test_only_the_last_window_counts():
+    guard, signals, started = __guard()
+    # a fast start does not cover for a stall later
+    assert not __feed(guard, started, 5, 100000)
+    assert __feed(guard, started + 5, 11, 0)
+
+
+def test_tripped_once():
+    guard, signals, started = __guard()
+    __feed(guard, started, 20, 0)
+    signals.abort_connections.assert_called_once()
+
+
+def test_paused_download_is_not_tripped():
+    guard, signals, started = __guard()
+    with guard.pause():
+        assert not __feed(guard, started, 20, 0)
+    # the window starts over once resumed
+    assert not __feed(guard, started + 20, 9, 0)
+    assert __feed(guard, started + 29, 2, 0)
+
+
+def test_rate_limited_download_has_lower_floor():
+    rate_limiter = MagicMock()
+    rate_limiter.is_limited.return_value = True
+    rate_limiter.effective_rate_limit.return_value = 400
+    guard, signals, started = __guard(rate_limiter)
+    assert guard.min_rate_bps() == 100
+    assert not __feed(guard, started, 20, 150)
+
+
+def test_watchdog_checks_watched_downloads():
+    watchdog = StallWatchdog(min_rate_bps=1000, stall_seconds=0.2, check_interval_seconds=0.05)
+    aborted = threading.Event()
+    signals = MagicMock()
+    signals.abort_connections.side_effect = aborted.set
+    guard = watchdog.watch(signals)
+    assert aborted.wait(2)
+    assert guard.tripped
+    guard.close()
+    watchdog.stop()
+
+
+def test_unwatched_downloads_are_not_checked():
+    watchdog = StallWatchdog(min_rate_bps=1000, stall_seconds=0.1, check_interval_seconds=0.05)
+    signals = MagicMock()
+    watchdog.watch(signals).close()
+    time.sleep(0.3)
+    signals.abort_connections.assert_not_called()
+    watchdog.stop()